@@ -2,8 +2,30 @@
 """A simple FTP server script that supports anonymous or authenticated access with customizable port and directory."""
 
 import argparse
+import shlex
+import subprocess
 from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.authorizers import SQLiteAuthorizer
+from pyftpdlib.filesystems import DigestCache
+from pyftpdlib.filesystems import FileCache
+from pyftpdlib.filesystems import ListingCache
+from pyftpdlib.filesystems import PathCache
+from pyftpdlib.handlers import BandwidthShaper
 from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.handlers import PageCachePolicy
+from pyftpdlib.hooks import HookDispatcher
+from pyftpdlib.ioloop import AsyncioLoop
+from pyftpdlib.ioloop import IOLoop
+from pyftpdlib.ioloop import ThreadPool
+from pyftpdlib.ioloop import TimerWheel
+from pyftpdlib.log import PREFIX
+from pyftpdlib.log import PREFIX_MPROC
+from pyftpdlib.log import BackgroundHandler
+from pyftpdlib.log import JSONFormatter
+from pyftpdlib.log import config_logging
+from pyftpdlib.metrics import Metrics
+from pyftpdlib.metrics import MetricsServer
+from pyftpdlib.prefork import task_id
 from pyftpdlib.servers import FTPServer
 import os
 
@@ -14,44 +36,363 @@ def get_eth0_ip():
     except (ImportError, ValueError, KeyError):
         return "IP not found (eth0)"
 
-def start_ftp_server(port=2121, username=None, password=None, directory=None):
-    # Create authorizer
-    authorizer = DummyAuthorizer()
-    
+def print_worker_stats(stats):
+    # Print per-worker and aggregated counters collected in shared memory
+    fields = ("accepted", "rejected", "peak", "transfers", "bytes_sent",
+              "bytes_received", "restarts")
+    print("\nWorker statistics:")
+    print("  " + "worker".ljust(8) + "".join(f.rjust(16) for f in fields))
+    for row in stats.snapshot():
+        print("  " + str(row["id"]).ljust(8)
+              + "".join(str(row[f]).rjust(16) for f in fields))
+    totals = stats.totals()
+    print("  " + "total".ljust(8)
+          + "".join(str(totals[f]).rjust(16) for f in fields))
+
+def print_pool_stats(pool):
+    # Print queue depth and per-command latency of the filesystem pool
+    stats = pool.stats()
+    print(f"\nFilesystem thread pool ({stats['max_workers']} threads): "
+          f"completed={stats['completed']} failed={stats['failed']} "
+          f"peak queued={stats['peak_queued']}")
+    for name, op in sorted(stats["ops"].items()):
+        print(f"  {name.ljust(8)} calls={op['calls']} "
+              f"avg wait={op['avg_wait'] * 1000:.3f}ms "
+              f"avg time={op['avg_time'] * 1000:.3f}ms "
+              f"max time={op['max_time'] * 1000:.3f}ms")
+
+def print_cache_stats(cache):
+    # Print hit ratio and memory usage of the directory listing cache
+    stats = cache.stats()
+    print(f"\nListing cache: entries={stats['entries']} "
+          f"size={stats['size']} hits={stats['hits']} "
+          f"misses={stats['misses']} hit ratio={stats['hit_ratio']:.1%} "
+          f"evictions={stats['evictions']}")
+
+def print_path_cache_stats(cache):
+    # Print hit ratio of the resolved real paths cache
+    stats = cache.stats()
+    print(f"\nPath cache: entries={stats['entries']} "
+          f"hits={stats['hits']} misses={stats['misses']} "
+          f"hit ratio={stats['hit_ratio']:.1%}")
+
+def print_digest_cache_stats(cache):
+    # Print hit ratio of the file checksums cache
+    stats = cache.stats()
+    print(f"\nDigest cache: entries={stats['entries']} "
+          f"hits={stats['hits']} misses={stats['misses']} "
+          f"xattr hits={stats['xattr_hits']} "
+          f"hit ratio={stats['hit_ratio']:.1%}")
+
+def print_shaper_stats(shaper):
+    # Print the bytes transferred and current rates of the shaper
+    stats = shaper.stats()
+    for direction, name in (("read", "Uploads"), ("write", "Downloads")):
+        info = stats[direction]
+        print(f"\n{name}: total={info['total']} "
+              f"rate={info['rate'] / 1024:.1f}KiB/s "
+              f"limit={info['limit'] / 1024:.0f}KiB/s")
+
+def print_page_cache_stats(policy):
+    # Print how many bytes the kernel was advised about
+    stats = policy.stats()
+    print(f"\nPage cache: files={stats['files']} "
+          f"prefetched={stats['prefetched']} dropped={stats['dropped']} "
+          f"written back={stats['written_back']}")
+
+def print_file_cache_stats(cache):
+    # Print hit ratio and bytes saved by the file content cache
+    stats = cache.stats()
+    print(f"\nFile cache: entries={stats['entries']} "
+          f"size={stats['size']} shared={stats['shared_size']} "
+          f"hits={stats['hits']} misses={stats['misses']} "
+          f"hit ratio={stats['hit_ratio']:.1%} "
+          f"evictions={stats['evictions']} "
+          f"bytes saved={stats['bytes_saved']}")
+
+def print_log_stats(log_handler):
+    # Print how many log records were written and dropped
+    stats = log_handler.stats()
+    print(f"\nLog: written={stats['written']} dropped={stats['dropped']} "
+          f"batches={stats['batches']} rotations={stats['rotations']}")
+
+def print_hook_stats(hooks):
+    # Print the outcome of the post-processing hooks
+    for name, hook in hooks.stats()["hooks"].items():
+        print(f"\nHook {name!r}: completed={hook['completed']} "
+              f"failed={hook['failed']} dropped={hook['dropped']} "
+              f"avg time={hook['avg_time'] * 1000:.3f}ms "
+              f"max time={hook['max_time'] * 1000:.3f}ms")
+
+def make_upload_hook(command):
+    # Run command with the uploaded file as its last argument; a non
+    # zero exit status makes the hook fail
+    argv = shlex.split(command)
+
+    def upload_hook(file):
+        subprocess.run(argv + [file], check=True,
+                       stdout=subprocess.DEVNULL)
+
+    return upload_hook
+
+def make_authorizer(directory, username=None, password=None,
+                    users_db=None, metrics=False):
+    # Full read/write access; SITE STATS requires the M permission
+    # (which also allows SITE CHMOD), granted when metrics are on
+    perm = "elradfmw"
+    if metrics:
+        perm += "M"
+    if users_db:
+        # Users are looked up in a SQLite database; the given
+        # credentials (if any) are added to it
+        authorizer = SQLiteAuthorizer(users_db)
+        if username and password and not authorizer.has_user(username):
+            authorizer.add_user(username, password, directory, perm=perm)
+    else:
+        # Add user if credentials are provided, otherwise allow
+        # anonymous access
+        authorizer = DummyAuthorizer()
+        if username and password:
+            authorizer.add_user(username, password, directory, perm=perm)
+        else:
+            authorizer.add_anonymous(directory, perm=perm)
+    return authorizer
+
+def parse_metrics_address(value):
+    # A UNIX socket path or [HOST:]PORT, HOST defaulting to loopback
+    if "/" in value:
+        return value
+    host, _, port = value.rpartition(":")
+    return (host.strip("[]") or "127.0.0.1", int(port))
+
+def worker_metrics_address(address, id):
+    # Each pre-forked worker has its own counters, hence its own
+    # endpoint: PORT + worker id, or PATH.<worker id>
+    if isinstance(address, str):
+        return f"{address}.{id}"
+    host, port = address
+    return (host, port + id)
+
+def start_ftp_server(port=2121, username=None, password=None, directory=None,
+                     workers=1, reuse_port=False, max_cons=None,
+                     max_cons_per_ip=None, max_cons_per_subnet=None,
+                     max_accept_rate=None, fs_threads=0, listing_cache=0,
+                     timer_wheel=False, download_limit=0, upload_limit=0,
+                     user_download_limit=0, user_upload_limit=0,
+                     metrics=False, metrics_address=None, asyncio_loop=None,
+                     users_db=None, path_cache=0, log_file=None,
+                     log_format="text", log_max_size=0, log_backups=5,
+                     upload_hook=None, upload_hook_wait=False,
+                     hook_threads=4, digest_cache=0, digest_xattrs=False,
+                     digest_threads=2, page_cache_threshold=0,
+                     file_cache=0, file_cache_preload=False):
     # Use current directory if none specified
     if directory is None:
         directory = os.getcwd()
 
-    # Add user if credentials are provided, otherwise allow anonymous access
-    if username and password:
-        authorizer.add_user(username, password, directory, perm="elradfmw")
-    else:
-        authorizer.add_anonymous(directory, perm="elradfmw")
+    authorizer = make_authorizer(directory, username, password, users_db,
+                                 metrics=metrics or metrics_address)
 
     # Create handler
     handler = FTPHandler
     handler.authorizer = authorizer
+    if users_db:
+        # Verify password hashes off the IO loop
+        handler.auth_executor = ThreadPool(max_workers=2,
+                                           name="pyftpdlib-auth")
+    if fs_threads:
+        # Run blocking filesystem calls (listings, open, rename...)
+        # off the IO loop
+        handler.fs_executor = ThreadPool(max_workers=fs_threads)
+    if listing_cache:
+        # Serve repeated LIST/NLST/MLSD of unchanged directories from
+        # memory (size is in MiB)
+        handler.listing_cache = ListingCache(
+            max_size=listing_cache * 1024 * 1024)
+    if path_cache:
+        # Resolve the real path of a file or directory once rather
+        # than on every command
+        handler.path_cache = PathCache(max_entries=path_cache)
+    if digest_threads:
+        # Compute HASH/XMD5/XCRC... checksums off the IO loop
+        handler.digest_executor = ThreadPool(max_workers=digest_threads,
+                                             name="pyftpdlib-digest")
+    if digest_cache:
+        # Remember file checksums, computing those of uploaded files
+        # while they are received
+        handler.digest_cache = DigestCache(max_entries=digest_cache,
+                                           use_xattrs=digest_xattrs)
+    if upload_hook:
+        # Post-process uploaded files in a pool of threads
+        handler.hook_dispatcher = HookDispatcher(max_workers=hook_threads)
+        handler.hook_dispatcher.register(
+            "file_received", make_upload_hook(upload_hook),
+            name="upload", reply=upload_hook_wait)
     
+    if download_limit or upload_limit or user_download_limit \
+            or user_upload_limit:
+        # limits are in KiB/s
+        handler.bandwidth_shaper = BandwidthShaper(
+            read_limit=upload_limit * 1024,
+            write_limit=download_limit * 1024,
+            user_read_limit=user_upload_limit * 1024,
+            user_write_limit=user_download_limit * 1024)
+    if page_cache_threshold:
+        # Keep big transfers from evicting hot files from the page
+        # cache (threshold is in MiB)
+        handler.page_cache_policy = PageCachePolicy(
+            threshold=page_cache_threshold * 1024 * 1024)
+    if file_cache:
+        # Send small files downloaded over and over from memory (size
+        # is in MiB)
+        handler.file_cache = FileCache(max_size=file_cache * 1024 * 1024)
+        if file_cache_preload:
+            # Read them once, before forking, into memory shared by
+            # all the workers
+            handler.file_cache.preload(
+                os.path.join(root, name)
+                for root, _, files in os.walk(directory)
+                for name in files)
+    if timer_wheel:
+        # O(1) reset/cancel of the per-connection timeouts
+        IOLoop.scheduler_class = TimerWheel
+    if metrics or metrics_address:
+        # Counters and histograms shown by SITE STATS
+        handler.metrics = Metrics()
+
+    ioloop = None
+    if asyncio_loop:
+        # Run on top of an asyncio event loop ("asyncio" or "uvloop")
+        if asyncio_loop == "uvloop":
+            import uvloop
+            AsyncioLoop.loop_factory = uvloop.new_event_loop
+        ioloop = AsyncioLoop()
+
+    log_handler = None
+    if log_file or log_format == "json":
+        # Format and write log records from a background thread so
+        # that a slow disk or terminal doesn't stall the clients
+        log_handler = BackgroundHandler(
+            filename=log_file,
+            max_bytes=log_max_size * 1024 * 1024,
+            backup_count=log_backups if log_max_size else 0)
+        if log_format == "json":
+            log_handler.setFormatter(JSONFormatter())
+        config_logging(prefix=PREFIX_MPROC if workers != 1 else PREFIX,
+                       handler=log_handler)
+
     # Set up server
-    server = FTPServer(("0.0.0.0", port), handler)
+    server = FTPServer(("0.0.0.0", port), handler, ioloop=ioloop)
+    if max_cons is not None:
+        server.max_cons = max_cons
+    if max_cons_per_ip is not None:
+        server.max_cons_per_ip = max_cons_per_ip
+    if max_cons_per_subnet is not None:
+        server.max_cons_per_subnet = max_cons_per_subnet
+    if max_accept_rate is not None:
+        server.max_accept_rate = max_accept_rate
+    if handler.metrics is not None:
+        server.ioloop.metrics = handler.metrics
+    if metrics_address and workers != 1:
+        # Prometheus endpoints, created by each worker once forked
+        # and served by its IO loop
+        def on_worker_start(id):
+            MetricsServer(worker_metrics_address(metrics_address, id),
+                          handler.metrics, server.ioloop)
+        server.on_worker_start = on_worker_start
+    elif metrics_address:
+        # Prometheus endpoint, served by the same IO loop
+        MetricsServer(metrics_address, handler.metrics, server.ioloop)
     
     # Print server info
     ip_address = get_eth0_ip()
     print(f"\nFTP Server started on {ip_address}:{port}")
     print(f"Serving directory: {directory}")
+    if users_db:
+        print(f"Users database: {users_db}")
     if username and password:
         print(f"Username: {username}")
         print(f"Password: {password}")
-    else:
+    elif not users_db:
         print("Anonymous access enabled")
+    if workers != 1:
+        print(f"Worker processes: {workers or 'one per CPU'}"
+              + (" (SO_REUSEPORT)" if reuse_port else ""))
+    if fs_threads:
+        print(f"Filesystem threads: {fs_threads}")
+    if listing_cache:
+        print(f"Listing cache: {listing_cache} MiB")
+    if path_cache:
+        print(f"Path cache: {path_cache} entries")
+    if digest_cache:
+        print(f"Digest cache: {digest_cache} entries"
+              + (" (+ xattrs)" if digest_xattrs else ""))
+    if page_cache_threshold:
+        print(f"Page cache policy: files >= {page_cache_threshold} MiB")
+    if file_cache:
+        print(f"File cache: {file_cache} MiB"
+              + (" (preloaded)" if file_cache_preload else ""))
+    if upload_hook:
+        print(f"Upload hook: {upload_hook} ({hook_threads} threads"
+              + (", 226 reply deferred)" if upload_hook_wait else ")"))
+    if log_handler is not None:
+        print(f"Log: {log_file or 'stderr'} ({log_format}, background)")
+    if metrics_address and workers != 1:
+        print(f"Metrics endpoints: {metrics_address} + worker id")
+    elif metrics_address:
+        print(f"Metrics endpoint: {metrics_address}")
     print("\nPress Ctrl+C to stop the server")
 
     # Start server
+    if workers != 1:
+        # Pre-fork mode: serve_forever() returns in each worker after it
+        # stopped serving and in the master once all workers are gone.
+        server.serve_forever(worker_processes=workers, reuse_port=reuse_port)
+        if handler.fs_executor is not None:
+            handler.fs_executor.shutdown(wait=False)
+        if handler.auth_executor is not None:
+            handler.auth_executor.shutdown(wait=False)
+        if handler.digest_executor is not None:
+            handler.digest_executor.shutdown(wait=False)
+        if handler.hook_dispatcher is not None:
+            handler.hook_dispatcher.shutdown()
+        if task_id() is None:
+            print("\nShutting down FTP server")
+            print_worker_stats(server.worker_stats)
+        return
+
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print("\nShutting down FTP server")
         server.close_all()
+    finally:
+        if handler.auth_executor is not None:
+            handler.auth_executor.shutdown(wait=False)
+        if handler.digest_executor is not None:
+            handler.digest_executor.shutdown(wait=False)
+        if handler.fs_executor is not None:
+            handler.fs_executor.shutdown(wait=False)
+            print_pool_stats(handler.fs_executor)
+        if handler.listing_cache is not None:
+            print_cache_stats(handler.listing_cache)
+        if handler.path_cache is not None:
+            print_path_cache_stats(handler.path_cache)
+        if handler.digest_cache is not None:
+            print_digest_cache_stats(handler.digest_cache)
+        if handler.bandwidth_shaper is not None:
+            print_shaper_stats(handler.bandwidth_shaper)
+        if handler.page_cache_policy is not None:
+            print_page_cache_stats(handler.page_cache_policy)
+        if handler.file_cache is not None:
+            print_file_cache_stats(handler.file_cache)
+        if handler.hook_dispatcher is not None:
+            # let running hooks complete
+            handler.hook_dispatcher.shutdown()
+            print_hook_stats(handler.hook_dispatcher)
+        if log_handler is not None:
+            log_handler.close()
+            print_log_stats(log_handler)
 
 def main():
     # Set up argument parser
@@ -71,8 +412,51 @@ Examples:
   # Serve specific directory
   python3 local-ftp.py -d /path/to/directory
 
+  # Serve the users stored in a SQLite database, adding myuser to it
+  python3 local-ftp.py --users-db users.db -u myuser -P mypassword
+
   # Combine options
   python3 local-ftp.py -p 2121 -u myuser -P mypassword -d /path/to/share
+
+  # Pre-fork 4 worker processes, at most 8 connections per client IP
+  python3 local-ftp.py -p 2121 --workers 4 --max-cons-per-ip 8
+
+  # Shed connection floods: 5 new connections/sec per client IP,
+  # at most 64 connections per /24 network
+  python3 local-ftp.py --max-accept-rate 5 --max-cons-per-subnet 64
+
+  # Serve a slow network mount without stalling other clients
+  python3 local-ftp.py -d /mnt/nfs --fs-threads 8
+
+  # Cache up to 64 MiB of rendered directory listings
+  python3 local-ftp.py --listing-cache 64
+
+  # Deep trees of symlinked directories: cache 100000 resolved paths
+  python3 local-ftp.py --path-cache 100000
+
+  # Answer HASH/XSHA256 right after uploads, keep checksums in xattrs
+  python3 local-ftp.py --digest-cache 10000 --digest-xattrs
+
+  # At most 10 MiB/s of downloads overall, 1 MiB/s per user
+  python3 local-ftp.py --download-limit 10240 --user-download-limit 1024
+
+  # Stream big files (>= 64 MiB) without evicting the small hot ones
+  python3 local-ftp.py --page-cache-threshold 64
+
+  # Send small hot files from 256 MiB of memory shared by 4 workers
+  python3 local-ftp.py --workers 4 --file-cache 256 --file-cache-preload
+
+  # Many thousands of mostly idle clients
+  python3 local-ftp.py --max-cons 20000 --timer-wheel
+
+  # JSON lines log file, rotated every 100 MiB, 5 backups kept
+  python3 local-ftp.py --log-file ftp.log --log-format json --log-max-size 100
+
+  # Scan every uploaded file, replying to STOR once the scan is done
+  python3 local-ftp.py --upload-hook "clamscan --no-summary" --upload-hook-wait
+
+  # Metrics for Prometheus on http://127.0.0.1:9121/metrics
+  python3 local-ftp.py --metrics-address 9121
         """,
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
@@ -99,18 +483,345 @@ Examples:
         help="Directory to serve (default: current directory)"
     )
 
+    parser.add_argument(
+        "--users-db",
+        metavar="PATH",
+        help="SQLite database of users, their home directories and "
+             "permissions (created if missing); -u/-P add a user to it"
+    )
+
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=1,
+        help="Number of pre-forked worker processes, 0 means one per CPU "
+             "(default: 1, no pre-forking; POSIX only)"
+    )
+
+    parser.add_argument(
+        "--reuse-port",
+        action="store_true",
+        help="Let each worker listen on its own SO_REUSEPORT socket "
+             "instead of sharing the inherited one"
+    )
+
+    parser.add_argument(
+        "--max-cons",
+        type=int,
+        help="Maximum simultaneous connections, across all workers "
+             "(default: 512)"
+    )
+
+    parser.add_argument(
+        "--max-cons-per-ip",
+        type=int,
+        help="Maximum simultaneous connections from the same IP address, "
+             "across all workers (default: unlimited)"
+    )
+
+    parser.add_argument(
+        "--max-cons-per-subnet",
+        type=int,
+        help="Maximum simultaneous connections from the same /24 (IPv4) or "
+             "/64 (IPv6) network, across all workers (default: unlimited)"
+    )
+
+    parser.add_argument(
+        "--max-accept-rate",
+        type=float,
+        help="Maximum new connections per second accepted from the same IP "
+             "address, after a burst of 10 (default: unlimited)"
+    )
+
+    parser.add_argument(
+        "--fs-threads",
+        type=int,
+        default=0,
+        help="Run blocking filesystem calls in a pool of N threads so that "
+             "slow disks don't stall other clients (default: 0, disabled)"
+    )
+
+    parser.add_argument(
+        "--listing-cache",
+        type=int,
+        default=0,
+        metavar="MIB",
+        help="Cache up to MIB megabytes of rendered LIST/NLST/MLSD output "
+             "(default: 0, disabled)"
+    )
+
+    parser.add_argument(
+        "--path-cache",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Cache the resolved real path of up to N files and "
+             "directories, shared by all sessions (default: 0, disabled)"
+    )
+
+    parser.add_argument(
+        "--digest-cache",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Cache the checksums (HASH, XMD5, XSHA256, XCRC...) of up to "
+             "N files, computing those of uploaded files while they are "
+             "received (default: 0, disabled)"
+    )
+
+    parser.add_argument(
+        "--digest-xattrs",
+        action="store_true",
+        help="Also store cached checksums in extended attributes of the "
+             "files, so that they survive restarts; requires --digest-cache"
+    )
+
+    parser.add_argument(
+        "--digest-threads",
+        type=int,
+        default=2,
+        metavar="N",
+        help="Number of threads computing checksums; 0 means in the IO "
+             "loop, or in --fs-threads if set (default: 2)"
+    )
+
+    parser.add_argument(
+        "--timer-wheel",
+        action="store_true",
+        help="Schedule idle and stall timeouts with a timing wheel instead "
+             "of a heap (cheaper with many thousands of connections)"
+    )
+
+    for direction in ("download", "upload"):
+        parser.add_argument(
+            f"--{direction}-limit",
+            type=int,
+            default=0,
+            metavar="KIBPS",
+            help=f"Maximum {direction} bandwidth in KiB/s, shared by all "
+                 "transfers (default: 0, unlimited)"
+        )
+        parser.add_argument(
+            f"--user-{direction}-limit",
+            type=int,
+            default=0,
+            metavar="KIBPS",
+            help=f"Maximum {direction} bandwidth in KiB/s for each user, "
+                 "across all of its transfers (default: 0, unlimited)"
+        )
+
+    parser.add_argument(
+        "--page-cache-threshold",
+        type=int,
+        default=0,
+        metavar="MIB",
+        help="Prefetch files of at least MIB megabytes being downloaded "
+             "and drop them from the page cache once sent; pace the "
+             "write-back of uploads that big (default: 0, disabled)"
+    )
+
+    parser.add_argument(
+        "--file-cache",
+        type=int,
+        default=0,
+        metavar="MIB",
+        help="Keep up to MIB megabytes of small files (up to 256 KiB) "
+             "in memory and send binary downloads of them from there "
+             "(default: 0, disabled)"
+    )
+
+    parser.add_argument(
+        "--file-cache-preload",
+        action="store_true",
+        help="Fill the file cache with the files of the served directory "
+             "at startup, in memory shared by the worker processes"
+    )
+
+    parser.add_argument(
+        "--asyncio",
+        nargs="?",
+        const="asyncio",
+        choices=("asyncio", "uvloop"),
+        dest="asyncio_loop",
+        help="Run on top of an asyncio event loop, the default one or "
+             "uvloop (must be installed)"
+    )
+
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Collect performance metrics, shown by the SITE STATS command "
+             "(those of the worker process serving them, with --workers). "
+             "The user (or anonymous) is granted the M permission it "
+             "requires, which also allows SITE CHMOD; users already in "
+             "--users-db keep their own permissions"
+    )
+
+    parser.add_argument(
+        "--metrics-address",
+        metavar="ADDR",
+        help="Serve metrics in Prometheus text format over HTTP on "
+             "[HOST:]PORT (HOST defaults to 127.0.0.1) or on a UNIX "
+             "socket PATH; implies --metrics. With --workers each worker "
+             "has its own endpoint, on PORT + its id (from 0) or on "
+             "PATH.<id>"
+    )
+
+    parser.add_argument(
+        "--upload-hook",
+        metavar="CMD",
+        help="Run CMD with the path of each uploaded file as its last "
+             "argument, in a pool of threads"
+    )
+
+    parser.add_argument(
+        "--upload-hook-wait",
+        action="store_true",
+        help="Reply to the upload once --upload-hook completed, with an "
+             "error if it exited with a non zero status"
+    )
+
+    parser.add_argument(
+        "--hook-threads",
+        type=int,
+        default=4,
+        metavar="N",
+        help="Number of threads running --upload-hook (default: 4)"
+    )
+
+    parser.add_argument(
+        "--log-file",
+        metavar="PATH",
+        help="Append the log to PATH instead of stderr; records are "
+             "written by a background thread"
+    )
+
+    parser.add_argument(
+        "--log-format",
+        choices=("text", "json"),
+        default="text",
+        help="Log lines as text or as JSON objects carrying the client "
+             "address, user, command, file, bytes... (default: text); "
+             "json is written by a background thread"
+    )
+
+    parser.add_argument(
+        "--log-max-size",
+        type=int,
+        default=0,
+        metavar="MIB",
+        help="Rotate the --log-file when it reaches MIB megabytes "
+             "(default: 0, never). Not supported with --workers, whose "
+             "processes would rotate the file under each other; rotate "
+             "it externally instead (e.g. logrotate)"
+    )
+
+    parser.add_argument(
+        "--log-backups",
+        type=int,
+        default=5,
+        metavar="N",
+        help="Number of rotated log files to keep (default: 5)"
+    )
+
     args = parser.parse_args()
 
     # Validate that if username is provided, password is also provided and vice versa
     if bool(args.username) != bool(args.password):
         parser.error("Both username and password must be provided together")
 
+    if args.workers != 1 and os.name != "posix":
+        parser.error("--workers is only supported on POSIX systems")
+    if args.reuse_port and args.workers == 1:
+        parser.error("--reuse-port requires --workers")
+    if args.fs_threads < 0:
+        parser.error("--fs-threads must be >= 0")
+    if args.listing_cache < 0:
+        parser.error("--listing-cache must be >= 0")
+    if args.path_cache < 0:
+        parser.error("--path-cache must be >= 0")
+    if args.digest_cache < 0:
+        parser.error("--digest-cache must be >= 0")
+    if args.digest_xattrs and not args.digest_cache:
+        parser.error("--digest-xattrs requires --digest-cache")
+    if args.digest_threads < 0:
+        parser.error("--digest-threads must be >= 0")
+    if args.upload_hook_wait and not args.upload_hook:
+        parser.error("--upload-hook-wait requires --upload-hook")
+    if args.hook_threads < 1:
+        parser.error("--hook-threads must be >= 1")
+    if args.log_max_size < 0:
+        parser.error("--log-max-size must be >= 0")
+    if args.log_max_size and not args.log_file:
+        parser.error("--log-max-size requires --log-file")
+    if args.log_max_size and args.workers != 1:
+        parser.error("--log-max-size can't be used with --workers")
+    if args.page_cache_threshold < 0:
+        parser.error("--page-cache-threshold must be >= 0")
+    if args.page_cache_threshold and not hasattr(os, "posix_fadvise"):
+        parser.error("--page-cache-threshold is not supported on this "
+                     "system")
+    if args.file_cache < 0:
+        parser.error("--file-cache must be >= 0")
+    if args.file_cache_preload and not args.file_cache:
+        parser.error("--file-cache-preload requires --file-cache")
+    if args.log_backups < 1:
+        parser.error("--log-backups must be >= 1")
+    if args.max_accept_rate is not None and args.max_accept_rate < 0:
+        parser.error("--max-accept-rate must be >= 0")
+    if args.asyncio_loop == "uvloop":
+        try:
+            import uvloop  # noqa: F401
+        except ImportError:
+            parser.error("--asyncio uvloop requires uvloop to be installed")
+    metrics_address = None
+    if args.metrics_address:
+        try:
+            metrics_address = parse_metrics_address(args.metrics_address)
+        except ValueError:
+            parser.error("--metrics-address must be [HOST:]PORT or a PATH")
+    for name in ("download_limit", "upload_limit", "user_download_limit",
+                 "user_upload_limit"):
+        if getattr(args, name) < 0:
+            parser.error(f"--{name.replace('_', '-')} must be >= 0")
+
     # Start the server
     start_ftp_server(
         port=args.port,
         username=args.username,
         password=args.password,
-        directory=args.directory
+        directory=args.directory,
+        workers=args.workers,
+        reuse_port=args.reuse_port,
+        max_cons=args.max_cons,
+        max_cons_per_ip=args.max_cons_per_ip,
+        max_cons_per_subnet=args.max_cons_per_subnet,
+        max_accept_rate=args.max_accept_rate,
+        fs_threads=args.fs_threads,
+        listing_cache=args.listing_cache,
+        timer_wheel=args.timer_wheel,
+        download_limit=args.download_limit,
+        upload_limit=args.upload_limit,
+        user_download_limit=args.user_download_limit,
+        user_upload_limit=args.user_upload_limit,
+        metrics=args.metrics,
+        metrics_address=metrics_address,
+        asyncio_loop=args.asyncio_loop,
+        users_db=args.users_db,
+        path_cache=args.path_cache,
+        log_file=args.log_file,
+        log_format=args.log_format,
+        log_max_size=args.log_max_size,
+        log_backups=args.log_backups,
+        upload_hook=args.upload_hook,
+        upload_hook_wait=args.upload_hook_wait,
+        hook_threads=args.hook_threads,
+        digest_cache=args.digest_cache,
+        digest_xattrs=args.digest_xattrs,
+        digest_threads=args.digest_threads,
+        page_cache_threshold=args.page_cache_threshold,
+        file_cache=args.file_cache,
+        file_cache_preload=args.file_cache_preload
     )
 
 if __name__ == "__main__":
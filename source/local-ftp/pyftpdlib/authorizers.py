@@ -18,12 +18,26 @@ interact with UNIX and Windows password database.
 """
 
 
+import base64
+import collections
+import hashlib
+import hmac
 import os
+import threading
+import time
 import warnings
+import weakref
+
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
 
 
 __all__ = [
     'DummyAuthorizer',
+    'SQLiteAuthorizer',
     # 'BaseUnixAuthorizer', 'UnixAuthorizer',
     # 'BaseWindowsAuthorizer', 'WindowsAuthorizer',
 ]
@@ -65,9 +79,15 @@ class DummyAuthorizer:
 
     read_perms = "elr"
     write_perms = "adfmwMT"
+    # how many (user, directory) permission overrides lookups to cache
+    override_cache_size = 10000
 
     def __init__(self):
         self.user_table = {}
+        # {username: _OverrideNode}
+        self._override_tries = {}
+        # {(username, directory): (_OverrideNode, inherited_perm)}
+        self._override_cache = {}
 
     def add_user(
         self,
@@ -89,15 +109,18 @@ class DummyAuthorizer:
         Read permissions:
          - "e" = change directory (CWD command)
          - "l" = list files (LIST, NLST, STAT, MLSD, MLST, SIZE, MDTM commands)
-         - "r" = retrieve file from the server (RETR command)
+         - "r" = retrieve file from the server (RETR command, source
+           of SITE COPY and SITE CPR commands)
 
         Write permissions:
          - "a" = append data to an existing file (APPE command)
          - "d" = delete file or directory (DELE, RMD commands)
          - "f" = rename file or directory (RNFR, RNTO commands)
-         - "m" = create directory (MKD command)
-         - "w" = store a file to the server (STOR, STOU commands)
-         - "M" = change file mode (SITE CHMOD command)
+         - "m" = create directory (MKD, SITE CPR commands)
+         - "w" = store a file to the server (STOR, STOU, SITE COPY,
+           SITE CPR commands)
+         - "M" = change file mode (SITE CHMOD command), read the server
+           statistics (SITE STATS command)
          - "T" = update file last modified time (MFMT command)
 
         Optional msg_login and msg_quit arguments can be specified to
@@ -118,6 +141,7 @@ class DummyAuthorizer:
             'msg_quit': str(msg_quit),
         }
         self.user_table[username] = dic
+        self._invalidate_overrides(username)
 
     def add_anonymous(self, homedir, **kwargs):
         """Add an anonymous user to the virtual users table.
@@ -140,9 +164,15 @@ class DummyAuthorizer:
     def remove_user(self, username):
         """Remove a user from the virtual users table."""
         del self.user_table[username]
+        self._invalidate_overrides(username)
 
     def override_perm(self, username, directory, perm, recursive=False):
-        """Override permissions for a given directory."""
+        """Override permissions for a given directory.
+
+        Non recursive overrides apply to the directory and to the
+        files it contains, recursive ones to the whole tree. When
+        multiple overrides apply to a path the one added first wins.
+        """
         self._check_permissions(username, perm)
         if not os.path.isdir(directory):
             raise ValueError(f'no such directory: {directory!r}')
@@ -153,6 +183,7 @@ class DummyAuthorizer:
         if not self._issubpath(directory, home):
             raise ValueError("path escapes user home directory")
         self.user_table[username]['operms'][directory] = perm, recursive
+        self._invalidate_overrides(username)
 
     def validate_authentication(self, username, password, handler):
         """Raises AuthenticationFailed if supplied username and
@@ -205,21 +236,30 @@ class DummyAuthorizer:
         Expected perm argument is one of the following letters:
         "elradfmwMT".
         """
-        if path is None:
-            return perm in self.user_table[username]['perm']
+        user = self.user_table[username]
+        if path is None or not user['operms']:
+            return perm in user['perm']
 
         path = os.path.normcase(path)
-        for dir in self.user_table[username]['operms']:
-            operm, recursive = self.user_table[username]['operms'][dir]
-            if self._issubpath(path, dir):
-                if recursive:
-                    return perm in operm
-                if path == dir or (
-                    os.path.dirname(path) == dir and not os.path.isdir(path)
-                ):
-                    return perm in operm
-
-        return perm in self.user_table[username]['perm']
+        dir, _, name = path.rpartition(os.sep)
+        node, override = self._resolve_override(username, dir)
+        if node is not None:
+            child = node.children.get(name)
+            if child is not None and child.perm is not None:
+                # the path itself is overridden
+                if override is None or child.index < override.index:
+                    override = child
+            if (
+                node.perm is not None
+                and not node.recursive
+                and (override is None or node.index < override.index)
+                and not os.path.isdir(path)
+            ):
+                # a file in a directory overridden non recursively
+                override = node
+        if override is not None:
+            return perm in override.perm
+        return perm in user['perm']
 
     def get_perms(self, username):
         """Return current user permissions."""
@@ -253,6 +293,61 @@ class DummyAuthorizer:
                 )
                 warned = 1
 
+    def _resolve_override(self, username, dir):
+        """Return a (node, override) tuple where node is the override
+        trie node of directory *dir* (None if no override lives at or
+        below it) and override the node of the first added recursive
+        override applying to *dir* (or None). Results are cached.
+        """
+        key = (username, dir)
+        try:
+            return self._override_cache[key]
+        except KeyError:
+            pass
+        node = self._override_tries.get(username)
+        if node is None:
+            node = self._build_override_trie(username)
+        override = None
+        for name in dir.split(os.sep):
+            node = node.children.get(name)
+            if node is None:
+                break
+            if node.recursive and (
+                override is None or node.index < override.index
+            ):
+                override = node
+        cache = self._override_cache
+        if len(cache) >= self.override_cache_size:
+            cache.clear()
+        cache[key] = ret = (node, override)
+        return ret
+
+    def _build_override_trie(self, username):
+        """Compile the user's permission overrides into a trie of path
+        components, so that the ones applying to a path are found in
+        O(depth) rather than by checking all of them.
+        """
+        root = _OverrideNode()
+        operms = self.user_table[username]['operms']
+        for index, (dir, (perm, recursive)) in enumerate(operms.items()):
+            node = root
+            for name in dir.rstrip(os.sep).split(os.sep):
+                child = node.children.get(name)
+                if child is None:
+                    child = node.children[name] = _OverrideNode()
+                node = child
+            node.perm = perm
+            node.recursive = recursive
+            # the order overrides were added in, which decides the
+            # one applying to a path when there are several
+            node.index = index
+        self._override_tries[username] = root
+        return root
+
+    def _invalidate_overrides(self, username):
+        self._override_tries.pop(username, None)
+        self._override_cache.clear()
+
     def _issubpath(self, a, b):
         """Return True if a is a sub-path of b or if the paths are equal."""
         p1 = a.rstrip(os.sep).split(os.sep)
@@ -260,6 +355,374 @@ class DummyAuthorizer:
         return p1[: len(p2)] == p2
 
 
+class _OverrideNode:
+    """A node of the permission overrides trie, one per path
+    component.
+    """
+
+    __slots__ = ('children', 'index', 'perm', 'recursive')
+
+    def __init__(self):
+        self.children = {}
+        self.perm = None
+        self.recursive = False
+        self.index = 0
+
+
+# ===================================================================
+# --- SQLite
+# ===================================================================
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    homedir TEXT NOT NULL,
+    perm TEXT NOT NULL DEFAULT 'elr',
+    msg_login TEXT NOT NULL DEFAULT 'Login successful.',
+    msg_quit TEXT NOT NULL DEFAULT 'Goodbye.'
+);
+CREATE TABLE IF NOT EXISTS overrides (
+    username TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+    directory TEXT NOT NULL,
+    perm TEXT NOT NULL,
+    recursive INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, directory)
+);
+"""
+
+_SELECT_USER = (
+    "SELECT password, homedir, perm, msg_login, msg_quit FROM users "
+    "WHERE username = ?"
+)
+_SELECT_OVERRIDES = (
+    "SELECT directory, perm, recursive FROM overrides WHERE username = ? "
+    "ORDER BY rowid"
+)
+_INSERT_USER = (
+    "INSERT INTO users (username, password, homedir, perm, msg_login, "
+    "msg_quit) VALUES (?, ?, ?, ?, ?, ?)"
+)
+_DELETE_USER = "DELETE FROM users WHERE username = ?"
+_INSERT_OVERRIDE = (
+    "INSERT OR REPLACE INTO overrides (username, directory, perm, "
+    "recursive) VALUES (?, ?, ?, ?)"
+)
+
+_HASH_PREFIX = 'pbkdf2_sha256$'
+
+
+class _UserTable:
+    """The user_table of SQLiteAuthorizer: a bounded LRU cache of
+    user records, which are loaded from the database on first access.
+    Users known not to exist are cached as well, in a separate and
+    smaller LRU cache, so that looking up many bogus usernames can't
+    evict the records of actual users.
+    """
+
+    def __init__(self, authorizer, size, missing_size):
+        self._auth = authorizer
+        self._size = size
+        self._missing_size = missing_size
+        # {username: record}, least recently used first
+        self._records = collections.OrderedDict()
+        # {username: None}, least recently used first
+        self._missing = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._records)
+
+    def _get(self, username):
+        auth = self._auth
+        with auth._lock:
+            if time.monotonic() >= auth._next_check:
+                auth._check_changed()
+            records = self._records
+            record = records.get(username)
+            if record is not None:
+                records.move_to_end(username)
+                return record
+            missing = self._missing
+            if username in missing:
+                missing.move_to_end(username)
+                return None
+            record = auth._load_user(username)
+            if record is None:
+                missing[username] = None
+                if len(missing) > self._missing_size:
+                    missing.popitem(last=False)
+            else:
+                records[username] = record
+                self._evict()
+            return record
+
+    def _evict(self):
+        while len(self._records) > self._size:
+            username, _ = self._records.popitem(last=False)
+            self._auth._override_tries.pop(username, None)
+
+    def __contains__(self, username):
+        return self._get(username) is not None
+
+    def __getitem__(self, username):
+        record = self._get(username)
+        if record is None:
+            raise KeyError(username)
+        return record
+
+    def __setitem__(self, username, record):
+        self._auth._insert_user(username, record)
+        with self._auth._lock:
+            self._missing.pop(username, None)
+            self._records[username] = record
+            self._evict()
+
+    def __delitem__(self, username):
+        self._auth._delete_user(username)
+        with self._auth._lock:
+            self._records.pop(username, None)
+
+    def clear(self):
+        self._records.clear()
+        self._missing.clear()
+
+
+class SQLiteAuthorizer(DummyAuthorizer):
+    """An authorizer reading virtual users, their home directories,
+    permissions and permission overrides from a SQLite database, for
+    when there are too many users to keep in memory.
+
+    A user is fetched the first time it's needed and then kept in a
+    LRU cache of cache_size users (usernames which don't exist in one
+    of missing_cache_size usernames). The database is checked for
+    changes made by other processes (or for having been replaced) at
+    most every check_interval seconds, in which case the cache is
+    emptied. Tables are created if missing:
+
+        users(username, password, homedir, perm, msg_login, msg_quit)
+        overrides(username, directory, perm, recursive)
+
+    Passwords are stored as salted PBKDF2 hashes, as returned by
+    hash_password(). Plain text passwords are accepted as well.
+    Since verifying a hash is meant to be slow, consider setting
+    FTPHandler.auth_executor so that it happens in a separate thread.
+
+    The add_user(), add_anonymous(), remove_user() and override_perm()
+    methods write to the database.
+
+     - (str) path: the path of the database file.
+     - (int) cache_size: the maximum number of users kept in memory.
+     - (int) missing_cache_size: the maximum number of usernames
+       known not to exist kept in memory.
+     - (float) check_interval: how often to check the database for
+       changes, in seconds.
+    """
+
+    # PBKDF2 iterations used by hash_password()
+    hash_iterations = 200000
+
+    def __init__(
+        self, path, cache_size=10000, check_interval=1, missing_cache_size=1000
+    ):
+        if sqlite3 is None:
+            raise AuthorizerError("sqlite3 module is not available")
+        DummyAuthorizer.__init__(self)
+        self.path = path
+        self.check_interval = check_interval
+        self.user_table = _UserTable(self, cache_size, missing_cache_size)
+        self._lock = threading.RLock()
+        self._conn = None
+        self._connect()
+        _sqlite_authorizers.add(self)
+
+    def _connect(self):
+        if self._conn is not None:
+            self._conn.close()
+        # statements are prepared once and cached by the connection;
+        # it's shared by all threads, serialized by self._lock
+        self._conn = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._conn.executescript(_SCHEMA)
+        self._pid = os.getpid()
+        self._ident = self._stat()
+        self._data_version = self._conn.execute(
+            "PRAGMA data_version"
+        ).fetchone()[0]
+        self._next_check = time.monotonic() + self.check_interval
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino)
+
+    def _invalidate(self):
+        self.user_table.clear()
+        self._override_tries.clear()
+        self._override_cache.clear()
+
+    def _check_changed(self):
+        """Empty the cache if the database has been changed by another
+        connection or replaced. Called with the lock held, at most
+        every check_interval seconds (and right after a fork).
+        """
+        if os.getpid() != self._pid:
+            # a forked process can't share the parent's connection
+            self._connect()
+            self._invalidate()
+            return
+        self._next_check = time.monotonic() + self.check_interval
+        ident = self._stat()
+        if ident is not None and ident != self._ident:
+            self._connect()
+            self._invalidate()
+            return
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._data_version = version
+            self._invalidate()
+
+    def _load_user(self, username):
+        row = self._conn.execute(_SELECT_USER, (username,)).fetchone()
+        if row is None:
+            return None
+        pwd, home, perm, msg_login, msg_quit = row
+        operms = {
+            os.path.normcase(dir): (operm, bool(recursive))
+            for dir, operm, recursive in self._conn.execute(
+                _SELECT_OVERRIDES, (username,)
+            )
+        }
+        return {
+            'pwd': pwd,
+            'home': home,
+            'perm': perm,
+            'operms': operms,
+            'msg_login': msg_login,
+            'msg_quit': msg_quit,
+        }
+
+    def _insert_user(self, username, record):
+        with self._lock:
+            try:
+                self._conn.execute(
+                    _INSERT_USER,
+                    (
+                        username,
+                        record['pwd'],
+                        record['home'],
+                        record['perm'],
+                        record['msg_login'],
+                        record['msg_quit'],
+                    ),
+                )
+            except sqlite3.IntegrityError:
+                raise ValueError(f'user {username!r} already exists')
+
+    def _delete_user(self, username):
+        with self._lock:
+            if not self._conn.execute(_DELETE_USER, (username,)).rowcount:
+                raise KeyError(username)
+
+    # --- public API
+
+    @classmethod
+    def hash_password(cls, password, iterations=None):
+        """Return a salted PBKDF2-SHA256 hash of password, to be
+        stored in the database.
+        """
+        iterations = iterations or cls.hash_iterations
+        salt = os.urandom(16)
+        digest = hashlib.pbkdf2_hmac(
+            'sha256', password.encode('utf8'), salt, iterations
+        )
+        return '{}{}${}${}'.format(
+            _HASH_PREFIX,
+            iterations,
+            base64.b64encode(salt).decode('ascii'),
+            base64.b64encode(digest).decode('ascii'),
+        )
+
+    @staticmethod
+    def check_password(password, stored):
+        """Whether password matches the stored one, either hashed by
+        hash_password() or in plain text.
+        """
+        if not stored.startswith(_HASH_PREFIX):
+            return hmac.compare_digest(
+                password.encode('utf8'), stored.encode('utf8')
+            )
+        try:
+            iterations, salt, digest = stored[len(_HASH_PREFIX) :].split('$')
+            salt = base64.b64decode(salt)
+            digest = base64.b64decode(digest)
+            iterations = int(iterations)
+        except ValueError:
+            return False
+        return hmac.compare_digest(
+            hashlib.pbkdf2_hmac(
+                'sha256', password.encode('utf8'), salt, iterations
+            ),
+            digest,
+        )
+
+    def add_user(self, username, password, homedir, perm='elr', **kwargs):
+        """Add a user to the database; password gets hashed. Arguments
+        are the same as DummyAuthorizer.add_user().
+        """
+        if password and not password.startswith(_HASH_PREFIX):
+            password = self.hash_password(password)
+        DummyAuthorizer.add_user(
+            self, username, password, homedir, perm, **kwargs
+        )
+
+    def override_perm(self, username, directory, perm, recursive=False):
+        DummyAuthorizer.override_perm(
+            self, username, directory, perm, recursive
+        )
+        directory = os.path.normcase(os.path.realpath(directory))
+        with self._lock:
+            self._conn.execute(
+                _INSERT_OVERRIDE,
+                (username, directory, perm, int(recursive)),
+            )
+
+    def validate_authentication(self, username, password, handler):
+        msg = "Authentication failed."
+        if not self.has_user(username):
+            if username == 'anonymous':
+                msg = "Anonymous access not allowed."
+            raise AuthenticationFailed(msg)
+        if username != 'anonymous' and not self.check_password(
+            password, self.user_table[username]['pwd']
+        ):
+            raise AuthenticationFailed(msg)
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_sqlite_authorizers = weakref.WeakSet()
+
+
+def _after_fork():
+    # have the next lookup of each SQLiteAuthorizer reopen the database
+    for auth in _sqlite_authorizers:
+        auth._next_check = float('-inf')
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
 def replace_anonymous(callable):
     """A decorator to replace anonymous user string passed to authorizer
     methods as first argument with the actual user used to handle
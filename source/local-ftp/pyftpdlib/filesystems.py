@@ -2,10 +2,20 @@
 # Use of this source code is governed by MIT license that can be
 # found in the LICENSE file.
 
+import collections
+import contextlib
+import errno
+import hashlib
+import itertools
+import mmap
+import operator
 import os
 import stat
+import sys
 import tempfile
+import threading
 import time
+import zlib
 
 
 try:
@@ -14,8 +24,20 @@ try:
 except ImportError:
     pwd = grp = None
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-__all__ = ['AbstractedFS', 'FilesystemError']
+
+__all__ = [
+    'AbstractedFS',
+    'DigestCache',
+    'FileCache',
+    'FilesystemError',
+    'ListingCache',
+    'PathCache',
+]
 
 
 _months_map = {
@@ -40,7 +62,10 @@ def _memoize(fun):
     """
 
     def wrapper(*args, **kwargs):
-        key = (args, frozenset(sorted(kwargs.items())))
+        if kwargs:
+            key = (args, frozenset(sorted(kwargs.items())))
+        else:
+            key = args
         try:
             return cache[key]
         except KeyError:
@@ -51,6 +76,53 @@ def _memoize(fun):
     return wrapper
 
 
+_entry_name = operator.attrgetter('name')
+
+# the checksum algorithms supported by AbstractedFS.digest(), named as
+# in draft-bryan-ftp-hash, mapped to their hashlib names
+DIGEST_ALGORITHMS = {
+    'SHA-1': 'sha1',
+    'SHA-256': 'sha256',
+    'SHA-512': 'sha512',
+    'MD5': 'md5',
+    'CRC32': 'crc32',
+}
+
+# the size of the reads done when computing a digest
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+# how many bytes AbstractedFS.copy() copies at a time
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+# the ioctl() cloning a file on Linux filesystems supporting reflinks
+# (btrfs, XFS...)
+_FICLONE = 0x40049409 if sys.platform.startswith('linux') else None
+
+
+class _CRC32:
+    """A hashlib-like interface to zlib.crc32()."""
+
+    __slots__ = ('_crc',)
+
+    def __init__(self):
+        self._crc = 0
+
+    def update(self, data):
+        self._crc = zlib.crc32(data, self._crc)
+
+    def hexdigest(self):
+        return f"{self._crc:08x}"
+
+
+def new_hash(algorithm):
+    """Return a new hash object for one of the DIGEST_ALGORITHMS."""
+    name = DIGEST_ALGORITHMS[algorithm]
+    if name == 'crc32':
+        return _CRC32()
+    # checksums are not used for security purposes
+    return hashlib.new(name, usedforsecurity=False)
+
+
 # ===================================================================
 # --- custom exceptions
 # ===================================================================
@@ -85,8 +157,15 @@ class AbstractedFS:
     FilesystemError exception can be raised from within any of
     the methods below in order to send a customized error string
     to the client.
+
+    The real path of the root directory is resolved once and then
+    reused by validpath(). If path_cache is set to a PathCache
+    instance (FTPHandler does that if configured) realpath() results
+    are cached as well.
     """
 
+    __slots__ = ('_cwd', '_real_root', '_root', 'cmd_channel', 'path_cache')
+
     def __init__(self, root, cmd_channel):
         """
         - (str) root: the user "real" home directory (e.g. '/home/user')
@@ -99,7 +178,9 @@ class AbstractedFS:
         # are responsible to set _cwd attribute as necessary.
         self._cwd = '/'
         self._root = root
+        self._real_root = None
         self.cmd_channel = cmd_channel
+        self.path_cache = None
 
     @property
     def root(self):
@@ -217,10 +298,16 @@ class AbstractedFS:
         Pathnames escaping from user's root directory are considered
         not valid.
         """
-        root = self.realpath(self.root)
+        # the real root is resolved once, as long as root is the same
+        cached = self._real_root
+        if cached is not None and cached[0] == self._root:
+            root = cached[1]
+        else:
+            root = self.realpath(self.root)
+            if not root.endswith(os.sep):
+                root += os.sep
+            self._real_root = (self._root, root)
         path = self.realpath(path)
-        if not root.endswith(os.sep):
-            root += os.sep
         if not path.endswith(os.sep):
             path += os.sep
         return path[0 : len(root)] == root
@@ -271,6 +358,27 @@ class AbstractedFS:
         """List the content of a directory."""
         return os.listdir(path)
 
+    def scandir(self, path):
+        """List the content of a directory as a list of os.DirEntry
+        objects sorted by name. Differently from listdir() this lets
+        format_list() and format_mlsx() reuse the information fetched
+        while reading the directory instead of joining paths and
+        calling lstat() for every entry (on Windows stat() info comes
+        for free).
+
+        Return None if listdir(), stat() or lstat() methods were
+        overridden by a subclass, meaning the caller is supposed to
+        fall back on listdir().
+        """
+        cls = type(self)
+        for name in ('listdir', 'lstat', 'stat'):
+            if getattr(cls, name) is not getattr(AbstractedFS, name):
+                return None
+        with os.scandir(path) as it:
+            entries = list(it)
+        entries.sort(key=_entry_name)
+        return entries
+
     def listdirinfo(self, path):
         """List the content of a directory."""
         return os.listdir(path)
@@ -343,12 +451,182 @@ class AbstractedFS:
         the epoch."""
         return os.path.getmtime(path)
 
+    def digest(self, path, algorithm, start=0, end=None, cache=None):
+        """Return the hex digest of the content of file path between
+        offsets start and end (excluded, None meaning the end of the
+        file) computed with one of the DIGEST_ALGORITHMS, plus the
+        size of the file. The file is read in DIGEST_CHUNK_SIZE chunks.
+
+        If cache (a DigestCache instance) is given the digest is looked
+        up there first, and stored there once computed.
+        """
+        iterator = self.iterdigest(path, algorithm, start, end, cache)
+        while True:
+            try:
+                next(iterator)
+            except StopIteration as exc:
+                return exc.value
+
+    def iterdigest(self, path, algorithm, start=0, end=None, cache=None):
+        """Like digest(), as a generator yielding the number of bytes
+        read after every DIGEST_CHUNK_SIZE chunk and returning the
+        (digest, size) tuple, so that the caller can do something else
+        in between.
+        """
+        st = self.stat(path)
+        size = st.st_size
+        if end is None or end > size:
+            end = size
+        if start > end:
+            raise FilesystemError(
+                f"Invalid range {start}-{end} (file size is {size})"
+            )
+        if cache is not None:
+            ret = cache.get(path, st, algorithm, start, end)
+            if ret is not None:
+                return ret, size
+        hasher = new_hash(algorithm)
+        remaining = end - start
+        buf = bytearray(min(remaining, DIGEST_CHUNK_SIZE))
+        view = memoryview(buf)
+        with self.open(path, 'rb') as f:
+            if start:
+                f.seek(start)
+            while remaining > 0:
+                n = f.readinto(view[: min(remaining, len(buf))])
+                if not n:
+                    break
+                hasher.update(view[:n])
+                remaining -= n
+                yield n
+        ret = hasher.hexdigest()
+        if cache is not None:
+            cache.put(path, st, algorithm, start, end, ret)
+        return ret, size
+
+    def copy(self, src, dst):
+        """Copy file src to dst, overwriting it. This is a generator
+        yielding the number of bytes copied every COPY_CHUNK_SIZE bytes
+        (at least once), so that the caller can do something else in
+        between.
+
+        The file is cloned if the filesystem supports it (reflink),
+        else copied by the kernel with os.copy_file_range(), falling
+        back on reading and writing it. If the copy doesn't complete
+        (e.g. the generator is closed) dst is removed.
+        """
+        yield from self._copyfile(src, dst)
+
+    def copytree(self, src, dst, check=None):
+        """Copy directory src recursively to dst, which must not exist,
+        as a generator like copy() which yields at least once per file
+        or directory. Symbolic links and special files are skipped. If
+        src is a file it's copied like copy() does.
+
+        If given, check(srcname, dstname, isdir) is called for every
+        file and directory below src before it's copied, and can raise
+        FilesystemError to stop the copy (what was copied so far is
+        left in place).
+        """
+        if not self.isdir(src):
+            yield from self._copyfile(src, dst)
+            return
+        realsrc = self.realpath(src)
+        realdst = self.realpath(os.path.dirname(dst))
+        if (realdst + os.sep).startswith(realsrc + os.sep):
+            raise FilesystemError("Can't copy a directory into itself")
+        dirs = [(src, dst)]
+        while dirs:
+            src, dst = dirs.pop()
+            self.mkdir(dst)
+            yield 0
+            for name in sorted(self.listdir(src)):
+                srcname = os.path.join(src, name)
+                dstname = os.path.join(dst, name)
+                mode = self.lstat(srcname).st_mode
+                if stat.S_ISDIR(mode):
+                    if check is not None:
+                        check(srcname, dstname, True)
+                    dirs.append((srcname, dstname))
+                elif stat.S_ISREG(mode):
+                    if check is not None:
+                        check(srcname, dstname, False)
+                    yield from self._copyfile(srcname, dstname)
+
+    def _copyfile(self, src, dst):
+        st = self.stat(src)
+        if not stat.S_ISREG(st.st_mode):
+            raise FilesystemError("Not a regular file")
+        if self.lexists(dst) and os.path.samestat(st, self.stat(dst)):
+            raise FilesystemError("Source and destination are the same file")
+        with self.open(src, 'rb') as fsrc, self.open(dst, 'wb') as fdst:
+            completed = False
+            try:
+                yield 0
+                yield from self._copydata(fsrc, fdst)
+                completed = True
+            finally:
+                if not completed:
+                    fdst.close()
+                    with contextlib.suppress(OSError):
+                        self.remove(dst)
+
+    @staticmethod
+    def _copydata(fsrc, fdst):
+        try:
+            infd = fsrc.fileno()
+            outfd = fdst.fileno()
+        except (AttributeError, OSError, ValueError):
+            # not real files
+            infd = outfd = None
+        if infd is not None and _FICLONE is not None and fcntl is not None:
+            try:
+                fcntl.ioctl(outfd, _FICLONE, infd)
+            except OSError:
+                pass
+            else:
+                yield os.fstat(outfd).st_size
+                return
+        if infd is not None and hasattr(os, 'copy_file_range'):
+            copied = 0
+            try:
+                while True:
+                    n = os.copy_file_range(infd, outfd, COPY_CHUNK_SIZE)
+                    if not n:
+                        return
+                    copied += n
+                    yield n
+            except OSError as err:
+                # e.g. across filesystems on Linux < 5.3
+                if copied or err.errno not in (
+                    errno.EXDEV,
+                    errno.ENOSYS,
+                    errno.EINVAL,
+                    errno.EOPNOTSUPP,
+                ):
+                    raise
+        buf = bytearray(COPY_CHUNK_SIZE)
+        view = memoryview(buf)
+        while True:
+            n = fsrc.readinto(buf)
+            if not n:
+                return
+            fdst.write(view[:n])
+            yield n
+
     def realpath(self, path):
         """Return the canonical version of path eliminating any
         symbolic links encountered in the path (if they are
         supported by the operating system).
         """
-        return os.path.realpath(path)
+        cache = self.path_cache
+        if cache is None:
+            return os.path.realpath(path)
+        ret = cache.get(path)
+        if ret is None:
+            ret = os.path.realpath(path)
+            cache.put(path, ret)
+        return ret
 
     def lexists(self, path):
         """Return True if path refers to an existing path, including
@@ -397,7 +675,8 @@ class AbstractedFS:
         directory emulating the "/bin/ls -lA" UNIX command output.
 
          - (str) basedir: the absolute dirname.
-         - (list) listing: the names of the entries in basedir
+         - (list) listing: the names of the entries in basedir, or the
+           os.DirEntry objects returned by scandir()
          - (bool) ignore_err: when False raise exception if os.lstat()
          call fails.
 
@@ -429,10 +708,20 @@ class AbstractedFS:
         SIX_MONTHS = 180 * 24 * 60 * 60
         readlink = getattr(self, 'readlink', None)
         now = time.time()
-        for basename in listing:
-            file = os.path.join(basedir, basename)
+        encoding = self.cmd_channel.encoding
+        unicode_errors = self.cmd_channel.unicode_errors
+        # {(minute, older_than_six_months): str}
+        mtimestrs = {}
+        for entry in listing:
             try:
-                st = self.lstat(file)
+                if isinstance(entry, str):
+                    basename = entry
+                    file = os.path.join(basedir, basename)
+                    st = self.lstat(file)
+                else:
+                    basename = entry.name
+                    file = entry.path
+                    st = entry.stat(follow_symlinks=False)
             except (OSError, FilesystemError):
                 if ignore_err:
                     continue
@@ -445,25 +734,33 @@ class AbstractedFS:
             size = st.st_size  # file size
             uname = get_user_by_uid(st.st_uid)
             gname = get_group_by_gid(st.st_gid)
-            mtime = timefunc(st.st_mtime)
             # if modification time > 6 months shows "month year"
             # else "month hh:mm";  this matches proftpd format, see:
             # https://github.com/giampaolo/pyftpdlib/issues/187
-            fmtstr = '%d  %Y' if now - st.st_mtime > SIX_MONTHS else '%d %H:%M'
+            old = now - st.st_mtime > SIX_MONTHS
+            # entries in the same directory usually share the same
+            # minute, hence we cache the time string
+            key = (st.st_mtime // 60, old)
             try:
-                mtimestr = "%s %s" % (  # noqa: UP031
-                    _months_map[mtime.tm_mon],
-                    time.strftime(fmtstr, mtime),
-                )
-            except ValueError:
-                # It could be raised if last mtime happens to be too
-                # old (prior to year 1900) in which case we return
-                # the current time as last mtime.
-                mtime = timefunc()
-                mtimestr = "%s %s" % (  # noqa: UP031
-                    _months_map[mtime.tm_mon],
-                    time.strftime("%d %H:%M", mtime),
-                )
+                mtimestr = mtimestrs[key]
+            except KeyError:
+                mtime = timefunc(st.st_mtime)
+                fmtstr = '%d  %Y' if old else '%d %H:%M'
+                try:
+                    mtimestr = "%s %s" % (  # noqa: UP031
+                        _months_map[mtime.tm_mon],
+                        time.strftime(fmtstr, mtime),
+                    )
+                except ValueError:
+                    # It could be raised if last mtime happens to be too
+                    # old (prior to year 1900) in which case we return
+                    # the current time as last mtime.
+                    mtime = timefunc()
+                    mtimestr = "%s %s" % (  # noqa: UP031
+                        _months_map[mtime.tm_mon],
+                        time.strftime("%d %H:%M", mtime),
+                    )
+                mtimestrs[key] = mtimestr
 
             # same as stat.S_ISLNK(st.st_mode) but slighlty faster
             islink = (st.st_mode & 61440) == stat.S_IFLNK
@@ -486,9 +783,7 @@ class AbstractedFS:
                 mtimestr,
                 basename,
             )
-            yield line.encode(
-                self.cmd_channel.encoding, self.cmd_channel.unicode_errors
-            )
+            yield line.encode(encoding, unicode_errors)
 
     def format_mlsx(self, basedir, listing, perms, facts, ignore_err=True):
         """Return an iterator object that yields the entries of a given
@@ -500,7 +795,8 @@ class AbstractedFS:
         fact stands for.
 
          - (str) basedir: the absolute dirname.
-         - (list) listing: the names of the entries in basedir
+         - (list) listing: the names of the entries in basedir, or the
+           os.DirEntry objects returned by scandir()
          - (str) perms: the string referencing the user permissions.
          - (str) facts: the list of "facts" to be returned.
          - (bool) ignore_err: when False raise exception if os.stat()
@@ -535,14 +831,18 @@ class AbstractedFS:
         show_uid = 'unix.uid' in facts
         show_gid = 'unix.gid' in facts
         show_unique = 'unique' in facts
-        for basename in listing:
+        for entry in listing:
             retfacts = {}
-            file = os.path.join(basedir, basename)
             # in order to properly implement 'unique' fact (RFC-3659,
             # chapter 7.5.2) we are supposed to follow symlinks, hence
             # use os.stat() instead of os.lstat()
             try:
-                st = self.stat(file)
+                if isinstance(entry, str):
+                    basename = entry
+                    st = self.stat(os.path.join(basedir, basename))
+                else:
+                    basename = entry.name
+                    st = entry.stat()
             except (OSError, FilesystemError):
                 if ignore_err:
                     continue
@@ -614,6 +914,640 @@ class AbstractedFS:
             )
 
 
+# ===================================================================
+# --- listing cache
+# ===================================================================
+
+
+class ListingCache:
+    """A size-bounded LRU cache of rendered (encoded) directory
+    listings, shared by all the sessions using it.
+
+    Entries are keyed by directory path, modification and change time
+    of the directory plus whatever affects the output (command,
+    facts, time zone, encoding) so that a directory gets re-listed as
+    soon as its content changes. Changes which do not alter the
+    directory's times (e.g. a file being overwritten) are expected to
+    be notified via invalidate(), which FTPHandler does for commands
+    modifying the filesystem. Since changes made by other processes
+    may go unnoticed, entries also expire after max_age seconds.
+
+     - (int) max_size: the maximum number of bytes stored.
+     - (int) max_entry_size: listings bigger than this are not cached
+       (defaults to 1/8 of max_size).
+     - (float) max_age: the number of seconds after which an entry
+       expires; None means never.
+    """
+
+    def __init__(
+        self, max_size=32 * 1024 * 1024, max_entry_size=None, max_age=60
+    ):
+        self.max_size = max_size
+        if max_entry_size is None:
+            max_entry_size = max_size // 8
+        self.max_entry_size = max_entry_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        # {key: (data, expires)}, least recently used first
+        self._entries = collections.OrderedDict()
+        # {path: set(keys)}
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}(entries={len(self._entries)}, "
+            f"size={self.size}, hits={self.hits}, misses={self.misses})>"
+        )
+
+    __str__ = __repr__
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the listing stored under key, or None. key[0] is
+        expected to be the directory path.
+        """
+        with self._lock:
+            try:
+                data, expires = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires is not None and time.monotonic() > expires:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        """Store a listing, evicting the least recently used ones
+        if max_size is exceeded.
+        """
+        if len(data) > self.max_entry_size:
+            return
+        expires = None
+        if self.max_age is not None:
+            expires = time.monotonic() + self.max_age
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (data, expires)
+            self._paths.setdefault(key[0], set()).add(key)
+            self.size += len(data)
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def store(self, key, iterator):
+        """Return a generator yielding the chunks produced by iterator
+        (e.g. format_list()) as they come, and storing them under key
+        once it is exhausted. Nothing is stored if the generator is not
+        consumed entirely (e.g. the transfer was aborted).
+        """
+        chunks = []
+        size = 0
+        for chunk in iterator:
+            if chunks is not None:
+                size += len(chunk)
+                if size > self.max_entry_size:
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+            yield chunk
+        if chunks is not None:
+            self.put(key, b''.join(chunks))
+
+    def invalidate(self, path):
+        """Remove all the listings of the given directory path."""
+        with self._lock:
+            for key in tuple(self._paths.get(path, ())):
+                self._remove(key)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._paths.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return cache statistics as a dict."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                entries=len(self._entries),
+                size=self.size,
+                max_size=self.max_size,
+                hits=self.hits,
+                misses=self.misses,
+                hit_ratio=self.hits / lookups if lookups else 0.0,
+                evictions=self.evictions,
+            )
+
+    def _remove(self, key):
+        data, _ = self._entries.pop(key)
+        self.size -= len(data)
+        keys = self._paths[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._paths[key[0]]
+
+
+class PathCache:
+    """A size-bounded LRU cache of resolved (real) filesystem paths,
+    saving AbstractedFS.realpath() the lstat() / readlink() calls
+    needed to resolve symbolic links on every command. Since paths
+    are checked against the user's home directory by comparing their
+    real paths, validpath() decisions don't cost any system call
+    either once the path is cached.
+
+    A path resolved while a session is in a directory could point
+    elsewhere later, e.g. if a symbolic link is changed by another
+    process. Therefore entries expire after max_age seconds.
+    FTPHandler also invalidates the paths it changes itself: on
+    MKD, RMD, DELE, RNTO and when entering a directory (CWD).
+
+    It can be used by a single session (see
+    FTPHandler.path_cache_size) or shared by all of them (see
+    FTPHandler.path_cache).
+
+     - (int) max_entries: the maximum number of paths stored.
+     - (float) max_age: the number of seconds after which an entry
+       expires; None means never.
+    """
+
+    def __init__(self, max_entries=1024, max_age=10):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        # {path: (realpath, expires)}, least recently used first
+        self._entries = collections.OrderedDict()
+        # {dir: set of the paths directly below it}, so that
+        # invalidate() only visits the entries it removes; it also
+        # holds the directories between entries which are not cached
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}(entries={len(self._entries)}, "
+            f"hits={self.hits}, misses={self.misses})>"
+        )
+
+    __str__ = __repr__
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _link(self, path):
+        # add path, and the directories above it, to the index
+        while True:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return
+            children = self._children.get(parent)
+            if children is not None:
+                children.add(path)
+                return
+            self._children[parent] = {path}
+            path = parent
+
+    def _unlink(self, path):
+        # remove path, and the directories above it left with nothing
+        # below them, from the index
+        while path not in self._entries and not self._children.get(path):
+            self._children.pop(path, None)
+            parent = os.path.dirname(path)
+            children = self._children.get(parent)
+            if parent == path or children is None:
+                return
+            children.discard(path)
+            path = parent
+
+    def get(self, path):
+        """Return the real path of path, or None."""
+        with self._lock:
+            try:
+                realpath, expires = self._entries[path]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires is not None and time.monotonic() > expires:
+                del self._entries[path]
+                self._unlink(path)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return realpath
+
+    def put(self, path, realpath):
+        """Store the real path of path, evicting the least recently
+        used entry if max_entries is exceeded.
+        """
+        expires = None
+        if self.max_age is not None:
+            expires = time.monotonic() + self.max_age
+        with self._lock:
+            if path not in self._entries:
+                self._link(path)
+            self._entries[path] = (realpath, expires)
+            self._entries.move_to_end(path)
+            if len(self._entries) > self.max_entries:
+                self._unlink(self._entries.popitem(last=False)[0])
+
+    def invalidate(self, path):
+        """Remove path and all the paths below it."""
+        path = path.rstrip(os.sep) or path
+        with self._lock:
+            stack = [path]
+            while stack:
+                key = stack.pop()
+                self._entries.pop(key, None)
+                stack.extend(self._children.pop(key, ()))
+            self._unlink(path)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._children.clear()
+
+    def stats(self):
+        """Return cache statistics as a dict."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                entries=len(self._entries),
+                max_entries=self.max_entries,
+                hits=self.hits,
+                misses=self.misses,
+                hit_ratio=self.hits / lookups if lookups else 0.0,
+            )
+
+
+class DigestCache:
+    """A size-bounded LRU cache of file digests computed by
+    AbstractedFS.digest(), shared by all the sessions using it.
+
+    Entries are keyed by device, inode, size and modification time of
+    the file (plus algorithm and byte range), so a digest is never
+    returned for a file whose content has changed since, as long as
+    its modification time changes too. Nothing needs to be
+    invalidated therefore. FTPHandler also stores the digest of
+    uploaded files, computed while they are being received.
+
+    If use_xattrs is True (and the platform supports them) the
+    digests of whole files are also stored in the "user.pyftpdlib.*"
+    extended attributes of the file, so that they survive server
+    restarts. Failing to read or write them (e.g. the filesystem
+    doesn't support them) is not an error.
+
+     - (int) max_entries: the maximum number of digests stored.
+     - (bool) use_xattrs: store digests in extended attributes.
+    """
+
+    def __init__(self, max_entries=4096, use_xattrs=False):
+        self.max_entries = max_entries
+        self.use_xattrs = use_xattrs and hasattr(os, 'setxattr')
+        self.hits = 0
+        self.misses = 0
+        self.xattr_hits = 0
+        # {key: digest}, least recently used first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}(entries={len(self._entries)}, "
+            f"hits={self.hits}, misses={self.misses})>"
+        )
+
+    __str__ = __repr__
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(st, algorithm, start, end):
+        return (
+            st.st_dev,
+            st.st_ino,
+            st.st_size,
+            st.st_mtime_ns,
+            algorithm,
+            start,
+            end,
+        )
+
+    @staticmethod
+    def _xattr(algorithm):
+        return 'user.pyftpdlib.' + algorithm.lower()
+
+    def get(self, path, st, algorithm, start, end):
+        """Return the digest of the bytes between start and end of
+        file path, whose os.stat() result is st, or None.
+        """
+        key = self._key(st, algorithm, start, end)
+        with self._lock:
+            try:
+                ret = self._entries[key]
+            except KeyError:
+                pass
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return ret
+        if self.use_xattrs and start == 0 and end == st.st_size:
+            try:
+                value = os.getxattr(path, self._xattr(algorithm))
+            except OSError:
+                pass
+            else:
+                value = value.decode('ascii', 'replace')
+                stamp, _, ret = value.rpartition(' ')
+                if stamp == f"{st.st_size}:{st.st_mtime_ns}":
+                    with self._lock:
+                        self.hits += 1
+                        self.xattr_hits += 1
+                    self._store(key, ret)
+                    return ret
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, path, st, algorithm, start, end, digest):
+        """Store the digest of the bytes between start and end of file
+        path, whose os.stat() result is st.
+        """
+        self._store(self._key(st, algorithm, start, end), digest)
+        if self.use_xattrs and start == 0 and end == st.st_size:
+            value = f"{st.st_size}:{st.st_mtime_ns} {digest}"
+            try:
+                os.setxattr(path, self._xattr(algorithm), value.encode())
+            except OSError:
+                pass
+
+    def _store(self, key, digest):
+        with self._lock:
+            self._entries[key] = digest
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries (extended attributes are left alone)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return cache statistics as a dict."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                entries=len(self._entries),
+                max_entries=self.max_entries,
+                hits=self.hits,
+                misses=self.misses,
+                xattr_hits=self.xattr_hits,
+                hit_ratio=self.hits / lookups if lookups else 0.0,
+            )
+
+
+class FileCache:
+    """A cache of the content of small files, limited in size and
+    shared by all the sessions using it, so that downloading them
+    again and again doesn't mean opening and reading them each time.
+
+    Entries are keyed by device and inode of the file and validated
+    against its size and modification time on every lookup: a file
+    rewritten in place is read again (unless its size and mtime stay
+    the same). Entries are immutable, read-only memoryviews which the
+    data channels send as is.
+
+    When max_size is exceeded the least recently used entries are
+    evicted ("lru") or, with eviction="lfu", the least used among the
+    sample oldest ones, so that a scan of many files read once doesn't
+    push out those read all the time.
+
+    preload() can be used before forking worker processes (see
+    FTPServer.serve_forever()): the files are read into an anonymous
+    shared memory map which the workers inherit, and share, rather
+    than each keeping a copy. Files cached afterwards are private to
+    the worker reading them.
+
+     - (int) max_size: the maximum total size of the files stored.
+     - (int) max_file_size: files bigger than this are not cached.
+     - (str) eviction: "lru" or "lfu".
+    """
+
+    sample = 16
+
+    def __init__(
+        self,
+        max_size=64 * 1024 * 1024,
+        max_file_size=256 * 1024,
+        eviction='lru',
+    ):
+        if eviction not in ('lru', 'lfu'):
+            raise ValueError(f"invalid eviction policy {eviction!r}")
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.eviction = eviction
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self._size = 0
+        self._shared_size = 0
+        # {(dev, ino): [size, mtime_ns, data, hits]}, least recently
+        # used first
+        self._entries = collections.OrderedDict()
+        # same as above, for the entries in the shared memory map,
+        # which are never evicted
+        self._shared = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}(entries={len(self)}, "
+            f"size={self._size + self._shared_size}, hits={self.hits}, "
+            f"misses={self.misses})>"
+        )
+
+    __str__ = __repr__
+
+    def __len__(self):
+        return len(self._entries) + len(self._shared)
+
+    def get(self, st):
+        """Return the content of the file whose os.stat() result is
+        st, or None.
+        """
+        key = (st.st_dev, st.st_ino)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            else:
+                entry = self._shared.get(key)
+            if entry is not None:
+                if entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+                    entry[3] += 1
+                    self.hits += 1
+                    self.bytes_saved += st.st_size
+                    return entry[2]
+                # the file has changed
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, st, data):
+        """Store data, the content of the file whose os.stat() result
+        is st, and return it as a read-only memoryview.
+        """
+        data = memoryview(data).toreadonly()
+        size = len(data)
+        if size > self.max_file_size or size > self.max_size:
+            return data
+        key = (st.st_dev, st.st_ino)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = [st.st_size, st.st_mtime_ns, data, 0]
+            self._size += size
+            while self._size > self.max_size:
+                self._evict()
+        return data
+
+    def load(self, fs, path):
+        """Return the content of file path (a filesystem path) of fs,
+        an AbstractedFS instance, reading and storing it if it's not
+        cached yet, or None if it can't be cached (not a regular file
+        or too big). OSError is raised if the file can't be accessed.
+        """
+        st = fs.stat(path)
+        if not stat.S_ISREG(st.st_mode) or st.st_size > self.max_file_size:
+            return None
+        data = self.get(st)
+        if data is not None:
+            return data
+        with fs.open(path, 'rb') as f:
+            data = f.read(self.max_file_size + 1)
+            newst = os.fstat(f.fileno())
+        if (
+            len(data) != newst.st_size
+            or newst.st_size > self.max_file_size
+            or newst.st_mtime_ns != st.st_mtime_ns
+        ):
+            # modified while being read
+            return None
+        return self.put(newst, data)
+
+    def preload(self, paths):
+        """Read the regular files in paths (filesystem paths), up to
+        max_size bytes, into a shared memory map. Files which can't be
+        read are skipped. Return the number of files stored.
+        """
+        files = []
+        total = 0
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if (
+                not stat.S_ISREG(st.st_mode)
+                or not st.st_size
+                or st.st_size > self.max_file_size
+                or total + st.st_size > self.max_size
+            ):
+                continue
+            files.append((path, st))
+            total += st.st_size
+        if not total:
+            return 0
+        arena = mmap.mmap(-1, total)
+        view = memoryview(arena)
+        offset = 0
+        entries = {}
+        for path, st in files:
+            try:
+                with open(path, 'rb') as f:
+                    nread = f.readinto(view[offset : offset + st.st_size])
+                    newst = os.fstat(f.fileno())
+            except OSError:
+                continue
+            if (
+                nread != st.st_size
+                or newst.st_size != st.st_size
+                or newst.st_mtime_ns != st.st_mtime_ns
+            ):
+                continue
+            data = view[offset : offset + nread].toreadonly()
+            entries[st.st_dev, st.st_ino] = [
+                st.st_size,
+                st.st_mtime_ns,
+                data,
+                0,
+            ]
+            offset += nread
+        with self._lock:
+            for key in entries:
+                self._remove(key)
+            self._shared.update(entries)
+            self._shared_size += offset
+        return len(entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[2])
+        entry = self._shared.pop(key, None)
+        if entry is not None:
+            self._shared_size -= len(entry[2])
+
+    def _evict(self):
+        entries = self._entries
+        if self.eviction == 'lru':
+            key = next(iter(entries))
+        else:
+            oldest = itertools.islice(entries.items(), self.sample)
+            key = min(oldest, key=lambda x: x[1][3])[0]
+        self._size -= len(entries.pop(key)[2])
+        self.evictions += 1
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._shared.clear()
+            self._size = self._shared_size = 0
+
+    def stats(self):
+        """Return cache statistics as a dict."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                entries=len(self._entries) + len(self._shared),
+                size=self._size,
+                shared_size=self._shared_size,
+                max_size=self.max_size,
+                hits=self.hits,
+                misses=self.misses,
+                hit_ratio=self.hits / lookups if lookups else 0.0,
+                evictions=self.evictions,
+                bytes_saved=self.bytes_saved,
+            )
+
+
 # ===================================================================
 # --- platform specific implementation
 # ===================================================================
@@ -629,6 +1563,8 @@ if os.name == 'posix':
         and navigate the real filesystem.
         """
 
+        __slots__ = ()
+
         def __init__(self, root, cmd_channel):
             AbstractedFS.__init__(self, root, cmd_channel)
             # initial cwd was set to "/" to emulate a chroot jail
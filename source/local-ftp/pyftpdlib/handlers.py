@@ -2,7 +2,7 @@
 # Use of this source code is governed by MIT license that can be
 # found in the LICENSE file.
 
-import asynchat
+import collections
 import contextlib
 import errno
 import glob
@@ -11,11 +11,19 @@ import os
 import random
 import socket
 import sys
+import threading
 import time
 import traceback
+import types
+import warnings
 from datetime import datetime
 
 
+with warnings.catch_warnings():
+    # deprecated, see ioloop.py
+    warnings.simplefilter('ignore', DeprecationWarning)
+    import asynchat
+
 try:
     import grp
     import pwd
@@ -33,6 +41,8 @@ from .authorizers import AuthorizerError
 from .authorizers import DummyAuthorizer
 from .filesystems import AbstractedFS
 from .filesystems import FilesystemError
+from .filesystems import PathCache
+from .filesystems import new_hash
 from .ioloop import _ERRNOS_DISCONNECTED
 from .ioloop import _ERRNOS_RETRY
 from .ioloop import Acceptor
@@ -44,7 +54,17 @@ from .log import debug
 from .log import logger
 
 
-CR_BYTE = ord('\r')
+_LINESEP = os.linesep.encode('ascii')
+
+# MLST facts supported on this platform and those returned by default
+_DEFAULT_FACTS = ('type', 'perm', 'size', 'modify')
+if os.name == 'posix':
+    _DEFAULT_FACTS += ('unique',)
+_AVAILABLE_FACTS = _DEFAULT_FACTS
+if pwd and grp:
+    _AVAILABLE_FACTS += ('unix.mode', 'unix.uid', 'unix.gid')
+if os.name == 'nt':
+    _AVAILABLE_FACTS += ('create',)
 
 
 proto_cmds = {
@@ -99,6 +119,12 @@ proto_cmds = {
         arg=False,
         help='Syntax: FEAT (list all new features supported).',
     ),
+    'HASH': dict(
+        perm='r',
+        auth=True,
+        arg=True,
+        help='Syntax: HASH <SP> file-name (get file checksum).',
+    ),
     'HELP': dict(
         perm=None,
         auth=False,
@@ -198,6 +224,15 @@ proto_cmds = {
         arg=False,
         help='Syntax: QUIT (quit current session).',
     ),
+    'RANG': dict(
+        perm=None,
+        auth=True,
+        arg=True,
+        help=(
+            'Syntax: RANG <SP> start-point <SP> end-point (set byte range '
+            'for HASH).'
+        ),
+    ),
     'REIN': dict(
         perm=None, auth=True, arg=False, help='Syntax: REIN (flush account).'
     ),
@@ -249,6 +284,24 @@ proto_cmds = {
         arg=True,
         help='Syntax: SITE CHMOD <SP> mode path (change file mode).',
     ),
+    'SITE COPY': dict(
+        perm='w',
+        auth=True,
+        arg=True,
+        help='Syntax: SITE COPY <SP> src-name dst-name (copy file).',
+    ),
+    'SITE CPR': dict(
+        perm='w',
+        auth=True,
+        arg=True,
+        help='Syntax: SITE CPR <SP> src-dir dst-dir (copy directory tree).',
+    ),
+    'SITE STATS': dict(
+        perm='M',
+        auth=True,
+        arg=False,
+        help='Syntax: SITE STATS (show server performance metrics).',
+    ),
     'SIZE': dict(
         perm='l',
         auth=True,
@@ -297,6 +350,12 @@ proto_cmds = {
         arg=True,
         help='Syntax: USER <SP> user-name (set username).',
     ),
+    'XCRC': dict(
+        perm='r',
+        auth=True,
+        arg=True,
+        help='Syntax: XCRC <SP> file-name [<SP> start [<SP> end]] (CRC32).',
+    ),
     'XCUP': dict(
         perm='e',
         auth=True,
@@ -315,6 +374,12 @@ proto_cmds = {
         arg=True,
         help='Syntax: XMKD <SP> dir-name (obsolete; create directory).',
     ),
+    'XMD5': dict(
+        perm='r',
+        auth=True,
+        arg=True,
+        help='Syntax: XMD5 <SP> file-name [<SP> start [<SP> end]] (MD5).',
+    ),
     'XPWD': dict(
         perm=None,
         auth=True,
@@ -327,6 +392,30 @@ proto_cmds = {
         arg=True,
         help='Syntax: XRMD <SP> dir-name (obsolete; remove directory).',
     ),
+    'XSHA1': dict(
+        perm='r',
+        auth=True,
+        arg=True,
+        help='Syntax: XSHA1 <SP> file-name [<SP> start [<SP> end]] (SHA-1).',
+    ),
+    'XSHA256': dict(
+        perm='r',
+        auth=True,
+        arg=True,
+        help=(
+            'Syntax: XSHA256 <SP> file-name [<SP> start [<SP> end]] '
+            '(SHA-256).'
+        ),
+    ),
+    'XSHA512': dict(
+        perm='r',
+        auth=True,
+        arg=True,
+        help=(
+            'Syntax: XSHA512 <SP> file-name [<SP> start [<SP> end]] '
+            '(SHA-512).'
+        ),
+    ),
 }
 
 if not hasattr(os, 'chmod'):
@@ -346,6 +435,50 @@ def _strerror(err):
         return str(err)
 
 
+def _split_digest_args(arg):
+    """Split the argument of XCRC, XMD5 & co., "path [start [end]]",
+    into path, start and end. path can be enclosed in double quotes,
+    which is necessary if it ends with numbers separated by spaces.
+    Raise ValueError if the range is not valid.
+    """
+    if arg.startswith('"') and '"' in arg[1:]:
+        path, _, rest = arg[1:].partition('"')
+        nums = rest.split()
+    else:
+        words = arg.split(' ')
+        nums = []
+        while len(words) > 1 and len(nums) < 2 and words[-1].isdigit():
+            nums.insert(0, words.pop())
+        path = ' '.join(words)
+    if len(nums) > 2:
+        raise ValueError("too many arguments")
+    start = int(nums[0]) if nums else 0
+    end = int(nums[1]) if len(nums) > 1 else None
+    if start < 0 or (end is not None and end < start):
+        raise ValueError("invalid range")
+    return path, start, end
+
+
+def _split_copy_args(arg):
+    """Split the argument of SITE COPY and SITE CPR, "src dst", into
+    the source and destination paths. Each of them can be enclosed in
+    double quotes, which is necessary if it contains spaces.
+    Raise ValueError if there aren't two paths.
+    """
+    paths = []
+    rest = arg.lstrip(' ')
+    while rest:
+        if rest.startswith('"') and '"' in rest[1:]:
+            path, _, rest = rest[1:].partition('"')
+        else:
+            path, _, rest = rest.partition(' ')
+        paths.append(path)
+        rest = rest.lstrip(' ')
+    if len(paths) != 2 or not all(paths):
+        raise ValueError("command needs two arguments")
+    return paths
+
+
 def _is_ssl_sock(sock):
     return SSL is not None and isinstance(sock, SSL.Connection)
 
@@ -367,6 +500,40 @@ def _support_hybrid_ipv6():
 
 SUPPORTS_HYBRID_IPV6 = _support_hybrid_ipv6()
 
+# Linux kernel TLS (linux/tcp.h, linux/tls.h)
+_TCP_ULP = 31
+_SOL_TLS = 282
+_TLS_TX = 1
+
+
+def _ktls_available():
+    """Return True if the kernel supports TLS offload (the "tls" TCP
+    upper layer protocol), in which case OpenSSL can have the kernel
+    encrypt data written by sendfile().
+    """
+    if not sys.platform.startswith('linux') or not hasattr(os, 'sendfile'):
+        return False
+    try:
+        with contextlib.closing(socket.socket()) as sock:
+            sock.setsockopt(socket.IPPROTO_TCP, _TCP_ULP, b'tls')
+    except OSError as err:
+        # the "tls" module was found (and loaded), but it can only be
+        # attached to connected sockets
+        return err.errno == errno.ENOTCONN
+    return True
+
+
+def _ktls_tx_enabled(sock):
+    """Return True if data sent on sock is encrypted by the kernel,
+    that is OpenSSL enabled kernel TLS after the handshake.
+    """
+    try:
+        # only the crypto_info header (version, cipher type)
+        sock.getsockopt(_SOL_TLS, _TLS_TX, 4)
+    except OSError:
+        return False
+    return True
+
 
 class _FileReadWriteError(OSError):
     """Exception raised when reading or writing a file during a transfer."""
@@ -380,6 +547,179 @@ class _GiveUpOnSendfile(Exception):
 
 # --- DTP classes
 
+# serializes PassivePortAllocator creation among threads
+_allocator_lock = threading.Lock()
+
+
+class PassivePortAllocator:
+    """Hands out the ports configured in FTPHandler.passive_ports to
+    PassiveDTP. It keeps track of the ports in use, so finding a free
+    one takes O(1) instead of bind()ing random ports until one
+    succeeds, and hands them out least recently used first.
+
+    It can also keep a pool of sockets already bound and listening
+    for each local address, so that PASV / EPSV replies don't wait for
+    bind() and listen(). When ports is None the kernel assigns ports
+    and only the pool is used.
+
+    An instance is shared by all the connections of a FTPServer
+    (threads included) and is available as its passive_allocator
+    attribute. Pre-forked workers and processes have their own one:
+    ports used by another process are detected when bind() fails,
+    and are skipped.
+
+     - (list) ports: the ports to hand out, or None.
+     - (int) pool_size: the number of idle listening sockets kept for
+       each local address (defaults to 0 == no pool).
+     - (int) backlog: the backlog passed to listen() for the sockets
+       in the pool.
+    """
+
+    def __init__(self, ports=None, pool_size=0, backlog=5):
+        self.ports = ports
+        self.pool_size = pool_size
+        self.backlog = backlog
+        self._free = collections.deque()
+        if ports is not None:
+            ports = list(dict.fromkeys(ports))
+            random.shuffle(ports)
+            self._free.extend(ports)
+        self._used = set()
+        # {(family, ip): [(sock, port), ...]}
+        self._pool = {}
+        self._lock = threading.Lock()
+        # bind() fell back on a kernel-assigned port
+        self.exhausted = 0
+        # bind() failed as a port was in use by someone else
+        self.busy = 0
+        self.pool_hits = 0
+        self.pool_misses = 0
+
+    def acquire(self):
+        """Return a free port, or None if they are all in use."""
+        with self._lock:
+            if not self._free:
+                return None
+            port = self._free.popleft()
+            self._used.add(port)
+            return port
+
+    def release(self, port):
+        """Put *port* back at the end of the free ports queue."""
+        with self._lock:
+            if port in self._used:
+                self._used.remove(port)
+                self._free.append(port)
+
+    def stats(self):
+        """Return the allocator counters as a dict."""
+        with self._lock:
+            return dict(
+                free=len(self._free),
+                in_use=len(self._used),
+                exhausted=self.exhausted,
+                busy=self.busy,
+                pool_hits=self.pool_hits,
+                pool_misses=self.pool_misses,
+            )
+
+    def listen(self, family, ip):
+        """Return a (sock, port) tuple where sock is a non-blocking
+        socket bound to *ip* and listening, taken from the pool if
+        possible. port is the port taken from the configured range,
+        or None if the kernel assigned it.
+        """
+        with self._lock:
+            pool = self._pool.get((family, ip))
+            if pool:
+                self.pool_hits += 1
+                sock, port = pool.pop()
+            else:
+                if self.pool_size:
+                    self.pool_misses += 1
+                sock = None
+        if sock is None:
+            return self._bind(family, ip)
+        # discard connections which were made before the port got
+        # advertised to the client
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                break
+            conn.close()
+        return (sock, port)
+
+    def fill(self, family, ip):
+        """Bind and listen sockets until the pool for *ip* is full."""
+        key = (family, ip)
+        while len(self._pool.get(key, ())) < self.pool_size:
+            sock, port = self._bind(family, ip)
+            if port is None and self.ports is not None:
+                # don't keep kernel-assigned ports around while the
+                # range is exhausted
+                sock.close()
+                break
+            with self._lock:
+                self._pool.setdefault(key, []).append((sock, port))
+
+    def close(self):
+        """Close the sockets in the pool."""
+        with self._lock:
+            pools = list(self._pool.values())
+            self._pool.clear()
+        for pool in pools:
+            for sock, port in pool:
+                sock.close()
+                if port is not None:
+                    self.release(port)
+
+    def _bind(self, family, ip):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            port = None
+            if self.ports is not None:
+                # avoid to reuse address on Windows
+                if os.name not in ('nt', 'ce') and sys.platform != 'cygwin':
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                # try each free port at most once
+                for _ in range(len(self._free)):
+                    port = self.acquire()
+                    if port is None:
+                        break
+                    try:
+                        sock.bind((ip, port))
+                    except PermissionError:
+                        logger.debug(
+                            "ignoring EPERM when bind()ing port %s", port
+                        )
+                        self.release(port)
+                        port = None
+                    except OSError as err:
+                        self.release(port)
+                        port = None
+                        if err.errno != errno.EADDRINUSE:
+                            raise
+                        with self._lock:
+                            self.busy += 1
+                    else:
+                        break
+                if port is None:
+                    with self._lock:
+                        self.exhausted += 1
+            if port is None:
+                # By using 0 as port number value we let kernel
+                # choose a free unprivileged random port.
+                sock.bind((ip, 0))
+            sock.listen(self.backlog)
+            sock.setblocking(False)
+        except BaseException:
+            sock.close()
+            if port is not None:
+                self.release(port)
+            raise
+        return (sock, port)
+
 
 class PassiveDTP(Acceptor):
     """Creates a socket listening on a local port, dispatching the
@@ -405,6 +745,8 @@ class PassiveDTP(Acceptor):
         self.cmd_channel = cmd_channel
         self.log = cmd_channel.log
         self.log_exception = cmd_channel.log_exception
+        self._allocator = None
+        self._port = None
         Acceptor.__init__(self, ioloop=cmd_channel.ioloop)
 
         local_ip = self.cmd_channel.socket.getsockname()[0]
@@ -423,45 +765,26 @@ class PassiveDTP(Acceptor):
         else:
             af = self.cmd_channel.socket.family
 
-        self.create_socket(af, socket.SOCK_STREAM)
-
-        if self.cmd_channel.passive_ports is None:
+        allocator = self.cmd_channel._get_passive_allocator()
+        if allocator is None:
             # By using 0 as port number value we let kernel choose a
             # free unprivileged random port.
+            self.create_socket(af, socket.SOCK_STREAM)
             self.bind((local_ip, 0))
         else:
-            ports = list(self.cmd_channel.passive_ports)
-            while ports:
-                port = ports.pop(random.randint(0, len(ports) - 1))
-                self.set_reuse_addr()
-                try:
-                    self.bind((local_ip, port))
-                except PermissionError:
-                    self.cmd_channel.log(
-                        f"ignoring EPERM when bind()ing port {port}",
-                        logfun=logger.debug,
-                    )
-                except OSError as err:
-                    if err.errno == errno.EADDRINUSE:  # port already in use
-                        if ports:
-                            continue
-                        # If cannot use one of the ports in the configured
-                        # range we'll use a kernel-assigned port, and log
-                        # a message reporting the issue.
-                        # By using 0 as port number value we let kernel
-                        # choose a free unprivileged random port.
-                        else:
-                            self.bind((local_ip, 0))
-                            self.cmd_channel.log(
-                                "Can't find a valid passive port in the "
-                                "configured range. A random kernel-assigned "
-                                "port will be used.",
-                                logfun=logger.warning,
-                            )
-                    else:
-                        raise
-                else:
-                    break
+            sock, self._port = allocator.listen(af, local_ip)
+            self._allocator = allocator
+            self.set_socket(sock)
+            if self._port is None and allocator.ports is not None:
+                # If cannot use one of the ports in the configured
+                # range we'll use a kernel-assigned port, and log
+                # a message reporting the issue.
+                self.cmd_channel.log(
+                    "Can't find a valid passive port in the "
+                    "configured range. A random kernel-assigned "
+                    "port will be used.",
+                    logfun=logger.warning,
+                )
         self.listen(self.backlog or self.cmd_channel.server.backlog)
 
         port = self.socket.getsockname()[1]
@@ -491,6 +814,9 @@ class PassiveDTP(Acceptor):
             )
         if self.timeout:
             self.call_later(self.timeout, self.handle_timeout)
+        if allocator is not None and allocator.pool_size:
+            # the reply has been sent already
+            allocator.fill(af, local_ip)
 
     # --- connection / overridden
 
@@ -554,6 +880,9 @@ class PassiveDTP(Acceptor):
     def close(self):
         debug("call: close()", inst=self)
         Acceptor.close(self)
+        if self._port is not None:
+            self._allocator.release(self._port)
+            self._port = None
 
 
 class ActiveDTP(Connector):
@@ -682,6 +1011,36 @@ class DTPHandler(AsyncChat):
      - (int) ac_out_buffer_size: outgoing data buffer size (defaults 65536)
     """
 
+    __slots__ = (
+        '_buckets',
+        '_data_wrapper',
+        '_filefd',
+        '_had_cr',
+        '_hash_algorithm',
+        '_hashed',
+        '_hasher',
+        '_idler',
+        '_initialized',
+        '_lastdata',
+        '_metrics',
+        '_offset',
+        '_pcache',
+        '_resp',
+        '_resumer',
+        '_sendfile',
+        '_shaper',
+        '_start_time',
+        'cmd',
+        'cmd_channel',
+        'file_obj',
+        'log',
+        'log_exception',
+        'receive',
+        'tot_bytes_received',
+        'tot_bytes_sent',
+        'transfer_finished',
+    )
+
     timeout = 300
     ac_in_buffer_size = 65536
     ac_out_buffer_size = 65536
@@ -705,12 +1064,21 @@ class DTPHandler(AsyncChat):
         self._data_wrapper = None
         self._lastdata = 0
         self._had_cr = False
+        self._hasher = None
+        self._hash_algorithm = None
+        self._hashed = 0
         self._start_time = timer()
         self._resp = ()
         self._offset = None
         self._filefd = None
         self._idler = None
         self._initialized = False
+        self._shaper = cmd_channel.bandwidth_shaper
+        self._buckets = None
+        self._resumer = None
+        self._metrics = cmd_channel.metrics
+        self._sendfile = False
+        self._pcache = None
         try:
             AsyncChat.__init__(self, sock, ioloop=cmd_channel.ioloop)
         except OSError as err:
@@ -735,6 +1103,8 @@ class DTPHandler(AsyncChat):
             self._idler = self.ioloop.call_every(
                 self.timeout, self.handle_timeout, _errback=self.handle_error
             )
+        if self._metrics is not None:
+            self._metrics.data_opened(self)
 
     def __repr__(self):
         return '<%s(%s)>' % (  # noqa: UP031
@@ -774,33 +1144,55 @@ class DTPHandler(AsyncChat):
         self._initialized = True
         self.modify_ioloop_events(self.ioloop.WRITE)
         self._wanted_io_events = self.ioloop.WRITE
-        if self.use_sendfile():
-            self._offset = producer.file.tell()
-            self._filefd = self.file_obj.fileno()
-            try:
-                self.initiate_sendfile()
-            except _GiveUpOnSendfile:
-                pass
-            else:
-                self.initiate_send = self.initiate_sendfile
-                return
+        if isinstance(producer, FileProducer) and producer.type == 'i':
+            self._advise_page_cache(producer.file, False)
+        if self.use_sendfile() and self._start_sendfile(producer):
+            return
         debug("starting transfer using send()", self)
         AsyncChat.push_with_producer(self, producer)
 
+    def _start_sendfile(self, producer):
+        """Start sending the file of producer (a FileProducer) from its
+        current position using sendfile(). Return False if sendfile()
+        can't be used, in which case nothing has been sent.
+        """
+        self._offset = producer.file.tell()
+        self._filefd = self.file_obj.fileno()
+        if self._shaper is None:
+            sendfile = self.initiate_sendfile
+        else:
+            sendfile = self._initiate_shaped_sendfile
+        try:
+            sendfile()
+        except _GiveUpOnSendfile:
+            return False
+        self.initiate_send = sendfile
+        self._sendfile = True
+        return True
+
     def close_when_done(self):
         asynchat.async_chat.close_when_done(self)
 
     def initiate_send(self):
-        asynchat.async_chat.initiate_send(self)
+        if self._shaper is None:
+            self.send_queued()
+            return
+        size = self._shaper_quota(self.ac_out_buffer_size)
+        if size:
+            sent = self.tot_bytes_sent
+            self.send_queued(size)
+            self._shaper.consume(self._buckets, self.tot_bytes_sent - sent)
 
-    def initiate_sendfile(self):
+    def initiate_sendfile(self, count=None):
         """A wrapper around sendfile."""
+        if count is None:
+            count = self.ac_out_buffer_size
         try:
             sent = os.sendfile(
                 self._fileno,
                 self._filefd,
                 self._offset,
-                self.ac_out_buffer_size,
+                count,
             )
         except OSError as err:
             if err.errno in _ERRNOS_RETRY or err.errno == errno.EBUSY:
@@ -822,6 +1214,42 @@ class DTPHandler(AsyncChat):
             else:
                 self._offset += sent
                 self.tot_bytes_sent += sent
+                if self._pcache is not None:
+                    self._pcache.advance(sent)
+
+    def _initiate_shaped_sendfile(self):
+        size = self._shaper_quota(self.ac_out_buffer_size)
+        if size:
+            sent = self.tot_bytes_sent
+            self.initiate_sendfile(size)
+            self._shaper.consume(self._buckets, self.tot_bytes_sent - sent)
+
+    # --- bandwidth shaping
+
+    def _shaper_quota(self, size):
+        """Return how many bytes (up to size) can be transferred now
+        according to the bandwidth shaper. If 0 stop polling until the
+        shaper's buckets get refilled.
+        """
+        if self._buckets is None:
+            self._buckets = self._shaper.attach(self.cmd_channel, self.receive)
+        quota = self._shaper.quota(self._buckets, size)
+        if not quota:
+            self.del_channel()
+            if self._resumer is None or self._resumer.cancelled:
+                self._resumer = self.ioloop.call_later(
+                    self._shaper.delay(self._buckets, size),
+                    self._shaper_resume,
+                    _errback=self.handle_error,
+                )
+        return quota
+
+    def _shaper_resume(self):
+        if not self._closed:
+            if self.receive:
+                self.add_channel(events=self.ioloop.READ)
+            else:
+                self.add_channel(events=self.ioloop.WRITE)
 
     # --- utility methods
 
@@ -829,9 +1257,16 @@ class DTPHandler(AsyncChat):
         """The data wrapper used for receiving data in ASCII mode on
         systems using a single line terminator, handling those cases
         where CRLF ('\r\n') gets delivered in two chunks.
+        The whole chunk is translated at once by bytes.replace().
         """
+        prefix = b''
         if self._had_cr:
-            chunk = b'\r' + chunk
+            # a CR was held back from the previous chunk
+            if chunk.startswith(b'\n'):
+                prefix = _LINESEP
+                chunk = chunk[1:]
+            else:
+                prefix = b'\r'
 
         if chunk.endswith(b'\r'):
             self._had_cr = True
@@ -839,7 +1274,11 @@ class DTPHandler(AsyncChat):
         else:
             self._had_cr = False
 
-        return chunk.replace(b'\r\n', bytes(os.linesep, "ascii"))
+        if b'\r' in chunk:
+            chunk = chunk.replace(b'\r\n', _LINESEP)
+        if prefix:
+            chunk = prefix + chunk
+        return chunk
 
     def enable_receiving(self, type, cmd):
         """Enable receiving of data over the channel. Depending on the
@@ -862,6 +1301,33 @@ class DTPHandler(AsyncChat):
         else:
             raise TypeError("unsupported type")
         self.receive = True
+        if self.cmd_channel.digest_cache is not None:
+            # compute the checksum of the file while it's written,
+            # unless the upload is resumed
+            try:
+                offset = self.file_obj.tell()
+            except (AttributeError, OSError, ValueError):
+                offset = None
+            if offset == 0:
+                self._hash_algorithm = self.cmd_channel._hash_algorithm
+                self._hasher = new_hash(self._hash_algorithm)
+        if type == 'i':
+            self._advise_page_cache(self.file_obj, True)
+
+    def _advise_page_cache(self, file, receive):
+        """Apply cmd_channel.page_cache_policy (if any) to file, about
+        to be transferred from its current position.
+        """
+        policy = self.cmd_channel.page_cache_policy
+        if policy is None or self._pcache is not None:
+            return
+        try:
+            fd = file.fileno()
+            offset = file.tell()
+        except (AttributeError, OSError, ValueError):
+            # not a regular file
+            return
+        self._pcache = policy.attach(fd, receive, offset)
 
     def get_transmitted_bytes(self):
         """Return the number of transmitted bytes."""
@@ -880,46 +1346,33 @@ class DTPHandler(AsyncChat):
     def send(self, data):
         result = AsyncChat.send(self, data)
         self.tot_bytes_sent += result
+        if self._pcache is not None:
+            self._pcache.advance(result)
         return result
 
-    def refill_buffer(self):  # pragma: no cover
-        """Overridden as a fix around https://bugs.python.org/issue1740572
-        (when the producer is consumed, close() was called instead of
-        handle_close()).
-        """
-        while True:
-            if len(self.producer_fifo):
-                p = self.producer_fifo.first()
-                # a 'None' in the producer fifo is a sentinel,
-                # telling us to close the channel.
-                if p is None:
-                    if not self.ac_out_buffer:
-                        self.producer_fifo.pop()
-                        # self.close()
-                        self.handle_close()
-                    return
-                elif isinstance(p, str):
-                    self.producer_fifo.pop()
-                    self.ac_out_buffer += p
-                    return
-                data = p.more()
-                if data:
-                    self.ac_out_buffer += data
-                    return
-                else:
-                    self.producer_fifo.pop()
-            else:
-                return
+    def sendmsg(self, buffers):
+        result = AsyncChat.sendmsg(self, buffers)
+        self.tot_bytes_sent += result
+        if self._pcache is not None:
+            self._pcache.advance(result)
+        return result
 
     def handle_read(self):
         """Called when there is data waiting to be read."""
+        size = self.ac_in_buffer_size
+        if self._shaper is not None:
+            size = self._shaper_quota(size)
+            if not size:
+                return
         try:
-            chunk = self.recv(self.ac_in_buffer_size)
+            chunk = self.recv(size)
         except RetryError:
             pass
         except OSError:
             self.handle_error()
         else:
+            if self._shaper is not None:
+                self._shaper.consume(self._buckets, len(chunk))
             self.tot_bytes_received += len(chunk)
             if not chunk:
                 self.transfer_finished = True
@@ -931,6 +1384,11 @@ class DTPHandler(AsyncChat):
                 self.file_obj.write(chunk)
             except OSError as err:
                 raise _FileReadWriteError(err)
+            if self._hasher is not None:
+                self._hasher.update(chunk)
+                self._hashed += len(chunk)
+            if self._pcache is not None:
+                self._pcache.advance(len(chunk))
 
     handle_read_event = handle_read  # small speedup
 
@@ -993,6 +1451,17 @@ class DTPHandler(AsyncChat):
         if not self._closed:
             if self.receive:
                 self.transfer_finished = True
+                if self._had_cr:
+                    # the file ends with a CR held back by the ASCII
+                    # data wrapper
+                    self._had_cr = False
+                    try:
+                        self.file_obj.write(b'\r')
+                    except OSError:
+                        self.transfer_finished = False
+                    if self._hasher is not None:
+                        self._hasher.update(b'\r')
+                        self._hashed += 1
             else:
                 self.transfer_finished = len(self.producer_fifo) == 0
             try:
@@ -1017,16 +1486,44 @@ class DTPHandler(AsyncChat):
         if not self._closed:
             # RFC-959 says we must close the connection before replying
             AsyncChat.close(self)
+            if self._metrics is not None:
+                self._metrics.data_closed(self, self._sendfile)
 
             # Close file object before responding successfully to client
             if self.file_obj is not None and not self.file_obj.closed:
+                if self._pcache is not None:
+                    if self.receive:
+                        with contextlib.suppress(OSError, ValueError):
+                            self.file_obj.flush()
+                    self._pcache.close()
+                    self._pcache = None
                 self.file_obj.close()
 
-            if self._resp:
+            hooks = self.cmd_channel.hook_dispatcher
+            deferred_resp = None
+            if (
+                hooks is not None
+                and self._resp
+                and self.transfer_finished
+                and self.file_obj is not None
+                and not self.cmd_channel._fs_pending
+                and not self.cmd_channel._quit_pending
+                and hooks.has_reply_hook(
+                    'file_received' if self.receive else 'file_sent'
+                )
+            ):
+                # the reply depends on the outcome of a hook
+                deferred_resp = self._resp
+            elif self._resp:
                 self.cmd_channel.respond(self._resp[0], logfun=self._resp[1])
 
             if self._idler is not None and not self._idler.cancelled:
                 self._idler.cancel()
+            if self._resumer is not None and not self._resumer.cancelled:
+                self._resumer.cancel()
+            if self._buckets is not None:
+                self._shaper.detach(self._buckets)
+                self._buckets = None
             if self.file_obj is not None:
                 filename = self.file_obj.name
                 elapsed_time = round(self.get_elapsed_time(), 3)
@@ -1038,15 +1535,42 @@ class DTPHandler(AsyncChat):
                     elapsed=elapsed_time,
                     bytes=self.get_transmitted_bytes(),
                 )
+                stats = self.cmd_channel.server.worker_stats
+                if stats is not None:
+                    stats.incr('transfers')
+                    stats.incr(
+                        'bytes_received' if self.receive else 'bytes_sent',
+                        self.get_transmitted_bytes(),
+                    )
+                if self.receive and isinstance(filename, str):
+                    # file size and mtime have changed
+                    self.cmd_channel._invalidate_listings(
+                        os.path.dirname(filename)
+                    )
+                if self._hasher is not None and self.transfer_finished:
+                    self.cmd_channel._store_digest(
+                        filename,
+                        self._hash_algorithm,
+                        self._hasher.hexdigest(),
+                        self._hashed,
+                    )
                 if self.transfer_finished:
                     if self.receive:
                         self.cmd_channel.on_file_received(filename)
+                        event = 'file_received'
                     else:
                         self.cmd_channel.on_file_sent(filename)
+                        event = 'file_sent'
                 elif self.receive:
                     self.cmd_channel.on_incomplete_file_received(filename)
+                    event = 'incomplete_file_received'
                 else:
                     self.cmd_channel.on_incomplete_file_sent(filename)
+                    event = 'incomplete_file_sent'
+                if hooks is not None:
+                    self.cmd_channel._dispatch_hooks(
+                        event, filename, resp=deferred_resp
+                    )
             self.cmd_channel._on_dtp_close()
 
 
@@ -1106,6 +1630,12 @@ class ThrottledDTPHandler(DTPHandler):
             self._throttle_bandwidth(num_sent, self.write_limit)
         return num_sent
 
+    def sendmsg(self, buffers):
+        num_sent = super().sendmsg(buffers)
+        if self.write_limit:
+            self._throttle_bandwidth(num_sent, self.write_limit)
+        return num_sent
+
     def _cancel_throttler(self):
         if self._throttler is not None and not self._throttler.cancelled:
             self._throttler.cancel()
@@ -1140,12 +1670,454 @@ class ThrottledDTPHandler(DTPHandler):
         super().close()
 
 
+# --- bandwidth shaping
+
+
+class TokenBucket:
+    """A bucket holding up to `capacity` bytes worth of tokens, being
+    refilled at `rate` bytes per second (0 means no limit). It also
+    keeps track of the actual transfer rate.
+    """
+
+    __slots__ = (
+        '_rate',
+        '_rate_bytes',
+        '_rate_start',
+        '_stamp',
+        'capacity',
+        'channels',
+        'owner',
+        'rate',
+        'tokens',
+        'total',
+    )
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.total = 0
+        # the number of data channels sharing this bucket
+        self.channels = 0
+        # the (table, key) pair the bucket is stored in, if any
+        self.owner = None
+        self._stamp = self._rate_start = timer()
+        self._rate = 0.0
+        self._rate_bytes = 0
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self._stamp) * self.rate
+            )
+        self._stamp = now
+
+    def consume(self, nbytes, now):
+        self.tokens -= nbytes
+        self.total += nbytes
+        self._rate_bytes += nbytes
+        elapsed = now - self._rate_start
+        if elapsed >= 1:
+            self._rate = self._rate_bytes / elapsed
+            self._rate_bytes = 0
+            self._rate_start = now
+
+    def current_rate(self, now):
+        """Return the transfer rate in bytes per second measured over
+        the last second or so.
+        """
+        elapsed = now - self._rate_start
+        if elapsed >= 1:
+            return self._rate_bytes / elapsed
+        return self._rate
+
+
+class BandwidthShaper:
+    """Limit the bandwidth used by data channels with token buckets
+    shared by all the transfers of the server, of the same user and
+    of the same client IP address. Opening more connections does not
+    give more bandwidth: a user having 8 transfers in progress gets
+    1/8 of its budget on each of them.
+
+    Each time a data channel is about to send or receive, it gets the
+    fair share of the tokens available in its buckets (at most
+    ac_in_buffer_size / ac_out_buffer_size bytes). When no tokens
+    are left, the channel stops polling until the buckets are
+    refilled, which happens continuously at the configured rate, so
+    throughput is smooth rather than bursty. Since the share bounds
+    the `count` argument passed to sendfile(), sendfile() keeps
+    being used.
+
+    Limits are in bytes per second, 0 meaning no limit. Limits are
+    enforced per process (see FTPServer.serve_forever()
+    worker_processes argument).
+
+     - (int) read_limit, write_limit: server-wide limits for uploads
+       and downloads.
+     - (int) user_read_limit, user_write_limit: per user limits.
+     - (dict) user_limits: a {username: (read_limit, write_limit)}
+       dict overriding user_*_limit for specific users.
+     - (int) ip_read_limit, ip_write_limit: per client IP limits.
+     - (float) burst: the bucket capacity, as seconds worth of bytes.
+    """
+
+    def __init__(
+        self,
+        read_limit=0,
+        write_limit=0,
+        user_read_limit=0,
+        user_write_limit=0,
+        ip_read_limit=0,
+        ip_write_limit=0,
+        user_limits=None,
+        burst=0.1,
+    ):
+        self.burst = burst
+        self.user_read_limit = user_read_limit
+        self.user_write_limit = user_write_limit
+        self.ip_read_limit = ip_read_limit
+        self.ip_write_limit = ip_write_limit
+        self.user_limits = user_limits or {}
+        self._server = (
+            self._new_bucket(read_limit),
+            self._new_bucket(write_limit),
+        )
+        # {username: [read_bucket, write_bucket]}
+        self._users = {}
+        # {ip: [read_bucket, write_bucket]}
+        self._ips = {}
+        # with ThreadedFTPServer buckets are shared by multiple threads
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}(users={len(self._users)}, "
+            f"ips={len(self._ips)})>"
+        )
+
+    __str__ = __repr__
+
+    def _new_bucket(self, rate):
+        return TokenBucket(rate, max(int(rate * self.burst), 1))
+
+    def _get_bucket(self, table, key, limits, receive):
+        pair = table.get(key)
+        if pair is None:
+            pair = table[key] = [None, None]
+        index = 0 if receive else 1
+        bucket = pair[index]
+        if bucket is None:
+            bucket = pair[index] = self._new_bucket(limits[index])
+            bucket.owner = (table, key)
+        return bucket
+
+    def attach(self, cmd_channel, receive):
+        """Return the buckets a data channel of cmd_channel has to
+        draw from, in the given direction.
+        """
+        user = cmd_channel.username
+        user_limits = self.user_limits.get(
+            user, (self.user_read_limit, self.user_write_limit)
+        )
+        ip_limits = (self.ip_read_limit, self.ip_write_limit)
+        with self._lock:
+            buckets = (
+                self._server[0 if receive else 1],
+                self._get_bucket(self._users, user, user_limits, receive),
+                self._get_bucket(
+                    self._ips, cmd_channel.remote_ip, ip_limits, receive
+                ),
+            )
+            for bucket in buckets:
+                bucket.channels += 1
+        return buckets
+
+    def detach(self, buckets):
+        """Release the buckets returned by attach()."""
+        with self._lock:
+            for bucket in buckets:
+                bucket.channels -= 1
+                if bucket.owner is not None and not bucket.channels:
+                    table, key = bucket.owner
+                    pair = table[key]
+                    if all(x is None or not x.channels for x in pair):
+                        del table[key]
+
+    def quota(self, buckets, size):
+        """Return the number of bytes (up to size) a channel drawing
+        from buckets may transfer now, or 0 if it has to wait.
+        """
+        now = timer()
+        with self._lock:
+            for bucket in buckets:
+                if bucket.rate:
+                    bucket.refill(now)
+                    share = round(bucket.tokens) // bucket.channels
+                    # avoid sending tiny chunks as long as a bigger
+                    # share can be reached
+                    min_share = min(
+                        bucket.capacity // bucket.channels, size, 16384
+                    )
+                    if share < max(min_share, 1):
+                        return 0
+                    size = min(size, share)
+        return size
+
+    def delay(self, buckets, size):
+        """Return the number of seconds after which quota() is
+        expected to grant something again.
+        """
+        now = timer()
+        delay = 0
+        with self._lock:
+            for bucket in buckets:
+                if bucket.rate:
+                    bucket.refill(now)
+                    needed = max(
+                        min(bucket.capacity // bucket.channels, size, 16384),
+                        1,
+                    )
+                    missing = needed * bucket.channels - bucket.tokens
+                    if missing > 0:
+                        delay = max(delay, missing / bucket.rate)
+        return delay
+
+    def consume(self, buckets, nbytes):
+        """Take nbytes worth of tokens from the buckets."""
+        if nbytes:
+            now = timer()
+            with self._lock:
+                for bucket in buckets:
+                    bucket.consume(nbytes, now)
+
+    def stats(self):
+        """Return limits, current rates (in bytes per second) and
+        total bytes transferred as a dict.
+        """
+
+        def info(bucket):
+            if bucket is None:
+                return None
+            return dict(
+                limit=bucket.rate,
+                rate=bucket.current_rate(now),
+                total=bucket.total,
+                channels=bucket.channels,
+            )
+
+        now = timer()
+        with self._lock:
+            return dict(
+                read=info(self._server[0]),
+                write=info(self._server[1]),
+                users={
+                    k: dict(read=info(v[0]), write=info(v[1]))
+                    for k, v in self._users.items()
+                },
+                ips={
+                    k: dict(read=info(v[0]), write=info(v[1]))
+                    for k, v in self._ips.items()
+                },
+            )
+
+
+class PageCachePolicy:
+    """Tell the kernel how the files being transferred are going to
+    be accessed (posix_fadvise()), so that big transfers don't evict
+    from the page cache the small files other clients keep
+    requesting. Only files at least threshold bytes big and binary
+    (TYPE I) transfers are affected.
+
+    Downloads are marked as sequential (doubling the kernel
+    readahead) and readahead bytes ahead of the current offset are
+    prefetched (FADV_WILLNEED), both with sendfile() and send().
+    With drop_behind the bytes already sent are evicted from the
+    page cache (FADV_DONTNEED), lagging one step behind so that pages
+    still queued in the socket buffers are not touched.
+
+    Uploads are paced without O_DIRECT: every writeback bytes written
+    FADV_DONTNEED is issued for the range written so far, which
+    starts the asynchronous write-back of the dirty pages and evicts
+    the ones written back since the previous call. This keeps big
+    uploads from filling the page cache with dirty pages and from
+    stalling the IO loop when the kernel eventually flushes them.
+
+     - (int) threshold: the minimum file size (or uploaded bytes).
+     - (int) readahead: how many bytes to prefetch; 0 disables it.
+     - (bool) drop_behind: evict downloaded files.
+     - (int) writeback: the upload pacing step; 0 disables it.
+    """
+
+    # how often (in bytes transferred) the kernel is advised
+    step = 1024 * 1024
+
+    def __init__(
+        self,
+        threshold=16 * 1024 * 1024,
+        readahead=4 * 1024 * 1024,
+        drop_behind=True,
+        writeback=8 * 1024 * 1024,
+    ):
+        if not hasattr(os, 'posix_fadvise'):
+            raise ValueError("posix_fadvise() is not supported")
+        self.threshold = threshold
+        self.readahead = readahead
+        self.drop_behind = drop_behind
+        self.writeback = writeback
+        self.files = 0
+        self.prefetched = 0
+        self.dropped = 0
+        self.written_back = 0
+        self.errors = 0
+        # with ThreadedFTPServer counters are shared by multiple threads
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}(threshold={self.threshold}, "
+            f"files={self.files})>"
+        )
+
+    __str__ = __repr__
+
+    def attach(self, fd, receive, offset=0):
+        """Return a _PageCacheWindow tracking the transfer of file
+        descriptor fd starting at offset, or None if the file is not
+        affected by the policy.
+        """
+        if receive:
+            if not self.writeback:
+                return None
+        else:
+            if not self.readahead and not self.drop_behind:
+                return None
+            try:
+                if os.fstat(fd).st_size < self.threshold:
+                    return None
+            except OSError:
+                return None
+        with self._lock:
+            self.files += 1
+        window = _PageCacheWindow(self, fd, receive, offset)
+        if not receive:
+            window.fadvise(offset, 0, os.POSIX_FADV_SEQUENTIAL)
+            window.prefetch()
+        return window
+
+    def stats(self):
+        """Return the number of files affected by the policy, bytes
+        prefetched, dropped from the page cache and whose write-back
+        was started, and the number of failed posix_fadvise() calls.
+        """
+        with self._lock:
+            return dict(
+                files=self.files,
+                prefetched=self.prefetched,
+                dropped=self.dropped,
+                written_back=self.written_back,
+                errors=self.errors,
+            )
+
+
+class _PageCacheWindow:
+    """The state of a transfer affected by PageCachePolicy."""
+
+    __slots__ = (
+        '_next',
+        'done',
+        'fd',
+        'fetched',
+        'policy',
+        'pos',
+        'receive',
+    )
+
+    def __init__(self, policy, fd, receive, offset):
+        self.policy = policy
+        self.fd = fd
+        self.receive = receive
+        # current file offset
+        self.pos = offset
+        # evicted up to done; prefetched (or, for uploads, write-back
+        # started) up to fetched
+        self.done = offset
+        self.fetched = offset
+        if receive:
+            self._next = max(offset + policy.writeback, policy.threshold)
+        else:
+            self._next = offset + policy.step
+
+    def fadvise(self, offset, length, advice):
+        try:
+            os.posix_fadvise(self.fd, offset, length, advice)
+        except OSError as err:
+            debug(f"posix_fadvise() failed: {err!r}")
+            with self.policy._lock:
+                self.policy.errors += 1
+            return False
+        return True
+
+    def prefetch(self):
+        policy = self.policy
+        end = self.pos + policy.readahead
+        if policy.readahead and end - self.fetched >= policy.step:
+            start = max(self.fetched, self.pos)
+            if self.fadvise(start, end - start, os.POSIX_FADV_WILLNEED):
+                with policy._lock:
+                    policy.prefetched += end - start
+            self.fetched = end
+
+    def drop(self, end):
+        if end > self.done:
+            size = end - self.done
+            if self.fadvise(self.done, size, os.POSIX_FADV_DONTNEED):
+                with self.policy._lock:
+                    self.policy.dropped += size
+            self.done = end
+
+    def write_back(self):
+        # the range whose write-back was started by the previous call
+        # is clean by now and gets evicted, the one written since then
+        # starts being written back
+        size = self.pos - self.done
+        if self.fadvise(self.done, size, os.POSIX_FADV_DONTNEED):
+            with self.policy._lock:
+                self.policy.written_back += self.pos - self.fetched
+        self.done = self.fetched
+        self.fetched = self.pos
+
+    def advance(self, nbytes):
+        """Called every time nbytes of the file have been transferred."""
+        self.pos += nbytes
+        if self.pos < self._next:
+            return
+        policy = self.policy
+        if self.receive:
+            self.write_back()
+            self._next = self.pos + policy.writeback
+        else:
+            self.prefetch()
+            if policy.drop_behind:
+                self.drop(self.pos - policy.step)
+            self._next = self.pos + policy.step
+
+    def close(self):
+        """Called when the transfer is over, before the file is closed."""
+        if self.receive:
+            if self.pos >= self.policy.threshold:
+                self.write_back()
+        elif self.policy.drop_behind:
+            self.drop(self.pos)
+
+
 # --- producers
 
 
 class FileProducer:
     """Producer wrapper for file[-like] objects."""
 
+    __slots__ = ('_data_wrapper', '_prev_chunk_endswith_cr', 'file', 'type')
+
     buffer_size = 65536
 
     def __init__(self, file, type):
@@ -1166,20 +2138,20 @@ class FileProducer:
         """The data wrapper used for sending data in ASCII mode on
         systems using a single line terminator, handling those cases
         where CRLF ('\r\n') gets delivered in two chunks.
+        Bare LFs are turned into CRLF while existing CRLFs are left
+        alone; the whole chunk is translated at once by bytes.replace().
         """
-        chunk = bytearray(chunk)
-        pos = 0
+        prefix = b''
         if self._prev_chunk_endswith_cr and chunk.startswith(b'\n'):
-            pos += 1
-        while True:
-            pos = chunk.find(b'\n', pos)
-            if pos == -1:
-                break
-            if chunk[pos - 1] != CR_BYTE:
-                chunk.insert(pos, CR_BYTE)
-                pos += 1
-            pos += 1
+            # second half of a CRLF split across two chunks
+            prefix = b'\n'
+            chunk = chunk[1:]
+        if b'\r' in chunk:
+            chunk = chunk.replace(b'\r\n', b'\n')
+        chunk = chunk.replace(b'\n', b'\r\n')
         self._prev_chunk_endswith_cr = chunk.endswith(b'\r')
+        if prefix:
+            chunk = prefix + chunk
         return chunk
 
     def more(self):
@@ -1197,6 +2169,8 @@ class FileProducer:
 class BufferedIteratorProducer:
     """Producer for iterator objects with buffer capabilities."""
 
+    __slots__ = ('iterator',)
+
     # how many times iterator.next() will be called before
     # returning some data
     loops = 20
@@ -1217,6 +2191,49 @@ class BufferedIteratorProducer:
         return b''.join(buffer)
 
 
+class _CachedFile:
+    """Stands for a file sent from FileCache as DTPHandler.file_obj,
+    which only needs its name and to close it.
+    """
+
+    __slots__ = ('closed', 'name')
+
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}(name={self.name!r})>"
+
+    def close(self):
+        self.closed = True
+
+
+class _FileCopy:
+    """A SITE COPY or SITE CPR in progress, consuming the iterator
+    returned by AbstractedFS.copy() or AbstractedFS.copytree().
+    """
+
+    __slots__ = (
+        'cancelled',
+        'cmd',
+        'copied',
+        'dst',
+        'iterator',
+        'src',
+        'started',
+    )
+
+    def __init__(self, cmd, src, dst, iterator):
+        self.cmd = cmd
+        self.src = src
+        self.dst = dst
+        self.iterator = iterator
+        self.copied = 0
+        self.cancelled = False
+        self.started = timer()
+
+
 # --- FTP
 
 
@@ -1271,6 +2288,11 @@ class FTPHandler(AsyncChat):
         When configured pyftpdlib will no longer use kernel-assigned
         random ports (default None).
 
+     - (int) passive_pool_size:
+        the number of sockets per local address kept bound and
+        listening on passive ports, ready to be handed out on PASV
+        and EPSV (default 0 == none).
+
      - (bool) use_gmt_times:
         when True causes the server to report all ls and MDTM times in
         GMT and not local time (default True).
@@ -1296,6 +2318,87 @@ class FTPHandler(AsyncChat):
        the prefix string preceding any log line; all instance
        attributes can be used as arguments.
 
+     - (instance) fs_executor:
+       a pyftpdlib.ioloop.ThreadPool instance used to run potentially
+       blocking filesystem calls (listing directories, opening,
+       removing and renaming files, etc.) in a separate thread so
+       that a slow disk or network filesystem doesn't stall the IO
+       loop and other clients. While the call is in progress further
+       commands sent by the client are queued. It's ignored (calls
+       are made from the IO loop) if the authorizer impersonates
+       users (e.g. UnixAuthorizer), since that affects the whole
+       process (default None).
+
+     - (instance) auth_executor:
+       a pyftpdlib.ioloop.ThreadPool instance used to run the
+       authorizer's validate_authentication(), get_home_dir() and
+       get_msg_login() on PASS, so that slow password hashing or
+       database lookups don't stall the IO loop (default None).
+
+     - (instance) listing_cache:
+       a pyftpdlib.filesystems.ListingCache instance used to cache
+       the output of LIST, NLST, MLSD and STAT commands, shared by all
+       sessions. Useful when clients keep polling the same
+       directories. Not used by authorizers impersonating users
+       (default None).
+
+     - (instance) path_cache:
+       a pyftpdlib.filesystems.PathCache instance caching the real
+       paths resolved by the filesystem, shared by all sessions
+       (default None).
+
+     - (int) path_cache_size:
+       if path_cache is not set, the number of real paths each
+       session caches in a PathCache of its own (default 0 == none).
+
+     - (instance) digest_cache:
+       a pyftpdlib.filesystems.DigestCache instance caching the file
+       checksums returned by HASH, XCRC, XMD5, XSHA1, XSHA256 and
+       XSHA512, shared by all sessions. When set the checksum of
+       uploaded files is also computed while they are received
+       (with the algorithm currently selected by OPTS HASH) so that
+       asking for it afterwards costs nothing (default None).
+
+     - (instance) digest_executor:
+       a pyftpdlib.ioloop.ThreadPool instance used to compute file
+       checksums, which means reading whole files. If None
+       fs_executor is used, if any, else files are hashed from the
+       IO loop one chunk per loop iteration (default None).
+
+     - (tuple) digest_algorithms:
+       the checksum algorithms clients can use, the first one being
+       the default for HASH (default ('SHA-256', 'SHA-1', 'SHA-512',
+       'MD5', 'CRC32')).
+
+     - (instance) hook_dispatcher:
+       a pyftpdlib.hooks.HookDispatcher instance running the functions
+       registered for login, logout and file transfer events in a
+       pool of threads or processes, after the corresponding on_*
+       method is called (default None).
+
+     - (instance) bandwidth_shaper:
+       a BandwidthShaper instance limiting the bandwidth used by data
+       transfers server-wide, per user and per client IP address.
+       Unlike ThrottledDTPHandler, limits apply to all the transfers
+       together and sendfile() keeps being used (default None).
+
+     - (instance) page_cache_policy:
+       a PageCachePolicy instance advising the kernel (readahead,
+       drop-behind, write-back pacing) about the big files being
+       downloaded or uploaded, so that they don't evict small hot
+       files from the page cache (default None).
+
+     - (instance) file_cache:
+       a pyftpdlib.filesystems.FileCache instance keeping the content
+       of small files in memory, shared by all sessions. Binary RETRs
+       of cached files are sent from there without opening them (not
+       if the authorizer impersonates users) (default None).
+
+     - (instance) metrics:
+       a pyftpdlib.metrics.Metrics instance collecting per-command
+       latency, connection and transfer counters, which are shown by
+       SITE STATS (default None).
+
 
     All relevant instance attributes initialized when client connects
     are reproduced below.  You may be interested in them in case you
@@ -1310,6 +2413,35 @@ class FTPHandler(AsyncChat):
      - (instance) data_channel: the data channel instance (if any).
     """
 
+    # private session state lives in slots rather than in the instance
+    # dict, which is much smaller with thousands of idle sessions;
+    # public attributes are left there as log_prefix refers to them
+    __slots__ = (
+        '_cmd_started',
+        '_copy',
+        '_current_cmd',
+        '_current_facts',
+        '_current_type',
+        '_dtp_acceptor',
+        '_dtp_connector',
+        '_epsvall',
+        '_extra_feats',
+        '_fs_deferred',
+        '_fs_pending',
+        '_hash_algorithm',
+        '_hash_range',
+        '_idler',
+        '_in_buffer',
+        '_in_buffer_len',
+        '_in_dtp_queue',
+        '_last_response',
+        '_log_debug',
+        '_out_dtp_queue',
+        '_quit_pending',
+        '_restart_position',
+        '_rnfr',
+    )
+
     # these are overridable defaults
 
     # default classes
@@ -1329,6 +2461,7 @@ class FTPHandler(AsyncChat):
     masquerade_address = None
     masquerade_address_map = {}
     passive_ports = None
+    passive_pool_size = 0
     use_gmt_times = True
     use_sendfile = hasattr(os, "sendfile")  # added in python 3.3
     tcp_no_delay = hasattr(socket, "TCP_NODELAY")
@@ -1336,6 +2469,19 @@ class FTPHandler(AsyncChat):
     unicode_errors = 'replace'
     log_prefix = '%(remote_ip)s:%(remote_port)s-[%(username)s]'
     auth_failed_timeout = 3
+    fs_executor = None
+    auth_executor = None
+    listing_cache = None
+    path_cache = None
+    path_cache_size = 0
+    digest_cache = None
+    digest_executor = None
+    digest_algorithms = ('SHA-256', 'SHA-1', 'SHA-512', 'MD5', 'CRC32')
+    hook_dispatcher = None
+    bandwidth_shaper = None
+    page_cache_policy = None
+    file_cache = None
+    metrics = None
 
     def __init__(self, conn, server, ioloop=None):
         """Initialize the command channel.
@@ -1368,22 +2514,24 @@ class FTPHandler(AsyncChat):
         self._dtp_connector = None
         self._in_dtp_queue = None
         self._out_dtp_queue = None
-        self._extra_feats = []
-        self._current_facts = ['type', 'perm', 'size', 'modify']
+        self._extra_feats = ()
+        # shared by all sessions until OPTS MLST replaces it
+        self._current_facts = _DEFAULT_FACTS
         self._rnfr = None
+        self._hash_algorithm = self.digest_algorithms[0]
+        self._hash_range = None
+        self._copy = None
         self._idler = None
+        self._current_cmd = None
+        self._cmd_started = 0
+        self._fs_pending = False
+        # commands queued while a filesystem call is in progress,
+        # allocated on first use
+        self._fs_deferred = None
         self._log_debug = (
             logging.getLogger('pyftpdlib').getEffectiveLevel() <= logging.DEBUG
         )
 
-        if os.name == 'posix':
-            self._current_facts.append('unique')
-        self._available_facts = self._current_facts[:]
-        if pwd and grp:
-            self._available_facts += ['unix.mode', 'unix.uid', 'unix.gid']
-        if os.name == 'nt':
-            self._available_facts.append('create')
-
         try:
             AsyncChat.__init__(self, conn, ioloop=ioloop)
         except OSError as err:
@@ -1486,6 +2634,9 @@ class FTPHandler(AsyncChat):
         """Return a 220 'ready' response to the client over the command
         channel.
         """
+        if self.metrics is not None:
+            self.metrics.control_opened(self)
+            self._attach_metrics()
         self.on_connect()
         if not self._closed and not self._closing:
             if len(self.banner) <= 75:
@@ -1494,8 +2645,23 @@ class FTPHandler(AsyncChat):
                 self.push(f'220-{self.banner!s}\r\n')
                 self.respond('220 ')
 
+    def _attach_metrics(self):
+        """Let metrics report the counters of the components in use
+        (the passive ports allocator, hook_dispatcher,
+        page_cache_policy and file_cache). Done as the session starts,
+        as they can be set at any time.
+        """
+        metrics = self.metrics
+        metrics.passive_allocator = self.server.passive_allocator
+        metrics.hook_dispatcher = self.hook_dispatcher
+        metrics.page_cache_policy = self.page_cache_policy
+        metrics.file_cache = self.file_cache
+
     def handle_max_cons(self):
-        """Called when limit for maximum number of connections is reached."""
+        """Called when limit for maximum number of connections is reached.
+        FTPServer rejects connections by itself, without instantiating
+        a handler, unless this is overridden.
+        """
         msg = "421 Too many connections. Service temporarily unavailable."
         self.respond_w_warning(msg)
         # If self.push is used, data could not be sent immediately in
@@ -1508,7 +2674,9 @@ class FTPHandler(AsyncChat):
         self.close()
 
     def handle_max_cons_per_ip(self):
-        """Called when too many clients are connected from the same IP."""
+        """Called when too many clients are connected from the same IP
+        (only if overridden, see handle_max_cons()).
+        """
         msg = "421 Too many connections from the same IP address."
         self.respond_w_warning(msg)
         self.close_when_done()
@@ -1556,6 +2724,18 @@ class FTPHandler(AsyncChat):
             self._idler.reset()
 
         line = b''.join(self._in_buffer)
+        self._in_buffer = []
+        self._in_buffer_len = 0
+        if self._fs_pending:
+            # a filesystem call is in progress in fs_executor; the
+            # command will be processed once it completes
+            if self._fs_deferred is None:
+                self._fs_deferred = collections.deque()
+            self._fs_deferred.append(line)
+        else:
+            self._process_line(line)
+
+    def _process_line(self, line):
         try:
             line = self.decode(line)
         except UnicodeDecodeError:
@@ -1565,9 +2745,6 @@ class FTPHandler(AsyncChat):
             # we'll just return 501 (bad arg).
             return self.respond("501 Can't decode command.")
 
-        self._in_buffer = []
-        self._in_buffer_len = 0
-
         cmd = line.split(' ')[0].upper()
         arg = line[len(cmd) + 1 :]
         try:
@@ -1668,6 +2845,26 @@ class FTPHandler(AsyncChat):
                         timeval, arg = arg.split(' ', 1)
                         arg = self.fs.ftp2fs(arg)
                         kwargs = dict(timeval=timeval)
+                elif cmd in ('SITE COPY', 'SITE CPR'):
+                    try:
+                        src, arg = _split_copy_args(arg)
+                    except ValueError:
+                        msg = "Syntax error: command needs two arguments."
+                        self.respond("501 " + msg)
+                        self.log_cmd(cmd, arg, 501, msg)
+                        return
+                    arg = self.fs.ftp2fs(arg)
+                    kwargs = dict(src=self.fs.ftp2fs(src))
+                elif cmd in ('XCRC', 'XMD5', 'XSHA1', 'XSHA256', 'XSHA512'):
+                    try:
+                        arg, start, end = _split_digest_args(arg)
+                    except ValueError as err:
+                        msg = f"Syntax error: {err}."
+                        self.respond("501 " + msg)
+                        self.log_cmd(cmd, arg, 501, msg)
+                        return
+                    arg = self.fs.ftp2fs(arg)
+                    kwargs = dict(start=start, end=end)
 
                 else:  # LIST, NLST, MLSD, MLST
                     arg = self.fs.ftp2fs(arg or self.fs.cwd)
@@ -1700,12 +2897,18 @@ class FTPHandler(AsyncChat):
         if self._closed:
             return
         self._last_response = ""
+        self._current_cmd = (cmd, args[0])
+        if self.metrics is not None:
+            self._cmd_started = timer()
         method = getattr(self, 'ftp_' + cmd.replace(' ', '_'))
         method(*args, **kwargs)
         if self._last_response:
             code = int(self._last_response[:3])
             resp = self._last_response[4:]
             self.log_cmd(cmd, args[0], code, resp)
+        if self.metrics is not None and not self._fs_pending:
+            # commands run by fs_executor are accounted on completion
+            self.metrics.observe_command(cmd, timer() - self._cmd_started)
 
     def handle_error(self):
         try:
@@ -1729,6 +2932,9 @@ class FTPHandler(AsyncChat):
                 self.data_channel.close()
                 del self.data_channel
 
+            if self._copy is not None:
+                self._cancel_copy()
+
             if self._out_dtp_queue is not None:
                 file = self._out_dtp_queue[2]
                 if file is not None:
@@ -1740,13 +2946,18 @@ class FTPHandler(AsyncChat):
 
             del self._out_dtp_queue
             del self._in_dtp_queue
+            self._fs_deferred = None
 
             if self._idler is not None and not self._idler.cancelled:
                 self._idler.cancel()
 
-            # remove client IP address from ip map
-            if self.remote_ip in self.server.ip_map:
-                self.server.ip_map.remove(self.remote_ip)
+            if self.metrics is not None:
+                self.metrics.control_closed(self)
+
+            # remove client IP address from the connection registry
+            subnet = self.server.registry.remove(self.remote_ip)
+            if subnet is not None and self.server.worker_stats is not None:
+                self.server.worker_stats.remove(self.remote_ip, subnet)
 
             if self.fs is not None:
                 self.fs.cmd_channel = None
@@ -1760,6 +2971,41 @@ class FTPHandler(AsyncChat):
                     0, self.on_disconnect, _errback=self.handle_error
                 )
 
+    def _get_passive_allocator(self):
+        """Return the server's PassivePortAllocator, (re)creating it if
+        passive_ports or passive_pool_size changed, or None if none of
+        them is set.
+        """
+        ports = self.passive_ports
+        pool_size = self.passive_pool_size
+        if ports is None and not pool_size:
+            return None
+        server = self.server
+        allocator = server.passive_allocator
+        if (
+            allocator is None
+            or allocator.ports is not ports
+            or allocator.pool_size != pool_size
+        ):
+            with _allocator_lock:
+                allocator = server.passive_allocator
+                if (
+                    allocator is None
+                    or allocator.ports is not ports
+                    or allocator.pool_size != pool_size
+                ):
+                    if allocator is not None:
+                        allocator.close()
+                    allocator = PassivePortAllocator(
+                        ports,
+                        pool_size,
+                        self.passive_dtp.backlog or server.backlog,
+                    )
+                    server.passive_allocator = allocator
+                    if self.metrics is not None:
+                        self._attach_metrics()
+        return allocator
+
     def _shutdown_connecting_dtp(self):
         """Close any ActiveDTP or PassiveDTP instance waiting to
         establish a connection (passive or active).
@@ -1773,7 +3019,8 @@ class FTPHandler(AsyncChat):
 
     # --- public callbacks
     # Note: to run a time consuming task make sure to use a separate
-    # process or thread (see FAQs).
+    # process or thread (see FAQs), e.g. by registering it in
+    # hook_dispatcher.
 
     def on_connect(self):
         """Called when client connects, *before* sending the initial
@@ -1822,12 +3069,47 @@ class FTPHandler(AsyncChat):
 
     # --- internal callbacks
 
-    def _on_dtp_connection(self):
-        """Called every time data channel connects, either active or
-        passive.
+    def _dispatch_hooks(self, event, *args, resp=None):
+        """Run the functions registered in hook_dispatcher for event
+        with *args. If resp, a (resp, logfun) tuple, is given it's
+        sent once the reply hook completes (see
+        HookDispatcher.register()); commands received in the meantime
+        are queued.
+        """
+        dispatcher = self.hook_dispatcher
+        if resp is None:
+            dispatcher.dispatch(self.ioloop, event, args)
+            return
 
-        Incoming and outgoing queues are checked for pending data.
-        If outbound data is pending, it is pushed into the data channel.
+        def callback(ret, err):
+            self._fs_pending = False
+            if self._closed:
+                return
+            try:
+                if err is not None:
+                    # the error is logged by the dispatcher
+                    self.respond(
+                        "451 Transfer complete but post-processing failed.",
+                        logfun=logger.warning,
+                    )
+                elif isinstance(ret, str) and ret.strip():
+                    text = ' '.join(ret.split())
+                    self.respond(f"{resp[0][:3]} {text}", logfun=resp[1])
+                else:
+                    self.respond(resp[0], logfun=resp[1])
+                self._process_deferred()
+            except Exception:
+                self.handle_error()
+
+        self._fs_pending = True
+        dispatcher.dispatch(self.ioloop, event, args, callback)
+
+    def _on_dtp_connection(self):
+        """Called every time data channel connects, either active or
+        passive.
+
+        Incoming and outgoing queues are checked for pending data.
+        If outbound data is pending, it is pushed into the data channel.
         If awaiting inbound data, the data channel is enabled for
         receiving.
         """
@@ -1883,7 +3165,7 @@ class FTPHandler(AsyncChat):
     # --- utility
 
     def push(self, data):
-        asynchat.async_chat.push(self, data.encode(self.encoding))
+        AsyncChat.push(self, data.encode(self.encoding))
 
     def respond(self, resp, logfun=logger.debug):
         """Send a response to the client using the command channel."""
@@ -1949,6 +3231,8 @@ class FTPHandler(AsyncChat):
         username = self.username
         if self.authenticated and username:
             self.on_logout(username)
+            if self.hook_dispatcher is not None:
+                self._dispatch_hooks('logout', username)
         self.authenticated = False
         self.username = ""
         self.password = ""
@@ -1958,6 +3242,7 @@ class FTPHandler(AsyncChat):
         self._quit_pending = False
         self._in_dtp_queue = None
         self._rnfr = None
+        self._hash_range = None
         self._out_dtp_queue = None
 
     def run_as_current_user(self, function, *args, **kwargs):
@@ -1968,15 +3253,118 @@ class FTPHandler(AsyncChat):
         finally:
             self.authorizer.terminate_impersonation(self.username)
 
+    def _fs_call(self, callback, function, *args, **kwargs):
+        """Call function(*args, **kwargs), which is supposed to perform
+        blocking filesystem operations, then callback(ret, err), where
+        err is the OSError or FilesystemError exception raised by
+        function (if any).
+
+        If fs_executor is set function is run in a separate thread
+        and callback is called from the IO loop once it completes.
+        Return what callback returns, or None if it is deferred.
+        """
+        executor = self.fs_executor
+        if executor is None or self._impersonates():
+            try:
+                ret = function(*args, **kwargs)
+            except (OSError, FilesystemError) as err:
+                return callback(None, err)
+            return callback(ret, None)
+
+        def run():
+            ret = function(*args, **kwargs)
+            if isinstance(ret, types.GeneratorType):
+                # listings are generated lazily by AbstractedFS, which
+                # would mean calling stat() from the IO loop
+                ret = b''.join(ret)
+            return ret
+
+        return self._submit(
+            executor, callback, run, (OSError, FilesystemError)
+        )
+
+    def _impersonates(self):
+        # impersonating a user affects the whole process, hence the
+        # other threads
+        return (
+            type(self.authorizer).impersonate_user
+            is not DummyAuthorizer.impersonate_user
+        )
+
+    def _submit(self, executor, callback, function, errors):
+        """Run function() in executor (a ThreadPool), then callback(ret,
+        err) from the IO loop. Exceptions other than errors are
+        handled by handle_error(). Commands received in the meantime
+        are queued.
+        """
+        cmd, arg = self._current_cmd
+        self._fs_pending = True
+        executor.submit(
+            self.ioloop,
+            cmd,
+            function,
+            lambda ret, err: self._fs_call_done(
+                callback, cmd, arg, ret, err, errors
+            ),
+        )
+
+    def _fs_call_done(
+        self, callback, cmd, arg, ret, err, errors=(OSError, FilesystemError)
+    ):
+        """Called from the IO loop when a function submitted to
+        fs_executor by _fs_call() (or by _submit()) completes.
+        """
+        self._fs_pending = False
+        if self._closed:
+            # e.g. a file opened by RETR or STOR
+            if hasattr(ret, 'close'):
+                ret.close()
+            return
+        try:
+            if err is not None and not isinstance(err, errors):
+                raise err
+            self._last_response = ""
+            self._current_cmd = (cmd, arg)
+            callback(ret, err)
+            if self._last_response:
+                code = int(self._last_response[:3])
+                resp = self._last_response[4:]
+                self.log_cmd(cmd, arg, code, resp)
+            if self.metrics is not None and not self._fs_pending:
+                self.metrics.observe_command(
+                    cmd, timer() - self._cmd_started
+                )
+            self._process_deferred()
+        except Exception:
+            self.handle_error()
+
+    def _process_deferred(self):
+        """Process the commands received while a filesystem call (or
+        a reply hook) was in progress.
+        """
+        while self._fs_deferred and not self._fs_pending:
+            if self._closed:
+                break
+            self._process_line(self._fs_deferred.popleft())
+
     # --- logging wrappers
 
     # this is defined earlier
     # log_prefix = '%(remote_ip)s:%(remote_port)s-[%(username)s]'
 
-    def log(self, msg, logfun=logger.info):
-        """Log a message, including additional identifying session data."""
+    def log(self, msg, logfun=logger.info, fields=None):
+        """Log a message, including additional identifying session data.
+        fields is an optional dict of structured data attached to the
+        log record, used by pyftpdlib.log.JSONFormatter.
+        """
         prefix = self.log_prefix % self.__dict__
-        logfun(f"{prefix} {msg}")
+        if fields is None:
+            logfun(f"{prefix} {msg}")
+        else:
+            fields['remote_ip'] = self.remote_ip
+            fields['remote_port'] = self.remote_port
+            fields['username'] = self.username
+            logfun(f"{prefix} {msg}", extra={'fields': fields})
 
     def logline(self, msg, logfun=logger.debug):
         """Log a line including additional identifying session data.
@@ -2011,6 +3399,8 @@ class FTPHandler(AsyncChat):
         "XCWD",
         "REIN",
         "SITE CHMOD",
+        "SITE COPY",
+        "SITE CPR",
         "MFMT",
     ]
 
@@ -2046,7 +3436,9 @@ class FTPHandler(AsyncChat):
             line = f"{cmd.strip()} {arg.strip()} {respcode}"
             if str(respcode)[0] in ('4', '5'):
                 line += f' {respstr!r}'
-            self.log(line)
+            self.log(
+                line, fields={'cmd': cmd, 'arg': arg, 'code': respcode}
+            )
 
     def log_transfer(self, cmd, filename, receive, completed, elapsed, bytes):
         """Log all file transfers in a standardized format.
@@ -2077,7 +3469,17 @@ class FTPHandler(AsyncChat):
             bytes,
             elapsed,
         )
-        self.log(line)
+        self.log(
+            line,
+            fields={
+                'cmd': cmd,
+                'file': filename,
+                'receive': receive,
+                'completed': completed,
+                'bytes': bytes,
+                'seconds': elapsed,
+            },
+        )
 
     # --- connection
     def _make_eport(self, ip, port):
@@ -2297,6 +3699,8 @@ class FTPHandler(AsyncChat):
             self.close_when_done()
         if self.authenticated and self.username:
             self.on_logout(self.username)
+            if self.hook_dispatcher is not None:
+                self._dispatch_hooks('logout', self.username)
 
         # --- data transferring
 
@@ -2308,49 +3712,135 @@ class FTPHandler(AsyncChat):
         # - If no argument, fall back on cwd as default.
         # - Some older FTP clients erroneously issue /bin/ls-like LIST
         #   formats in which case we fall back on cwd as default.
-        try:
-            isdir = self.fs.isdir(path)
-            if isdir:
-                listing = self.run_as_current_user(self.fs.listdir, path)
-                # RFC 959 recommends the listing to be sorted.
-                listing.sort()
-                iterator = self.fs.format_list(path, listing)
+        def callback(data, err):
+            if err is not None:
+                why = _strerror(err)
+                self.respond(f'550 {why}.')
+            elif isinstance(data, bytes):
+                self.push_dtp_data(data, cmd="LIST")
+                return path
             else:
-                basedir, filename = os.path.split(path)
-                self.fs.lstat(path)  # raise exc in case of problems
-                iterator = self.fs.format_list(basedir, [filename])
-        except (OSError, FilesystemError) as err:
-            why = _strerror(err)
-            self.respond(f'550 {why}.')
+                producer = BufferedIteratorProducer(data)
+                self.push_dtp_data(producer, isproducer=True, cmd="LIST")
+                return path
+
+        return self._fs_call(callback, self._list_path, path)
+
+    def _list_path(self, path):
+        """Return an iterator yielding the "ls -l" lines of path,
+        used by LIST and STAT commands.
+        """
+        isdir = self.fs.isdir(path)
+        if isdir:
+            return self._cached_listing(
+                path,
+                'LIST',
+                lambda: self.fs.format_list(path, self._listdir(path)),
+            )
         else:
-            producer = BufferedIteratorProducer(iterator)
-            self.push_dtp_data(producer, isproducer=True, cmd="LIST")
-            return path
+            basedir, filename = os.path.split(path)
+            self.fs.lstat(path)  # raise exc in case of problems
+            return self.fs.format_list(basedir, [filename])
+
+    def _listdir(self, path):
+        """Return the content of a directory sorted by name, either
+        as a list of os.DirEntry objects (see AbstractedFS.scandir())
+        or as a list of names.
+        """
+        listing = self.run_as_current_user(self.fs.scandir, path)
+        if listing is None:
+            listing = self.run_as_current_user(self.fs.listdir, path)
+            if isinstance(listing, list):
+                # RFC 959 recommends the listing to be sorted.
+                listing.sort()
+        if self.metrics is not None and isinstance(listing, list):
+            self.metrics.observe_listing(len(listing))
+        return listing
+
+    def _cached_listing(self, path, cmd, function, *extra):
+        """Return the listing of directory path produced by function()
+        either as an iterator of encoded lines or as bytes, going
+        through listing_cache (if any). extra arguments are added to
+        the cache key.
+
+        The cache is bypassed by authorizers impersonating users, as
+        whether a user can list a directory is then decided by the OS.
+        """
+        cache = self.listing_cache
+        if cache is None or self._impersonates():
+            return function()
+        st = self.fs.stat(path)
+        key = (
+            path,
+            st.st_mtime,
+            st.st_ctime,
+            cmd,
+            self.use_gmt_times,
+            self.encoding,
+            self.unicode_errors,
+            *extra,
+        )
+        data = cache.get(key)
+        if data is not None:
+            return data
+        ret = function()
+        if isinstance(ret, bytes):
+            cache.put(key, ret)
+            return ret
+        return cache.store(key, ret)
+
+    def _invalidate_listings(self, *paths):
+        """Remove the cached listings of the given directories (see
+        listing_cache).
+        """
+        cache = self.listing_cache
+        if cache is not None:
+            for path in paths:
+                cache.invalidate(path)
+
+    def _invalidate_paths(self, *paths):
+        """Remove the given paths, and those below them, from the real
+        paths cache (see path_cache).
+        """
+        cache = self.fs.path_cache if self.fs is not None else None
+        if cache is not None:
+            for path in paths:
+                cache.invalidate(path)
 
     def ftp_NLST(self, path):
         """Return a list of files in the specified directory in a
         compact form to the client.
         On success return the directory path, else None.
         """
-        try:
+
+        def format_names(listing):
+            names = [x if isinstance(x, str) else x.name for x in listing]
+            data = ''
+            if names:
+                # RFC 959 recommends the listing to be sorted.
+                names.sort()
+                data = '\r\n'.join(names) + '\r\n'
+            return data.encode(self.encoding, self.unicode_errors)
+
+        def listdir():
             if self.fs.isdir(path):
-                listing = list(self.run_as_current_user(self.fs.listdir, path))
+                return self._cached_listing(
+                    path, 'NLST', lambda: format_names(self._listdir(path))
+                )
             else:
                 # if path is a file we just list its name
                 self.fs.lstat(path)  # raise exc in case of problems
-                listing = [os.path.basename(path)]
-        except (OSError, FilesystemError) as err:
-            self.respond(f'550 {_strerror(err)}.')
-        else:
-            data = ''
-            if listing:
-                # RFC 959 recommends the listing to be sorted.
-                listing.sort()
-                data = '\r\n'.join(listing) + '\r\n'
-            data = data.encode(self.encoding, self.unicode_errors)
+                return format_names([os.path.basename(path)])
+
+        def callback(data, err):
+            if err is not None:
+                self.respond(f'550 {_strerror(err)}.')
+                return
             self.push_dtp_data(data, cmd="NLST")
             return path
 
+        return self._fs_call(callback, listdir)
+
         # --- MLST and MLSD commands
 
     # The MLST and MLSD commands are intended to standardize the file and
@@ -2395,23 +3885,39 @@ class FTPHandler(AsyncChat):
         as defined in RFC-3659.
         On success return the path just listed, else None.
         """
-        # RFC-3659 requires 501 response code if path is not a directory
-        if not self.fs.isdir(path):
-            self.respond("501 No such directory.")
-            return
-        try:
-            listing = self.run_as_current_user(self.fs.listdir, path)
-        except (OSError, FilesystemError) as err:
-            why = _strerror(err)
-            self.respond(f'550 {why}.')
-        else:
-            perms = self.authorizer.get_perms(self.username)
-            iterator = self.fs.format_mlsx(
-                path, listing, perms, self._current_facts
+        perms = self.authorizer.get_perms(self.username)
+
+        def listdir():
+            # RFC-3659 requires 501 response code if path is not a
+            # directory
+            if not self.fs.isdir(path):
+                return None
+            facts = self._current_facts
+            return self._cached_listing(
+                path,
+                'MLSD',
+                lambda: self.fs.format_mlsx(
+                    path, self._listdir(path), perms, facts
+                ),
+                perms,
+                tuple(facts),
             )
-            producer = BufferedIteratorProducer(iterator)
-            self.push_dtp_data(producer, isproducer=True, cmd="MLSD")
-            return path
+
+        def callback(data, err):
+            if err is not None:
+                why = _strerror(err)
+                self.respond(f'550 {why}.')
+            elif data is None:
+                self.respond("501 No such directory.")
+            elif isinstance(data, bytes):
+                self.push_dtp_data(data, cmd="MLSD")
+                return path
+            else:
+                producer = BufferedIteratorProducer(data)
+                self.push_dtp_data(producer, isproducer=True, cmd="MLSD")
+                return path
+
+        return self._fs_call(callback, listdir)
 
     def ftp_RETR(self, file):
         """Retrieve the specified file (transfer from the server to the
@@ -2419,9 +3925,51 @@ class FTPHandler(AsyncChat):
         """
         rest_pos = self._restart_position
         self._restart_position = 0
-        try:
-            fd = self.run_as_current_user(self.fs.open, file, 'rb')
-        except (OSError, FilesystemError) as err:
+        if (
+            self.file_cache is not None
+            and self._current_type == 'i'
+            and not self._impersonates()
+        ):
+            # the cache doesn't know about the permissions of the
+            # impersonated users
+            return self._fs_call(
+                lambda data, err: self._on_retr_file_cached(
+                    file, rest_pos, data, err
+                ),
+                self.file_cache.load,
+                self.fs,
+                file,
+            )
+        return self._open_retr_file(file, rest_pos)
+
+    def _on_retr_file_cached(self, file, rest_pos, data, err):
+        if err is not None:
+            why = _strerror(err)
+            self.respond(f'550 {why}.')
+            return
+        if data is None:
+            # not cacheable
+            return self._open_retr_file(file, rest_pos)
+        if rest_pos > len(data):
+            why = f"REST position ({rest_pos}) > file size ({len(data)})"
+            self.respond(f'554 {why}')
+            return
+        self.push_dtp_data(
+            data[rest_pos:], file=_CachedFile(file), cmd="RETR"
+        )
+        return file
+
+    def _open_retr_file(self, file, rest_pos):
+        return self._fs_call(
+            lambda fd, err: self._on_retr_file_opened(file, rest_pos, fd, err),
+            self.run_as_current_user,
+            self.fs.open,
+            file,
+            'rb',
+        )
+
+    def _on_retr_file_opened(self, file, rest_pos, fd, err):
+        if err is not None:
             why = _strerror(err)
             self.respond(f'550 {why}.')
             return
@@ -2469,12 +4017,22 @@ class FTPHandler(AsyncChat):
         self._restart_position = 0
         if rest_pos:
             mode = 'r+'
-        try:
-            fd = self.run_as_current_user(self.fs.open, file, mode + 'b')
-        except (OSError, FilesystemError) as err:
+        return self._fs_call(
+            lambda fd, err: self._on_stor_file_opened(
+                file, cmd, rest_pos, fd, err
+            ),
+            self.run_as_current_user,
+            self.fs.open,
+            file,
+            mode + 'b',
+        )
+
+    def _on_stor_file_opened(self, file, cmd, rest_pos, fd, err):
+        if err is not None:
             why = _strerror(err)
             self.respond(f'550 {why}.')
             return
+        self._invalidate_listings(os.path.dirname(file))
 
         try:
             if rest_pos:
@@ -2563,6 +4121,7 @@ class FTPHandler(AsyncChat):
                 self.respond("550 Not enough privileges.")
                 return
 
+            self._invalidate_listings(basedir)
             # now just acts like STOR except that restarting isn't allowed
             filename = os.path.basename(fd.name)
             if self.data_channel is not None:
@@ -2603,13 +4162,19 @@ class FTPHandler(AsyncChat):
             self._restart_position = marker
 
     def ftp_ABOR(self, line):
-        """Abort the current data transfer."""
+        """Abort the current data transfer (or SITE COPY)."""
         # ABOR received while no data channel exists
         if (
             self._dtp_acceptor is None
             and self._dtp_connector is None
             and self.data_channel is None
         ):
+            if self._copy is not None:
+                task = self._copy
+                self._cancel_copy()
+                self._respond_copy(task, "426 Copy aborted via ABOR.")
+                self.respond("226 ABOR command successful.")
+                return
             self.respond("225 No transfer to abort.")
             return
         else:
@@ -2710,7 +4275,13 @@ class FTPHandler(AsyncChat):
         self.attempted_logins = 0
 
         self.fs = self.abstracted_fs(home, self)
+        if self.path_cache is not None:
+            self.fs.path_cache = self.path_cache
+        elif self.path_cache_size:
+            self.fs.path_cache = PathCache(self.path_cache_size)
         self.on_login(self.username)
+        if self.hook_dispatcher is not None:
+            self._dispatch_hooks('login', self.username)
 
     def ftp_PASS(self, line):
         """Check username's password against the authorizer."""
@@ -2721,14 +4292,32 @@ class FTPHandler(AsyncChat):
             self.respond("503 Login with USER first.")
             return
 
-        try:
-            self.authorizer.validate_authentication(self.username, line, self)
-            home = self.authorizer.get_home_dir(self.username)
-            msg_login = self.authorizer.get_msg_login(self.username)
-        except (AuthenticationFailed, AuthorizerError) as err:
-            self.handle_auth_failed(str(err), line)
-        else:
-            self.handle_auth_success(home, line, msg_login)
+        username = self.username
+
+        def authenticate():
+            self.authorizer.validate_authentication(username, line, self)
+            home = self.authorizer.get_home_dir(username)
+            msg_login = self.authorizer.get_msg_login(username)
+            return (home, msg_login)
+
+        def callback(ret, err):
+            if err is not None:
+                self.handle_auth_failed(str(err), line)
+            else:
+                self.handle_auth_success(ret[0], line, ret[1])
+
+        if self.auth_executor is None:
+            try:
+                ret = authenticate()
+            except (AuthenticationFailed, AuthorizerError) as err:
+                return callback(None, err)
+            return callback(ret, None)
+        return self._submit(
+            self.auth_executor,
+            callback,
+            authenticate,
+            (AuthenticationFailed, AuthorizerError),
+        )
 
     def ftp_REIN(self, line):
         """Reinitialize user's current session."""
@@ -2769,6 +4358,9 @@ class FTPHandler(AsyncChat):
         # will fail with ENOENT) but we can't do anything about that
         # except logging an error.
         init_cwd = os.getcwd()
+        # resolve the directory being entered (and what's below it)
+        # again rather than relying on cached paths
+        self._invalidate_paths(path)
         try:
             self.run_as_current_user(self.fs.chdir, path)
         except (OSError, FilesystemError) as err:
@@ -2810,17 +4402,20 @@ class FTPHandler(AsyncChat):
             why = "SIZE not allowed in ASCII mode"
             self.respond(f"550 {why}.")
             return
-        if not self.fs.isfile(self.fs.realpath(path)):
-            why = f"{line} is not retrievable"
-            self.respond(f"550 {why}.")
-            return
-        try:
-            size = self.run_as_current_user(self.fs.getsize, path)
-        except (OSError, FilesystemError) as err:
-            why = _strerror(err)
-            self.respond(f'550 {why}.')
-        else:
-            self.respond(f"213 {size}")
+
+        def getsize():
+            if not self.fs.isfile(self.fs.realpath(path)):
+                raise FilesystemError(f"{line} is not retrievable")
+            return self.run_as_current_user(self.fs.getsize, path)
+
+        def callback(size, err):
+            if err is not None:
+                why = _strerror(err)
+                self.respond(f'550 {why}.')
+            else:
+                self.respond(f"213 {size}")
+
+        return self._fs_call(callback, getsize)
 
     def ftp_MDTM(self, path):
         """Return last modification time of file to the client as an ISO
@@ -2828,25 +4423,197 @@ class FTPHandler(AsyncChat):
         On success return the file path, else None.
         """
         line = self.fs.fs2ftp(path)
-        if not self.fs.isfile(self.fs.realpath(path)):
-            self.respond(f"550 {line} is not retrievable")
-            return
-        timefunc = time.gmtime if self.use_gmt_times else time.localtime
-        try:
-            secs = self.run_as_current_user(self.fs.getmtime, path)
-            lmt = time.strftime("%Y%m%d%H%M%S", timefunc(secs))
-        except (ValueError, OSError, FilesystemError) as err:
-            if isinstance(err, ValueError):
+
+        def getmtime():
+            if not self.fs.isfile(self.fs.realpath(path)):
+                return None
+            return self.run_as_current_user(self.fs.getmtime, path)
+
+        def callback(secs, err):
+            if err is not None:
+                self.respond(f'550 {_strerror(err)}.')
+                return
+            if secs is None:
+                self.respond(f"550 {line} is not retrievable")
+                return
+            timefunc = time.gmtime if self.use_gmt_times else time.localtime
+            try:
+                lmt = time.strftime("%Y%m%d%H%M%S", timefunc(secs))
+            except ValueError:
                 # It could happen if file's last modification time
                 # happens to be too old (prior to year 1900)
                 why = "Can't determine file's last modification time"
+                self.respond(f'550 {why}.')
             else:
-                why = _strerror(err)
-            self.respond(f'550 {why}.')
+                self.respond(f"213 {lmt}")
+                return path
+
+        return self._fs_call(callback, getmtime)
+
+    def _digest_call(self, callback, path, algorithm, start=0, end=None):
+        """Compute the checksum of file path through digest_cache (if
+        any), then call callback(ret, err) where ret is a (digest,
+        file size) tuple. The file is read in digest_executor, else in
+        fs_executor. If there's neither (or the authorizer impersonates
+        users) it's read from the IO loop, one DIGEST_CHUNK_SIZE chunk
+        per loop iteration, so that hashing a big file doesn't stall
+        the other sessions.
+        """
+        line = self.fs.fs2ftp(path)
+
+        def check():
+            if not self.fs.isfile(self.fs.realpath(path)):
+                raise FilesystemError(f"{line} is not retrievable")
+
+        def digest():
+            check()
+            return self.run_as_current_user(
+                self.fs.digest, path, algorithm, start, end, self.digest_cache
+            )
+
+        def iterdigest():
+            check()
+            return (
+                yield from self.fs.iterdigest(
+                    path, algorithm, start, end, self.digest_cache
+                )
+            )
+
+        executor = self.digest_executor or self.fs_executor
+        if executor is not None and not self._impersonates():
+            return self._submit(
+                executor, callback, digest, (OSError, FilesystemError)
+            )
+        cmd, arg = self._current_cmd
+        # commands received meanwhile are queued, see _submit()
+        self._fs_pending = True
+        self.ioloop.call_later(
+            0,
+            self._digest_step,
+            callback,
+            cmd,
+            arg,
+            iterdigest(),
+            _errback=self.handle_error,
+        )
+
+    def _digest_step(self, callback, cmd, arg, iterator):
+        """Hash the next chunk of the file being hashed by iterator (see
+        _digest_call()) and reschedule itself until it's done.
+        """
+        if self._closed:
+            self._fs_pending = False
+            iterator.close()
+            return
+        try:
+            self.run_as_current_user(next, iterator)
+        except StopIteration as exc:
+            self._fs_call_done(callback, cmd, arg, exc.value, None)
+        except (OSError, FilesystemError) as err:
+            self._fs_call_done(callback, cmd, arg, None, err)
+        else:
+            self.ioloop.call_later(
+                0,
+                self._digest_step,
+                callback,
+                cmd,
+                arg,
+                iterator,
+                _errback=self.handle_error,
+            )
+
+    def _store_digest(self, path, algorithm, digest, size):
+        """Store in digest_cache the checksum of file path computed
+        while it was received, unless it has changed meanwhile.
+        """
+        try:
+            st = self.run_as_current_user(self.fs.stat, path)
+        except (OSError, FilesystemError):
+            return
+        if st.st_size == size:
+            self.digest_cache.put(path, st, algorithm, 0, size, digest)
+
+    def ftp_HASH(self, path):
+        """Return the checksum of file computed with the algorithm
+        selected by OPTS HASH over the range set by RANG (if any), as
+        defined in draft-bryan-ftp-hash.
+        On success return the file path, else None.
+        """
+        algorithm = self._hash_algorithm
+        start, end = self._hash_range or (0, None)
+        self._hash_range = None
+        line = self.fs.fs2ftp(path)
+
+        def callback(ret, err):
+            if err is not None:
+                self.respond(f'550 {_strerror(err)}.')
+                return
+            digest, size = ret
+            # the end point is included
+            last = max(size if end is None else min(end, size), 1) - 1
+            self.respond(f"213 {algorithm} {start}-{last} {digest} {line}")
+            return path
+
+        return self._digest_call(callback, path, algorithm, start, end)
+
+    def ftp_RANG(self, line):
+        """Set the byte range (start and end point, both included) the
+        next HASH is computed over, as defined in draft-bryan-ftp-range.
+        "RANG 1 0" resets it. RETR and STOR are not affected.
+        """
+        try:
+            start, end = (int(x) for x in line.split(' '))
+            if start < 0 or end < 0:
+                raise ValueError
+        except (ValueError, OverflowError):
+            self.respond("501 Invalid parameter.")
+            return
+        if (start, end) == (1, 0):
+            self._hash_range = None
+            self.respond("350 Restarting at 0. Ending byte at EOF.")
+        elif start > end:
+            self.respond("501 Invalid range.")
         else:
-            self.respond(f"213 {lmt}")
+            self._hash_range = (start, end + 1)
+            self.respond(f"350 Restarting at {start}. Ending byte at {end}.")
+
+    def _xdigest(self, path, algorithm, start, end):
+        if algorithm not in self.digest_algorithms:
+            self.respond(f"504 {algorithm} checksums are not supported.")
+            return
+
+        def callback(ret, err):
+            if err is not None:
+                self.respond(f'550 {_strerror(err)}.')
+                return
+            self.respond(f"250 {ret[0]}")
             return path
 
+        return self._digest_call(callback, path, algorithm, start, end)
+
+    def ftp_XCRC(self, path, start=0, end=None):
+        """Return the CRC32 checksum of file, optionally of the bytes
+        between offsets start and end (excluded).
+        On success return the file path, else None.
+        """
+        return self._xdigest(path, 'CRC32', start, end)
+
+    def ftp_XMD5(self, path, start=0, end=None):
+        """Return the MD5 checksum of file (see ftp_XCRC)."""
+        return self._xdigest(path, 'MD5', start, end)
+
+    def ftp_XSHA1(self, path, start=0, end=None):
+        """Return the SHA-1 checksum of file (see ftp_XCRC)."""
+        return self._xdigest(path, 'SHA-1', start, end)
+
+    def ftp_XSHA256(self, path, start=0, end=None):
+        """Return the SHA-256 checksum of file (see ftp_XCRC)."""
+        return self._xdigest(path, 'SHA-256', start, end)
+
+    def ftp_XSHA512(self, path, start=0, end=None):
+        """Return the SHA-512 checksum of file (see ftp_XCRC)."""
+        return self._xdigest(path, 'SHA-512', start, end)
+
     def ftp_MFMT(self, path, timeval):
         """Sets the last modification time of file to timeval
         3307 style timestamp (YYYYMMDDHHMMSS) as defined in RFC-3659.
@@ -2891,6 +4658,7 @@ class FTPHandler(AsyncChat):
                 why = _strerror(err)
             self.respond(f'550 {why}.')
         else:
+            self._invalidate_listings(os.path.dirname(path))
             self.respond(f"213 Modify={lmt}; {line}.")
             return (lmt, path)
 
@@ -2899,48 +4667,67 @@ class FTPHandler(AsyncChat):
         On success return the directory path, else None.
         """
         line = self.fs.fs2ftp(path)
-        try:
-            self.run_as_current_user(self.fs.mkdir, path)
-        except (OSError, FilesystemError) as err:
-            why = _strerror(err)
-            self.respond(f'550 {why}.')
-        else:
-            # The 257 response is supposed to include the directory
-            # name and in case it contains embedded double-quotes
-            # they must be doubled (see RFC-959, chapter 7, appendix 2).
-            self.respond(
-                '257 "%s" directory created.' % line.replace('"', '""')  # noqa
-            )
-            return path
+
+        def callback(ret, err):
+            if err is not None:
+                why = _strerror(err)
+                self.respond(f'550 {why}.')
+            else:
+                # The 257 response is supposed to include the directory
+                # name and in case it contains embedded double-quotes
+                # they must be doubled (see RFC-959, chapter 7,
+                # appendix 2).
+                self._invalidate_listings(os.path.dirname(path))
+                self._invalidate_paths(path)
+                self.respond(
+                    '257 "%s" directory created.'  # noqa: UP031
+                    % line.replace('"', '""')
+                )
+                return path
+
+        return self._fs_call(
+            callback, self.run_as_current_user, self.fs.mkdir, path
+        )
 
     def ftp_RMD(self, path):
         """Remove the specified directory.
         On success return the directory path, else None.
         """
-        if self.fs.realpath(path) == self.fs.realpath(self.fs.root):
-            msg = "Can't remove root directory."
-            self.respond(f"550 {msg}")
-            return
-        try:
+
+        def rmdir():
+            if self.fs.realpath(path) == self.fs.realpath(self.fs.root):
+                raise FilesystemError("Can't remove root directory")
             self.run_as_current_user(self.fs.rmdir, path)
-        except (OSError, FilesystemError) as err:
-            why = _strerror(err)
-            self.respond(f'550 {why}.')
-        else:
-            self.respond("250 Directory removed.")
+
+        def callback(ret, err):
+            if err is not None:
+                why = _strerror(err)
+                self.respond(f'550 {why}.')
+            else:
+                self._invalidate_listings(path, os.path.dirname(path))
+                self._invalidate_paths(path)
+                self.respond("250 Directory removed.")
+
+        return self._fs_call(callback, rmdir)
 
     def ftp_DELE(self, path):
         """Delete the specified file.
         On success return the file path, else None.
         """
-        try:
-            self.run_as_current_user(self.fs.remove, path)
-        except (OSError, FilesystemError) as err:
-            why = _strerror(err)
-            self.respond(f'550 {why}.')
-        else:
-            self.respond("250 File removed.")
-            return path
+
+        def callback(ret, err):
+            if err is not None:
+                why = _strerror(err)
+                self.respond(f'550 {why}.')
+            else:
+                self._invalidate_listings(os.path.dirname(path))
+                self._invalidate_paths(path)
+                self.respond("250 File removed.")
+                return path
+
+        return self._fs_call(
+            callback, self.run_as_current_user, self.fs.remove, path
+        )
 
     def ftp_RNFR(self, path):
         """Rename the specified (only the source name is specified
@@ -2963,14 +4750,22 @@ class FTPHandler(AsyncChat):
             return
         src = self._rnfr
         self._rnfr = None
-        try:
-            self.run_as_current_user(self.fs.rename, src, path)
-        except (OSError, FilesystemError) as err:
-            why = _strerror(err)
-            self.respond(f'550 {why}.')
-        else:
-            self.respond("250 Renaming ok.")
-            return (src, path)
+
+        def callback(ret, err):
+            if err is not None:
+                why = _strerror(err)
+                self.respond(f'550 {why}.')
+            else:
+                self._invalidate_listings(
+                    src, os.path.dirname(src), os.path.dirname(path)
+                )
+                self._invalidate_paths(src, path)
+                self.respond("250 Renaming ok.")
+                return (src, path)
+
+        return self._fs_call(
+            callback, self.run_as_current_user, self.fs.rename, src, path
+        )
 
         # --- others
 
@@ -3060,6 +4855,16 @@ class FTPHandler(AsyncChat):
                 ))
             else:
                 s.append('Data connection closed.')
+            if self._copy is not None:
+                task = self._copy
+                elapsed_time = round(timer() - task.started, 3)
+                s.extend((
+                    f'{task.cmd} in progress: '
+                    f'{self.fs.fs2ftp(task.src)} -> '
+                    f'{self.fs.fs2ftp(task.dst)}',
+                    f'Total bytes copied: {task.copied}',
+                    f'Copy elapsed time: {elapsed_time} secs',
+                ))
 
             self.push('211-FTP server status:\r\n')
             self.push(''.join([f' {item}\r\n' for item in s]))
@@ -3067,27 +4872,22 @@ class FTPHandler(AsyncChat):
         # return directory LISTing over the command channel
         else:
             line = self.fs.fs2ftp(path)
-            try:
-                isdir = self.fs.isdir(path)
-                if isdir:
-                    listing = self.run_as_current_user(self.fs.listdir, path)
-                    if isinstance(listing, list):
-                        # RFC 959 recommends the listing to be sorted.
-                        listing.sort()
-                    iterator = self.fs.format_list(path, listing)
-                else:
-                    basedir, filename = os.path.split(path)
-                    self.fs.lstat(path)  # raise exc in case of problems
-                    iterator = self.fs.format_list(basedir, [filename])
-            except (OSError, FilesystemError) as err:
-                why = _strerror(err)
-                self.respond(f'550 {why}.')
-            else:
+
+            def callback(data, err):
+                if err is not None:
+                    why = _strerror(err)
+                    self.respond(f'550 {why}.')
+                    return
                 self.push(f'213-Status of "{line}":\r\n')
-                self.push_with_producer(BufferedIteratorProducer(iterator))
+                if isinstance(data, bytes):
+                    asynchat.async_chat.push(self, data)
+                else:
+                    self.push_with_producer(BufferedIteratorProducer(data))
                 self.respond('213 End of status.')
                 return path
 
+            return self._fs_call(callback, self._list_path, path)
+
     def ftp_FEAT(self, line):
         """List all new features supported as defined in RFC-2398."""
         features = {'TVFS'}
@@ -3101,7 +4901,7 @@ class FTPHandler(AsyncChat):
         features.update(self._extra_feats)
         if 'MLST' in self.proto_cmds or 'MLSD' in self.proto_cmds:
             facts = ''
-            for fact in self._available_facts:
+            for fact in _AVAILABLE_FACTS:
                 if fact in self._current_facts:
                     facts += fact + '*;'
                 else:
@@ -3109,6 +4909,14 @@ class FTPHandler(AsyncChat):
             features.add('MLST ' + facts)
         if 'REST' in self.proto_cmds:
             features.add('REST STREAM')
+        if 'HASH' in self.proto_cmds:
+            features.add(
+                'HASH '
+                + ';'.join([
+                    x + '*' if x == self._hash_algorithm else x
+                    for x in self.digest_algorithms
+                ])
+            )
         features = sorted(features)
         self.push("211-Features supported:\r\n")
         self.push("".join([f" {x}\r\n" for x in features]))
@@ -3116,6 +4924,18 @@ class FTPHandler(AsyncChat):
 
     def ftp_OPTS(self, line):
         """Specify options for FTP commands as specified in RFC-2389."""
+        cmd, _, arg = line.partition(' ')
+        if cmd.upper() == 'HASH' and 'HASH' in self.proto_cmds:
+            # select the HASH algorithm (draft-bryan-ftp-hash)
+            arg = arg.strip().upper()
+            if not arg:
+                self.respond(f'200 {self._hash_algorithm}')
+            elif arg in self.digest_algorithms:
+                self._hash_algorithm = arg
+                self.respond(f'200 {arg}')
+            else:
+                self.respond('501 Unknown algorithm.')
+            return
         try:
             if line.count(' ') > 1:
                 raise ValueError('Invalid number of arguments')
@@ -3125,7 +4945,7 @@ class FTPHandler(AsyncChat):
                     raise ValueError('Invalid argument')
             else:
                 cmd, arg = line, ''
-            # actually the only command able to accept options is MLST
+            # the only other command able to accept options is MLST
             if cmd.upper() != 'MLST' or 'MLST' not in self.proto_cmds:
                 raise ValueError(f'Unsupported command "{cmd}"')
         except ValueError as err:
@@ -3133,7 +4953,7 @@ class FTPHandler(AsyncChat):
         else:
             facts = [x.lower() for x in arg.split(';')]
             self._current_facts = [
-                x for x in facts if x in self._available_facts
+                x for x in facts if x in _AVAILABLE_FACTS
             ]
             f = ''.join([x + ';' for x in self._current_facts])
             self.respond('200 MLST OPTS ' + f)
@@ -3207,9 +5027,151 @@ class FTPHandler(AsyncChat):
                 why = _strerror(err)
                 self.respond(f'550 {why}.')
             else:
+                self._invalidate_listings(os.path.dirname(path))
                 self.respond('200 SITE CHMOD successful.')
                 return (path, mode)
 
+    def ftp_SITE_COPY(self, path, src):
+        """Copy file src to path (or into path if it's a directory) on
+        the server side. The reply is sent once the copy completes;
+        STAT shows its progress and ABOR cancels it, as does the
+        client disconnecting.
+        """
+        return self._start_copy('SITE COPY', src, path)
+
+    def ftp_SITE_CPR(self, path, src):
+        """Copy directory src recursively to path (or into path if
+        it's a directory), like SITE COPY. Every file and directory
+        copied is subject to the same checks as the top level ones.
+        """
+        return self._start_copy('SITE CPR', src, path)
+
+    def _check_copy_path(self, path, perm):
+        """Raise FilesystemError unless path is within the user's root
+        directory and the user has perm over it.
+        """
+        if not self.fs.validpath(path):
+            line = self.fs.fs2ftp(path)
+            raise FilesystemError(
+                f"{line!r} points to a path which is outside the user's "
+                "root directory"
+            )
+        if not self.authorizer.has_perm(self.username, perm, path):
+            raise FilesystemError("Not enough privileges")
+
+    def _start_copy(self, cmd, src, dst):
+        if self._copy is not None:
+            self.respond("450 Another copy is in progress.")
+            return
+        recursive = cmd == 'SITE CPR'
+
+        def resolve():
+            # copying into a directory
+            if self.fs.isdir(dst):
+                return os.path.join(dst, os.path.basename(src))
+            return dst
+
+        def callback(path, err):
+            if err is None:
+                try:
+                    self._check_copy_path(src, 'r')
+                    self._check_copy_path(path, 'w')
+                    if recursive:
+                        self._check_copy_path(path, 'm')
+                except FilesystemError as _:
+                    err = _
+            if err is not None:
+                self.respond(f'550 {_strerror(err)}.')
+                return
+            if recursive:
+                iterator = self.fs.copytree(src, path, self._check_copy)
+            else:
+                iterator = self.fs.copy(src, path)
+            task = self._copy = _FileCopy(cmd, src, path, iterator)
+            self.ioloop.call_later(
+                0, self._copy_step, task, _errback=self.handle_error
+            )
+            return path
+
+        return self._fs_call(callback, self.run_as_current_user, resolve)
+
+    def _check_copy(self, src, dst, isdir):
+        # called by AbstractedFS.copytree() for every entry
+        self._check_copy_path(src, 'r')
+        self._check_copy_path(dst, 'm' if isdir else 'w')
+
+    def _copy_step(self, task):
+        """Copy the next chunk of the file(s) being copied by task (a
+        _FileCopy), in fs_executor if set, so that neither big files
+        nor big trees block the IO loop.
+        """
+        if task.cancelled:
+            self.run_as_current_user(task.iterator.close)
+            return
+        executor = self.fs_executor
+        if executor is None or self._impersonates():
+            try:
+                ret = self.run_as_current_user(next, task.iterator, None)
+            except Exception as err:
+                self._copy_step_done(task, None, err)
+            else:
+                self._copy_step_done(task, ret, None)
+        else:
+            executor.submit(
+                self.ioloop,
+                task.cmd,
+                lambda: next(task.iterator, None),
+                lambda ret, err: self._copy_step_done(task, ret, err),
+            )
+
+    def _copy_step_done(self, task, ret, err):
+        if task.cancelled:
+            # aborted or disconnected meanwhile
+            self._copy_step(task)
+            return
+        try:
+            if err is not None:
+                self._copy = None
+                if not isinstance(err, (OSError, FilesystemError)):
+                    raise err
+                self._respond_copy(task, f'550 {_strerror(err)}.')
+            elif ret is None:
+                self._copy = None
+                self._invalidate_listings(task.dst, os.path.dirname(task.dst))
+                self._respond_copy(
+                    task, f"250 Copy complete ({task.copied} bytes)."
+                )
+            else:
+                task.copied += ret
+                self.ioloop.call_later(
+                    0, self._copy_step, task, _errback=self.handle_error
+                )
+        except Exception:
+            self.handle_error()
+
+    def _respond_copy(self, task, resp):
+        self.respond(resp)
+        self.log_cmd(task.cmd, task.dst, int(resp[:3]), resp[4:])
+
+    def _cancel_copy(self):
+        """Stop the SITE COPY or SITE CPR in progress. The file being
+        copied is removed.
+        """
+        task = self._copy
+        self._copy = None
+        task.cancelled = True
+
+    def ftp_SITE_STATS(self, line):
+        """Return the server performance metrics (if enabled). Only
+        users having the "M" permission can see them.
+        """
+        if self.metrics is None:
+            self.respond("550 Statistics are not enabled.")
+            return
+        self.push("211-Server statistics:\r\n")
+        self.push(''.join(f' {x}\r\n' for x in self.metrics.report()))
+        self.respond("211 End of statistics.")
+
     def ftp_SITE_HELP(self, line):
         """Return help text to the client for a given SITE command."""
         if line:
@@ -3263,12 +5225,25 @@ class FTPHandler(AsyncChat):
 
 
 if SSL is not None:
+    # SSL_OP_ENABLE_KTLS (OpenSSL >= 3.0), not exposed by pyOpenSSL
+    _OP_ENABLE_KTLS = getattr(SSL, 'OP_ENABLE_KTLS', 1 << 3)
+
+    def _ssl_session_reused(conn):
+        """Return True if the handshake of conn (a SSL.Connection)
+        resumed a previous session rather than being a full one.
+        """
+        # SSL_session_reused() is not exposed by pyOpenSSL
+        try:
+            return bool(SSL._lib.SSL_session_reused(conn._ssl))
+        except AttributeError:
+            return False
 
     class SSLConnection:
         """An AsyncChat subclass supporting TLS/SSL."""
 
         _ssl_accepting = False
         _ssl_established = False
+        _ssl_resumed = False
         _ssl_closing = False
         _ssl_requested = False
 
@@ -3373,7 +5348,12 @@ if SSL is not None:
                 debug(f"call: _do_ssl_handshake, err: {err!r}", inst=self)
                 self.handle_failed_ssl_handshake()
             else:
-                debug("SSL connection established", self)
+                self._ssl_resumed = _ssl_session_reused(self.socket)
+                debug(
+                    "SSL connection established "
+                    f"(resumed={self._ssl_resumed})",
+                    self,
+                )
                 self._ssl_accepting = False
                 self._ssl_established = True
                 self.handle_ssl_established()
@@ -3428,6 +5408,11 @@ if SSL is not None:
             except Exception:
                 logger.critical(traceback.format_exc())
 
+        def sendmsg(self, buffers):
+            # SSL_write() has no scatter-gather counterpart: send the
+            # first buffer only, the rest is sent on the next call.
+            return self.send(buffers[0])
+
         def send(self, data):
             if not isinstance(data, bytes):
                 data = bytes(data)
@@ -3611,7 +5596,14 @@ if SSL is not None:
                 super().close()
 
     class TLS_DTPHandler(SSLConnection, DTPHandler):
-        """A DTPHandler subclass supporting TLS/SSL."""
+        """A DTPHandler subclass supporting TLS/SSL.
+
+        Encrypted files are sent with sendfile() only if the kernel
+        encrypts them (see TLS_FTPHandler.ktls).
+        """
+
+        # whether kernel TLS is enabled for sending
+        _ktls = False
 
         def __init__(self, sock, cmd_channel):
             super().__init__(sock, cmd_channel)
@@ -3622,11 +5614,47 @@ if SSL is not None:
             return DTPHandler.__repr__(self)
 
         def use_sendfile(self):
-            if isinstance(self.socket, SSL.Connection):
+            if isinstance(self.socket, SSL.Connection) and not self._ktls:
                 return False
             else:
                 return super().use_sendfile()
 
+        def push_with_producer(self, producer):
+            if (
+                self._ssl_accepting
+                and self.cmd_channel.ktls
+                and isinstance(producer, FileProducer)
+            ):
+                # don't read the file before knowing whether kernel
+                # TLS gets enabled by the handshake
+                if producer.type == 'i':
+                    self._advise_page_cache(producer.file, False)
+                self._initialized = True
+                self.modify_ioloop_events(self.ioloop.WRITE)
+                self._wanted_io_events = self.ioloop.WRITE
+                self.producer_fifo.append(producer)
+            else:
+                super().push_with_producer(producer)
+
+        def handle_ssl_established(self):
+            if self._metrics is not None:
+                self._metrics.tls_handshake('data', self._ssl_resumed)
+            if not self.cmd_channel.ktls or not _ktls_tx_enabled(self.socket):
+                return
+            debug("kernel TLS enabled", self)
+            self._ktls = True
+            # a file queued while the handshake was in progress hasn't
+            # been read yet: send it with sendfile() instead
+            fifo = self.producer_fifo
+            if (
+                fifo
+                and isinstance(fifo[0], FileProducer)
+                and self.use_sendfile()
+            ):
+                producer = fifo.pop(0)
+                if not self._start_sendfile(producer):
+                    fifo.insert(0, producer)
+
         def handle_failed_ssl_handshake(self):
             # TLS/SSL handshake failure, probably client's fault which
             # used a SSL version different from server's.
@@ -3683,6 +5711,35 @@ if SSL is not None:
             a SSL Context object previously configured; if specified
             all other parameters will be ignored.
             (default None).
+
+         - (bool) ktls:
+            When True, on Linux, have OpenSSL hand the encryption of
+            connections over to the kernel (kernel TLS) so that RETR on
+            encrypted data channels uses sendfile() (see use_sendfile)
+            as on clear ones. It requires OpenSSL 3 built with kTLS
+            support and the "tls" kernel module; connections for which
+            it can't be enabled (e.g. the negotiated cipher is not
+            supported by the kernel) fall back on SSL_write(). If
+            ssl_context is provided SSL.OP_ENABLE_KTLS must be set on it
+            instead (default False).
+
+         - (bool) ssl_session_cache:
+            When True TLS sessions can be resumed: session IDs are
+            cached server-side and (unless ssl_session_tickets is False)
+            session tickets are issued. Clients resuming the session of
+            the control connection on data connections (as FileZilla
+            does) skip a full handshake for every transfer. Since the
+            context is created before pre-forking workers, they all
+            share the ticket keys (default True).
+
+         - (bool) ssl_session_tickets:
+            Whether to issue session tickets, so that the server
+            doesn't need to keep the state of resumable sessions
+            (default True).
+
+         - (int) ssl_session_timeout:
+            the number of seconds a TLS session can be resumed for
+            (default 300).
         """
 
         # configurable attributes
@@ -3700,6 +5757,10 @@ if SSL is not None:
         if hasattr(SSL, "OP_NO_COMPRESSION"):
             ssl_options |= SSL.OP_NO_COMPRESSION
         ssl_context = None
+        ktls = False
+        ssl_session_cache = True
+        ssl_session_tickets = True
+        ssl_session_timeout = 300
 
         # overridden attributes
         dtp_handler = TLS_DTPHandler
@@ -3754,6 +5815,29 @@ if SSL is not None:
                 cls.ssl_context.use_privatekey_file(cls.keyfile)
                 if cls.ssl_options:
                     cls.ssl_context.set_options(cls.ssl_options)
+                if cls.ssl_session_cache:
+                    cls.ssl_context.set_session_cache_mode(
+                        SSL.SESS_CACHE_SERVER
+                    )
+                    # sessions can't be resumed across contexts
+                    # having a different ID
+                    cls.ssl_context.set_session_id(b'pyftpdlib')
+                    cls.ssl_context.set_timeout(cls.ssl_session_timeout)
+                    if not cls.ssl_session_tickets:
+                        cls.ssl_context.set_options(SSL.OP_NO_TICKET)
+                else:
+                    cls.ssl_context.set_session_cache_mode(
+                        SSL.SESS_CACHE_OFF
+                    )
+                    cls.ssl_context.set_options(SSL.OP_NO_TICKET)
+                if cls.ktls:
+                    if _ktls_available():
+                        cls.ssl_context.set_options(_OP_ENABLE_KTLS)
+                    else:
+                        logger.warning(
+                            "kernel TLS is not supported by this system; "
+                            "encrypted files will be sent with SSL_write()"
+                        )
             return cls.ssl_context
 
         # --- overridden methods
@@ -3782,6 +5866,10 @@ if SSL is not None:
             SSLConnection.close(self)
             FTPHandler.close(self)
 
+        def handle_ssl_established(self):
+            if self.metrics is not None:
+                self.metrics.tls_handshake('control', self._ssl_resumed)
+
         # --- new methods
 
         def handle_failed_ssl_handshake(self):
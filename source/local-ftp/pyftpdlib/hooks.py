@@ -0,0 +1,355 @@
+# Copyright (C) 2007 Giampaolo Rodola' <g.rodola@gmail.com>.
+# Use of this source code is governed by MIT license that can be
+# found in the LICENSE file.
+
+"""
+Run post-processing hooks (virus scans, indexing, moving uploaded
+files into place...) in a pool of threads or processes rather than
+in the IO loop, as FTPHandler.on_file_received() & co. do.
+
+Example usage:
+
+>>> import subprocess
+>>> from pyftpdlib.handlers import FTPHandler
+>>> from pyftpdlib.hooks import HookDispatcher
+>>>
+>>> def scan(file):
+...     subprocess.run(['clamscan', '--no-summary', file], check=True)
+...     return "Transfer complete, no virus found."
+...
+>>> hooks = HookDispatcher(max_workers=4)
+>>> hooks.register('file_received', scan, concurrency=2, reply=True)
+>>> FTPHandler.hook_dispatcher = hooks
+"""
+
+import collections
+import concurrent.futures
+import threading
+
+from .ioloop import timer
+from .log import logger
+
+
+__all__ = ['HookDispatcher', 'HookQueueFull']
+
+
+# the events hooks can be registered for, named after the
+# FTPHandler.on_* methods whose arguments they receive
+EVENTS = (
+    'login',
+    'logout',
+    'file_sent',
+    'file_received',
+    'incomplete_file_sent',
+    'incomplete_file_received',
+)
+
+# the events whose hooks can determine the reply to the transfer
+REPLY_EVENTS = ('file_sent', 'file_received')
+
+
+class HookQueueFull(Exception):
+    """The error a hook fails with when max_queue tasks are pending."""
+
+
+class _Hook:
+    __slots__ = (
+        'completed',
+        'concurrency',
+        'dropped',
+        'event',
+        'failed',
+        'function',
+        'max_time',
+        'name',
+        'queued',
+        'reply',
+        'retried',
+        'retries',
+        'retry_delay',
+        'running',
+        'tot_time',
+    )
+
+    def __init__(
+        self, event, function, name, concurrency, retries, retry_delay, reply
+    ):
+        self.event = event
+        self.function = function
+        self.name = name
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.reply = reply
+        # tasks waiting for one of the concurrency slots
+        self.queued = collections.deque()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.tot_time = 0.0
+        self.max_time = 0.0
+
+
+class _Task:
+    __slots__ = ('args', 'attempts', 'callback', 'hook', 'ioloop', 'started')
+
+    def __init__(self, hook, args, ioloop, callback):
+        self.hook = hook
+        self.args = args
+        self.ioloop = ioloop
+        self.callback = callback
+        self.attempts = 0
+        self.started = 0
+
+
+class HookDispatcher:
+    """Run the functions registered for an event (see register()) in
+    a pool of worker threads or processes, to be set as
+    FTPHandler.hook_dispatcher. The FTPHandler.on_* methods are still
+    called as usual from the IO loop, before the hooks are dispatched.
+
+    At most max_queue tasks can be pending (waiting or running) at
+    any time: hooks dispatched beyond that are dropped, counted and
+    fail with HookQueueFull. Hooks failing after all their retries are
+    logged.
+
+     - (int) max_workers: the number of worker threads or processes.
+     - (int) max_queue: the maximum number of pending tasks.
+     - (bool) processes: use a pool of processes rather than threads;
+       hooks and their arguments must be picklable then.
+     - (instance) executor: a concurrent.futures.Executor to use
+       instead of creating one; it's not shut down by shutdown().
+    """
+
+    def __init__(
+        self, max_workers=4, max_queue=1000, processes=False, executor=None
+    ):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._own_executor = executor is None
+        if executor is None:
+            if processes:
+                executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=max_workers
+                )
+            else:
+                executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max_workers,
+                    thread_name_prefix='pyftpdlib-hook',
+                )
+        self._executor = executor
+        # {event: [_Hook, ...]}
+        self._hooks = {}
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}(max_workers={self.max_workers}, "
+            f"pending={self._pending}, "
+            f"hooks={[h.name for h in self._iter_hooks()]})>"
+        )
+
+    __str__ = __repr__
+
+    def _iter_hooks(self):
+        for hooks in self._hooks.values():
+            yield from hooks
+
+    def register(
+        self,
+        event,
+        function,
+        name=None,
+        concurrency=0,
+        retries=0,
+        retry_delay=1.0,
+        reply=False,
+    ):
+        """Call function() with the arguments of the FTPHandler.on_*
+        method of the given event (e.g. "file_received" means
+        function(file)) every time the event occurs.
+
+         - (str) name: identifies the hook in stats() and logs
+           (defaults to the function name).
+         - (int) concurrency: the maximum number of calls of function
+           running at the same time; 0 means max_workers.
+         - (int) retries: how many times function is called again if
+           it raises an exception.
+         - (float) retry_delay: the number of seconds to wait before
+           retrying.
+         - (bool) reply: for "file_sent" and "file_received" only: the
+           reply to the transfer ("226 Transfer complete.") is deferred
+           until function completes; if it returns a string that's
+           used as the reply text, if it fails (or is dropped) the
+           client gets a 451 error reply instead. The session doesn't
+           process further commands in the meantime; other sessions
+           are not affected. Only one reply hook per event is allowed.
+        """
+        if event not in EVENTS:
+            raise ValueError(f"unknown event {event!r}")
+        if reply and event not in REPLY_EVENTS:
+            raise ValueError(f"reply hooks are not supported for {event!r}")
+        if name is None:
+            name = getattr(function, '__name__', repr(function))
+        hooks = self._hooks.get(event, [])
+        if name in [h.name for h in self._iter_hooks()]:
+            raise ValueError(f"hook {name!r} already registered")
+        if reply and [h for h in hooks if h.reply]:
+            raise ValueError(f"{event!r} already has a reply hook")
+        hook = _Hook(
+            event, function, name, concurrency, retries, retry_delay, reply
+        )
+        # copy on write: dispatch() may be iterating over them
+        self._hooks = dict(self._hooks)
+        self._hooks[event] = [*hooks, hook]
+
+    def unregister(self, name):
+        """Remove the hook named name. Pending calls are not affected."""
+        hooks = dict(self._hooks)
+        for event, lst in list(hooks.items()):
+            if name in [h.name for h in lst]:
+                lst = [h for h in lst if h.name != name]
+                if lst:
+                    hooks[event] = lst
+                else:
+                    del hooks[event]
+                self._hooks = hooks
+                return
+        raise ValueError(f"no such hook {name!r}")
+
+    def has_hooks(self, event):
+        """Return True if any hook is registered for event."""
+        return event in self._hooks
+
+    def has_reply_hook(self, event):
+        """Return True if a reply hook is registered for event."""
+        return any(h.reply for h in self._hooks.get(event, ()))
+
+    def dispatch(self, ioloop, event, args, callback=None):
+        """Schedule the hooks registered for event, called with *args.
+        If callback is given it's called from ioloop as callback(ret,
+        err) once the reply hook completes, where ret is what the hook
+        returned and err the exception it raised (if any).
+        Must be called from the ioloop thread.
+        """
+        hooks = self._hooks.get(event)
+        if not hooks:
+            return
+        # callbacks and retries are delivered through the IO loop
+        ioloop._get_waker()
+        for hook in hooks:
+            task = _Task(hook, args, ioloop, callback if hook.reply else None)
+            with self._lock:
+                if self._pending >= self.max_queue:
+                    hook.dropped += 1
+                    full = True
+                else:
+                    full = False
+                    self._pending += 1
+                    if hook.concurrency and hook.running >= hook.concurrency:
+                        hook.queued.append(task)
+                        continue
+                    hook.running += 1
+            if full:
+                logger.warning(
+                    f"hook {hook.name!r} dropped: {self.max_queue} tasks "
+                    "already pending"
+                )
+                if task.callback is not None:
+                    ioloop.call_later(
+                        0, task.callback, None, HookQueueFull(hook.name)
+                    )
+            else:
+                self._run(task)
+
+    def _run(self, task):
+        task.attempts += 1
+        task.started = timer()
+        try:
+            future = self._executor.submit(task.hook.function, *task.args)
+        except RuntimeError as err:
+            # shut down
+            self._done(task, None, err)
+        else:
+            future.add_done_callback(lambda fut: self._future_done(task, fut))
+
+    def _future_done(self, task, future):
+        # called from a thread of the executor
+        try:
+            ret, err = future.result(), None
+        except BaseException as _:  # noqa: BLE001
+            ret, err = None, _
+        hook = task.hook
+        if err is not None and task.attempts <= hook.retries:
+            with self._lock:
+                hook.retried += 1
+            # the task keeps its concurrency slot while waiting
+            task.ioloop.add_callback(
+                task.ioloop.call_later, hook.retry_delay, self._run, task
+            )
+            return
+        self._done(task, ret, err)
+
+    def _done(self, task, ret, err):
+        hook = task.hook
+        elapsed = timer() - task.started
+        with self._lock:
+            self._pending -= 1
+            if err is None:
+                hook.completed += 1
+            else:
+                hook.failed += 1
+            hook.tot_time += elapsed
+            hook.max_time = max(hook.max_time, elapsed)
+            if hook.queued:
+                next_task = hook.queued.popleft()
+            else:
+                next_task = None
+                hook.running -= 1
+        if err is not None:
+            logger.error(
+                f"hook {hook.name!r} failed after {task.attempts} "
+                f"attempt(s): {err!r}"
+            )
+        if task.callback is not None:
+            task.ioloop.add_callback(task.callback, ret, err)
+        if next_task is not None:
+            self._run(next_task)
+
+    def stats(self):
+        """Return a dict including the number of pending tasks and, for
+        each hook, the number of queued (waiting for a concurrency
+        slot), running, completed, failed, retried and dropped calls
+        plus their average and maximum duration in seconds.
+        """
+        with self._lock:
+            hooks = {}
+            for hook in self._iter_hooks():
+                calls = hook.completed + hook.failed
+                hooks[hook.name] = dict(
+                    event=hook.event,
+                    queued=len(hook.queued),
+                    running=hook.running,
+                    completed=hook.completed,
+                    failed=hook.failed,
+                    retried=hook.retried,
+                    dropped=hook.dropped,
+                    avg_time=hook.tot_time / calls if calls else 0.0,
+                    max_time=hook.max_time,
+                )
+            return dict(
+                max_workers=self.max_workers,
+                max_queue=self.max_queue,
+                pending=self._pending,
+                hooks=hooks,
+            )
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads or processes. If wait is True wait
+        for running hooks to complete.
+        """
+        if self._own_executor:
+            self._executor.shutdown(wait=wait)
@@ -56,8 +56,12 @@ server = Server('localhost', 2121)
 IOLoop.instance().loop()
 """
 
+import asyncio
+import collections
+import concurrent.futures
 import errno
 import heapq
+import math
 import os
 import select
 import socket
@@ -103,6 +107,12 @@ _ERRNOS_RETRY = {errno.EAGAIN, errno.EWOULDBLOCK}
 if hasattr(errno, "WSAEWOULDBLOCK"):
     _ERRNOS_RETRY.add(errno.WSAEWOULDBLOCK)
 
+# The max number of buffers passed to a single sendmsg() call (POSIX
+# guarantees at least 16 for IOV_MAX, Linux has 1024).
+_MAX_IOV = 64
+_HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+_BUFFER_TYPES = (bytes, bytearray, memoryview)
+
 
 class RetryError(Exception):
     pass
@@ -187,6 +197,164 @@ class _Scheduler:
         self._cancellations = 0
 
 
+class TimerWheel:
+    """A hierarchical timing wheel which can be used in place of the
+    default heap-based scheduler (see IOLoop.scheduler_class).
+    Registering, cancelling and resetting a call are O(1), which pays
+    off with tens of thousands of connections, each one having its
+    own idle timeout being reset on every command.
+
+    Time is split in ticks of `resolution` seconds. The first wheel
+    holds the calls due in the next `wheel_size` ticks, one slot per
+    tick; each following wheel covers `wheel_size` times the range of
+    the previous one, and its slots are moved to lower wheels as time
+    gets closer. Calls are never run before their timeout and at most
+    one tick later.
+    Resetting a call just updates its timeout: it gets moved to the
+    right slot when its former one expires.
+
+     - (float) resolution: the duration of a tick in seconds.
+     - (int) wheel_size: the number of slots per wheel (a power of 2).
+     - (int) levels: the number of wheels; calls due later than what
+       the wheels can hold (about 248 days with the defaults) are
+       parked in the last slot and re-inserted when they get there.
+    """
+
+    def __init__(self, resolution=0.005, wheel_size=256, levels=4):
+        assert wheel_size > 1, wheel_size
+        assert wheel_size & (wheel_size - 1) == 0, wheel_size
+        self.resolution = resolution
+        self._size = wheel_size
+        self._bits = wheel_size.bit_length() - 1
+        self._mask = wheel_size - 1
+        self._span = wheel_size**levels
+        # one {slot index: set(calls)} dict per wheel
+        self._wheels = [{} for _ in range(levels)]
+        # calls to run on next poll()
+        self._ready = set()
+        # all the calls not cancelled yet
+        self._tasks = set()
+        self._tick = int(timer() / resolution)
+
+    def _insert(self, call):
+        if not call._delay:
+            slot = self._ready
+        else:
+            due = math.ceil(call.timeout / self.resolution)
+            delta = due - self._tick
+            if delta <= 0:
+                slot = self._ready
+            else:
+                if delta >= self._span:
+                    due = self._tick + self._span - 1
+                    delta = self._span - 1
+                level = 0
+                while delta >= self._size:
+                    delta >>= self._bits
+                    level += 1
+                wheel = self._wheels[level]
+                index = (due >> (self._bits * level)) & self._mask
+                slot = wheel.get(index)
+                if slot is None:
+                    slot = wheel[index] = set()
+        slot.add(call)
+        call._slot = slot
+
+    def _advance(self, target, calls):
+        """Move the wheels forward up to the target tick, collecting
+        the expired calls in the given list.
+        """
+        wheels = self._wheels
+        first = wheels[0]
+        bits = self._bits
+        mask = self._mask
+        while self._tick < target:
+            self._tick += 1
+            tick = self._tick
+            # cascade the slots of the upper wheels whose turn has come
+            level = 1
+            while level < len(wheels) and not tick & (
+                (1 << (bits * level)) - 1
+            ):
+                slot = wheels[level].pop((tick >> (bits * level)) & mask, None)
+                if slot:
+                    for call in slot:
+                        self._insert(call)
+                level += 1
+            slot = first.pop(tick & mask, None)
+            if slot:
+                calls.extend(slot)
+
+    def poll(self):
+        """Run the scheduled functions which expired and return the
+        timeout of the next one (if any, else None).
+        """
+        now = timer()
+        target = int(now / self.resolution)
+        calls = []
+        if self._tasks:
+            self._advance(target, calls)
+        else:
+            self._tick = max(self._tick, target)
+        calls.extend(self._ready)
+        self._ready.clear()
+        calls.sort()
+        for call in calls:
+            call._slot = None
+        for call in calls:
+            if call.cancelled:
+                continue
+            if call.timeout > now:
+                # reset() was called in the meantime
+                self._insert(call)
+                continue
+            try:
+                call.call()
+            except Exception:
+                logger.error(traceback.format_exc())
+
+        if self._ready:
+            return 0
+        first = self._wheels[0]
+        if first:
+            cur = self._tick & self._mask
+            dist = min((index - cur) & self._mask for index in first)
+            return max(0, (self._tick + dist) * self.resolution - now)
+        if self._tasks:
+            # wake up when the next upper slot gets cascaded
+            tick = ((self._tick >> self._bits) + 1) << self._bits
+            return max(0, tick * self.resolution - now)
+
+    def register(self, what):
+        """Register a _CallLater instance."""
+        self._tasks.add(what)
+        self._insert(what)
+
+    def unregister(self, what):
+        """Unregister a _CallLater instance."""
+        self._tasks.discard(what)
+        if what._slot is not None:
+            what._slot.discard(what)
+            what._slot = None
+
+    def reheapify(self):
+        """Provided for compatibility with the heap-based scheduler:
+        cancelled calls are removed immediately so it's a no-op.
+        """
+
+    def close(self):
+        for x in list(self._tasks):
+            try:
+                if not x.cancelled:
+                    x.cancel()
+            except Exception:
+                logger.error(traceback.format_exc())
+        for wheel in self._wheels:
+            wheel.clear()
+        self._ready.clear()
+        self._tasks.clear()
+
+
 class _CallLater:
     """Container object which instance is returned by ioloop.call_later()."""
 
@@ -197,6 +365,7 @@ class _CallLater:
         '_kwargs',
         '_repush',
         '_sched',
+        '_slot',
         '_target',
         'cancelled',
         'timeout',
@@ -214,6 +383,7 @@ class _CallLater:
         self._errback = kwargs.pop('_errback', None)
         self._sched = kwargs.pop('_scheduler')
         self._repush = False
+        self._slot = None
         # seconds from the epoch at which to call the function
         if not seconds:
             self.timeout = 0
@@ -279,6 +449,8 @@ class _CallLater:
 class _CallEvery(_CallLater):
     """Container object which instance is returned by IOLoop.call_every()."""
 
+    __slots__ = ()
+
     def _post_call(self, exc):
         if not self.cancelled:
             if exc:
@@ -296,10 +468,17 @@ class _IOLoop:
     _instance = None
     _lock = threading.Lock()
     _started_once = False
+    # the scheduler running call_later() and call_every() functions:
+    # either the heap-based _Scheduler or TimerWheel
+    scheduler_class = _Scheduler
+    # a pyftpdlib.metrics.Metrics instance timing event dispatching
+    metrics = None
 
     def __init__(self):
         self.socket_map = {}
-        self.sched = _Scheduler()
+        self.sched = self.scheduler_class()
+        self._callbacks = collections.deque()
+        self._waker = None
 
     def __enter__(self):
         return self
@@ -412,6 +591,44 @@ class _IOLoop:
         kwargs['_scheduler'] = self.sched
         return _CallEvery(seconds, target, *args, **kwargs)
 
+    def add_callback(self, callback, *args):
+        """Call a function on the next IO loop iteration.
+        Unlike call_later() this is safe to call from any thread, and
+        it's the only way threads other than the one running the loop
+        are supposed to interact with it. A waker has to be set up
+        first by calling _get_waker() from the IO loop thread.
+        """
+        self._callbacks.append((callback, args))
+        waker = self._waker
+        if waker is not None:
+            waker.wake()
+
+    def _get_waker(self):
+        """Return the _Waker instance used to interrupt poll() when
+        add_callback() is used, creating it on first use.
+        Must be called from the IO loop thread.
+        """
+        if self._waker is None or self._waker._closed:
+            self._waker = _Waker(ioloop=self)
+        return self._waker
+
+    def _run_callbacks(self):
+        callbacks = self._callbacks
+        # only run the callbacks added so far, not those added by
+        # the callbacks themselves
+        for _ in range(len(callbacks)):
+            callback, args = callbacks.popleft()
+            try:
+                callback(*args)
+            except Exception:
+                logger.error(traceback.format_exc())
+
+    def _close_poller(self):
+        """Close the underlying poller (if any) leaving registered
+        instances untouched. Used by pre-forked workers to get rid of
+        the poller inherited from the parent process.
+        """
+
     def close(self):
         """Closes the IOLoop, freeing any resources used."""
         debug("closing IOLoop", self)
@@ -428,6 +645,8 @@ class _IOLoop:
             except Exception:
                 logger.error(traceback.format_exc())
         self.socket_map.clear()
+        self._waker = None
+        self._callbacks.clear()
 
         # free scheduled functions
         self.sched.close()
@@ -479,6 +698,9 @@ class Select(_IOLoop):
         except InterruptedError:
             return
 
+        metrics = self.metrics
+        if metrics is not None:
+            started = timer()
         smap_get = self.socket_map.get
         for fd in r:
             obj = smap_get(fd)
@@ -490,6 +712,9 @@ class Select(_IOLoop):
             if obj is None or not obj.writable():
                 continue
             _write(obj)
+        if metrics is not None:
+            now = timer()
+            metrics.observe_iteration(now - started, now)
 
 
 # ===================================================================
@@ -508,6 +733,10 @@ class _BasePollEpoll(_IOLoop):
         _IOLoop.__init__(self)
         self._poller = self._poller()
 
+    def _close_poller(self):
+        if hasattr(self._poller, 'close'):
+            self._poller.close()
+
     def register(self, fd, instance, events):
         try:
             self._poller.register(fd, events)
@@ -552,6 +781,9 @@ class _BasePollEpoll(_IOLoop):
             events = self._poller.poll(timeout)
         except InterruptedError:
             return
+        metrics = self.metrics
+        if metrics is not None:
+            started = timer()
         # localize variable access to minimize overhead
         smap_get = self.socket_map.get
         for fd, event in events:
@@ -565,6 +797,9 @@ class _BasePollEpoll(_IOLoop):
                     _read(inst)
                 if event & self.WRITE and inst.writable():
                     _write(inst)
+        if metrics is not None:
+            now = timer()
+            metrics.observe_iteration(now - started, now)
 
 
 # ===================================================================
@@ -678,6 +913,9 @@ if hasattr(select, 'kqueue'):  # pragma: no cover
             _IOLoop.close(self)
             self._kqueue.close()
 
+        def _close_poller(self):
+            self._kqueue.close()
+
         def register(self, fd, instance, events):
             self.socket_map[fd] = instance
             try:
@@ -747,6 +985,9 @@ if hasattr(select, 'kqueue'):  # pragma: no cover
                 )
             except InterruptedError:
                 return
+            metrics = self.metrics
+            if metrics is not None:
+                started = timer()
             for kevent in kevents:
                 inst = self.socket_map.get(kevent.ident)
                 if inst is None:
@@ -767,6 +1008,208 @@ if hasattr(select, 'kqueue'):  # pragma: no cover
                         _write(inst)
                 if kevent.flags & _ERROR:
                     inst.handle_close()
+            if metrics is not None:
+                now = timer()
+                metrics.observe_iteration(now - started, now)
+
+
+# ===================================================================
+# --- asyncio
+# ===================================================================
+
+
+class AsyncioLoop(_IOLoop):
+    """An IO loop running on top of an asyncio event loop (the default
+    selector-based one or any compatible implementation, e.g. uvloop),
+    by registering fds via add_reader() / add_writer().
+    Handlers, scheduler and servers keep working as with any other
+    poller. It can be passed to FTPServer:
+
+    >>> server = FTPServer(('', 21), FTPHandler, ioloop=AsyncioLoop())
+
+    In blocking mode loop() keeps the asyncio loop running, with the
+    scheduler being polled by an asyncio timer set when the next
+    scheduled call expires (call_later() and call_every() move it
+    forward if needed). poll() instead runs a single iteration, which
+    stops as soon as some I/O events have been dispatched or when the
+    timeout expires (used by ThreadedFTPServer and non-blocking loops).
+
+     - (callable) loop_factory: the function used to create a new
+       asyncio loop for each instance (e.g. uvloop.new_event_loop);
+       defaults to asyncio.new_event_loop.
+    """
+
+    loop_factory = None
+
+    def __init__(self):
+        _IOLoop.__init__(self)
+        # not looked up on the instance, which would bind functions
+        factory = self.__class__.loop_factory or asyncio.new_event_loop
+        self._loop = factory()
+        self._events = {}
+        self._dispatch_started = None
+        self._running = False
+        self._sched_pending = False
+        self._sched_timer = None
+        self._sched_due = None
+        self._closing = False
+
+    def _close_poller(self):
+        self._events.clear()
+        self._closing = True
+        if self._loop.is_running():
+            # called by a callback: closed once run_forever() returns
+            self._loop.stop()
+        else:
+            self._loop.close()
+
+    def close(self):
+        _IOLoop.close(self)
+        self._close_poller()
+
+    def _run_forever(self):
+        try:
+            self._loop.run_forever()
+        finally:
+            if self._closing and not self._loop.is_closed():
+                self._loop.close()
+
+    def _dispatching(self):
+        # called on every I/O event
+        if self._dispatch_started is None:
+            self._dispatch_started = timer()
+        if not self._running:
+            self._loop.stop()
+        elif self.metrics is not None and not self._sched_pending:
+            # run after the other I/O events of this iteration
+            self._sched_pending = True
+            self._loop.call_soon(self._run_sched)
+
+    def _handle_read(self, fd):
+        self._dispatching()
+        inst = self.socket_map.get(fd)
+        if inst is not None and inst.readable():
+            _read(inst)
+
+    def _handle_write(self, fd):
+        self._dispatching()
+        inst = self.socket_map.get(fd)
+        if inst is not None and inst.writable():
+            _write(inst)
+
+    def _observe_iteration(self):
+        started = self._dispatch_started
+        if started is not None:
+            self._dispatch_started = None
+            metrics = self.metrics
+            if metrics is not None:
+                now = timer()
+                metrics.observe_iteration(now - started, now)
+
+    def _run_sched(self):
+        self._sched_pending = False
+        self._observe_iteration()
+        timeout = self.sched.poll()
+        if not self.socket_map:
+            self._loop.stop()
+            return
+        if self._sched_timer is not None:
+            self._sched_timer.cancel()
+            self._sched_timer = None
+        if timeout is not None:
+            self._sched_due = timer() + timeout
+            self._sched_timer = self._loop.call_later(timeout, self._run_sched)
+        else:
+            self._sched_due = None
+
+    def _wake_sched(self, call):
+        # make sure the scheduler gets polled by the time call expires
+        if self._running and (
+            self._sched_due is None or call.timeout < self._sched_due
+        ):
+            if self._sched_timer is not None:
+                self._sched_timer.cancel()
+            self._sched_due = call.timeout
+            self._sched_timer = self._loop.call_later(
+                max(0, call.timeout - timer()), self._run_sched
+            )
+
+    def call_later(self, seconds, target, *args, **kwargs):
+        call = _IOLoop.call_later(self, seconds, target, *args, **kwargs)
+        self._wake_sched(call)
+        return call
+
+    def call_every(self, seconds, target, *args, **kwargs):
+        call = _IOLoop.call_every(self, seconds, target, *args, **kwargs)
+        self._wake_sched(call)
+        return call
+
+    def loop(self, timeout=None, blocking=True):
+        if not blocking:
+            return _IOLoop.loop(self, timeout, blocking)
+        if not _IOLoop._started_once:
+            _IOLoop._started_once = True
+            if not is_logging_configured():
+                config_logging()
+        if not self.socket_map:
+            return
+        self._running = True
+        try:
+            self._loop.call_soon(self._run_sched)
+            self._sched_pending = True
+            self._run_forever()
+        finally:
+            self._running = False
+            self._sched_pending = False
+            self._sched_due = None
+            if self._sched_timer is not None:
+                self._sched_timer.cancel()
+                self._sched_timer = None
+
+    def register(self, fd, instance, events):
+        self.socket_map[fd] = instance
+        self.modify(fd, events)
+
+    def unregister(self, fd):
+        try:
+            del self.socket_map[fd]
+        except KeyError:
+            debug("call: unregister(); fd was no longer in socket_map", self)
+        events = self._events.pop(fd, 0)
+        if events & self.READ:
+            self._loop.remove_reader(fd)
+        if events & self.WRITE:
+            self._loop.remove_writer(fd)
+
+    def modify(self, fd, events):
+        if fd not in self.socket_map:
+            debug("call: modify(); fd was no longer in socket_map", self)
+            return
+        current = self._events.get(fd, 0)
+        if events & self.READ and not current & self.READ:
+            self._loop.add_reader(fd, self._handle_read, fd)
+        elif current & self.READ and not events & self.READ:
+            self._loop.remove_reader(fd)
+        if events & self.WRITE and not current & self.WRITE:
+            self._loop.add_writer(fd, self._handle_write, fd)
+        elif current & self.WRITE and not events & self.WRITE:
+            self._loop.remove_writer(fd)
+        self._events[fd] = events
+
+    def poll(self, timeout):
+        loop = self._loop
+        if timeout is None:
+            handle = None
+        elif timeout > 0:
+            handle = loop.call_later(timeout, loop.stop)
+        else:
+            handle = loop.call_soon(loop.stop)
+        try:
+            self._run_forever()
+        finally:
+            if handle is not None and not loop.is_closed():
+                handle.cancel()
+        self._observe_iteration()
 
 
 # ===================================================================
@@ -797,6 +1240,14 @@ class AsyncChat(asynchat.async_chat):
     """Same as asynchat.async_chat, only working with the new IO poller
     and being more clever in avoid registering for read events when
     it shouldn't.
+
+    Outgoing data is not copied: buffers are queued as they are and
+    sent with a single sendmsg() (writev) call when more than one is
+    pending; partial writes replace the first buffer with a memoryview
+    starting at the first unsent byte.
+    The queue is a list rather than a deque: it rarely holds more
+    than a couple of items and an empty list is a fraction of the
+    size of an empty deque, which adds up with many idle connections.
     """
 
     def __init__(self, sock=None, ioloop=None):
@@ -808,6 +1259,7 @@ class AsyncChat(asynchat.async_chat):
         self._fileno = sock.fileno() if sock else None
         self._tasks = []
         asynchat.async_chat.__init__(self, sock)
+        self.producer_fifo = []
 
     # --- IO loop related methods
 
@@ -941,6 +1393,22 @@ class AsyncChat(asynchat.async_chat):
             else:
                 raise
 
+    def sendmsg(self, buffers):
+        """Send a list of buffers with a single system call and
+        return the number of bytes sent.
+        """
+        try:
+            return self.socket.sendmsg(buffers)
+        except OSError as err:
+            debug(f"call: sendmsg(), err: {err}", inst=self)
+            if err.errno in _ERRNOS_RETRY:
+                return 0
+            elif err.errno in _ERRNOS_DISCONNECTED:
+                self.handle_close()
+                return 0
+            else:
+                raise
+
     def recv(self, buffer_size):
         try:
             data = self.socket.recv(buffer_size)
@@ -969,8 +1437,83 @@ class AsyncChat(asynchat.async_chat):
             # This can be raised by (the overridden) recv().
             pass
 
+    def push(self, data):
+        # Differently from asynchat, big buffers are not split in
+        # ac_out_buffer_size slices: send_queued() takes care of that
+        # without copying.
+        if not isinstance(data, _BUFFER_TYPES):
+            raise TypeError(
+                f"data argument must be byte-ish ({type(data)!r})"
+            )
+        if data:
+            self.producer_fifo.append(data)
+        self.initiate_send()
+
+    def send_queued(self, max_size=None):
+        """Send as much data as possible (up to ac_out_buffer_size or
+        max_size bytes) from the output queue, consuming producers as
+        needed. Replaces asynchat.async_chat.initiate_send().
+        """
+        fifo = self.producer_fifo
+        while fifo and self.connected:
+            first = fifo[0]
+            if first is None:
+                # a None in the queue is a sentinel telling us to
+                # close the channel (see close_when_done())
+                del fifo[0]
+                self.handle_close()
+                return
+            if not isinstance(first, _BUFFER_TYPES):
+                # a producer
+                data = first.more()
+                if data:
+                    fifo.insert(0, data)
+                else:
+                    del fifo[0]
+                continue
+            if not first:
+                del fifo[0]
+                continue
+
+            # gather the buffers at the head of the queue
+            obs = self.ac_out_buffer_size
+            if max_size is not None and max_size < obs:
+                obs = max_size
+            buffers = []
+            size = 0
+            for buf in fifo:
+                if buf is None or not isinstance(buf, _BUFFER_TYPES):
+                    break
+                buffers.append(buf)
+                size += len(buf)
+                if size >= obs or len(buffers) >= _MAX_IOV:
+                    break
+            if size > obs:
+                buffers[-1] = memoryview(buffers[-1])[: obs - size]
+
+            try:
+                if len(buffers) == 1 or not _HAS_SENDMSG:
+                    num_sent = self.send(buffers[0])
+                else:
+                    num_sent = self.sendmsg(buffers)
+            except OSError:
+                self.handle_error()
+                return
+
+            # advance the queue past the sent bytes
+            while num_sent and fifo:
+                first = fifo[0]
+                if num_sent >= len(first):
+                    num_sent -= len(first)
+                    del fifo[0]
+                else:
+                    fifo[0] = memoryview(first)[num_sent:]
+                    num_sent = 0
+            # we tried to send some actual data
+            return
+
     def initiate_send(self):
-        asynchat.async_chat.initiate_send(self)
+        self.send_queued()
         if not self._closed:
             # if there's still data to send we want to be ready
             # for writing, else we're only interested in reading
@@ -1114,3 +1657,159 @@ class Acceptor(AsyncChat):
 
         def set_reuse_addr(self):
             pass
+
+
+class _Waker(AsyncChat):
+    """A socket pair registered in the IO loop used to wake it up
+    when a function is scheduled via IOLoop.add_callback() from
+    another thread.
+    """
+
+    def __init__(self, ioloop=None):
+        rsock, self._wsock = socket.socketpair()
+        self._wsock.setblocking(False)
+        AsyncChat.__init__(self, rsock, ioloop=ioloop)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}(fd={self._fileno})>'
+
+    __str__ = __repr__
+
+    def wake(self):
+        try:
+            self._wsock.send(b'x')
+        except OSError:
+            # either the buffer is full, meaning the loop is going to
+            # wake up anyway, or we have been closed
+            pass
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        try:
+            while self.socket.recv(1024):
+                pass
+        except OSError:
+            pass
+        self.ioloop._run_callbacks()
+
+    def handle_error(self):
+        logger.error(traceback.format_exc())
+
+    def close(self):
+        AsyncChat.close(self)
+        self._wsock.close()
+
+
+# ===================================================================
+# --- thread pool
+# ===================================================================
+
+
+class ThreadPool:
+    """A bounded pool of worker threads used to run blocking functions
+    (e.g. filesystem calls) without blocking the IO loop. The result
+    of each function is delivered back into the IO loop which
+    submitted it.
+
+     - (int) max_workers: the maximum number of threads.
+     - (str) name: the prefix used for naming worker threads.
+    """
+
+    def __init__(self, max_workers=4, name="pyftpdlib-pool"):
+        self.max_workers = max_workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._peak_queued = 0
+        # {name: [calls, tot_wait, tot_time, max_time]}
+        self._ops = {}
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}(max_workers={self.max_workers}, "
+            f"queued={self._queued}, running={self._running})>"
+        )
+
+    __str__ = __repr__
+
+    def submit(self, ioloop, name, function, callback):
+        """Run function() in a worker thread, then callback(ret, err)
+        from within ioloop, where ret is the value returned by
+        function and err is the exception it raised (if any).
+        Must be called from the ioloop thread.
+
+        - (instance) ioloop: the IOLoop instance calling callback.
+        - (str) name: a name identifying the operation in stats().
+        """
+        ioloop._get_waker()
+        submitted = timer()
+        with self._lock:
+            self._queued += 1
+            self._peak_queued = max(self._peak_queued, self._queued)
+
+        def run():
+            started = timer()
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+            ret = err = None
+            try:
+                ret = function()
+            except Exception as _:
+                err = _
+            elapsed = timer() - started
+            with self._lock:
+                self._running -= 1
+                if err is None:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+                op = self._ops.setdefault(name, [0, 0.0, 0.0, 0.0])
+                op[0] += 1
+                op[1] += started - submitted
+                op[2] += elapsed
+                op[3] = max(op[3], elapsed)
+            ioloop.add_callback(callback, ret, err)
+
+        self._executor.submit(run)
+
+    def stats(self):
+        """Return a dict including the number of queued (waiting for a
+        free worker) and running functions plus, for each operation
+        name, the number of calls and the average time they spent
+        waiting in the queue and running, in seconds.
+        """
+        with self._lock:
+            ops = {}
+            for name, (calls, wait, elapsed, max_elapsed) in self._ops.items():
+                ops[name] = dict(
+                    calls=calls,
+                    avg_wait=wait / calls,
+                    avg_time=elapsed / calls,
+                    max_time=max_elapsed,
+                )
+            return dict(
+                max_workers=self.max_workers,
+                queued=self._queued,
+                peak_queued=self._peak_queued,
+                running=self._running,
+                completed=self._completed,
+                failed=self._failed,
+                ops=ops,
+            )
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads. If wait is True wait for pending
+        functions to complete.
+        """
+        self._executor.shutdown(wait=wait)
@@ -10,10 +10,15 @@ This is not supposed to be imported/used directly.
 Instead you should use logging.basicConfig before serve_forever().
 """
 
+import collections
+import json
 import logging
+import os
 import re
 import sys
+import threading
 import time
+import weakref
 
 
 try:
@@ -131,6 +136,268 @@ class LogFormatter(logging.Formatter):
         return formatted.replace("\n", "\n    ")
 
 
+class JSONFormatter(logging.Formatter):
+    """Log formatter emitting one compact JSON object per record, e.g.:
+
+    {"time":"2024-01-01 10:00:00.123","level":"INFO","msg":"...",
+     "remote_ip":"127.0.0.1","remote_port":5042,"username":"user",
+     "cmd":"RETR","file":"/home/user/file.ext","bytes":1024,...}
+
+    Besides the message, the dict found in the "fields" attribute of
+    the record is included, as passed by FTPHandler.log_cmd() and
+    log_transfer() (logger.info(msg, extra={'fields': {...}})).
+    """
+
+    def format(self, record):
+        try:
+            message = record.getMessage()
+        except Exception as err:
+            message = f"Bad message ({err!r}): {record.__dict__!r}"
+        asctime = time.strftime(TIME_FORMAT, self.converter(record.created))
+        out = {
+            'time': f"{asctime}.{int(record.msecs):03d}",
+            'level': record.levelname,
+        }
+        if record.process is not None and logging.logProcesses:
+            out['pid'] = record.process
+        out['msg'] = message
+        fields = getattr(record, 'fields', None)
+        if fields:
+            out.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            out['exc'] = record.exc_text
+        return json.dumps(out, separators=(',', ':'), default=str)
+
+
+# handlers whose writer thread must be restarted in forked children
+_background_handlers = weakref.WeakSet()
+
+
+def _after_fork():
+    for handler in list(_background_handlers):
+        handler._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+class BackgroundHandler(logging.Handler):
+    """A logging handler which formats and writes records from a
+    background thread, so that a slow terminal or disk does not stall
+    the IO loop (and hence every session) while logging.
+
+    emit() only appends the record to a queue. The writer thread
+    wakes up every flush_interval seconds, or as soon as batch_size
+    records are queued, formats all of them and writes them with a
+    single write() call. If the writer can't keep up and max_queue
+    records are waiting, new records are dropped rather than blocking
+    the caller; the number of dropped records is returned by stats().
+
+    Log files are rotated by the writer thread as well, in the same
+    way as logging.handlers.RotatingFileHandler does. When serving
+    with multiple worker processes each of them rotates the file on
+    its own, so either use a file per process or rotate it externally
+    (e.g. with logrotate and max_bytes=0).
+
+     - (str) filename: the file records are appended to; if None,
+       stream is used instead.
+     - (file) stream: the stream records are written to (default
+       sys.stderr).
+     - (int) max_queue: the maximum number of records waiting to be
+       written.
+     - (int) batch_size: the number of queued records which causes
+       the writer to wake up before flush_interval expires.
+     - (float) flush_interval: the maximum number of seconds records
+       wait in the queue.
+     - (int) max_bytes: rotate the file when it's about to grow past
+       this size; 0 means never.
+     - (int) backup_count: the number of rotated files to keep
+       (filename.1, filename.2, ...); rotation is disabled if 0.
+    """
+
+    def __init__(
+        self,
+        filename=None,
+        stream=None,
+        max_queue=10000,
+        batch_size=256,
+        flush_interval=0.2,
+        max_bytes=0,
+        backup_count=0,
+        encoding='utf-8',
+    ):
+        logging.Handler.__init__(self)
+        self.filename = (
+            os.path.abspath(filename) if filename is not None else None
+        )
+        self.stream = stream if stream is not None else sys.stderr
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.encoding = encoding
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.rotations = 0
+        self._queue = collections.deque()
+        self._file = None
+        self._size = 0
+        if self.filename is not None:
+            self._open()
+        self._start()
+        _background_handlers.add(self)
+
+    def __repr__(self):
+        target = self.filename or getattr(self.stream, 'name', self.stream)
+        return (
+            f"<{self.__class__.__name__}({target}, "
+            f"queued={len(self._queue)}, dropped={self.dropped})>"
+        )
+
+    def _open(self):
+        self._file = open(self.filename, 'ab')  # noqa: SIM115
+        self._size = self._file.seek(0, os.SEEK_END)
+
+    def _start(self):
+        self._wakeup = threading.Event()
+        self._write_lock = threading.Lock()
+        self._closing = False
+        self._thread = threading.Thread(
+            target=self._run, name='pyftpdlib-log', daemon=True
+        )
+        self._thread.start()
+
+    def _after_fork(self):
+        # records queued by the parent are written by the parent
+        self._queue.clear()
+        if self._thread is not None:
+            self._start()
+
+    def handle(self, record):
+        # emit() doesn't need the handler lock
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+        queue = self._queue
+        if len(queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        if record.args:
+            # the arguments may change by the time the record is
+            # formatted
+            try:
+                record.msg = record.getMessage()
+            except Exception:  # noqa: BLE001
+                self.handleError(record)
+                return
+            record.args = None
+        queue.append(record)
+        if len(queue) == self.batch_size:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            closing = self._closing
+            self._drain()
+            if closing:
+                break
+
+    def _drain(self):
+        queue = self._queue
+        with self._write_lock:
+            while queue:
+                lines = []
+                try:
+                    for _ in range(self.batch_size):
+                        record = queue.popleft()
+                        try:
+                            lines.append(self.format(record))
+                        except Exception:  # noqa: BLE001
+                            self.handleError(record)
+                except IndexError:
+                    pass
+                if lines:
+                    self._write('\n'.join(lines) + '\n', len(lines), record)
+
+    def _write(self, data, count, record):
+        try:
+            if self._file is None:
+                self.stream.write(data)
+                self.stream.flush()
+            else:
+                data = data.encode(self.encoding, 'backslashreplace')
+                if (
+                    self.max_bytes
+                    and self.backup_count
+                    and self._size
+                    and self._size + len(data) > self.max_bytes
+                ):
+                    self._rotate()
+                self._file.write(data)
+                self._file.flush()
+                self._size += len(data)
+        except Exception:  # noqa: BLE001
+            self.dropped += count
+            self.handleError(record)
+        else:
+            self.written += count
+            self.batches += 1
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.filename}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.filename}.{i + 1}")
+        os.replace(self.filename, self.filename + ".1")
+        self._open()
+        self.rotations += 1
+
+    def flush(self):
+        """Write all queued records now, from the calling thread."""
+        self._drain()
+
+    def close(self):
+        """Write all queued records, stop the writer thread and close
+        the file.
+        """
+        thread = self._thread
+        if thread is not None:
+            self._thread = None
+            self._closing = True
+            self._wakeup.set()
+            if thread is not threading.current_thread():
+                thread.join()
+        self._drain()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        _background_handlers.discard(self)
+        logging.Handler.close(self)
+
+    def stats(self):
+        """Return a dict of counters: queued, written, dropped, batches
+        and rotations.
+        """
+        return dict(
+            queued=len(self._queue),
+            written=self.written,
+            dropped=self.dropped,
+            batches=self.batches,
+            rotations=self.rotations,
+        )
+
+
 def debug(s, inst=None):
     s = "[debug] " + s
     if inst is not None:
@@ -147,7 +414,9 @@ def is_logging_configured():
 # TODO: write tests
 
 
-def config_logging(level=LEVEL, prefix=PREFIX, other_loggers=None):
+def config_logging(
+    level=LEVEL, prefix=PREFIX, other_loggers=None, handler=None
+):
     # Speedup logging by preventing certain internal log record info to
     # be unnecessarily fetched. This results in about 28% speedup. See:
     # * https://docs.python.org/3/howto/logging.html#optimization
@@ -173,10 +442,12 @@ def config_logging(level=LEVEL, prefix=PREFIX, other_loggers=None):
         # biggest speedup as it avoids calling sys._getframe()
         logging._srcfile = None
 
-    handler = logging.StreamHandler()
-    formatter = LogFormatter()
-    formatter.PREFIX = prefix
-    handler.setFormatter(formatter)
+    if handler is None:
+        handler = logging.StreamHandler()
+    if handler.formatter is None:
+        formatter = LogFormatter()
+        formatter.PREFIX = prefix
+        handler.setFormatter(formatter)
     loggers = [logging.getLogger('pyftpdlib')]
     if other_loggers is not None:
         loggers.extend(other_loggers)
@@ -0,0 +1,713 @@
+# Copyright (C) 2007 Giampaolo Rodola' <g.rodola@gmail.com>.
+# Use of this source code is governed by MIT license that can be
+# found in the LICENSE file.
+
+"""
+Live performance metrics: counters and histograms collected by
+FTPHandler and IOLoop, readable through the SITE STATS command or
+served over HTTP in Prometheus text exposition format by
+MetricsServer.
+
+Example usage:
+
+>>> from pyftpdlib.handlers import FTPHandler
+>>> from pyftpdlib.metrics import Metrics, MetricsServer
+>>> from pyftpdlib.servers import FTPServer
+>>>
+>>> handler = FTPHandler
+>>> handler.metrics = Metrics()
+>>> server = FTPServer(('', 2121), handler)
+>>> server.ioloop.metrics = handler.metrics  # IO loop iterations
+>>> MetricsServer(('127.0.0.1', 9121), handler.metrics, server.ioloop)
+>>> server.serve_forever()
+"""
+
+import bisect
+import collections
+import errno
+import os
+import socket
+import stat
+import threading
+import time
+
+from .ioloop import Acceptor
+from .ioloop import AsyncChat
+from .ioloop import timer
+from .log import debug
+
+
+__all__ = ['Histogram', 'Metrics', 'MetricsServer']
+
+
+# buckets upper bounds
+LATENCY_BOUNDS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+    5, 10,
+)  # fmt: skip
+LOOP_BOUNDS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 1,
+)  # fmt: skip
+LISTING_BOUNDS = (10, 100, 1000, 10000, 100000, 1000000)
+
+
+class Histogram:
+    """A histogram with fixed buckets. Bucket counts are not
+    cumulative internally; prometheus() makes them so.
+
+     - (tuple) bounds: the buckets upper bounds, sorted.
+    """
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        # the last bucket is +Inf
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0
+
+    def quantile(self, q):
+        """Estimate the q quantile (0 <= q <= 1), returning the upper
+        bound of the bucket it falls into (or the highest bound).
+        """
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.bounds[-1]
+
+    def prometheus(self, name, labels=''):
+        """Return the lines representing this histogram in Prometheus
+        text format.
+        """
+        sep = ',' if labels else ''
+        lines = []
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {seen}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {self.sum}')
+        lines.append(f'{name}_count{suffix} {self.count}')
+        return lines
+
+
+class Metrics:
+    """Server-wide performance counters and histograms, to be set as
+    FTPHandler.metrics. Collecting them is cheap enough to leave them
+    on in production: a couple of timer() calls per command and per
+    IO loop iteration, plus a set insertion / removal per connection.
+    Data channels still open are not touched while transferring: the
+    bytes they transferred so far are summed on read instead.
+
+    An instance is shared by all the connections handled by a process
+    (threads included); pre-forked workers have their own.
+
+     - (int) rate_window: the number of seconds bytes/sec rates are
+       averaged over (defaults to 10).
+
+    The passive_allocator, hook_dispatcher, page_cache_policy and
+    file_cache attributes are set by FTPHandler, when a session
+    starts, to the PassivePortAllocator, HookDispatcher,
+    PageCachePolicy and FileCache in use (if any), whose counters get
+    reported as well.
+    """
+
+    def __init__(self, rate_window=10):
+        self.started = time.time()
+        self.commands = collections.defaultdict(
+            lambda: Histogram(LATENCY_BOUNDS)
+        )
+        self.listings = Histogram(LISTING_BOUNDS)
+        self.iterations = Histogram(LOOP_BOUNDS)
+        self.transfers = collections.Counter()
+        self.tls_handshakes = collections.Counter()
+        self.control_accepted = 0
+        self.data_accepted = 0
+        self.passive_allocator = None
+        self.hook_dispatcher = None
+        self.page_cache_policy = None
+        self.file_cache = None
+        self._control = set()
+        self._data = set()
+        self._bytes_sent = 0
+        self._bytes_received = 0
+        self._samples = collections.deque(maxlen=rate_window + 1)
+        self._next_sample = 0
+        self._lock = threading.Lock()
+
+    # --- collection
+
+    def observe_command(self, cmd, elapsed):
+        """Called by FTPHandler when a command has been processed."""
+        with self._lock:
+            self.commands[cmd].observe(elapsed)
+
+    def observe_listing(self, size):
+        """Called by FTPHandler with the number of entries of a
+        directory being listed.
+        """
+        with self._lock:
+            self.listings.observe(size)
+
+    def observe_iteration(self, elapsed, now):
+        """Called by the IO loop with the time spent dispatching the
+        events returned by a single poll() call.
+        """
+        with self._lock:
+            self.iterations.observe(elapsed)
+        if now >= self._next_sample:
+            self._sample(now)
+
+    def control_opened(self, handler):
+        with self._lock:
+            self._control.add(handler)
+            self.control_accepted += 1
+
+    def control_closed(self, handler):
+        with self._lock:
+            self._control.discard(handler)
+
+    def data_opened(self, handler):
+        with self._lock:
+            self._data.add(handler)
+            self.data_accepted += 1
+
+    def data_closed(self, handler, sendfile):
+        """Called by DTPHandler.close(). sendfile tells whether data
+        was sent by using sendfile(2) rather than send().
+        """
+        with self._lock:
+            if handler not in self._data:
+                return
+            self._data.remove(handler)
+            self._bytes_sent += handler.tot_bytes_sent
+            self._bytes_received += handler.tot_bytes_received
+            if handler.receive:
+                self.transfers['upload', 'recv'] += 1
+            else:
+                method = 'sendfile' if sendfile else 'send'
+                self.transfers['download', method] += 1
+
+    def tls_handshake(self, channel, resumed):
+        """Called by TLS_FTPHandler and TLS_DTPHandler when a TLS
+        handshake completes. channel is either "control" or "data";
+        resumed tells whether a previous session was resumed.
+        """
+        with self._lock:
+            self.tls_handshakes[channel, 'resumed' if resumed else 'full'] += 1
+
+    # --- reading
+
+    def _sample(self, now):
+        sent, received = self.bytes_transferred()
+        self._samples.append((now, sent, received))
+        self._next_sample = now + 1
+        return (sent, received)
+
+    def bytes_transferred(self):
+        """Return a (sent, received) tuple including the data channels
+        still open.
+        """
+        with self._lock:
+            sent = self._bytes_sent
+            received = self._bytes_received
+            for handler in self._data:
+                sent += handler.tot_bytes_sent
+                received += handler.tot_bytes_received
+        return (sent, received)
+
+    def rates(self):
+        """Return the (sent, received) bytes/sec rates averaged over
+        the last rate_window seconds (or since the oldest sample, in
+        case the IO loop hasn't been sampling them every second).
+        """
+        now = timer()
+        if now >= self._next_sample:
+            sent, received = self._sample(now)
+        else:
+            sent, received = self.bytes_transferred()
+        then, sent_then, received_then = self._samples[0]
+        elapsed = now - then
+        if elapsed <= 0:
+            return (0.0, 0.0)
+        return (
+            (sent - sent_then) / elapsed,
+            (received - received_then) / elapsed,
+        )
+
+    def snapshot(self):
+        """Return all the metrics as a dict."""
+        sent, received = self.bytes_transferred()
+        sent_rate, received_rate = self.rates()
+        allocator = self.passive_allocator
+        passive = allocator.stats() if allocator is not None else None
+        dispatcher = self.hook_dispatcher
+        hooks = dispatcher.stats()['hooks'] if dispatcher is not None else None
+        policy = self.page_cache_policy
+        page_cache = policy.stats() if policy is not None else None
+        cache = self.file_cache
+        file_cache = cache.stats() if cache is not None else None
+        with self._lock:
+            return dict(
+                uptime=time.time() - self.started,
+                control_connections=len(self._control),
+                control_accepted=self.control_accepted,
+                data_connections=len(self._data),
+                data_accepted=self.data_accepted,
+                bytes_sent=sent,
+                bytes_received=received,
+                bytes_sent_rate=sent_rate,
+                bytes_received_rate=received_rate,
+                transfers=dict(self.transfers),
+                tls_handshakes=dict(self.tls_handshakes),
+                commands={
+                    cmd: (h.count, h.mean(), h.quantile(0.99))
+                    for cmd, h in self.commands.items()
+                },
+                listings=(self.listings.count, self.listings.mean()),
+                iterations=(
+                    self.iterations.count,
+                    self.iterations.mean(),
+                    self.iterations.quantile(0.99),
+                ),
+                passive_ports=passive,
+                hooks=hooks,
+                page_cache=page_cache,
+                file_cache=file_cache,
+            )
+
+    def report(self):
+        """Return a list of human readable lines, as sent in reply to
+        SITE STATS.
+        """
+        snap = self.snapshot()
+        transfers = snap['transfers']
+        lines = [
+            f"uptime: {int(snap['uptime'])} secs",
+            f"control connections: {snap['control_connections']} "
+            f"(total {snap['control_accepted']})",
+            f"data connections: {snap['data_connections']} "
+            f"(total {snap['data_accepted']})",
+            f"bytes sent: {snap['bytes_sent']} "
+            f"({snap['bytes_sent_rate']:.0f} B/s)",
+            f"bytes received: {snap['bytes_received']} "
+            f"({snap['bytes_received_rate']:.0f} B/s)",
+            "transfers: {} sendfile, {} send, {} recv".format(
+                transfers.get(('download', 'sendfile'), 0),
+                transfers.get(('download', 'send'), 0),
+                transfers.get(('upload', 'recv'), 0),
+            ),
+            "listings: {} (avg {:.0f} entries)".format(*snap['listings']),
+            "ioloop iterations: {} (avg {:.3f} ms, p99 <= {:g} ms)".format(
+                snap['iterations'][0],
+                snap['iterations'][1] * 1000,
+                snap['iterations'][2] * 1000,
+            ),
+        ]
+        handshakes = snap['tls_handshakes']
+        if handshakes:
+            lines.append(
+                "TLS handshakes: control {} full, {} resumed; "
+                "data {} full, {} resumed".format(
+                    *[
+                        handshakes.get((channel, kind), 0)
+                        for channel in ('control', 'data')
+                        for kind in ('full', 'resumed')
+                    ]
+                )
+            )
+        passive = snap['passive_ports']
+        if passive is not None:
+            lines.append(
+                "passive ports: {in_use} in use, {free} free, "
+                "{exhausted} exhausted, {busy} busy "
+                "(pool: {pool_hits} hits, {pool_misses} misses)".format(
+                    **passive
+                )
+            )
+        page_cache = snap['page_cache']
+        if page_cache is not None:
+            lines.append(
+                "page cache policy: {files} files, {prefetched} bytes "
+                "prefetched, {dropped} dropped, {written_back} written "
+                "back ({errors} errors)".format(**page_cache)
+            )
+        file_cache = snap['file_cache']
+        if file_cache is not None:
+            lines.append(
+                "file cache: {entries} files, {size} bytes "
+                "(+{shared_size} shared), {hits} hits, {misses} misses "
+                "({hit_ratio:.1%}), {evictions} evictions, {bytes_saved} "
+                "bytes saved".format(**file_cache)
+            )
+        for name, hook in sorted((snap['hooks'] or {}).items()):
+            lines.append(
+                "hook {}: {completed} completed, {failed} failed, "
+                "{retried} retried, {dropped} dropped, {running} running, "
+                "{queued} queued (avg {:.3f} ms)".format(
+                    name, hook['avg_time'] * 1000, **hook
+                )
+            )
+        for cmd, (count, mean, p99) in sorted(snap['commands'].items()):
+            lines.append(
+                f"{cmd}: {count} (avg {mean * 1000:.3f} ms, "
+                f"p99 <= {p99 * 1000:g} ms)"
+            )
+        return lines
+
+    def prometheus(self):
+        """Return all the metrics in Prometheus text format (bytes)."""
+        sent, received = self.bytes_transferred()
+        allocator = self.passive_allocator
+        passive = allocator.stats() if allocator is not None else None
+        dispatcher = self.hook_dispatcher
+        hooks = dispatcher.stats()['hooks'] if dispatcher is not None else None
+        policy = self.page_cache_policy
+        page_cache = policy.stats() if policy is not None else None
+        cache = self.file_cache
+        file_cache = cache.stats() if cache is not None else None
+
+        def metric(name, type, help, *lines):
+            out.append(f'# HELP {name} {help}')
+            out.append(f'# TYPE {name} {type}')
+            out.extend(lines)
+
+        out = []
+        with self._lock:
+            metric(
+                'ftp_start_time_seconds',
+                'gauge',
+                'Start time since the epoch.',
+                f'ftp_start_time_seconds {self.started}',
+            )
+            metric(
+                'ftp_control_connections',
+                'gauge',
+                'Open control connections.',
+                f'ftp_control_connections {len(self._control)}',
+            )
+            metric(
+                'ftp_control_connections_total',
+                'counter',
+                'Accepted control connections.',
+                f'ftp_control_connections_total {self.control_accepted}',
+            )
+            metric(
+                'ftp_data_connections',
+                'gauge',
+                'Open data connections.',
+                f'ftp_data_connections {len(self._data)}',
+            )
+            metric(
+                'ftp_data_connections_total',
+                'counter',
+                'Established data connections.',
+                f'ftp_data_connections_total {self.data_accepted}',
+            )
+            metric(
+                'ftp_sent_bytes_total',
+                'counter',
+                'Bytes sent over data connections.',
+                f'ftp_sent_bytes_total {sent}',
+            )
+            metric(
+                'ftp_received_bytes_total',
+                'counter',
+                'Bytes received over data connections.',
+                f'ftp_received_bytes_total {received}',
+            )
+            metric(
+                'ftp_transfers_total',
+                'counter',
+                'Data transfers by direction and system call used.',
+                *[
+                    f'ftp_transfers_total{{direction="{d}",method="{m}"}} {n}'
+                    for (d, m), n in sorted(self.transfers.items())
+                ],
+            )
+            metric(
+                'ftp_tls_handshakes_total',
+                'counter',
+                'Completed TLS handshakes by channel and type.',
+                *[
+                    f'ftp_tls_handshakes_total{{channel="{c}",type="{t}"}} '
+                    f'{n}'
+                    for (c, t), n in sorted(self.tls_handshakes.items())
+                ],
+            )
+            lines = []
+            for cmd, hist in sorted(self.commands.items()):
+                lines += hist.prometheus(
+                    'ftp_command_duration_seconds', f'command="{cmd}"'
+                )
+            metric(
+                'ftp_command_duration_seconds',
+                'histogram',
+                'Time spent processing commands.',
+                *lines,
+            )
+            metric(
+                'ftp_listing_entries',
+                'histogram',
+                'Number of entries of listed directories.',
+                *self.listings.prometheus('ftp_listing_entries'),
+            )
+            metric(
+                'ftp_ioloop_iteration_seconds',
+                'histogram',
+                'Time spent dispatching the events of an IO loop iteration.',
+                *self.iterations.prometheus('ftp_ioloop_iteration_seconds'),
+            )
+        if passive is not None:
+            metric(
+                'ftp_passive_ports',
+                'gauge',
+                'Passive ports of the configured range by state.',
+                f'ftp_passive_ports{{state="in_use"}} {passive["in_use"]}',
+                f'ftp_passive_ports{{state="free"}} {passive["free"]}',
+            )
+            metric(
+                'ftp_passive_ports_exhausted_total',
+                'counter',
+                'Passive ports assigned by the kernel as no port of the '
+                'configured range could be bound.',
+                f'ftp_passive_ports_exhausted_total {passive["exhausted"]}',
+            )
+            metric(
+                'ftp_passive_ports_busy_total',
+                'counter',
+                'Passive ports of the configured range found in use by '
+                'another socket.',
+                f'ftp_passive_ports_busy_total {passive["busy"]}',
+            )
+            metric(
+                'ftp_passive_pool_total',
+                'counter',
+                'Passive listening sockets requested from the pool.',
+                f'ftp_passive_pool_total{{result="hit"}} '
+                f'{passive["pool_hits"]}',
+                f'ftp_passive_pool_total{{result="miss"}} '
+                f'{passive["pool_misses"]}',
+            )
+        if page_cache is not None:
+            metric(
+                'ftp_page_cache_files_total',
+                'counter',
+                'Transferred files the page cache policy was applied to.',
+                f'ftp_page_cache_files_total {page_cache["files"]}',
+            )
+            metric(
+                'ftp_page_cache_bytes_total',
+                'counter',
+                'Bytes the kernel was advised about by the page cache '
+                'policy.',
+                *[
+                    f'ftp_page_cache_bytes_total{{advice="{x}"}} '
+                    f'{page_cache[x]}'
+                    for x in ('prefetched', 'dropped', 'written_back')
+                ],
+            )
+        if file_cache is not None:
+            metric(
+                'ftp_file_cache_lookups_total',
+                'counter',
+                'File cache lookups by RETR.',
+                f'ftp_file_cache_lookups_total{{result="hit"}} '
+                f'{file_cache["hits"]}',
+                f'ftp_file_cache_lookups_total{{result="miss"}} '
+                f'{file_cache["misses"]}',
+            )
+            metric(
+                'ftp_file_cache_saved_bytes_total',
+                'counter',
+                'Bytes sent from the file cache rather than read from '
+                'disk.',
+                f'ftp_file_cache_saved_bytes_total '
+                f'{file_cache["bytes_saved"]}',
+            )
+            metric(
+                'ftp_file_cache_evictions_total',
+                'counter',
+                'Files evicted from the file cache.',
+                f'ftp_file_cache_evictions_total {file_cache["evictions"]}',
+            )
+            metric(
+                'ftp_file_cache_bytes',
+                'gauge',
+                'Size of the files in the file cache.',
+                f'ftp_file_cache_bytes{{memory="private"}} '
+                f'{file_cache["size"]}',
+                f'ftp_file_cache_bytes{{memory="shared"}} '
+                f'{file_cache["shared_size"]}',
+            )
+        if hooks:
+            metric(
+                'ftp_hook_calls_total',
+                'counter',
+                'Hook calls by outcome.',
+                *[
+                    f'ftp_hook_calls_total{{hook="{name}",result="{r}"}} '
+                    f'{hook[r]}'
+                    for name, hook in sorted(hooks.items())
+                    for r in ('completed', 'failed', 'retried', 'dropped')
+                ],
+            )
+            metric(
+                'ftp_hook_tasks',
+                'gauge',
+                'Hook calls running or waiting for a concurrency slot.',
+                *[
+                    f'ftp_hook_tasks{{hook="{name}",state="{state}"}} '
+                    f'{hook[state]}'
+                    for name, hook in sorted(hooks.items())
+                    for state in ('running', 'queued')
+                ],
+            )
+            metric(
+                'ftp_hook_max_duration_seconds',
+                'gauge',
+                'Longest hook call.',
+                *[
+                    f'ftp_hook_max_duration_seconds{{hook="{name}"}} '
+                    f'{hook["max_time"]}'
+                    for name, hook in sorted(hooks.items())
+                ],
+            )
+        return ('\n'.join(out) + '\n').encode('ascii')
+
+
+# ===================================================================
+# --- HTTP endpoint
+# ===================================================================
+
+
+class _MetricsHandler(AsyncChat):
+    """Reply to a single HTTP request with the metrics, then
+    disconnect. Clients not done within timeout seconds (whether
+    they're slow to send the request or to read the reply) are
+    disconnected.
+    """
+
+    max_request_size = 8192
+    timeout = 10
+
+    def __init__(self, sock, server):
+        AsyncChat.__init__(self, sock, ioloop=server.ioloop)
+        self.server = server
+        self._request = []
+        self._request_size = 0
+        self._idler = None
+        self.set_terminator(b'\r\n\r\n')
+        if self.timeout:
+            self._idler = self.ioloop.call_later(
+                self.timeout, self.handle_timeout, _errback=self.handle_error
+            )
+
+    def collect_incoming_data(self, data):
+        self._request_size += len(data)
+        if self._request_size > self.max_request_size:
+            self.close()
+        else:
+            self._request.append(data)
+
+    def found_terminator(self):
+        line = b''.join(self._request).split(b'\r\n', 1)[0].split()
+        self.set_terminator(None)
+        if len(line) < 2 or line[0] != b'GET':
+            status, body = '405 Method Not Allowed', b''
+        elif line[1].split(b'?')[0] not in (b'/', b'/metrics'):
+            status, body = '404 Not Found', b''
+        else:
+            status, body = '200 OK', self.server.metrics.prometheus()
+        head = (
+            f"HTTP/1.0 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        self.push(head.encode('ascii'))
+        if body:
+            self.push(body)
+        self.close_when_done()
+
+    def handle_timeout(self):
+        debug("metrics endpoint timeout", self)
+        self.close()
+
+    def handle_error(self):
+        debug("metrics endpoint error", self)
+        self.close()
+
+    def close(self):
+        if self._idler is not None and not self._idler.cancelled:
+            self._idler.cancel()
+        AsyncChat.close(self)
+
+
+class MetricsServer(Acceptor):
+    """Serve the metrics over HTTP in Prometheus text format from the
+    same IO loop as the FTP server. Every GET request (for "/" or
+    "/metrics") gets the current metrics in reply.
+
+    Being meant for local scrapers only, it's better to listen on a
+    loopback address or on a UNIX socket.
+
+     - (tuple|str) address: a (host, port) tuple or the path of a
+       UNIX socket; a stale socket file is removed first.
+     - (instance) metrics: the Metrics instance to serve.
+     - (instance) ioloop: a pyftpdlib.ioloop.IOLoop instance.
+    """
+
+    def __init__(self, address, metrics, ioloop=None, backlog=5):
+        Acceptor.__init__(self, ioloop=ioloop)
+        self.metrics = metrics
+        self._unix_path = None
+        if isinstance(address, str):
+            try:
+                if stat.S_ISSOCK(os.stat(address).st_mode):
+                    os.remove(address)
+            except FileNotFoundError:
+                pass
+            self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.bind(address)
+            self._unix_path = address
+        else:
+            self.bind_af_unspecified(address)
+        self.listen(backlog)
+
+    @property
+    def address(self):
+        """The address this server is listening on."""
+        return self.socket.getsockname()
+
+    def handle_accepted(self, sock, addr):
+        try:
+            _MetricsHandler(sock, self)
+        except OSError as err:
+            if err.errno != errno.ENOTCONN:
+                raise
+
+    def close(self):
+        if self._unix_path is not None:
+            try:
+                os.remove(self._unix_path)
+            except OSError:
+                pass
+            self._unix_path = None
+        Acceptor.close(self)
@@ -6,8 +6,10 @@
 
 import os
 import random
+import signal
 import sys
 import time
+import zlib
 from binascii import hexlify
 
 
@@ -37,6 +39,14 @@ def cpu_count():
     return 1
 
 
+def task_id():
+    """Return the id of the current pre-forked worker process (a
+    number between 0 and the number of workers) or None if this is
+    not a pre-forked worker.
+    """
+    return _task_id
+
+
 def _reseed_random():
 
     # If os.urandom is available, this method does the same thing as
@@ -78,6 +88,7 @@ def fork_processes(number, max_restarts=100):
         if pid == 0:
             # child process
             _reseed_random()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
             global _task_id
             _task_id = i
             return i
@@ -85,16 +96,26 @@ def fork_processes(number, max_restarts=100):
             children[pid] = i
             return None
 
+    def on_sigterm(signum, frame):
+        sys.exit(0)
+
     for i in range(number):
         id = start_child(i)
         if id is not None:
             return id
+    # From now on turn SIGTERM into SystemExit so that the master gets
+    # a chance to terminate its children instead of leaving them
+    # orphaned.
+    signal.signal(signal.SIGTERM, on_sigterm)
     num_restarts = 0
     while children:
         try:
             pid, status = os.wait()
         except InterruptedError:
             continue
+        except (KeyboardInterrupt, SystemExit):
+            _terminate_children(children)
+            raise
         if pid not in children:
             continue
         id = children.pop(pid)
@@ -126,3 +147,174 @@ def fork_processes(number, max_restarts=100):
     # fork_processes (which will probably just start up another IOLoop
     # unless the caller checks the return value).
     sys.exit(0)
+
+
+def _terminate_children(children, timeout=5):
+    """Send SIGTERM to the given {pid: task_id} children and reap
+    them, resorting to SIGKILL for those still alive after *timeout*
+    seconds.
+    """
+    for pid in list(children):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            children.pop(pid)
+    stop_at = time.monotonic() + timeout
+    while children:
+        for pid in list(children):
+            try:
+                wpid, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                wpid = pid
+            if wpid == pid:
+                children.pop(pid)
+        if children:
+            if time.monotonic() > stop_at:
+                for pid in children:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                stop_at = float('inf')
+            time.sleep(0.01)
+
+
+# ===================================================================
+# --- shared accounting across pre-forked workers
+# ===================================================================
+
+
+class WorkerStats:
+    """Connection counters and per-worker statistics living in
+    anonymous shared memory, so that pre-forked workers can enforce
+    FTPServer.max_cons, max_cons_per_ip and max_cons_per_subnet
+    globally and the master process can report aggregated figures on
+    shutdown.
+
+    It must be instantiated *before* forking. Each worker writes to
+    its own row only (hence no locking is necessary), while readers
+    sum all rows together. Per-IP and per-subnet counters are kept in
+    a fixed number of hash buckets: collisions can only over-estimate
+    the number of connections of an IP address, never under-estimate
+    it.
+
+     - (int) workers: the number of worker processes.
+     - (int) ip_slots: the number of per-IP (and per-subnet) hash
+       buckets per worker.
+    """
+
+    FIELDS = (
+        'pid',
+        'restarts',
+        'accepted',
+        'rejected',
+        'closed',
+        'active',
+        'peak',
+        'transfers',
+        'bytes_sent',
+        'bytes_received',
+    )
+
+    def __init__(self, workers, ip_slots=4096):
+        if multiprocessing is None:
+            raise RuntimeError("multiprocessing module is not available")
+        self.workers = workers
+        self.ip_slots = ip_slots
+        self._nfields = len(self.FIELDS)
+        self._index = {name: i for i, name in enumerate(self.FIELDS)}
+        self._stats = multiprocessing.RawArray('q', workers * self._nfields)
+        self._ips = multiprocessing.RawArray('i', workers * ip_slots)
+        self._subnets = multiprocessing.RawArray('i', workers * ip_slots)
+        self._id = None
+
+    def _slot(self, ip):
+        return zlib.crc32(ip.encode('ascii', 'replace')) % self.ip_slots
+
+    def attach(self, id):
+        """Called by worker *id* right after fork(); it resets the live
+        counters a previous (dead) incarnation may have left behind.
+        """
+        self._id = id
+        base = id * self._nfields
+        index = self._index
+        if self._stats[base + index['pid']]:
+            self._stats[base + index['restarts']] += 1
+        self._stats[base + index['pid']] = os.getpid()
+        self._stats[base + index['active']] = 0
+        start = id * self.ip_slots
+        for i in range(start, start + self.ip_slots):
+            self._ips[i] = 0
+            self._subnets[i] = 0
+
+    def incr(self, name, value=1):
+        """Increment the *name* counter of the current worker."""
+        self._stats[self._id * self._nfields + self._index[name]] += value
+
+    def add(self, ip, subnet=None):
+        """Account a new connection from *ip* (belonging to *subnet*)."""
+        base = self._id * self._nfields
+        index = self._index
+        stats = self._stats
+        stats[base + index['accepted']] += 1
+        stats[base + index['active']] += 1
+        if stats[base + index['active']] > stats[base + index['peak']]:
+            stats[base + index['peak']] = stats[base + index['active']]
+        self._ips[self._id * self.ip_slots + self._slot(ip)] += 1
+        if subnet is not None:
+            self._subnets[self._id * self.ip_slots + self._slot(subnet)] += 1
+
+    def remove(self, ip, subnet=None):
+        """Account a connection from *ip* (belonging to *subnet*) being
+        closed.
+        """
+        base = self._id * self._nfields
+        self._stats[base + self._index['active']] -= 1
+        self._stats[base + self._index['closed']] += 1
+        self._ips[self._id * self.ip_slots + self._slot(ip)] -= 1
+        if subnet is not None:
+            self._subnets[self._id * self.ip_slots + self._slot(subnet)] -= 1
+
+    def count(self):
+        """Return the number of connections across all workers."""
+        idx = self._index['active']
+        n = self._nfields
+        return sum(self._stats[i * n + idx] for i in range(self.workers))
+
+    def count_ip(self, ip):
+        """Return the number of connections from *ip* across all
+        workers.
+        """
+        slot = self._slot(ip)
+        n = self.ip_slots
+        return sum(self._ips[i * n + slot] for i in range(self.workers))
+
+    def count_subnet(self, subnet):
+        """Return the number of connections from *subnet* across all
+        workers.
+        """
+        slot = self._slot(subnet)
+        n = self.ip_slots
+        return sum(self._subnets[i * n + slot] for i in range(self.workers))
+
+    def snapshot(self):
+        """Return a list of dicts, one per worker."""
+        ret = []
+        for id in range(self.workers):
+            base = id * self._nfields
+            row = {'id': id}
+            for i, name in enumerate(self.FIELDS):
+                row[name] = self._stats[base + i]
+            ret.append(row)
+        return ret
+
+    def totals(self):
+        """Return a dict summing up all workers' counters (peak is
+        the sum of per-worker peaks).
+        """
+        ret = dict.fromkeys(self.FIELDS, 0)
+        for row in self.snapshot():
+            for name in self.FIELDS:
+                ret[name] += row[name]
+        del ret['pid']
+        return ret
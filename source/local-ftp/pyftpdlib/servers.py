@@ -34,27 +34,170 @@ without hanging the whole FTP server.
 """
 
 import errno
+import ipaddress
 import os
 import select
 import signal
+import socket
 import sys
 import threading
 import time
 import traceback
+import warnings
 
+from .handlers import FTPHandler
 from .ioloop import Acceptor
+from .ioloop import timer
 from .log import PREFIX
 from .log import PREFIX_MPROC
 from .log import config_logging
 from .log import debug
 from .log import is_logging_configured
 from .log import logger
+from .prefork import WorkerStats
+from .prefork import cpu_count
 from .prefork import fork_processes
 
 
-__all__ = ['FTPServer', 'ThreadedFTPServer']
+__all__ = ['ConnectionRegistry', 'FTPServer', 'ThreadedFTPServer']
 _BSD = 'bsd' in sys.platform
 
+_TOO_MANY_CONS = "Too many connections. Service temporarily unavailable."
+_TOO_MANY_CONS_PER_IP = "Too many connections from the same IP address."
+# the handler methods called (if overridden) to reject a connection,
+# by reason
+_REJECT_HOOKS = {
+    _TOO_MANY_CONS: 'handle_max_cons',
+    _TOO_MANY_CONS_PER_IP: 'handle_max_cons_per_ip',
+}
+
+
+# ===================================================================
+# --- connection accounting
+# ===================================================================
+
+
+def _subnet(ip, prefixlen):
+    """Return the subnet *ip* belongs to as a string (e.g.
+    '10.0.0.0/24'), given a (IPv4, IPv6) *prefixlen* tuple.
+    IPv4-mapped IPv6 addresses are treated as IPv4 ones.
+    """
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip
+    if addr.version == 6 and addr.ipv4_mapped is not None:
+        addr = addr.ipv4_mapped
+    bits = prefixlen[0] if addr.version == 4 else prefixlen[1]
+    return str(ipaddress.ip_network((addr, bits), strict=False))
+
+
+class ConnectionRegistry:
+    """Keeps track of the connections opened by each client IP address
+    and subnet, and of the rate at which each IP address connects,
+    so that FTPServer can tell whether to accept a new connection in
+    O(1) and before instantiating a handler.
+
+    It is thread safe, as ThreadedFTPServer closes handlers (and hence
+    removes their connections) from other threads.
+    Accept rates are measured with a token bucket per IP address;
+    buckets which got full again are periodically discarded.
+    """
+
+    def __init__(self):
+        # {ip: [connections, subnet]}
+        self._ips = {}
+        # {subnet: connections}
+        self._subnets = {}
+        # {ip: [tokens, timestamp]}
+        self._buckets = {}
+        self._swept = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """The total number of connections."""
+        with self._lock:
+            return sum(x[0] for x in self._ips.values())
+
+    def add(self, ip, subnet):
+        """Account a new connection from *ip*, belonging to *subnet*."""
+        with self._lock:
+            entry = self._ips.get(ip)
+            if entry is None:
+                self._ips[ip] = [1, subnet]
+            else:
+                entry[0] += 1
+                subnet = entry[1]
+            self._subnets[subnet] = self._subnets.get(subnet, 0) + 1
+
+    def remove(self, ip):
+        """Account a connection from *ip* being closed. Return the
+        subnet it belonged to or None if there were no connections
+        from *ip*.
+        """
+        with self._lock:
+            entry = self._ips.get(ip)
+            if entry is None:
+                return None
+            subnet = entry[1]
+            entry[0] -= 1
+            if not entry[0]:
+                del self._ips[ip]
+            count = self._subnets[subnet] - 1
+            if count:
+                self._subnets[subnet] = count
+            else:
+                del self._subnets[subnet]
+            return subnet
+
+    def ips(self):
+        """Return a list of the IP addresses of the connections, one
+        per connection.
+        """
+        with self._lock:
+            return [
+                ip for ip, (count, _) in self._ips.items()
+                for i in range(count)
+            ]  # fmt: skip
+
+    def count_ip(self, ip):
+        """Return the number of connections from *ip*."""
+        entry = self._ips.get(ip)
+        return entry[0] if entry is not None else 0
+
+    def count_subnet(self, subnet):
+        """Return the number of connections from *subnet*."""
+        return self._subnets.get(subnet, 0)
+
+    def consume_token(self, ip, rate, burst, now):
+        """Take a token from the bucket of *ip*, which holds up to
+        *burst* tokens and is refilled at *rate* tokens per second.
+        Return False if the bucket is empty.
+        """
+        with self._lock:
+            if now - self._swept >= max(1.0, burst / rate):
+                self._sweep(rate, burst, now)
+            bucket = self._buckets.get(ip)
+            if bucket is None:
+                bucket = self._buckets[ip] = [burst, now]
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                return False
+            bucket[0] -= 1
+            return True
+
+    def _sweep(self, rate, burst, now):
+        self._swept = now
+        full = [
+            ip
+            for ip, (tokens, stamp) in self._buckets.items()
+            if tokens + (now - stamp) * rate >= burst
+        ]
+        for ip in full:
+            del self._buckets[ip]
+
 
 # ===================================================================
 # --- base class
@@ -80,10 +223,53 @@ class FTPServer(Acceptor):
      - (int) max_cons_per_ip:
         number of maximum connections accepted for the same IP address
         (defaults to 0 == unlimited).
+
+     - (int) max_cons_per_subnet:
+        number of maximum connections accepted for the same subnet, as
+        defined by subnet_prefixlen (defaults to 0 == unlimited).
+
+     - (tuple) subnet_prefixlen:
+        the (IPv4, IPv6) prefix lengths used to group client addresses
+        into subnets (defaults to (24, 64)).
+
+     - (float) max_accept_rate:
+        number of maximum new connections per second accepted from
+        the same IP address (defaults to 0 == unlimited).
+
+     - (int) max_accept_burst:
+        number of connections an IP address may open in a row before
+        max_accept_rate kicks in (defaults to 10).
+
+     - (float) reject_log_interval:
+        rejected connections are logged at most once every that many
+        seconds, together with how many were rejected meanwhile
+        (defaults to 10).
+
+    Connections exceeding these limits are rejected with a 421 response
+    as soon as they are accepted, without instantiating a handler,
+    unless the handler overrides handle_max_cons() (for max_cons) or
+    handle_max_cons_per_ip() (for max_cons_per_ip), which are then
+    called to reject them.
+    The counters are kept by a ConnectionRegistry instance, available
+    as the registry instance attribute.
+
+    The PassivePortAllocator handing out passive ports, if any, is
+    available as the passive_allocator instance attribute.
+
+    When pre-forking worker processes (see serve_forever()) connection
+    limits apply to the connections handled by all workers combined
+    (accept rates are measured by each worker on its own), and
+    the per-worker counters are available via the worker_stats
+    instance attribute (a pyftpdlib.prefork.WorkerStats instance).
     """
 
     max_cons = 512
     max_cons_per_ip = 0
+    max_cons_per_subnet = 0
+    subnet_prefixlen = (24, 64)
+    max_accept_rate = 0
+    max_accept_burst = 10
+    reject_log_interval = 10
 
     def __init__(self, address_or_socket, handler, ioloop=None, backlog=100):
         """Creates a socket listening on 'address' dispatching
@@ -105,7 +291,12 @@ class FTPServer(Acceptor):
         Acceptor.__init__(self, ioloop=ioloop)
         self.handler = handler
         self.backlog = backlog
-        self.ip_map = []
+        self.registry = ConnectionRegistry()
+        self.passive_allocator = None
+        self._reject_logged = float('-inf')
+        self._rejects_unlogged = 0
+        self.worker_stats = None
+        self._prefork_addr = None
         # in case of FTPS class not properly configured we want errors
         # to be raised here rather than later, when client connects
         if hasattr(handler, 'get_ssl_context'):
@@ -129,6 +320,18 @@ class FTPServer(Acceptor):
         """The address this server is listening on as a (ip, port) tuple."""
         return self.socket.getsockname()[:2]
 
+    @property
+    def ip_map(self):
+        """The IP addresses of the connected clients, one per connection
+        (a copy: changing it has no effect). Deprecated, use registry.
+        """
+        warnings.warn(
+            "FTPServer.ip_map is deprecated, use FTPServer.registry",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return self.registry.ips()
+
     def _map_len(self):
         return len(self.ioloop.socket_map)
 
@@ -136,8 +339,83 @@ class FTPServer(Acceptor):
         """Return True if the server is willing to accept new connections."""
         if not self.max_cons:
             return True
+        elif self.worker_stats is not None:
+            # pre-fork mode: take all workers' connections into account
+            return self.worker_stats.count() < self.max_cons
         else:
-            return self._map_len() <= self.max_cons
+            return self._map_len() < self.max_cons
+
+    def _reject_reason(self, ip, subnet, now):
+        """Return the reason why a new connection from *ip* should be
+        rejected, or None.
+        """
+        stats = self.worker_stats
+        # For performance and security reasons we should always set a
+        # limit for the number of file descriptors that socket_map
+        # should contain.
+        if not self._accept_new_cons():
+            return _TOO_MANY_CONS
+        # accept only a limited number of connections from the same
+        # source address / network.
+        if self.max_cons_per_ip:
+            if stats is not None:
+                count = stats.count_ip(ip)
+            else:
+                count = self.registry.count_ip(ip)
+            if count >= self.max_cons_per_ip:
+                return _TOO_MANY_CONS_PER_IP
+        if self.max_cons_per_subnet:
+            if stats is not None:
+                count = stats.count_subnet(subnet)
+            else:
+                count = self.registry.count_subnet(subnet)
+            if count >= self.max_cons_per_subnet:
+                return "Too many connections from the same network."
+        if self.max_accept_rate and not self.registry.consume_token(
+            ip, self.max_accept_rate, max(1, self.max_accept_burst), now
+        ):
+            return "Too many connection attempts. Try again later."
+        return None
+
+    def _reject(self, sock, addr, reason):
+        """Send a 421 response and close the connection, all without
+        instantiating a handler.
+        """
+        self._log_reject(addr, reason)
+        try:
+            sock.setblocking(False)
+            sock.send(f"421 {reason}\r\n".encode('ascii'))
+        except OSError:
+            pass
+        finally:
+            sock.close()
+
+    def _log_reject(self, addr, reason):
+        """Log a rejected connection. So that floods don't flood the
+        log as well, at most one is logged every reject_log_interval
+        seconds: the others are counted, and their number is logged
+        when the interval expires.
+        """
+        now = timer()
+        if now - self._reject_logged >= self.reject_log_interval:
+            self._reject_logged = now
+            logger.warning("%s:%s-[] %s", addr[0], addr[1], reason)
+            return
+        if not self._rejects_unlogged:
+            self.ioloop.call_later(
+                self._reject_logged + self.reject_log_interval - now,
+                self._log_rejects_unlogged,
+                _errback=self.handle_error,
+            )
+        self._rejects_unlogged += 1
+
+    def _log_rejects_unlogged(self):
+        logger.warning(
+            "%d more connection(s) rejected in the last %s seconds",
+            self._rejects_unlogged,
+            self.reject_log_interval,
+        )
+        self._rejects_unlogged = 0
 
     def _log_start(self, prefork=False):
         def get_fqname(obj):
@@ -180,6 +458,10 @@ class FTPServer(Acceptor):
             "masquerade (NAT) address: %s", self.handler.masquerade_address
         )
         logger.info("passive ports: %s", pasv_ports)
+        if self.handler.passive_pool_size:
+            logger.debug(
+                "passive listeners pool: %s", self.handler.passive_pool_size
+            )
         logger.debug("poller: %r", get_fqname(self.ioloop))
         logger.debug("authorizer: %r", get_fqname(self.handler.authorizer))
         if os.name == 'posix':
@@ -189,6 +471,18 @@ class FTPServer(Acceptor):
         logger.debug(
             "max connections per ip: %s", self.max_cons_per_ip or "unlimited"
         )
+        if self.max_cons_per_subnet:
+            logger.debug(
+                "max connections per subnet: %s (prefix lengths %s/%s)",
+                self.max_cons_per_subnet,
+                *self.subnet_prefixlen,
+            )
+        if self.max_accept_rate:
+            logger.debug(
+                "max accept rate per ip: %s/sec (burst %s)",
+                self.max_accept_rate,
+                self.max_accept_burst,
+            )
         logger.debug("timeout: %s", self.handler.timeout or "unlimited")
         logger.debug("banner: %r", self.handler.banner)
         logger.debug("max login attempts: %r", self.handler.max_login_attempts)
@@ -198,7 +492,12 @@ class FTPServer(Acceptor):
             logger.debug("SSL keyfile: %r", self.handler.keyfile)
 
     def serve_forever(
-        self, timeout=None, blocking=True, handle_exit=True, worker_processes=1
+        self,
+        timeout=None,
+        blocking=True,
+        handle_exit=True,
+        worker_processes=1,
+        reuse_port=False,
     ):
         """Start serving.
 
@@ -226,6 +525,15 @@ class FTPServer(Acceptor):
           By splitting the work load over multiple processes the delay
           introduced by a blocking function call is amortized and divided
           by the number of worker processes.
+          Each worker runs its own IOLoop; workers which die abnormally
+          are restarted. In the master process this method returns
+          (or raises if handle_exit is False) once all workers exited.
+
+        - (bool) reuse_port: only meaningful with worker_processes;
+          instead of sharing the listening socket inherited from the
+          master, each worker listens on its own socket bound to the
+          same address with SO_REUSEPORT, letting the kernel balance
+          incoming connections across workers (Linux >= 3.9, BSD).
         """
         log = handle_exit and blocking
 
@@ -234,9 +542,39 @@ class FTPServer(Acceptor):
                 raise ValueError(
                     "'worker_processes' and 'blocking' are mutually exclusive"
                 )
+            if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+                raise ValueError("SO_REUSEPORT is not supported")
+            if worker_processes is None or worker_processes <= 0:
+                worker_processes = cpu_count()
             if log:
                 self._log_start(prefork=True)
-            fork_processes(worker_processes)
+            self.worker_stats = WorkerStats(worker_processes)
+            if reuse_port:
+                # Workers will bind() their own sockets; the master's
+                # one must go away or it would get its share of the
+                # incoming connections without ever accept()ing them.
+                self._prefork_addr = (
+                    self.socket.family,
+                    self.socket.getsockname(),
+                )
+                self.del_channel()
+                self.socket.close()
+            try:
+                id = fork_processes(worker_processes)
+            except (KeyboardInterrupt, SystemExit):
+                # master process: all workers are gone
+                if not handle_exit:
+                    raise
+                if log:
+                    totals = self.worker_stats.totals()
+                    logger.info(
+                        ">>> shutting down pre-fork master, pid=%i, %s <<<",
+                        os.getpid(),
+                        ", ".join(f"{k}={v}" for k, v in totals.items()),
+                    )
+                self.close_all()
+                return
+            self._setup_worker(id)
         elif log:
             self._log_start()
 
@@ -263,33 +601,76 @@ class FTPServer(Acceptor):
         else:
             self.ioloop.loop(timeout, blocking)
 
+    def _setup_worker(self, id):
+        """Called in a freshly pre-forked worker process. Replace the
+        IOLoop inherited from the master (whose poller would otherwise
+        be shared between all workers) with a new one and register
+        the listening socket against it.
+        """
+        old = self.ioloop
+        self.ioloop = old.factory()
+        if old.__class__._instance is old:
+            old.__class__._instance = self.ioloop
+        old._close_poller()
+        old.socket_map.clear()
+        if self._prefork_addr is not None:
+            family, addr = self._prefork_addr
+            self.create_socket(family, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.bind(addr)
+            self.listen(self.backlog)
+        else:
+            self.add_channel()
+        self.ioloop.metrics = old.metrics
+        self.worker_stats.attach(id)
+        self.on_worker_start(id)
+
+    def on_worker_start(self, id):
+        """Called in each pre-forked worker process once it's set up,
+        before it starts serving. id is the worker id, a number between
+        0 and the number of workers. Can be overridden to create
+        per-worker resources, which must be registered against the
+        worker's own IOLoop (self.ioloop), e.g. a MetricsServer: the
+        IO loop of the master process is discarded by the workers.
+        """
+
     def handle_accepted(self, sock, addr):
         """Called when remote client initiates a connection."""
         handler = None
-        ip = None
+        stats = self.worker_stats
         try:
-            handler = self.handler(sock, self, ioloop=self.ioloop)
-            if not handler.connected:
-                return
-
             ip = addr[0]
-            self.ip_map.append(ip)
-
-            # For performance and security reasons we should always set a
-            # limit for the number of file descriptors that socket_map
-            # should contain.  When we're running out of such limit we'll
-            # use the last available channel for sending a 421 response
-            # to the client before disconnecting it.
-            if not self._accept_new_cons():
-                handler.handle_max_cons()
+            subnet = _subnet(ip, self.subnet_prefixlen)
+            # reject connections as early as possible, so that floods
+            # don't pay for instantiating a handler
+            reason = self._reject_reason(ip, subnet, timer())
+            if reason is not None:
+                if stats is not None:
+                    stats.incr('rejected')
+                hook = _REJECT_HOOKS.get(reason)
+                if hook is not None and getattr(
+                    self.handler, hook, None
+                ) not in (None, getattr(FTPHandler, hook)):
+                    # overridden: let the handler reply
+                    handler = self.handler(sock, self, ioloop=self.ioloop)
+                    if handler.connected:
+                        # accounted as any other connection, as
+                        # closing the handler discounts it
+                        self.registry.add(ip, subnet)
+                        if stats is not None:
+                            stats.add(ip, subnet)
+                        getattr(handler, hook)()
+                    return
+                self._reject(sock, addr, reason)
                 return
 
-            # accept only a limited number of connections from the same
-            # source address.
-            if self.max_cons_per_ip:
-                if self.ip_map.count(ip) > self.max_cons_per_ip:
-                    handler.handle_max_cons_per_ip()
-                    return
+            handler = self.handler(sock, self, ioloop=self.ioloop)
+            if not handler.connected:
+                return
+            self.registry.add(ip, subnet)
+            if stats is not None:
+                stats.add(ip, subnet)
 
             try:
                 handler.handle()
@@ -308,8 +689,6 @@ class FTPServer(Acceptor):
             logger.error(traceback.format_exc())
             if handler is not None:
                 handler.close()
-            elif ip is not None and ip in self.ip_map:
-                self.ip_map.remove(ip)
 
     def handle_error(self):
         """Called to handle any uncaught exceptions."""
@@ -323,6 +702,8 @@ class FTPServer(Acceptor):
         """Stop serving and also disconnects all currently connected
         clients.
         """
+        if self.passive_allocator is not None:
+            self.passive_allocator.close()
         return self.ioloop.close()
 
 
@@ -349,6 +730,10 @@ class _SpawnerBase(FTPServer):
             self, address_or_socket, handler, ioloop=ioloop, backlog=backlog
         )
         self._active_tasks = []
+        # the client IP addresses of the processes being run: their
+        # connections stay accounted until they are join()ed
+        self._task_ips = {}
+        self._refreshed = timer()
         self._active_tasks_idler = self.ioloop.call_every(
             self.refresh_interval,
             self._refresh_tasks,
@@ -371,6 +756,7 @@ class _SpawnerBase(FTPServer):
         """join() terminated tasks and update internal _tasks list.
         This gets called every X secs.
         """
+        self._refreshed = timer()
         if self._active_tasks:
             logger.debug(
                 f"refreshing tasks ({len(self._active_tasks)} join()"
@@ -381,14 +767,31 @@ class _SpawnerBase(FTPServer):
                 for t in self._active_tasks:
                     if not t.is_alive():
                         self._join_task(t)
+                        ip = self._task_ips.pop(t, None)
+                        if ip is not None:
+                            self.registry.remove(ip)
                     else:
                         new.append(t)
 
                 self._active_tasks = new
 
+    def _reject_reason(self, ip, subnet, now):
+        reason = FTPServer._reject_reason(self, ip, subnet, now)
+        if (
+            reason is not None
+            and self._task_ips
+            and now - self._refreshed >= 1
+        ):
+            # processes which exited are only noticed by refreshing
+            # tasks (at most once per second, that's O(N))
+            self._refresh_tasks()
+            reason = FTPServer._reject_reason(self, ip, subnet, now)
+        return reason
+
     def _loop(self, handler):
         """Serve handler's IO loop in a separate thread or process."""
         with self.ioloop.factory() as ioloop:
+            ioloop.metrics = self.ioloop.metrics
             handler.ioloop = ioloop
             try:
                 handler.add_channel()
@@ -480,6 +883,11 @@ class _SpawnerBase(FTPServer):
             # it is a different process so free resources here
             if hasattr(t, 'pid'):
                 handler.close()
+                # ...but keep its connection accounted until the
+                # process exits
+                ip = addr[0]
+                self.registry.add(ip, _subnet(ip, self.subnet_prefixlen))
+                self._task_ips[t] = ip
 
             with self._lock:
                 # add the new task
@@ -542,6 +950,9 @@ class _SpawnerBase(FTPServer):
             for t in self._active_tasks:
                 self._join_task(t)
             del self._active_tasks[:]
+            for ip in self._task_ips.values():
+                self.registry.remove(ip)
+            self._task_ips.clear()
 
         FTPServer.close_all(self)
 
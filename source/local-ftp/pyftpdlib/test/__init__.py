@@ -370,6 +370,7 @@ def reset_server_opts():
         klass.masquerade_address_map = {}
         klass.max_login_attempts = 3
         klass.passive_ports = None
+        klass.passive_pool_size = 0
         klass.permit_foreign_addresses = False
         klass.permit_privileged_ports = False
         klass.tcp_no_delay = hasattr(socket, 'TCP_NODELAY')
@@ -380,9 +381,32 @@ def reset_server_opts():
         klass.ac_in_buffer_size = 4096
         klass.ac_out_buffer_size = 4096
         klass.encoding = "utf8"
+        klass.fs_executor = None
+        klass.auth_executor = None
+        klass.listing_cache = None
+        klass.path_cache = None
+        klass.path_cache_size = 0
+        klass.digest_cache = None
+        klass.digest_executor = None
+        klass.digest_algorithms = (
+            'SHA-256',
+            'SHA-1',
+            'SHA-512',
+            'MD5',
+            'CRC32',
+        )
+        klass.hook_dispatcher = None
+        klass.bandwidth_shaper = None
+        klass.page_cache_policy = None
+        klass.file_cache = None
+        klass.metrics = None
         if klass.__name__ == 'TLS_FTPHandler':
             klass.tls_control_required = False
             klass.tls_data_required = False
+            klass.ktls = False
+            klass.ssl_session_cache = True
+            klass.ssl_session_tickets = True
+            klass.ssl_session_timeout = 300
 
     # Data handlers.
     tls_handler = getattr(
@@ -403,6 +427,9 @@ def reset_server_opts():
     for klass in ls:
         klass.max_cons = 0
         klass.max_cons_per_ip = 0
+        klass.max_cons_per_subnet = 0
+        klass.max_accept_rate = 0
+        klass.max_accept_burst = 10
 
 
 class FtpdThreadWrapper(threading.Thread):
@@ -13,6 +13,7 @@ import pytest
 from pyftpdlib.authorizers import AuthenticationFailed
 from pyftpdlib.authorizers import AuthorizerError
 from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.authorizers import SQLiteAuthorizer
 
 from . import HOME
 from . import PASSWD
@@ -190,6 +191,187 @@ class TestDummyAuthorizer(PyftpdlibTestCase):
         if (os.name in ('nt', 'ce')) or (sys.platform == 'cygwin'):
             assert auth.has_perm(USER, 'w', self.tempdir.upper())
 
+    def test_override_perm_nested(self):
+        # when several overrides apply to a path the one added first
+        # wins, regardless of which one is the most specific
+        auth = DummyAuthorizer()
+        auth.add_user(USER, PASSWD, HOME, perm='elr')
+        auth.override_perm(USER, self.tempdir, perm='w', recursive=True)
+        auth.override_perm(USER, self.subtempdir, perm='a')
+        assert auth.has_perm(USER, 'w', self.tempfile)
+        assert auth.has_perm(USER, 'w', self.subtempdir)
+        assert auth.has_perm(USER, 'w', self.subtempfile)
+        assert not auth.has_perm(USER, 'a', self.subtempfile)
+
+        auth = DummyAuthorizer()
+        auth.add_user(USER, PASSWD, HOME, perm='elr')
+        auth.override_perm(USER, self.subtempdir, perm='a')
+        auth.override_perm(USER, self.tempdir, perm='w', recursive=True)
+        assert auth.has_perm(USER, 'w', self.tempfile)
+        assert auth.has_perm(USER, 'a', self.subtempdir)
+        assert auth.has_perm(USER, 'a', self.subtempfile)
+        assert not auth.has_perm(USER, 'w', self.subtempfile)
+        # a directory inside a non recursively overridden one inherits
+        # the outer recursive override
+        subsubdir = os.path.join(self.subtempdir, self.get_testfn())
+        os.mkdir(subsubdir)
+        try:
+            assert auth.has_perm(USER, 'w', subsubdir)
+            assert not auth.has_perm(USER, 'a', subsubdir)
+        finally:
+            os.rmdir(subsubdir)
+
+    def test_override_perm_cache(self):
+        auth = DummyAuthorizer()
+        auth.add_user(USER, PASSWD, HOME, perm='elr')
+        auth.override_perm(USER, self.subtempdir, perm='a')
+        assert not auth.has_perm(USER, 'w', self.tempfile)
+        # cached results are dropped when overrides change
+        auth.override_perm(USER, self.tempdir, perm='w')
+        assert auth.has_perm(USER, 'w', self.tempfile)
+        auth.remove_user(USER)
+        auth.add_user(USER, PASSWD, HOME, perm='elr')
+        assert not auth.has_perm(USER, 'w', self.tempfile)
+        # the cache is bounded
+        auth.override_perm(USER, self.tempdir, perm='w')
+        auth.override_cache_size = 2
+        for _ in range(2):
+            for path in (HOME, self.tempdir, self.subtempdir):
+                auth.has_perm(USER, 'w', os.path.join(path, 'x'))
+        assert len(auth._override_cache) <= 2
+
+
+class TestSQLiteAuthorizer(PyftpdlibTestCase):
+    """Tests for SQLiteAuthorizer class."""
+
+    def setUp(self):
+        super().setUp()
+        self.dbfn = self.get_testfn()
+        self.tempdir = os.path.abspath(self.get_testfn())
+        os.mkdir(self.tempdir)
+        self.pwd = SQLiteAuthorizer.hash_password(PASSWD, iterations=1000)
+
+    def authorizer(self, **kwargs):
+        auth = SQLiteAuthorizer(self.dbfn, **kwargs)
+        self.addCleanup(auth.close)
+        return auth
+
+    def test_password(self):
+        check = SQLiteAuthorizer.check_password
+        assert check(PASSWD, self.pwd)
+        assert not check(PASSWD + 'x', self.pwd)
+        assert self.pwd != SQLiteAuthorizer.hash_password(PASSWD, 1000)
+        assert check('plain', 'plain')
+        assert not check('plain', 'Plain')
+        assert not check('x', 'pbkdf2_sha256$bogus')
+
+    def test_users(self):
+        auth = self.authorizer()
+        auth.add_user(USER, PASSWD, HOME, perm='elrw', msg_login='hi')
+        auth.add_anonymous(HOME)
+        with pytest.raises(ValueError, match='already exists'):
+            auth.add_user(USER, PASSWD, HOME)
+        # read back by another connection
+        auth = self.authorizer()
+        assert auth.has_user(USER)
+        assert not auth.has_user(USER + 'x')
+        assert auth.get_home_dir(USER) == os.path.realpath(HOME)
+        assert auth.get_perms(USER) == 'elrw'
+        assert auth.get_msg_login(USER) == 'hi'
+        auth.validate_authentication(USER, PASSWD, None)
+        auth.validate_authentication('anonymous', 'foo', None)
+        with pytest.raises(AuthenticationFailed):
+            auth.validate_authentication(USER, 'wrongpwd', None)
+        with pytest.raises(AuthenticationFailed):
+            auth.validate_authentication(USER + 'x', PASSWD, None)
+        auth.remove_user(USER)
+        assert not auth.has_user(USER)
+        with pytest.raises(KeyError):
+            auth.remove_user(USER)
+        assert not self.authorizer().has_user(USER)
+
+    def test_override_perm(self):
+        auth = self.authorizer()
+        auth.add_user(USER, self.pwd, HOME, perm='elr')
+        auth.override_perm(USER, self.tempdir, perm='w', recursive=True)
+        auth = self.authorizer()
+        assert not auth.has_perm(USER, 'w', HOME)
+        assert auth.has_perm(USER, 'w', os.path.join(self.tempdir, 'x'))
+
+    def test_cache_size(self):
+        auth = self.authorizer(cache_size=2)
+        for i in range(5):
+            auth.add_user(USER + str(i), self.pwd, HOME)
+        assert len(auth.user_table) == 2
+        for i in range(5):
+            assert auth.has_user(USER + str(i))
+        assert not auth.has_user(USER)
+        assert len(auth.user_table) == 2
+
+    def test_missing_cache_size(self):
+        # usernames which don't exist don't evict actual users
+        auth = self.authorizer(cache_size=2, missing_cache_size=3)
+        auth.add_user(USER, self.pwd, HOME)
+        assert auth.has_user(USER)
+        for i in range(10):
+            assert not auth.has_user('x' + str(i))
+        assert len(auth.user_table) == 1
+        assert len(auth.user_table._missing) == 3
+        # a user added afterwards is no longer missing
+        auth.add_user('x9', self.pwd, HOME)
+        assert auth.has_user('x9')
+        assert len(auth.user_table._missing) == 2
+
+    def test_check_interval(self):
+        # the database is queried for changes once per check_interval
+        auth = self.authorizer()
+        auth.add_user(USER, self.pwd, HOME)
+        statements = []
+        auth._conn.set_trace_callback(statements.append)
+        auth._next_check = float('-inf')
+        for _ in range(10):
+            assert auth.has_perm(USER, 'r', HOME)
+        assert statements == ['PRAGMA data_version']
+
+    @pytest.mark.skipif(not hasattr(os, 'fork'), reason="no fork()")
+    def test_fork(self):
+        # a forked process reopens the database on the next lookup
+        auth = self.authorizer()
+        auth.add_user(USER, self.pwd, HOME)
+        assert auth.has_user(USER)
+        conn = auth._conn
+        pid = os.fork()
+        if pid == 0:
+            ok = False
+            try:
+                ok = auth.has_user(USER) and auth._conn is not conn
+            finally:
+                os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+        assert auth._conn is conn
+
+    def test_changes(self):
+        # changes made by another process are seen by the next lookup
+        # after check_interval
+        writer = self.authorizer()
+        writer.add_user(USER, self.pwd, HOME, perm='elr')
+        auth = self.authorizer(check_interval=0)
+        assert auth.get_perms(USER) == 'elr'
+        assert not auth.has_user('foo')
+        writer.add_user('foo', self.pwd, HOME)
+        writer.remove_user(USER)
+        assert auth.has_user('foo')
+        assert not auth.has_user(USER)
+        # a database being replaced is reopened
+        other = self.get_testfn()
+        replacement = SQLiteAuthorizer(other)
+        replacement.add_user('bar', self.pwd, HOME)
+        replacement.close()
+        os.replace(other, self.dbfn)
+        assert auth.has_user('bar')
+        assert not auth.has_user('foo')
+
 
 class _SharedAuthorizerTests:
     """Tests valid for both UnixAuthorizer and WindowsAuthorizer for
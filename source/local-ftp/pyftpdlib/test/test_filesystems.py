@@ -2,12 +2,22 @@
 # Use of this source code is governed by MIT license that can be
 # found in the LICENSE file.
 
+import hashlib
+import mmap
 import os
 import tempfile
+import time
+import types
+import zlib
 
 import pytest
 
 from pyftpdlib.filesystems import AbstractedFS
+from pyftpdlib.filesystems import DigestCache
+from pyftpdlib.filesystems import FileCache
+from pyftpdlib.filesystems import FilesystemError
+from pyftpdlib.filesystems import ListingCache
+from pyftpdlib.filesystems import PathCache
 
 from . import HOME
 from . import POSIX
@@ -193,6 +203,535 @@ class TestAbstractedFS(PyftpdlibTestCase):
                 finally:
                     safe_rmpath(testfn)
 
+    def test_slots(self):
+        fs = AbstractedFS('/', None)
+        assert not hasattr(fs, '__dict__')
+        if POSIX:
+            assert not hasattr(UnixFilesystem('/', None), '__dict__')
+
+
+class TestListing(PyftpdlibTestCase):
+    """Test listing methods of AbstractedFS class."""
+
+    def setUp(self):
+        super().setUp()
+        self.tempdir = self.get_testfn()
+        os.mkdir(self.tempdir)
+        for name in ('c', 'a', 'b'):
+            touch(os.path.join(self.tempdir, name))
+        os.mkdir(os.path.join(self.tempdir, 'd'))
+        cmd_channel = types.SimpleNamespace(
+            use_gmt_times=True, encoding='utf8', unicode_errors='replace'
+        )
+        self.fs = AbstractedFS(HOME, cmd_channel)
+
+    def test_scandir(self):
+        entries = self.fs.scandir(self.tempdir)
+        assert [x.name for x in entries] == ['a', 'b', 'c', 'd']
+        assert entries[3].is_dir()
+
+    def test_scandir_overridden_listdir(self):
+        class FS(AbstractedFS):
+            def listdir(self, path):
+                return ['a']
+
+        fs = FS(HOME, None)
+        assert fs.scandir(self.tempdir) is None
+
+    def test_format_list(self):
+        names = sorted(os.listdir(self.tempdir))
+        entries = self.fs.scandir(self.tempdir)
+        ls1 = list(self.fs.format_list(self.tempdir, names))
+        ls2 = list(self.fs.format_list(self.tempdir, entries))
+        assert ls1 == ls2
+        assert len(ls1) == 4
+
+    def test_format_mlsx(self):
+        names = sorted(os.listdir(self.tempdir))
+        entries = self.fs.scandir(self.tempdir)
+        facts = ['type', 'perm', 'size', 'modify', 'unique']
+        ls1 = list(self.fs.format_mlsx(self.tempdir, names, 'elr', facts))
+        ls2 = list(self.fs.format_mlsx(self.tempdir, entries, 'elr', facts))
+        assert ls1 == ls2
+        assert ls1[3].startswith(b'modify=')
+        assert b'type=dir;' in ls1[3]
+
+    if hasattr(os, 'symlink'):
+
+        def test_format_list_broken_symlink(self):
+            os.symlink('bogus', os.path.join(self.tempdir, 'e'))
+            entries = self.fs.scandir(self.tempdir)
+            ls = list(self.fs.format_list(self.tempdir, entries))
+            assert ls[4].endswith(b' e -> bogus\r\n')
+            # stat() fails for broken links: the entry is skipped
+            ls = list(self.fs.format_mlsx(self.tempdir, entries, 'elr', []))
+            assert len(ls) == 4
+
+
+class TestListingCache(PyftpdlibTestCase):
+    """Test ListingCache class."""
+
+    def test_get_put(self):
+        cache = ListingCache()
+        key = ('/dir', 1.0, 1.0, 'LIST')
+        assert cache.get(key) is None
+        cache.put(key, b'abc')
+        assert cache.get(key) == b'abc'
+        assert cache.size == 3
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['hit_ratio'] == 0.5
+        # replace
+        cache.put(key, b'abcd')
+        assert cache.size == 4
+        assert len(cache) == 1
+
+    def test_lru_eviction(self):
+        cache = ListingCache(max_size=10, max_entry_size=10)
+        cache.put(('/a',), b'x' * 4)
+        cache.put(('/b',), b'x' * 4)
+        cache.get(('/a',))
+        cache.put(('/c',), b'x' * 4)
+        # /b was the least recently used one
+        assert cache.get(('/b',)) is None
+        assert cache.get(('/a',)) is not None
+        assert cache.get(('/c',)) is not None
+        assert cache.size == 8
+        assert cache.evictions == 1
+
+    def test_max_entry_size(self):
+        cache = ListingCache(max_size=100, max_entry_size=10)
+        cache.put(('/a',), b'x' * 11)
+        assert len(cache) == 0
+        assert list(cache.store(('/a',), [b'x' * 6, b'x' * 6])) == [
+            b'x' * 6,
+            b'x' * 6,
+        ]
+        assert len(cache) == 0
+
+    def test_max_age(self):
+        cache = ListingCache(max_age=0)
+        cache.put(('/a',), b'x')
+        time.sleep(0.01)
+        assert cache.get(('/a',)) is None
+        assert len(cache) == 0
+
+    def test_store(self):
+        cache = ListingCache()
+        it = cache.store(('/a', 'LIST'), iter([b'a\r\n', b'b\r\n']))
+        assert next(it) == b'a\r\n'
+        # not stored until exhausted
+        assert len(cache) == 0
+        assert list(it) == [b'b\r\n']
+        assert cache.get(('/a', 'LIST')) == b'a\r\nb\r\n'
+
+    def test_invalidate(self):
+        cache = ListingCache()
+        cache.put(('/a', 'LIST'), b'x')
+        cache.put(('/a', 'NLST'), b'x')
+        cache.put(('/b', 'LIST'), b'x')
+        cache.invalidate('/a')
+        cache.invalidate('/c')
+        assert len(cache) == 1
+        assert cache.size == 1
+        assert cache.get(('/b', 'LIST')) == b'x'
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.size == 0
+
+
+class TestPathCache(PyftpdlibTestCase):
+    """Test PathCache class."""
+
+    def test_get_put(self):
+        cache = PathCache()
+        assert cache.get('/a') is None
+        cache.put('/a', '/b')
+        assert cache.get('/a') == '/b'
+        stats = cache.stats()
+        assert stats['entries'] == 1
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['hit_ratio'] == 0.5
+
+    def test_lru_eviction(self):
+        cache = PathCache(max_entries=2)
+        cache.put('/a', '/a')
+        cache.put('/b', '/b')
+        cache.get('/a')
+        cache.put('/c', '/c')
+        # /b was the least recently used one
+        assert cache.get('/b') is None
+        assert cache.get('/a') == '/a'
+        assert cache.get('/c') == '/c'
+        assert len(cache) == 2
+
+    def test_max_age(self):
+        cache = PathCache(max_age=0)
+        cache.put('/a', '/a')
+        time.sleep(0.01)
+        assert cache.get('/a') is None
+        assert len(cache) == 0
+        cache = PathCache(max_age=None)
+        cache.put('/a', '/a')
+        assert cache.get('/a') == '/a'
+
+    def test_invalidate(self):
+        join = os.path.join
+        cache = PathCache()
+        for path in ('a', join('a', 'b'), join('a', 'b', 'c'), 'ab'):
+            cache.put(path, path)
+        cache.invalidate(join('a', 'b'))
+        assert len(cache) == 2
+        cache.invalidate('a')
+        assert len(cache) == 1
+        assert cache.get('ab') == 'ab'
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_invalidate_uncached_parent(self):
+        join = os.path.join
+        root = os.path.abspath(os.sep)
+        cache = PathCache(max_entries=2)
+        cache.put(join(root, 'a', 'b', 'c'), 'c')
+        cache.put(join(root, 'a', 'd'), 'd')
+        cache.put(join(root, 'e'), 'e')
+        # the least recently used entry was evicted from the index too
+        assert len(cache) == 2
+        assert join(root, 'a', 'b') not in cache._children
+        cache.invalidate(join(root, 'a') + os.sep)
+        assert len(cache) == 1
+        assert cache.get(join(root, 'e')) == 'e'
+        assert list(cache._children) == [root]
+        cache.invalidate(root)
+        assert len(cache) == 0
+        assert cache._children == {}
+
+    def test_abstracted_fs(self):
+        root = os.path.realpath(HOME)
+        fs = AbstractedFS(root, None)
+        fs.path_cache = PathCache()
+        calls = []
+        realpath = os.path.realpath
+
+        def counting_realpath(path):
+            calls.append(path)
+            return realpath(path)
+
+        path = os.path.join(root, 'foo')
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr(os.path, 'realpath', counting_realpath)
+            for _ in range(3):
+                assert fs.validpath(path)
+                assert fs.realpath(path) == realpath(path)
+        # the root and the path are resolved once
+        assert calls == [root, path]
+        assert not fs.validpath(os.path.dirname(root))
+        # a different root is resolved again
+        fs.root = tempfile.gettempdir()
+        assert fs.validpath(os.path.join(tempfile.gettempdir(), 'foo'))
+
+
+class TestDigestCache(PyftpdlibTestCase):
+    """Test DigestCache class and AbstractedFS.digest()."""
+
+    def setUp(self):
+        super().setUp()
+        self.testfn = self.get_testfn()
+        self.data = os.urandom(3000)
+        with open(self.testfn, 'wb') as f:
+            f.write(self.data)
+        self.fs = AbstractedFS(os.path.realpath(HOME), None)
+
+    def test_digest(self):
+        fs = self.fs
+        data = self.data
+        assert fs.digest(self.testfn, 'SHA-256') == (
+            hashlib.sha256(data).hexdigest(),
+            len(data),
+        )
+        md5 = fs.digest(self.testfn, 'MD5')[0]
+        assert md5 == hashlib.md5(data).hexdigest()
+        crc = fs.digest(self.testfn, 'CRC32')[0]
+        assert crc == f"{zlib.crc32(data):08x}"
+        # ranges
+        ret = fs.digest(self.testfn, 'SHA-1', 10, 20)[0]
+        assert ret == hashlib.sha1(data[10:20]).hexdigest()
+        ret = fs.digest(self.testfn, 'SHA-1', 10, 10**6)[0]
+        assert ret == hashlib.sha1(data[10:]).hexdigest()
+        with pytest.raises(FilesystemError, match="Invalid range"):
+            fs.digest(self.testfn, 'SHA-1', 5000)
+
+    def test_chunks(self):
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr('pyftpdlib.filesystems.DIGEST_CHUNK_SIZE', 7)
+            ret = self.fs.digest(self.testfn, 'SHA-512', 3)[0]
+        assert ret == hashlib.sha512(self.data[3:]).hexdigest()
+
+    def test_cache(self):
+        cache = DigestCache()
+        expected = hashlib.sha256(self.data).hexdigest()
+        for _ in range(2):
+            ret = self.fs.digest(self.testfn, 'SHA-256', cache=cache)
+            assert ret[0] == expected
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['entries'] == 1
+        # the file changes
+        with open(self.testfn, 'ab') as f:
+            f.write(b'x')
+        ret = self.fs.digest(self.testfn, 'SHA-256', cache=cache)
+        assert ret[0] == hashlib.sha256(self.data + b'x').hexdigest()
+        assert cache.stats()['misses'] == 2
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_lru_eviction(self):
+        cache = DigestCache(max_entries=2)
+        st = os.stat(self.testfn)
+        for algo in ('MD5', 'SHA-1', 'SHA-256'):
+            cache.put(self.testfn, st, algo, 0, st.st_size, algo)
+        assert len(cache) == 2
+        assert cache.get(self.testfn, st, 'MD5', 0, st.st_size) is None
+        assert cache.get(self.testfn, st, 'SHA-1', 0, st.st_size) == 'SHA-1'
+
+    @pytest.mark.skipif(not hasattr(os, 'setxattr'), reason="no xattrs")
+    def test_xattrs(self):
+        st = os.stat(self.testfn)
+        try:
+            os.setxattr(self.testfn, 'user.test', b'')
+        except OSError:
+            raise pytest.skip("xattrs not supported by the filesystem")
+        cache = DigestCache(use_xattrs=True)
+        self.fs.digest(self.testfn, 'SHA-256', cache=cache)
+        # a new cache (e.g. the server was restarted)
+        cache = DigestCache(use_xattrs=True)
+        ret = self.fs.digest(self.testfn, 'SHA-256', cache=cache)
+        assert ret[0] == hashlib.sha256(self.data).hexdigest()
+        assert cache.stats()['xattr_hits'] == 1
+        # ranges are not stored
+        cache.put(self.testfn, st, 'MD5', 1, 2, 'foo')
+        assert DigestCache(use_xattrs=True).get(
+            self.testfn, st, 'MD5', 1, 2
+        ) is None  # fmt: skip
+        # stale attribute
+        with open(self.testfn, 'ab') as f:
+            f.write(b'x')
+        cache = DigestCache(use_xattrs=True)
+        ret = self.fs.digest(self.testfn, 'SHA-256', cache=cache)
+        assert ret[0] == hashlib.sha256(self.data + b'x').hexdigest()
+        assert cache.stats()['xattr_hits'] == 0
+
+
+class TestFileCache(PyftpdlibTestCase):
+    """Test FileCache class."""
+
+    def setUp(self):
+        super().setUp()
+        self.testfn = self.get_testfn()
+        self.data = os.urandom(3000)
+        with open(self.testfn, 'wb') as f:
+            f.write(self.data)
+        self.fs = AbstractedFS(os.path.realpath(HOME), None)
+
+    def test_load(self):
+        cache = FileCache()
+        for _ in range(3):
+            ret = cache.load(self.fs, self.testfn)
+            assert ret == self.data
+            assert ret.readonly
+        stats = cache.stats()
+        assert stats['entries'] == 1
+        assert stats['size'] == len(self.data)
+        assert stats['hits'] == 2
+        assert stats['misses'] == 1
+        assert stats['bytes_saved'] == 2 * len(self.data)
+        # the file changes
+        with open(self.testfn, 'ab') as f:
+            f.write(b'x')
+        assert cache.load(self.fs, self.testfn) == self.data + b'x'
+        # same size, different mtime
+        with open(self.testfn, 'r+b') as f:
+            f.write(b'y')
+        st = os.stat(self.testfn)
+        os.utime(self.testfn, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert cache.load(self.fs, self.testfn) == b'y' + self.data[1:] + b'x'
+        stats = cache.stats()
+        assert stats['entries'] == 1
+        assert stats['misses'] == 3
+        assert stats['size'] == len(self.data) + 1
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.stats()['size'] == 0
+
+    def test_not_cacheable(self):
+        cache = FileCache(max_file_size=1000)
+        assert cache.load(self.fs, self.testfn) is None
+        assert cache.load(self.fs, HOME) is None
+        assert len(cache) == 0
+        with pytest.raises(OSError):
+            cache.load(self.fs, self.testfn + 'x')
+
+    def test_lru_eviction(self):
+        cache = FileCache(max_size=2000, max_file_size=1000)
+        files = []
+        for _ in range(3):
+            path = self.get_testfn()
+            with open(path, 'wb') as f:
+                f.write(b'x' * 1000)
+            files.append(path)
+        cache.load(self.fs, files[0])
+        cache.load(self.fs, files[1])
+        cache.load(self.fs, files[0])
+        cache.load(self.fs, files[2])
+        assert len(cache) == 2
+        assert cache.stats()['evictions'] == 1
+        assert cache.get(os.stat(files[1])) is None
+        assert cache.get(os.stat(files[0])) is not None
+
+    def test_lfu_eviction(self):
+        cache = FileCache(max_size=2000, max_file_size=1000, eviction='lfu')
+        files = []
+        for _ in range(4):
+            path = self.get_testfn()
+            with open(path, 'wb') as f:
+                f.write(b'x' * 1000)
+            files.append(path)
+        for _ in range(3):
+            cache.load(self.fs, files[0])
+        cache.load(self.fs, files[1])
+        # files read once only push each other out
+        cache.load(self.fs, files[2])
+        cache.load(self.fs, files[3])
+        assert cache.get(os.stat(files[0])) is not None
+        assert cache.get(os.stat(files[3])) is not None
+        assert cache.stats()['evictions'] == 2
+        with pytest.raises(ValueError):
+            FileCache(eviction='fifo')
+
+    def test_preload(self):
+        cache = FileCache(max_size=5000)
+        other = self.get_testfn()
+        with open(other, 'wb') as f:
+            f.write(b'x' * 3000)
+        # the second file doesn't fit
+        assert cache.preload([self.testfn, other, HOME]) == 1
+        ret = cache.load(self.fs, self.testfn)
+        assert ret == self.data
+        assert ret.readonly
+        assert isinstance(ret.obj, mmap.mmap)
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['shared_size'] == len(self.data)
+        assert stats['size'] == 0
+        # files changed afterwards are cached privately
+        with open(self.testfn, 'ab') as f:
+            f.write(b'x')
+        ret = cache.load(self.fs, self.testfn)
+        assert ret == self.data + b'x'
+        assert not isinstance(ret.obj, mmap.mmap)
+        stats = cache.stats()
+        assert stats['entries'] == 1
+        assert stats['shared_size'] == 0
+
+
+class TestCopy(PyftpdlibTestCase):
+    """Test AbstractedFS.copy() and AbstractedFS.copytree()."""
+
+    def setUp(self):
+        super().setUp()
+        self.testfn = self.get_testfn()
+        self.testfn2 = self.get_testfn()
+        self.data = os.urandom(30000)
+        with open(self.testfn, 'wb') as f:
+            f.write(self.data)
+        self.fs = AbstractedFS(os.path.realpath(HOME), None)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_copy(self):
+        assert sum(self.fs.copy(self.testfn, self.testfn2)) == len(self.data)
+        assert self.read(self.testfn2) == self.data
+
+    def test_chunks(self):
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr('pyftpdlib.filesystems.COPY_CHUNK_SIZE', 7000)
+            mp.setattr('pyftpdlib.filesystems._FICLONE', None)
+            ret = list(self.fs.copy(self.testfn, self.testfn2))
+            assert ret == [0, 7000, 7000, 7000, 7000, 2000]
+            assert self.read(self.testfn2) == self.data
+            # without copy_file_range()
+            mp.delattr(os, 'copy_file_range', raising=False)
+            ret = list(self.fs.copy(self.testfn, self.testfn2))
+            assert ret == [0, 7000, 7000, 7000, 7000, 2000]
+            assert self.read(self.testfn2) == self.data
+
+    def test_empty_file(self):
+        with open(self.testfn, 'wb'):
+            pass
+        assert list(self.fs.copy(self.testfn, self.testfn2)) == [0]
+        assert self.read(self.testfn2) == b''
+
+    def test_incomplete(self):
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr('pyftpdlib.filesystems.COPY_CHUNK_SIZE', 7000)
+            mp.setattr('pyftpdlib.filesystems._FICLONE', None)
+            it = self.fs.copy(self.testfn, self.testfn2)
+            next(it)
+            next(it)
+            it.close()
+        assert not os.path.exists(self.testfn2)
+
+    def test_errors(self):
+        with pytest.raises(FilesystemError, match="same file"):
+            list(self.fs.copy(self.testfn, self.testfn))
+        with pytest.raises(FilesystemError, match="Not a regular file"):
+            list(self.fs.copy(HOME, self.testfn2))
+        with pytest.raises(FileNotFoundError):
+            list(self.fs.copy(self.testfn2, self.testfn))
+
+    def test_copytree(self):
+        os.mkdir(self.testfn2)
+        os.mkdir(os.path.join(self.testfn2, 'sub'))
+        os.rename(self.testfn, os.path.join(self.testfn2, 'sub', 'file'))
+        if hasattr(os, 'symlink'):
+            os.symlink(HOME, os.path.join(self.testfn2, 'link'))
+        dst = self.get_testfn()
+        assert sum(self.fs.copytree(self.testfn2, dst)) == len(self.data)
+        assert sorted(os.listdir(dst)) == ['sub']
+        assert self.read(os.path.join(dst, 'sub', 'file')) == self.data
+        # dst must not exist
+        with pytest.raises(FileExistsError):
+            list(self.fs.copytree(self.testfn2, dst))
+        with pytest.raises(FilesystemError, match="into itself"):
+            list(self.fs.copytree(self.testfn2, self.testfn2 + '/sub/x'))
+
+    def test_copytree_check(self):
+        os.mkdir(self.testfn2)
+        os.mkdir(os.path.join(self.testfn2, 'sub'))
+        os.rename(self.testfn, os.path.join(self.testfn2, 'file'))
+        dst = self.get_testfn()
+        calls = []
+
+        def check(src, dst, isdir):
+            calls.append((src, dst, isdir))
+            if isdir:
+                raise FilesystemError("denied")
+
+        with pytest.raises(FilesystemError, match="denied"):
+            list(self.fs.copytree(self.testfn2, dst, check))
+        assert calls == [
+            (os.path.join(self.testfn2, 'file'), os.path.join(dst, 'file'),
+             False),
+            (os.path.join(self.testfn2, 'sub'), os.path.join(dst, 'sub'),
+             True),
+        ]  # fmt: skip
+        assert os.listdir(dst) == ['file']
+
 
 @pytest.mark.skipif(not POSIX, reason="UNIX only")
 class TestUnixFilesystem(PyftpdlibTestCase):
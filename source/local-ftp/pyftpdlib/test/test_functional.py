@@ -5,6 +5,7 @@
 import contextlib
 import errno
 import ftplib
+import hashlib
 import io
 import logging
 import os
@@ -15,17 +16,31 @@ import socket
 import ssl
 import stat
 import struct
+import tempfile
 import time
+import types
+import zlib
 from unittest.mock import patch
 
 import pytest
 
+from pyftpdlib.authorizers import SQLiteAuthorizer
 from pyftpdlib.filesystems import AbstractedFS
+from pyftpdlib.filesystems import DigestCache
+from pyftpdlib.filesystems import FileCache
+from pyftpdlib.filesystems import ListingCache
+from pyftpdlib.filesystems import PathCache
 from pyftpdlib.handlers import SUPPORTS_HYBRID_IPV6
+from pyftpdlib.handlers import BandwidthShaper
 from pyftpdlib.handlers import DTPHandler
+from pyftpdlib.handlers import FileProducer
 from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.handlers import PageCachePolicy
+from pyftpdlib.handlers import PassivePortAllocator
 from pyftpdlib.handlers import ThrottledDTPHandler
 from pyftpdlib.ioloop import IOLoop
+from pyftpdlib.ioloop import ThreadPool
+from pyftpdlib.metrics import Metrics
 from pyftpdlib.servers import FTPServer
 
 from . import BUFSIZE
@@ -241,6 +256,39 @@ class TestFtpAuthentication(PyftpdlibTestCase):
             assert hash(data) == hash(datafile)
 
 
+class TestFtpAuthenticationSQLite(TestFtpAuthentication):
+    """Test: USER, PASS, REIN using SQLiteAuthorizer and verifying
+    passwords in a thread pool (see FTPHandler.auth_executor).
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.dbfn = self.get_testfn()
+        authorizer = SQLiteAuthorizer(self.dbfn)
+        pwd = SQLiteAuthorizer.hash_password(PASSWD, iterations=1000)
+        authorizer.add_user(USER, pwd, HOME, perm='elradfmwMT')
+        authorizer.add_anonymous(HOME)
+        self.executor = ThreadPool(max_workers=2)
+        self.server.handler.authorizer = authorizer
+        self.server.handler.auth_executor = self.executor
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.server.handler.authorizer.close()
+        super().tearDown()
+
+    def test_pipelined_cmds(self):
+        # commands received while the password is being verified are
+        # processed afterwards
+        self.client.sock.sendall(
+            f"USER {USER}\r\nPASS {PASSWD}\r\nPWD\r\n".encode()
+        )
+        assert self.client.getresp()[:3] == '331'
+        assert self.client.getresp()[:3] == '230'
+        assert self.client.getresp()[:3] == '257'
+        assert self.executor.stats()['ops']['PASS']['calls'] == 1
+
+
 class TestFtpDummyCmds(PyftpdlibTestCase):
     """Test: TYPE, STRU, MODE, NOOP, SYST, ALLO, HELP, SITE HELP."""
 
@@ -391,26 +439,35 @@ class TestFtpCmdsSemantic(PyftpdlibTestCase):
         'appe',
         'dele',
         'eprt',
+        'hash',
         'mdtm',
         'mfmt',
         'mkd',
         'mode',
         'opts',
         'port',
+        'rang',
         'rest',
         'retr',
         'rmd',
         'rnfr',
         'rnto',
         'site chmod',
+        'site copy',
+        'site cpr',
         'site',
         'size',
         'stor',
         'stru',
         'type',
         'user',
+        'xcrc',
+        'xmd5',
         'xmkd',
         'xrmd',
+        'xsha1',
+        'xsha256',
+        'xsha512',
     ]
 
     def setUp(self):
@@ -715,6 +772,37 @@ class CustomIO(io.RawIOBase):
         return self._bytesio.write(b)
 
 
+@pytest.mark.skipif(not POSIX, reason="UNIX only")
+class TestAsciiDataWrappers(PyftpdlibTestCase):
+    """Test ASCII mode line ending translation of data split in
+    arbitrary chunks.
+    """
+
+    data = b'a\nbb\r\n\r\n\n\rc\r\r\nd\n\r' * 50
+
+    def chunks(self, data):
+        for size in (1, 2, 3, 7, 64, len(data)):
+            yield [data[i : i + size] for i in range(0, len(data), size)]
+
+    def test_send(self):
+        expected = re.sub(rb'(?<!\r)\n', b'\r\n', self.data)
+        for chunks in self.chunks(self.data):
+            producer = FileProducer(io.BytesIO(), 'a')
+            got = b''.join(producer._data_wrapper(x) for x in chunks)
+            assert got == expected
+
+    def test_receive(self):
+        expected = self.data.replace(b'\r\n', b'\n')
+        for chunks in self.chunks(self.data):
+            dtp = types.SimpleNamespace(_had_cr=False)
+            got = b''.join(
+                DTPHandler._posix_ascii_data_wrapper(dtp, x) for x in chunks
+            )
+            # the last CR is held back until EOF
+            assert dtp._had_cr
+            assert got + b'\r' == expected
+
+
 class TestFtpStoreData(PyftpdlibTestCase):
     """Test STOR, STOU, APPE, REST, TYPE."""
 
@@ -799,6 +887,19 @@ class TestFtpStoreData(PyftpdlibTestCase):
         assert hash(expected) == hash(datafile)
 
     @retry_on_failure
+    def test_stor_ascii_trailing_cr(self):
+        # Test that a CR ending the file is not lost in ASCII mode.
+        self.client.voidcmd('type a')
+        with contextlib.closing(
+            self.client.transfercmd('stor ' + self.testfn)
+        ) as conn:
+            conn.sendall(b'foo\r\nbar\r')
+        self.client.voidresp()
+        with open(self.testfn, 'rb') as f:
+            assert f.read() == b'foo\r\nbar\r'.replace(
+                b'\r\n', bytes(os.linesep, "ascii")
+            )
+
     def test_stor_ascii_2(self):
         # Test that no extra extra carriage returns are added to the
         # file in ASCII mode in case CRLF gets truncated in two chunks
@@ -1093,6 +1194,18 @@ class TestFtpRetrieveData(PyftpdlibTestCase):
         assert len(expected) == len(datafile)
         assert hash(expected) == hash(datafile)
 
+    def test_retr_ascii_mixed(self):
+        # Test ASCII mode RETR for data mixing LF and CRLF line endings,
+        # with CRLFs split across chunks.
+        data = b'abcde12345\r\n' * 10000 + b'abcde1234\n' * 10000
+        with open(self.testfn, 'wb') as f:
+            f.write(data)
+        with patch.object(FileProducer, 'buffer_size', 8191):
+            self.retrieve_ascii("retr " + self.testfn, self.dummyfile.write)
+        expected = re.sub(rb'(?<!\r)\n', b'\r\n', data)
+        self.dummyfile.seek(0)
+        assert self.dummyfile.read() == expected
+
     def test_retr_ascii_already_crlf(self):
         # Test ASCII mode RETR for data with CRLF line endings.
         data = b'abcde12345\r\n' * 100000
@@ -1332,6 +1445,533 @@ class TestFtpListingCmds(PyftpdlibTestCase):
             AbstractedFS.getmtime = _getmtime
 
 
+class _FsExecutorMixin:
+    """Run filesystem calls in a thread pool (see
+    FTPHandler.fs_executor).
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.executor = ThreadPool(max_workers=2)
+        self.server.handler.fs_executor = self.executor
+
+    def tearDown(self):
+        # worker threads must be gone before the server is stopped
+        self.executor.shutdown()
+        super().tearDown()
+
+
+class TestFtpFsOperationsFsExecutor(_FsExecutorMixin, TestFtpFsOperations):
+    """Test filesystem commands using a thread pool."""
+
+    def test_pipelined_cmds(self):
+        # commands received while a filesystem call is in progress
+        # are supposed to be processed afterwards, in order
+        self.client.sock.sendall(
+            (
+                f"MKD {self.tempdir}/a\r\nRMD {self.tempdir}/a\r\n"
+                f"DELE {self.tempfile}\r\nNOOP\r\n"
+            ).encode()
+        )
+        assert self.client.getresp()[:3] == '257'
+        assert self.client.getresp()[:3] == '250'
+        assert self.client.getresp()[:3] == '250'
+        assert self.client.getresp()[:3] == '200'
+        assert not os.path.exists(self.tempfile)
+
+    def test_stats(self):
+        self.client.sendcmd('mdtm ' + self.tempfile)
+        with pytest.raises(ftplib.error_perm, match="No such file"):
+            self.client.delete(self.tempdir + '/bogus')
+        stats = self.executor.stats()
+        assert stats['queued'] == 0
+        assert stats['failed'] == 1
+        assert stats['ops']['MDTM']['calls'] == 1
+        assert stats['ops']['DELE']['calls'] == 1
+        assert stats['ops']['DELE']['avg_time'] >= 0
+
+
+class TestFtpStoreDataFsExecutor(_FsExecutorMixin, TestFtpStoreData):
+    """Test STOR, STOU, APPE, REST, TYPE using a thread pool."""
+
+
+class TestFtpRetrieveDataFsExecutor(_FsExecutorMixin, TestFtpRetrieveData):
+    """Test RETR, REST, TYPE using a thread pool."""
+
+
+class TestFtpListingCmdsFsExecutor(_FsExecutorMixin, TestFtpListingCmds):
+    """Test LIST, NLST, argumented STAT using a thread pool."""
+
+
+class TestFtpRetrieveDataFileCache(TestFtpRetrieveData):
+    """Test RETR, REST, TYPE using a FileCache."""
+
+    def setUp(self):
+        super().setUp()
+        self.server.handler.file_cache = FileCache(max_file_size=2**20)
+
+
+class TestFtpListingCmdsListingCache(TestFtpListingCmds):
+    """Test LIST, NLST, argumented STAT using a listing cache."""
+
+    def setUp(self):
+        super().setUp()
+        self.cache = ListingCache()
+        self.server.handler.listing_cache = self.cache
+
+    def test_hits(self):
+        tempdir = self.get_testfn()
+        os.mkdir(tempdir)
+        touch(os.path.join(tempdir, 'a'))
+        for cmd in ('LIST', 'NLST', 'MLSD', 'STAT'):
+            for _ in range(2):
+                if cmd == 'STAT':
+                    self.client.sendcmd(f'STAT {tempdir}')
+                else:
+                    self.client.retrlines(f'{cmd} {tempdir}', lambda x: x)
+        stats = self.cache.stats()
+        # STAT and LIST output is the same
+        assert stats['misses'] == 3
+        assert stats['hits'] == 5
+        assert stats['entries'] == 3
+
+    def test_impersonation(self):
+        # access to directories is checked by the OS, as the user the
+        # server impersonates: cached listings are never used
+        tempdir = self.get_testfn()
+        os.mkdir(tempdir)
+        with patch.object(FTPHandler, '_impersonates', return_value=True):
+            for _ in range(2):
+                self.client.retrlines(f'LIST {tempdir}', lambda x: x)
+        stats = self.cache.stats()
+        assert stats['hits'] == 0
+        assert stats['entries'] == 0
+
+    def test_invalidation(self):
+        tempdir = self.get_testfn()
+        os.mkdir(tempdir)
+
+        def ls():
+            ls = []
+            self.client.retrlines(f'LIST {tempdir}', ls.append)
+            return ls
+
+        assert ls() == []
+        self.client.storbinary(f'STOR {tempdir}/a', io.BytesIO(b'x'))
+        assert ls()[0].split()[4] == '1'
+        # overwriting a file does not change the directory mtime
+        self.client.storbinary(f'STOR {tempdir}/a', io.BytesIO(b'xx'))
+        assert ls()[0].split()[4] == '2'
+        self.client.rename(f'{tempdir}/a', f'{tempdir}/b')
+        assert ls()[0].endswith(' b')
+        self.client.mkd(f'{tempdir}/c')
+        assert len(ls()) == 2
+        self.client.rmd(f'{tempdir}/c')
+        self.client.delete(f'{tempdir}/b')
+        assert ls() == []
+
+
+class TestFtpFsOperationsPathCache(TestFtpFsOperations):
+    """Test filesystem commands using a real paths cache."""
+
+    def setUp(self):
+        self.cache = PathCache()
+        FTPHandler.path_cache = self.cache
+        super().setUp()
+
+    def test_hits(self):
+        self.client.sendcmd('mdtm ' + self.tempfile)
+        misses = self.cache.misses
+        self.client.sendcmd('mdtm ' + self.tempfile)
+        self.client.sendcmd('mdtm ' + self.tempfile)
+        assert self.cache.misses == misses
+        assert self.cache.hits >= 2
+
+    def test_session_cache(self):
+        close_client(self.client)
+        self.server.handler.path_cache = None
+        self.server.handler.path_cache_size = 10
+        self.client = self.client_class(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+        self.client.login(USER, PASSWD)
+        self.client.sendcmd('mdtm ' + self.tempfile)
+        handler = get_server_handler()
+        assert handler.fs.path_cache is not self.cache
+        assert len(handler.fs.path_cache) > 0
+        assert len(self.cache) == 0
+
+    @pytest.mark.skipif(not hasattr(os, 'symlink'), reason="no symlinks")
+    def test_renamed_dir_replaced_by_symlink(self):
+        # a directory whose real path was cached is renamed and a
+        # symlink pointing outside of the user's home takes its place
+        home = os.path.realpath(os.path.join(self.tempdir, 'home'))
+        outside = os.path.realpath(os.path.join(self.tempdir, 'outside'))
+        os.makedirs(os.path.join(home, 'a'))
+        os.mkdir(outside)
+        touch(os.path.join(home, 'a', 'f'))
+        touch(os.path.join(outside, 'f'))
+        authorizer = self.server.handler.authorizer
+        authorizer.add_user('jailed', PASSWD, home, perm='elradfmw')
+        self.addCleanup(authorizer.remove_user, 'jailed')
+        self.client.login('jailed', PASSWD)
+
+        self.client.sendcmd('mdtm a/f')
+        self.client.rename('a', 'b')
+        os.symlink(outside, os.path.join(home, 'a'))
+        with pytest.raises(ftplib.error_perm, match="outside"):
+            self.client.sendcmd('mdtm a/f')
+        self.client.sendcmd('mdtm b/f')
+
+
+class TestFtpChecksums(PyftpdlibTestCase):
+    """Test: HASH, RANG, XCRC, XMD5, XSHA1, XSHA256, XSHA512."""
+
+    server_class = FtpdThreadWrapper
+    client_class = ftplib.FTP
+
+    def setUp(self):
+        super().setUp()
+        self.cache = DigestCache()
+        FTPHandler.digest_cache = self.cache
+        self.server = self.server_class()
+        self.server.start()
+        self.client = self.client_class(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+        self.client.login(USER, PASSWD)
+        self.testfn = self.get_testfn()
+        self.data = b'abcdefghij' * 1000
+        with open(self.testfn, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        close_client(self.client)
+        self.server.stop()
+        super().tearDown()
+
+    def test_hash(self):
+        digest = hashlib.sha256(self.data).hexdigest()
+        resp = self.client.sendcmd(f'HASH {self.testfn}')
+        assert resp == f"213 SHA-256 0-9999 {digest} /{self.testfn}"
+        with pytest.raises(ftplib.error_perm, match="not retrievable"):
+            self.client.sendcmd('HASH /')
+        with pytest.raises(ftplib.error_perm, match="not retrievable"):
+            self.client.sendcmd('HASH ' + self.get_testfn())
+
+    def test_chunks(self):
+        # without executors the file is hashed a chunk per IO loop
+        # iteration; commands received meanwhile are queued
+        digest = hashlib.sha256(self.data).hexdigest()
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr('pyftpdlib.filesystems.DIGEST_CHUNK_SIZE', 777)
+            self.client.sock.sendall(
+                f'HASH {self.testfn}\r\nNOOP\r\n'.encode()
+            )
+            resp = self.client.getmultiline()
+            assert resp == f"213 SHA-256 0-9999 {digest} /{self.testfn}"
+            assert self.client.getmultiline().startswith('200')
+            resp = self.client.sendcmd(f'XMD5 {self.testfn} 10 5000')
+            assert resp == f"250 {hashlib.md5(self.data[10:5000]).hexdigest()}"
+
+    def test_opts_hash(self):
+        def feat():
+            resp = self.client.sendcmd('feat')
+            return re.search(r'^\s*HASH\s+(\S+)$', resp, re.MULTILINE).group(1)
+
+        assert feat() == 'SHA-256*;SHA-1;SHA-512;MD5;CRC32'
+        assert self.client.sendcmd('opts hash') == '200 SHA-256'
+        assert self.client.sendcmd('opts hash md5') == '200 MD5'
+        assert self.client.sendcmd('opts hash') == '200 MD5'
+        assert feat() == 'SHA-256;SHA-1;SHA-512;MD5*;CRC32'
+        digest = hashlib.md5(self.data).hexdigest()
+        resp = self.client.sendcmd(f'HASH {self.testfn}')
+        assert resp.startswith(f"213 MD5 0-9999 {digest} ")
+        with pytest.raises(ftplib.error_perm, match="Unknown algorithm"):
+            self.client.sendcmd('opts hash foo')
+
+    def test_rang(self):
+        assert self.client.sendcmd('rang 10 19')[:3] == '350'
+        digest = hashlib.sha256(self.data[10:20]).hexdigest()
+        resp = self.client.sendcmd(f'HASH {self.testfn}')
+        assert resp.startswith(f"213 SHA-256 10-19 {digest} ")
+        # the range only applies to the next HASH
+        resp = self.client.sendcmd(f'HASH {self.testfn}')
+        assert resp.startswith("213 SHA-256 0-9999 ")
+        self.client.sendcmd('rang 10 19')
+        self.client.sendcmd('rang 1 0')
+        resp = self.client.sendcmd(f'HASH {self.testfn}')
+        assert resp.startswith("213 SHA-256 0-9999 ")
+        for arg in ('10', '10 a', '-1 5', '5 4'):
+            with pytest.raises(ftplib.error_perm, match="501"):
+                self.client.sendcmd('rang ' + arg)
+        self.client.sendcmd('rang 20000 30000')
+        with pytest.raises(ftplib.error_perm, match="Invalid range"):
+            self.client.sendcmd(f'HASH {self.testfn}')
+
+    def test_xcmds(self):
+        data = self.data
+        for cmd, expected in (
+            ('XCRC', f"{zlib.crc32(data):08x}"),
+            ('XMD5', hashlib.md5(data).hexdigest()),
+            ('XSHA1', hashlib.sha1(data).hexdigest()),
+            ('XSHA256', hashlib.sha256(data).hexdigest()),
+            ('XSHA512', hashlib.sha512(data).hexdigest()),
+        ):
+            resp = self.client.sendcmd(f'{cmd} {self.testfn}')
+            assert resp == f"250 {expected}"
+        FTPHandler.digest_algorithms = ('SHA-256',)
+        with pytest.raises(ftplib.error_perm, match="not supported"):
+            self.client.sendcmd(f'XMD5 {self.testfn}')
+
+    def test_xcmds_range(self):
+        data = self.data
+        resp = self.client.sendcmd(f'XMD5 {self.testfn} 10 20')
+        assert resp == f"250 {hashlib.md5(data[10:20]).hexdigest()}"
+        resp = self.client.sendcmd(f'XMD5 {self.testfn} 10')
+        assert resp == f"250 {hashlib.md5(data[10:]).hexdigest()}"
+        resp = self.client.sendcmd(f'XMD5 "{self.testfn}" 10 20')
+        assert resp == f"250 {hashlib.md5(data[10:20]).hexdigest()}"
+        with pytest.raises(ftplib.error_perm, match="invalid range"):
+            self.client.sendcmd(f'XMD5 {self.testfn} 20 10')
+        with pytest.raises(ftplib.error_perm, match="501"):
+            self.client.sendcmd(f'XMD5 "{self.testfn}" 1 2 3')
+
+    def test_xcmds_quoted_path(self):
+        # a file name ending with a number
+        testfn = self.get_testfn(suffix=' 10')
+        with open(testfn, 'wb') as f:
+            f.write(self.data)
+        resp = self.client.sendcmd(f'XSHA1 "{testfn}"')
+        assert resp == f"250 {hashlib.sha1(self.data).hexdigest()}"
+
+    def test_cache(self):
+        for _ in range(3):
+            self.client.sendcmd(f'XSHA256 {self.testfn}')
+            self.client.sendcmd(f'HASH {self.testfn}')
+        stats = self.cache.stats()
+        assert stats['misses'] == 1
+        assert stats['hits'] == 5
+
+    def test_stor(self):
+        # the checksum is computed while the file is received
+        testfn = self.get_testfn()
+        data = os.urandom(100000)
+        self.client.storbinary(f'STOR {testfn}', io.BytesIO(data))
+        resp = self.client.sendcmd(f'HASH {testfn}')
+        assert hashlib.sha256(data).hexdigest() in resp
+        stats = self.cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 0
+
+    def test_stor_ascii(self):
+        testfn = self.get_testfn()
+        data = b'line1\r\nline2\r\nline3\r'
+        self.client.storlines(f'STOR {testfn}', io.BytesIO(data))
+        with open(testfn, 'rb') as f:
+            expected = hashlib.sha256(f.read()).hexdigest()
+        assert expected in self.client.sendcmd(f'HASH {testfn}')
+
+    def test_rest_appe(self):
+        # resumed uploads are hashed afterwards
+        self.client.sendcmd('type i')
+        self.client.sendcmd('rest 5000')
+        self.client.storbinary(f'STOR {self.testfn}', io.BytesIO(b'x'))
+        self.client.storbinary(f'APPE {self.testfn}', io.BytesIO(b'y'))
+        data = self.data[:5000] + b'x' + self.data[5001:] + b'y'
+        resp = self.client.sendcmd(f'HASH {self.testfn}')
+        assert hashlib.sha256(data).hexdigest() in resp
+        assert self.cache.stats()['hits'] == 0
+
+    def test_digest_executor(self):
+        executor = ThreadPool(max_workers=1)
+        self.server.handler.digest_executor = executor
+        try:
+            self.client.sendcmd(f'XCRC {self.testfn}')
+            self.client.sendcmd(f'HASH {self.testfn}')
+            assert executor.stats()['ops']['XCRC']['calls'] == 1
+            assert executor.stats()['ops']['HASH']['calls'] == 1
+        finally:
+            # worker threads must be gone before the server is stopped
+            executor.shutdown()
+
+
+class TestFtpSiteCopy(PyftpdlibTestCase):
+    """Test SITE COPY and SITE CPR."""
+
+    server_class = FtpdThreadWrapper
+    client_class = ftplib.FTP
+
+    def setUp(self):
+        super().setUp()
+        self.server = self.server_class()
+        self.server.start()
+        self.client = self.client_class(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+        self.client.login(USER, PASSWD)
+        self.testfn = self.get_testfn()
+        self.testfn2 = self.get_testfn()
+        self.data = os.urandom(100000)
+        with open(self.testfn, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        close_client(self.client)
+        self.server.stop()
+        super().tearDown()
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_copy(self):
+        resp = self.client.sendcmd(f'site copy {self.testfn} {self.testfn2}')
+        assert resp == f"250 Copy complete ({len(self.data)} bytes)."
+        assert self.read(self.testfn2) == self.data
+        # overwrite
+        with open(self.testfn, 'ab') as f:
+            f.write(b'x')
+        self.client.sendcmd(f'site copy {self.testfn} {self.testfn2}')
+        assert self.read(self.testfn2) == self.data + b'x'
+
+    def test_copy_into_dir(self):
+        os.mkdir(self.testfn2)
+        self.client.sendcmd(f'site copy {self.testfn} {self.testfn2}')
+        path = os.path.join(self.testfn2, self.testfn)
+        assert self.read(path) == self.data
+
+    def test_copy_chunks(self):
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr('pyftpdlib.filesystems.COPY_CHUNK_SIZE', 7000)
+            mp.setattr('pyftpdlib.filesystems._FICLONE', None)
+            self.client.sendcmd(f'site copy {self.testfn} {self.testfn2}')
+        assert self.read(self.testfn2) == self.data
+
+    def test_quoted_paths(self):
+        dst = self.testfn2 + ' 2'
+        self.client.sendcmd(f'site copy "{self.testfn}" "{dst}"')
+        assert self.read(dst) == self.data
+        with pytest.raises(ftplib.error_perm, match="needs two arguments"):
+            self.client.sendcmd(f'site copy {self.testfn}')
+        with pytest.raises(ftplib.error_perm, match="needs two arguments"):
+            self.client.sendcmd(f'site copy {self.testfn} {dst}')
+
+    def test_errors(self):
+        with pytest.raises(ftplib.error_perm, match="550 No such file"):
+            self.client.sendcmd(f'site copy {self.testfn2} {self.testfn}')
+        with pytest.raises(ftplib.error_perm, match="550 Not a regular"):
+            self.client.sendcmd(f'site copy / {self.testfn2}')
+        with pytest.raises(ftplib.error_perm, match="550 Source and dest"):
+            self.client.sendcmd(f'site copy {self.testfn} {self.testfn}')
+        assert self.read(self.testfn) == self.data
+
+    def test_perms(self):
+        os.mkdir(self.testfn2)
+        src = os.path.join(self.testfn2, 'src')
+        dst = os.path.join(self.testfn2, 'dst')
+        os.rename(self.testfn, src)
+        auth = self.server.handler.authorizer
+        # no "r" on the source
+        auth.override_perm(USER, self.testfn2, 'elw')
+        with pytest.raises(ftplib.error_perm, match="Not enough priv"):
+            self.client.sendcmd(f'site copy {src} {self.testfn}')
+        # no "w" on the destination
+        auth.override_perm(USER, self.testfn2, 'elr')
+        with pytest.raises(ftplib.error_perm, match="Not enough priv"):
+            self.client.sendcmd(f'site copy {self.testfn} {dst}')
+        self.client.sendcmd(f'site copy {src} {self.testfn}')
+        # no "m" on the destination
+        auth.override_perm(USER, self.testfn2, 'elrw')
+        with pytest.raises(ftplib.error_perm, match="Not enough priv"):
+            self.client.sendcmd(f'site cpr {self.testfn2} {dst}')
+        assert not os.path.exists(dst)
+
+    def test_cpr_perms(self):
+        # the permissions are checked for every entry copied
+        os.mkdir(self.testfn2)
+        secret = os.path.join(self.testfn2, 'secret')
+        os.mkdir(secret)
+        os.rename(self.testfn, os.path.join(secret, 'file'))
+        auth = self.server.handler.authorizer
+        auth.override_perm(USER, os.path.realpath(secret), 'el',
+                           recursive=True)  # fmt: skip
+        dst = self.get_testfn()
+        with pytest.raises(ftplib.error_perm, match="Not enough priv"):
+            self.client.sendcmd(f'site cpr {self.testfn2} {dst}')
+        assert not os.path.exists(os.path.join(dst, 'secret', 'file'))
+
+    @pytest.mark.skipif(not POSIX, reason="UNIX only")
+    def test_copy_into_dir_symlink(self):
+        # the final destination is validated: a symlink named after the
+        # source can't be used to write outside the user's root
+        home = os.path.realpath(self.testfn2)
+        os.mkdir(home)
+        os.mkdir(os.path.join(home, 'dir'))
+        os.rename(self.testfn, os.path.join(home, 'src'))
+        outside = os.path.realpath(self.get_testfn())
+        os.symlink(outside, os.path.join(home, 'dir', 'src'))
+        auth = self.server.handler.authorizer
+        auth.add_user('user2', PASSWD, home, perm='elrwm')
+        close_client(self.client)
+        self.client = self.client_class(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+        self.client.login('user2', PASSWD)
+        with pytest.raises(ftplib.error_perm, match="outside the user's"):
+            self.client.sendcmd('site copy src dir')
+        with pytest.raises(ftplib.error_perm, match="outside the user's"):
+            self.client.sendcmd('site cpr src dir')
+        assert not os.path.exists(outside)
+
+    def test_cpr(self):
+        os.mkdir(self.testfn2)
+        os.mkdir(os.path.join(self.testfn2, 'sub'))
+        src = os.path.join(self.testfn2, 'sub', 'file')
+        os.rename(self.testfn, src)
+        dst = self.get_testfn()
+        resp = self.client.sendcmd(f'site cpr {self.testfn2} {dst}')
+        assert resp == f"250 Copy complete ({len(self.data)} bytes)."
+        assert self.read(os.path.join(dst, 'sub', 'file')) == self.data
+        with pytest.raises(ftplib.error_perm, match="into itself"):
+            self.client.sendcmd(f'site cpr {self.testfn2} {self.testfn2}')
+
+    def test_stat(self):
+        # STAT is processed before the first chunk is copied
+        self.client.sock.sendall(
+            f'site copy {self.testfn} {self.testfn2}\r\nstat\r\n'.encode()
+        )
+        resp = self.client.getmultiline()
+        assert resp.startswith('211-FTP server status:')
+        assert (
+            f'SITE COPY in progress: /{self.testfn} -> /{self.testfn2}'
+            in resp
+        )
+        assert 'Total bytes copied: 0' in resp
+        assert self.client.voidresp().startswith('250 Copy complete')
+        assert 'in progress' not in self.client.sendcmd('stat')
+
+    def test_abor(self):
+        self.client.sock.sendall(
+            f'site copy {self.testfn} {self.testfn2}\r\nabor\r\n'.encode()
+        )
+        assert self.client.getmultiline() == '426 Copy aborted via ABOR.'
+        assert self.client.voidresp() == '226 ABOR command successful.'
+        self.client.sendcmd('noop')
+        assert not os.path.exists(self.testfn2)
+
+    def test_one_at_a_time(self):
+        self.client.sock.sendall(
+            f'site copy {self.testfn} {self.testfn2}\r\n'
+            f'site copy {self.testfn} {self.testfn2}\r\n'.encode()
+        )
+        assert self.client.getmultiline() == (
+            '450 Another copy is in progress.'
+        )
+        self.client.voidresp()
+        assert self.read(self.testfn2) == self.data
+
+
+class TestFtpSiteCopyFsExecutor(_FsExecutorMixin, TestFtpSiteCopy):
+    """Test SITE COPY and SITE CPR using a thread pool."""
+
+
 class TestFtpAbort(PyftpdlibTestCase):
     """Test: ABOR."""
 
@@ -1492,6 +2132,442 @@ class TestThrottleBandwidth(PyftpdlibTestCase):
         assert hash(data) == hash(file_data)
 
 
+class TestBandwidthShaper(PyftpdlibTestCase):
+    """Test BandwidthShaper class."""
+
+    def setUp(self):
+        super().setUp()
+        self.now = 1000.0
+        patcher = patch("pyftpdlib.handlers.timer", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def channel(self, username='user', ip='127.0.0.1'):
+        return types.SimpleNamespace(username=username, remote_ip=ip)
+
+    def test_quota(self):
+        shaper = BandwidthShaper(write_limit=100000)
+        buckets = shaper.attach(self.channel(), receive=False)
+        # the burst allowance: 1/10 of the limit
+        assert shaper.quota(buckets, 65536) == 10000
+        shaper.consume(buckets, 10000)
+        assert shaper.quota(buckets, 65536) == 0
+        assert shaper.delay(buckets, 65536) == pytest.approx(0.1)
+        self.now += 0.05
+        # small chunks are not handed out as long as more can come
+        assert shaper.quota(buckets, 65536) == 0
+        assert shaper.quota(buckets, 1000) == 1000
+        self.now += 0.05
+        assert shaper.quota(buckets, 65536) == 10000
+        shaper.detach(buckets)
+
+    def test_fair_share(self):
+        shaper = BandwidthShaper(user_write_limit=100000)
+        b1 = shaper.attach(self.channel(), receive=False)
+        b2 = shaper.attach(self.channel(), receive=False)
+        b3 = shaper.attach(self.channel('other'), receive=False)
+        assert b1[1] is b2[1]
+        assert b1[1] is not b3[1]
+        assert shaper.quota(b1, 65536) == 5000
+        assert shaper.quota(b3, 65536) == 10000
+        # reading is not limited
+        b4 = shaper.attach(self.channel(), receive=True)
+        assert shaper.quota(b4, 65536) == 65536
+        for buckets in (b1, b2, b3, b4):
+            shaper.detach(buckets)
+        assert not shaper._users
+        assert not shaper._ips
+
+    def test_user_limits(self):
+        shaper = BandwidthShaper(
+            user_read_limit=100000, user_limits={'vip': (0, 0)}
+        )
+        buckets = shaper.attach(self.channel('vip'), receive=True)
+        assert shaper.quota(buckets, 65536) == 65536
+        shaper.detach(buckets)
+
+    def test_ip_limits(self):
+        shaper = BandwidthShaper(ip_read_limit=100000)
+        b1 = shaper.attach(self.channel('a'), receive=True)
+        b2 = shaper.attach(self.channel('b'), receive=True)
+        assert b1[2] is b2[2]
+        assert shaper.quota(b1, 65536) == 5000
+        shaper.detach(b1)
+        shaper.detach(b2)
+
+    def test_stats(self):
+        shaper = BandwidthShaper(read_limit=100000)
+        buckets = shaper.attach(self.channel(), receive=True)
+        shaper.consume(buckets, 5000)
+        self.now += 1
+        shaper.consume(buckets, 5000)
+        stats = shaper.stats()
+        assert stats['read']['limit'] == 100000
+        assert stats['read']['total'] == 10000
+        assert stats['read']['rate'] == 10000
+        assert stats['read']['channels'] == 1
+        assert stats['write']['total'] == 0
+        assert stats['users']['user']['read']['total'] == 10000
+        assert stats['users']['user']['write'] is None
+        assert stats['ips']['127.0.0.1']['read']['total'] == 10000
+        shaper.detach(buckets)
+        assert shaper.stats()['users'] == {}
+
+
+class TestFtpBandwidthShaper(PyftpdlibTestCase):
+    """Test data transfers using a BandwidthShaper."""
+
+    server_class = FtpdThreadWrapper
+    client_class = ftplib.FTP
+
+    def setUp(self):
+        super().setUp()
+        self.server = self.server_class()
+        self.shaper = BandwidthShaper(read_limit=2000000, write_limit=2000000)
+        self.server.handler.bandwidth_shaper = self.shaper
+        self.server.start()
+        self.client = self.client_class(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+        self.client.login(USER, PASSWD)
+        self.dummyfile = io.BytesIO()
+        self.testfn = self.get_testfn()
+
+    def tearDown(self):
+        close_client(self.client)
+        self.server.stop()
+        if not self.dummyfile.closed:
+            self.dummyfile.close()
+        super().tearDown()
+
+    def test_send(self):
+        data = b'abcde12345' * 100000
+        with open(self.testfn, 'wb') as file:
+            file.write(data)
+        t = time.monotonic()
+        self.client.retrbinary("retr " + self.testfn, self.dummyfile.write)
+        # 1MB at 2MB/s, minus the initial burst
+        assert time.monotonic() - t > 0.3
+        assert self.dummyfile.getvalue() == data
+        assert self.shaper.stats()['write']['total'] == len(data)
+
+    @pytest.mark.skipif(not hasattr(os, "sendfile"), reason="no sendfile")
+    def test_send_sendfile(self):
+        data = b'abcde12345' * 10000
+        with open(self.testfn, 'wb') as file:
+            file.write(data)
+        with patch(
+            "pyftpdlib.handlers.os.sendfile", side_effect=os.sendfile
+        ) as m:
+            self.client.retrbinary(
+                "retr " + self.testfn, self.dummyfile.write
+            )
+        assert m.called
+        # the count argument is bound by the quota
+        assert max(x[0][3] for x in m.call_args_list) <= 200000
+        assert self.dummyfile.getvalue() == data
+
+    def test_single_resumer(self):
+        # pauses reuse the same timer rather than piling up new ones
+        # for the whole transfer
+        tasks = []
+        resume = DTPHandler._shaper_resume
+
+        def shaper_resume(dtp):
+            tasks.append(len(dtp._tasks))
+            resume(dtp)
+
+        data = b'abcde12345' * 100000
+        with open(self.testfn, 'wb') as file:
+            file.write(data)
+        with patch.object(DTPHandler, '_shaper_resume', shaper_resume):
+            self.client.retrbinary("retr " + self.testfn, self.dummyfile.write)
+        assert len(tasks) > 1
+        assert tasks == [0] * len(tasks)
+
+    def test_recv(self):
+        data = b'abcde12345' * 100000
+        self.dummyfile.write(data)
+        self.dummyfile.seek(0)
+        t = time.monotonic()
+        self.client.storbinary("stor " + self.testfn, self.dummyfile)
+        assert time.monotonic() - t > 0.3
+        self.client.quit()
+        with open(self.testfn, 'rb') as file:
+            assert file.read() == data
+        assert self.shaper.stats()['read']['total'] == len(data)
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "posix_fadvise"), reason="no posix_fadvise"
+)
+class TestPageCachePolicy(PyftpdlibTestCase):
+    """Test PageCachePolicy class."""
+
+    def setUp(self):
+        super().setUp()
+        self.testfn = self.get_testfn()
+        with open(self.testfn, 'wb') as f:
+            f.write(b'x' * 100000)
+        self.file = open(self.testfn, 'rb+')  # noqa: SIM115
+        self.addCleanup(self.file.close)
+        self.fd = self.file.fileno()
+
+    def new_policy(self, **kwargs):
+        kwargs.setdefault('threshold', 50000)
+        kwargs.setdefault('readahead', 16384)
+        kwargs.setdefault('writeback', 8192)
+        policy = PageCachePolicy(**kwargs)
+        policy.step = 4096
+        return policy
+
+    def calls(self, fun, *args):
+        with patch(
+            'pyftpdlib.handlers.os.posix_fadvise',
+            side_effect=os.posix_fadvise,
+        ) as m:
+            ret = fun(*args)
+        return ret, [x[0][1:] for x in m.call_args_list]
+
+    def test_download(self):
+        policy = self.new_policy()
+        window, calls = self.calls(policy.attach, self.fd, False, 0)
+        assert calls == [
+            (0, 0, os.POSIX_FADV_SEQUENTIAL),
+            (0, 16384, os.POSIX_FADV_WILLNEED),
+        ]
+        # nothing happens within a step
+        assert self.calls(window.advance, 4000)[1] == []
+        _, calls = self.calls(window.advance, 4192)
+        assert calls == [
+            (16384, 8192, os.POSIX_FADV_WILLNEED),
+            (0, 4096, os.POSIX_FADV_DONTNEED),
+        ]
+        _, calls = self.calls(window.close)
+        assert calls == [(4096, 4096, os.POSIX_FADV_DONTNEED)]
+        assert policy.stats() == dict(
+            files=1, prefetched=24576, dropped=8192, written_back=0,
+            errors=0,
+        )  # fmt: skip
+
+    def test_download_offset(self):
+        policy = self.new_policy(readahead=0)
+        window, calls = self.calls(policy.attach, self.fd, False, 60000)
+        assert calls == [(60000, 0, os.POSIX_FADV_SEQUENTIAL)]
+        window.advance(10000)
+        window.close()
+        assert policy.stats()['dropped'] == 10000
+        assert policy.stats()['prefetched'] == 0
+
+    def test_small_file(self):
+        policy = self.new_policy(threshold=100001)
+        assert policy.attach(self.fd, False, 0) is None
+        assert policy.stats()['files'] == 0
+        policy = self.new_policy(readahead=0, drop_behind=False)
+        assert policy.attach(self.fd, False, 0) is None
+
+    def test_upload(self):
+        policy = self.new_policy(threshold=0)
+        window = policy.attach(self.fd, True, 0)
+        assert self.calls(window.advance, 8191)[1] == []
+        _, calls = self.calls(window.advance, 1)
+        assert calls == [(0, 8192, os.POSIX_FADV_DONTNEED)]
+        # the first range is evicted, the second one is written back
+        _, calls = self.calls(window.advance, 8192)
+        assert calls == [(0, 16384, os.POSIX_FADV_DONTNEED)]
+        window.advance(100)
+        _, calls = self.calls(window.close)
+        assert calls == [(8192, 8292, os.POSIX_FADV_DONTNEED)]
+        assert policy.stats()['written_back'] == 16484
+        policy = self.new_policy(writeback=0)
+        assert policy.attach(self.fd, True, 0) is None
+
+    def test_upload_threshold(self):
+        policy = self.new_policy(threshold=20000)
+        window = policy.attach(self.fd, True, 0)
+        assert self.calls(window.advance, 16384)[1] == []
+        window.advance(3616)
+        assert policy.stats()['written_back'] == 20000
+        # smaller uploads are left alone
+        window = policy.attach(self.fd, True, 0)
+        window.advance(100)
+        assert self.calls(window.close)[1] == []
+
+    def test_errors(self):
+        policy = self.new_policy()
+        with patch(
+            'pyftpdlib.handlers.os.posix_fadvise',
+            side_effect=OSError(errno.EBADF, 'bad'),
+        ):
+            window = policy.attach(self.fd, False, 0)
+            window.close()
+        assert policy.stats()['errors'] == 2
+        assert policy.stats()['prefetched'] == 0
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "posix_fadvise"), reason="no posix_fadvise"
+)
+class TestFtpPageCachePolicy(PyftpdlibTestCase):
+    """Test data transfers using a PageCachePolicy."""
+
+    server_class = FtpdThreadWrapper
+    client_class = ftplib.FTP
+
+    def setUp(self):
+        super().setUp()
+        self.server = self.server_class()
+        self.policy = PageCachePolicy(
+            threshold=100000, readahead=65536, writeback=65536
+        )
+        self.policy.step = 16384
+        self.server.handler.page_cache_policy = self.policy
+        self.server.handler.metrics = Metrics()
+        self.server.start()
+        self.client = self.client_class(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+        self.client.login(USER, PASSWD)
+        self.testfn = self.get_testfn()
+        self.data = os.urandom(300000)
+
+    def tearDown(self):
+        close_client(self.client)
+        self.server.stop()
+        super().tearDown()
+
+    def retr(self):
+        with open(self.testfn, 'wb') as f:
+            f.write(self.data)
+        buf = io.BytesIO()
+        self.client.retrbinary("retr " + self.testfn, buf.write)
+        assert buf.getvalue() == self.data
+
+    def test_retr(self):
+        self.retr()
+        stats = self.policy.stats()
+        assert stats['files'] == 1
+        assert stats['dropped'] == len(self.data)
+        assert stats['prefetched'] >= 65536
+        report = self.server.handler.metrics.report()
+        assert any(x.startswith('page cache policy: 1 files') for x in report)
+
+    def test_retr_no_sendfile(self):
+        self.server.handler.use_sendfile = False
+        self.retr()
+        assert self.policy.stats()['dropped'] == len(self.data)
+
+    def test_retr_ascii(self):
+        with open(self.testfn, 'wb') as f:
+            f.write(b'abcde12345\n' * 30000)
+        self.client.retrlines("retr " + self.testfn, lambda x: x)
+        assert self.policy.stats()['files'] == 0
+
+    def test_stor(self):
+        self.client.storbinary("stor " + self.testfn, io.BytesIO(self.data))
+        with open(self.testfn, 'rb') as f:
+            assert f.read() == self.data
+        stats = self.policy.stats()
+        assert stats['files'] == 1
+        assert stats['written_back'] == len(self.data)
+        lines = self.server.handler.metrics.prometheus().decode()
+        assert (
+            f'ftp_page_cache_bytes_total{{advice="written_back"}} '
+            f'{len(self.data)}'
+        ) in lines.splitlines()
+
+
+class TestFtpFileCache(PyftpdlibTestCase):
+    """Test downloads served from a FileCache."""
+
+    server_class = FtpdThreadWrapper
+    client_class = ftplib.FTP
+
+    def setUp(self):
+        super().setUp()
+        self.server = self.server_class()
+        self.cache = FileCache(max_file_size=100000)
+        self.server.handler.file_cache = self.cache
+        self.server.handler.metrics = Metrics()
+        self.server.start()
+        self.client = self.client_class(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+        self.client.login(USER, PASSWD)
+        self.testfn = self.get_testfn()
+        self.data = os.urandom(50000)
+        with open(self.testfn, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        close_client(self.client)
+        self.server.stop()
+        super().tearDown()
+
+    def retr(self, rest=None):
+        buf = io.BytesIO()
+        self.client.retrbinary("retr " + self.testfn, buf.write, rest=rest)
+        return buf.getvalue()
+
+    def test_retr(self):
+        for _ in range(3):
+            assert self.retr() == self.data
+        stats = self.cache.stats()
+        assert stats['hits'] == 2
+        assert stats['misses'] == 1
+        assert stats['bytes_saved'] == 2 * len(self.data)
+        report = self.server.handler.metrics.report()
+        assert any(x.startswith('file cache: 1 files') for x in report)
+        lines = self.server.handler.metrics.prometheus().decode()
+        assert (
+            f'ftp_file_cache_saved_bytes_total {2 * len(self.data)}'
+            in lines.splitlines()
+        )
+
+    def test_rest(self):
+        self.retr()
+        assert self.retr(rest=1000) == self.data[1000:]
+        assert self.retr(rest=len(self.data)) == b''
+        self.client.sendcmd(f'rest {len(self.data) + 1}')
+        with pytest.raises(ftplib.error_perm, match="^554 REST position"):
+            self.client.sendcmd('retr ' + self.testfn)
+        assert self.cache.stats()['hits'] == 3
+
+    def test_modified(self):
+        assert self.retr() == self.data
+        self.client.storbinary("stor " + self.testfn, io.BytesIO(b'abc'))
+        assert self.retr() == b'abc'
+        assert self.cache.stats()['misses'] == 2
+
+    def test_not_cached(self):
+        # ASCII mode
+        with open(self.testfn, 'wb') as f:
+            f.write(b'abcde12345\n' * 1000)
+        self.client.retrlines("retr " + self.testfn, lambda x: x)
+        self.client.retrlines("retr " + self.testfn, lambda x: x)
+        assert self.cache.stats()['hits'] == 0
+        # too big
+        data = os.urandom(200000)
+        with open(self.testfn, 'wb') as f:
+            f.write(data)
+        assert self.retr() == data
+        assert len(self.cache) == 0
+
+    def test_no_such_file(self):
+        with pytest.raises(ftplib.error_perm, match="^550"):
+            self.client.sendcmd('retr ' + self.testfn + 'x')
+
+    def test_on_file_sent(self):
+        with patch.object(self.server.handler, 'on_file_sent') as m:
+            self.retr()
+            self.retr()
+            # make sure the data channel has been closed
+            self.client.sendcmd('noop')
+        assert m.call_count == 2
+        m.assert_called_with(os.path.abspath(self.testfn))
+
+
+class TestFtpFileCacheFsExecutor(_FsExecutorMixin, TestFtpFileCache):
+    """Test downloads served from a FileCache using a thread pool."""
+
+
 class TestTimeouts(PyftpdlibTestCase):
     """Test idle-timeout capabilities of control and data channels.
     Some tests may fail on slow machines.
@@ -1691,6 +2767,7 @@ class TestConfigurableOptions(PyftpdlibTestCase):
             self.server.handler.permit_privileged_ports = False
             self.server.handler.permit_foreign_addresses = False
             self.server.handler.passive_ports = None
+            self.server.handler.passive_pool_size = 0
             self.server.handler.use_gmt_times = True
             self.server.handler.tcp_no_delay = hasattr(socket, 'TCP_NODELAY')
             self.server.handler.encoding = "utf8"
@@ -1799,6 +2876,47 @@ class TestConfigurableOptions(PyftpdlibTestCase):
                 except (OSError, EOFError):  # already disconnected
                     c.close()
 
+    @disable_log_warning
+    def test_max_connections_per_subnet(self):
+        # Test FTPServer.max_cons_per_subnet attribute
+        self.server = self.server_class()
+        self.server.server.max_cons_per_subnet = 1
+        self.server.start()
+        self.connect()
+        c2 = self.client_class(timeout=GLOBAL_TIMEOUT)
+        try:
+            with pytest.raises(
+                ftplib.error_temp,
+                match="Too many connections from the same network",
+            ):
+                c2.connect(self.server.host, self.server.port)
+        finally:
+            c2.close()
+
+    @disable_log_warning
+    def test_max_accept_rate(self):
+        # Test FTPServer.max_accept_rate attribute
+        self.server = self.server_class()
+        self.server.server.max_accept_rate = 0.001
+        self.server.server.max_accept_burst = 2
+        self.server.start()
+        clients = []
+        try:
+            for _ in range(2):
+                c = self.client_class(timeout=GLOBAL_TIMEOUT)
+                clients.append(c)
+                c.connect(self.server.host, self.server.port)
+                c.quit()
+            c = self.client_class(timeout=GLOBAL_TIMEOUT)
+            clients.append(c)
+            with pytest.raises(
+                ftplib.error_temp, match="Too many connection attempts"
+            ):
+                c.connect(self.server.host, self.server.port)
+        finally:
+            for c in clients:
+                c.close()
+
     def test_banner(self):
         # Test FTPHandler.banner attribute
         self.server = self.server_class()
@@ -1871,6 +2989,36 @@ class TestConfigurableOptions(PyftpdlibTestCase):
             self.connect()
             resulting_port = self.client.makepasv()[1]
             assert port != resulting_port
+            stats = self.server.server.passive_allocator.stats()
+            assert stats['busy'] == 1
+            assert stats['exhausted'] == 1
+
+    def test_passive_ports_reused(self):
+        # ports are released when the passive data channel is closed
+        _range = free_ports(2)
+        self.server = self.server_class()
+        self.server.handler.passive_ports = _range
+        self.server.start()
+        self.connect()
+        for _ in range(6):
+            assert self.client.makepasv()[1] in _range
+        self.client.nlst()
+        stats = self.server.server.passive_allocator.stats()
+        assert stats['exhausted'] == 0
+        assert stats['in_use'] == 0
+        assert stats['free'] == 2
+
+    def test_passive_pool_size(self):
+        self.server = self.server_class()
+        self.server.handler.passive_pool_size = 2
+        self.server.start()
+        self.connect()
+        port = self.client.makepasv()[1]
+        assert self.client.makepasv()[1] != port
+        self.client.nlst()
+        stats = self.server.server.passive_allocator.stats()
+        assert stats['pool_misses'] == 1
+        assert stats['pool_hits'] == 2
 
     @retry_on_failure
     def test_use_gmt_times(self):
@@ -1920,6 +3068,85 @@ class TestConfigurableOptions(PyftpdlibTestCase):
 
 
 @pytest.mark.xdist_group(name="serial")
+def free_ports(num):
+    socks = [socket.socket() for _ in range(num)]
+    try:
+        for sock in socks:
+            sock.bind((HOST, 0))
+        return [sock.getsockname()[1] for sock in socks]
+    finally:
+        for sock in socks:
+            sock.close()
+
+
+class TestPassivePortAllocator(PyftpdlibTestCase):
+
+    def test_acquire_release(self):
+        allocator = PassivePortAllocator([1, 2, 3, 2])
+        ports = [allocator.acquire() for _ in range(3)]
+        assert sorted(ports) == [1, 2, 3]
+        assert allocator.acquire() is None
+        allocator.release(ports[1])
+        allocator.release(ports[0])
+        allocator.release(ports[0])
+        # least recently used first
+        assert allocator.acquire() == ports[1]
+        assert allocator.stats()['in_use'] == 2
+        assert allocator.stats()['free'] == 1
+
+    def test_listen(self):
+        allocator = PassivePortAllocator(free_ports(2))
+        sock, port = allocator.listen(socket.AF_INET, HOST)
+        with sock:
+            assert sock.getsockname()[1] == port
+            assert not sock.getblocking()
+            assert allocator.stats()['in_use'] == 1
+        allocator.release(port)
+        assert allocator.stats()['in_use'] == 0
+
+    def test_listen_busy(self):
+        with socket.socket() as busy:
+            busy.bind((HOST, 0))
+            allocator = PassivePortAllocator([busy.getsockname()[1]])
+            sock, port = allocator.listen(socket.AF_INET, HOST)
+            with sock:
+                assert port is None
+                assert sock.getsockname()[1] != busy.getsockname()[1]
+        stats = allocator.stats()
+        assert stats['busy'] == 1
+        assert stats['exhausted'] == 1
+        assert stats['free'] == 1
+
+    def test_pool(self):
+        allocator = PassivePortAllocator(free_ports(3), pool_size=2)
+        allocator.fill(socket.AF_INET, HOST)
+        assert allocator.stats()['in_use'] == 2
+        sock, port = allocator.listen(socket.AF_INET, HOST)
+        with sock:
+            # pending connections are discarded
+            with socket.create_connection((HOST, port)):
+                pass
+            allocator.fill(socket.AF_INET, HOST)
+            allocator.listen(socket.AF_INET, HOST)[0].close()
+        stats = allocator.stats()
+        assert stats['in_use'] == 3
+        assert stats['pool_hits'] == 2
+        assert stats['pool_misses'] == 0
+        allocator.close()
+        # the ones handed out are released by their owner
+        assert allocator.stats()['in_use'] == 2
+
+    def test_pool_kernel_ports(self):
+        allocator = PassivePortAllocator(pool_size=1)
+        allocator.fill(socket.AF_INET, HOST)
+        sock, port = allocator.listen(socket.AF_INET, HOST)
+        with sock:
+            assert port is None
+            assert sock.getsockname()[1]
+        assert allocator.stats()['pool_hits'] == 1
+        allocator.close()
+
+
 class TestCallbacks(PyftpdlibTestCase):
     server_class = FtpdThreadWrapper
     client_class = ftplib.FTP
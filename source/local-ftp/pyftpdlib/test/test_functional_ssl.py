@@ -3,14 +3,19 @@
 # found in the LICENSE file.
 
 import contextlib
+import errno
 import ftplib
+import io
 import os
 import ssl
+from unittest.mock import patch
 
 import OpenSSL  # requires "pip install pyopenssl"
 import pytest
+from OpenSSL import SSL
 
 from pyftpdlib.handlers import TLS_FTPHandler
+from pyftpdlib.metrics import Metrics
 
 from . import CI_TESTING
 from . import GLOBAL_TIMEOUT
@@ -63,6 +68,20 @@ class FTPSClient(ftplib.FTP_TLS):
         self.prot_p()
 
 
+class ResumingFTPSClient(FTPSClient):
+    """A FTPSClient resuming the TLS session of the control
+    connection on data connections.
+    """
+
+    def ntransfercmd(self, cmd, rest=None):
+        conn, size = ftplib.FTP.ntransfercmd(self, cmd, rest)
+        if self._prot_p:
+            conn = self.context.wrap_socket(
+                conn, server_hostname=self.host, session=self.sock.session
+            )
+        return conn, size
+
+
 class FTPSServer(FtpdThreadWrapper):
     """A threaded FTPS server used for functional testing."""
 
@@ -312,6 +331,93 @@ class TestFTPS(PyftpdlibTestCase):
         self.client.prot_p()
         self.client.retrlines('list', lambda x: x)
 
+    def _new_ssl_context(self, **attrs):
+        # create the SSL context again with different options
+        ctx = TLS_FTPHandler.ssl_context
+        proto = TLS_FTPHandler.ssl_protocol
+        self.addCleanup(setattr, TLS_FTPHandler, 'ssl_context', ctx)
+        TLS_FTPHandler.ssl_context = None
+        TLS_FTPHandler.ssl_protocol = SSL.TLS_SERVER_METHOD
+        for name, value in attrs.items():
+            setattr(TLS_FTPHandler, name, value)
+        try:
+            TLS_FTPHandler.get_ssl_context()
+        finally:
+            TLS_FTPHandler.ssl_protocol = proto
+
+    def _setup_ktls(self):
+        self._new_ssl_context(ktls=True)
+        self._setup()
+        self.client.login()
+        self.client.prot_p()
+        testfn = self.get_testfn()
+        data = os.urandom(200000)
+        with open(testfn, 'wb') as f:
+            f.write(data)
+        return testfn, data
+
+    def retr(self, testfn):
+        buf = io.BytesIO()
+        self.client.retrbinary(f'RETR {testfn}', buf.write)
+        return buf.getvalue()
+
+    def test_ktls_unsupported(self):
+        with patch(
+            'pyftpdlib.handlers._ktls_available', return_value=False
+        ), patch('pyftpdlib.handlers.logger.warning') as m:
+            testfn, data = self._setup_ktls()
+        assert m.called
+        assert self.retr(testfn) == data
+
+    def test_ktls_fallback(self):
+        # kernel TLS is reported as enabled on the data connection but
+        # sendfile() fails: the file is sent with SSL_write()
+        testfn, data = self._setup_ktls()
+        with patch(
+            'pyftpdlib.handlers._ktls_tx_enabled', return_value=True
+        ), patch(
+            'os.sendfile', side_effect=OSError(errno.EINVAL, 'invalid')
+        ) as m, patch('pyftpdlib.handlers.logger.warning'):
+            assert self.retr(testfn) == data
+        assert m.called
+
+    def test_ktls_prot_c(self):
+        testfn, data = self._setup_ktls()
+        self.client.prot_c()
+        assert self.retr(testfn) == data
+
+    def _setup_resumption(self, **attrs):
+        self._new_ssl_context(**attrs)
+        TLS_FTPHandler.metrics = Metrics()
+        self.server = FTPSServer()
+        self.server.start()
+        self.client = ResumingFTPSClient(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+        self.client.login(USER, PASSWD)
+        for _ in range(3):
+            self.client.nlst()
+        return TLS_FTPHandler.metrics.tls_handshakes
+
+    def test_session_resumption(self):
+        handshakes = self._setup_resumption()
+        assert handshakes['control', 'full'] == 1
+        assert handshakes['data', 'resumed'] == 3
+        assert ('data', 'full') not in handshakes
+        assert any(
+            x.startswith('TLS handshakes: control 1 full, 0 resumed')
+            for x in TLS_FTPHandler.metrics.report()
+        )
+
+    def test_session_resumption_no_tickets(self):
+        # session IDs cached server-side
+        handshakes = self._setup_resumption(ssl_session_tickets=False)
+        assert handshakes['data', 'resumed'] == 3
+
+    def test_session_cache_disabled(self):
+        handshakes = self._setup_resumption(ssl_session_cache=False)
+        assert handshakes['data', 'full'] == 3
+        assert ('data', 'resumed') not in handshakes
+
     def try_protocol_combo(self, server_protocol, client_protocol):
         self._setup(ssl_protocol=server_protocol)
         self.client.ssl_version = client_protocol
@@ -0,0 +1,310 @@
+# Copyright (C) 2007 Giampaolo Rodola' <g.rodola@gmail.com>.
+# Use of this source code is governed by MIT license that can be
+# found in the LICENSE file.
+
+import ftplib
+import io
+import os
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.hooks import HookDispatcher
+from pyftpdlib.hooks import HookQueueFull
+from pyftpdlib.ioloop import IOLoop
+from pyftpdlib.metrics import Metrics
+
+from . import GLOBAL_TIMEOUT
+from . import PASSWD
+from . import USER
+from . import FtpdThreadWrapper
+from . import PyftpdlibTestCase
+from . import close_client
+
+
+class TestHookDispatcher(PyftpdlibTestCase):
+    """Tests for HookDispatcher class."""
+
+    def setUp(self):
+        super().setUp()
+        self.ioloop = IOLoop.factory()
+        self.addCleanup(self.ioloop.close)
+        self.hooks = HookDispatcher(max_workers=2)
+        self.addCleanup(self.hooks.shutdown)
+
+    def poll(self, cond, count=200):
+        while not cond() and count > 0:
+            self.ioloop.loop(timeout=0.01, blocking=False)
+            count -= 1
+        assert cond()
+
+    def test_register(self):
+        def hook(file):
+            pass
+
+        self.hooks.register('file_received', hook)
+        assert self.hooks.has_hooks('file_received')
+        assert not self.hooks.has_reply_hook('file_received')
+        assert not self.hooks.has_hooks('file_sent')
+        with pytest.raises(ValueError, match="already registered"):
+            self.hooks.register('file_sent', hook)
+        with pytest.raises(ValueError, match="unknown event"):
+            self.hooks.register('foo', hook, name='foo')
+        with pytest.raises(ValueError, match="not supported"):
+            self.hooks.register('login', hook, name='login', reply=True)
+        self.hooks.register('file_sent', hook, name='reply1', reply=True)
+        assert self.hooks.has_reply_hook('file_sent')
+        with pytest.raises(ValueError, match="already has a reply hook"):
+            self.hooks.register('file_sent', hook, name='reply2', reply=True)
+        self.hooks.unregister('reply1')
+        assert not self.hooks.has_hooks('file_sent')
+        with pytest.raises(ValueError, match="no such hook"):
+            self.hooks.unregister('reply1')
+        assert list(self.hooks.stats()['hooks']) == ['hook']
+
+    def test_dispatch(self):
+        calls = []
+        results = []
+
+        def hook(file):
+            calls.append((file, threading.current_thread()))
+            return file.upper()
+
+        self.hooks.register('file_sent', hook, reply=True)
+        self.hooks.dispatch(
+            self.ioloop,
+            'file_sent',
+            ('foo',),
+            lambda ret, err: results.append((ret, err)),
+        )
+        self.poll(lambda: results)
+        assert results == [('FOO', None)]
+        assert calls[0][0] == 'foo'
+        assert calls[0][1] is not threading.current_thread()
+        stats = self.hooks.stats()
+        assert stats['pending'] == 0
+        assert stats['hooks']['hook']['completed'] == 1
+        assert stats['hooks']['hook']['running'] == 0
+        # no hooks for this event
+        self.hooks.dispatch(self.ioloop, 'login', ('user',))
+
+    def test_retries(self):
+        calls = []
+        results = []
+
+        def hook(file):
+            calls.append(file)
+            if len(calls) < 3:
+                raise ValueError(len(calls))
+
+        self.hooks.register(
+            'file_sent', hook, retries=2, retry_delay=0, reply=True
+        )
+        self.hooks.dispatch(
+            self.ioloop,
+            'file_sent',
+            ('foo',),
+            lambda ret, err: results.append((ret, err)),
+        )
+        self.poll(lambda: results)
+        assert results == [(None, None)]
+        assert len(calls) == 3
+        stats = self.hooks.stats()['hooks']['hook']
+        assert stats['retried'] == 2
+        assert stats['completed'] == 1
+        assert stats['failed'] == 0
+
+    def test_failure(self):
+        results = []
+
+        def hook(file):
+            raise ValueError(file)
+
+        self.hooks.register(
+            'file_sent', hook, retries=1, retry_delay=0, reply=True
+        )
+        with patch('pyftpdlib.hooks.logger.error') as m:
+            self.hooks.dispatch(
+                self.ioloop,
+                'file_sent',
+                ('foo',),
+                lambda ret, err: results.append((ret, err)),
+            )
+            self.poll(lambda: results)
+        assert isinstance(results[0][1], ValueError)
+        assert m.called
+        assert self.hooks.stats()['hooks']['hook']['failed'] == 1
+
+    def test_concurrency(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+        event = threading.Event()
+
+        def hook(file):
+            with lock:
+                running.append(file)
+                peak.append(len(running))
+            event.wait(GLOBAL_TIMEOUT)
+            with lock:
+                running.remove(file)
+
+        self.hooks.register('file_received', hook, concurrency=1)
+        for i in range(3):
+            self.hooks.dispatch(self.ioloop, 'file_received', (str(i),))
+        stats = self.hooks.stats()
+        assert stats['pending'] == 3
+        assert stats['hooks']['hook']['running'] == 1
+        assert stats['hooks']['hook']['queued'] == 2
+        event.set()
+        self.poll(lambda: self.hooks.stats()['pending'] == 0)
+        assert max(peak) == 1
+        assert self.hooks.stats()['hooks']['hook']['completed'] == 3
+
+    def test_max_queue(self):
+        results = []
+        event = threading.Event()
+        self.hooks.max_queue = 1
+        self.hooks.register(
+            'file_sent', lambda file: event.wait(GLOBAL_TIMEOUT), name='hook',
+            reply=True,
+        )  # fmt: skip
+        with patch('pyftpdlib.hooks.logger.warning') as m:
+            for _ in range(2):
+                self.hooks.dispatch(
+                    self.ioloop,
+                    'file_sent',
+                    ('foo',),
+                    lambda ret, err: results.append((ret, err)),
+                )
+        assert m.called
+        self.poll(lambda: results)
+        assert isinstance(results[0][1], HookQueueFull)
+        event.set()
+        self.poll(lambda: len(results) == 2)
+        assert self.hooks.stats()['hooks']['hook']['dropped'] == 1
+
+    def test_processes(self):
+        results = []
+        hooks = HookDispatcher(max_workers=1, processes=True)
+        self.addCleanup(hooks.shutdown)
+        # functions and arguments must be picklable
+        hooks.register('file_sent', os.path.basename, reply=True)
+        hooks.dispatch(
+            self.ioloop,
+            'file_sent',
+            ('/a/b',),
+            lambda ret, err: results.append((ret, err)),
+        )
+        self.poll(lambda: results, count=1000)
+        assert results == [('b', None)]
+
+
+class TestFtpHooks(PyftpdlibTestCase):
+    """Test hook_dispatcher with a running server."""
+
+    def setUp(self):
+        super().setUp()
+        self.hooks = HookDispatcher(max_workers=2)
+        FTPHandler.hook_dispatcher = self.hooks
+        self.server = FtpdThreadWrapper()
+        self.server.start()
+        self.client = ftplib.FTP(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+
+    def tearDown(self):
+        close_client(self.client)
+        # worker threads must be gone before the server is stopped
+        self.hooks.shutdown()
+        self.server.stop()
+        super().tearDown()
+
+    def test_hooks(self):
+        events = {}
+        done = threading.Semaphore(0)
+
+        def hook(name):
+            def fun(arg):
+                events[name] = arg
+                done.release()
+
+            return fun
+
+        for event in ('login', 'file_received', 'file_sent', 'logout'):
+            self.hooks.register(event, hook(event), event)
+        self.client.login(USER, PASSWD)
+        testfn = self.get_testfn()
+        self.client.storbinary(f'STOR {testfn}', io.BytesIO(b'x'))
+        self.client.retrbinary(f'RETR {testfn}', lambda x: x)
+        self.client.quit()
+        for _ in range(4):
+            assert done.acquire(timeout=GLOBAL_TIMEOUT)
+        path = os.path.abspath(testfn)
+        assert events == {
+            'login': USER,
+            'file_received': path,
+            'file_sent': path,
+            'logout': USER,
+        }
+
+    def test_reply(self):
+        self.hooks.register(
+            'file_received',
+            lambda file: f"Stored as {os.path.basename(file)}.",
+            'reply',
+            reply=True,
+        )
+        self.client.login(USER, PASSWD)
+        testfn = self.get_testfn()
+        resp = self.client.storbinary(f'STOR {testfn}', io.BytesIO(b'x'))
+        assert resp == f"226 Stored as {testfn}."
+
+    def test_reply_error(self):
+        def hook(file):
+            raise ValueError(file)
+
+        self.hooks.register('file_received', hook, reply=True)
+        self.client.login(USER, PASSWD)
+        testfn = self.get_testfn()
+        with patch('pyftpdlib.hooks.logger.error'):
+            with pytest.raises(ftplib.error_temp, match="451"):
+                self.client.storbinary(f'STOR {testfn}', io.BytesIO(b'x'))
+
+    def test_pipelined_cmds(self):
+        # commands received while the reply hook is running are
+        # processed after the transfer reply
+        started = threading.Event()
+        event = threading.Event()
+
+        def hook(file):
+            started.set()
+            event.wait(GLOBAL_TIMEOUT)
+
+        self.hooks.register('file_received', hook, reply=True)
+        self.client.login(USER, PASSWD)
+        testfn = self.get_testfn()
+        conn = self.client.transfercmd(f'STOR {testfn}')
+        conn.sendall(b'x')
+        conn.close()
+        assert started.wait(GLOBAL_TIMEOUT)
+        self.client.sock.sendall(b'NOOP\r\n')
+        event.set()
+        assert self.client.getresp()[:3] == '226'
+        assert self.client.getresp()[:3] == '200'
+
+    def test_metrics(self):
+        # components are attached to metrics as sessions start
+        FTPHandler.metrics = Metrics()
+        close_client(self.client)
+        self.client = ftplib.FTP(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+        done = threading.Event()
+        self.hooks.register('login', lambda user: done.set(), 'hook')
+        self.client.login(USER, PASSWD)
+        assert done.wait(GLOBAL_TIMEOUT)
+        metrics = FTPHandler.metrics
+        assert 'hook' in metrics.snapshot()['hooks']
+        assert any(x.startswith('hook hook:') for x in metrics.report())
+        assert b'ftp_hook_calls_total{hook="hook"' in metrics.prometheus()
@@ -5,6 +5,7 @@
 import contextlib
 import errno
 import socket
+import threading
 import time
 from unittest.mock import Mock
 from unittest.mock import patch
@@ -13,9 +14,14 @@ import pytest
 
 import pyftpdlib.ioloop
 from pyftpdlib.ioloop import Acceptor
+from pyftpdlib.ioloop import AsyncioLoop
+from pyftpdlib.ioloop import _CallEvery
+from pyftpdlib.ioloop import _CallLater
 from pyftpdlib.ioloop import AsyncChat
 from pyftpdlib.ioloop import IOLoop
 from pyftpdlib.ioloop import RetryError
+from pyftpdlib.ioloop import ThreadPool
+from pyftpdlib.ioloop import TimerWheel
 
 from . import POSIX
 from . import PyftpdlibTestCase
@@ -294,6 +300,54 @@ class KqueueIOLoopTestCase(PyftpdlibTestCase, BaseIOLoopTestCase):
     ioloop_class = getattr(pyftpdlib.ioloop, "Kqueue", None)
 
 
+# ===================================================================
+# asyncio
+# ===================================================================
+
+
+class AsyncioIOLoopTestCase(PyftpdlibTestCase, BaseIOLoopTestCase):
+    ioloop_class = AsyncioLoop
+
+    def test_poll(self):
+        s, rd, wr = self.register()
+        handler = s.socket_map[rd]
+        handler.handle_read_event = Mock()
+        handler.handle_write_event = Mock()
+        handler.writable = lambda: True
+        s.unregister(wr)
+        # nothing to read: the timeout expires
+        t = time.monotonic()
+        s.poll(0.05)
+        assert time.monotonic() - t >= 0.04
+        assert not handler.handle_read_event.called
+        # a single iteration is run as soon as there's data
+        wr.send(b'x')
+        s.poll(5)
+        assert handler.handle_read_event.call_count == 1
+        s.modify(rd, s.WRITE)
+        s.poll(5)
+        assert handler.handle_read_event.call_count == 1
+        assert handler.handle_write_event.call_count == 1
+
+    def test_loop_factory(self):
+        import asyncio  # noqa: PLC0415
+
+        loop = asyncio.new_event_loop()
+        with patch.object(AsyncioLoop, 'loop_factory', lambda: loop):
+            s = self.ioloop_class()
+        s.close()
+        assert loop.is_closed()
+
+    def test_close_from_loop(self):
+        s, rd, wr = self.register()
+        handler = s.socket_map[rd]
+        handler.handle_read_event = lambda: s.call_later(0, s.close)
+        wr.send(b'x')
+        s.loop()
+        assert not s.socket_map
+        assert s._loop.is_closed()
+
+
 class TestCallLater(PyftpdlibTestCase):
     """Tests for CallLater class."""
 
@@ -429,6 +483,11 @@ class TestCallEvery(PyftpdlibTestCase):
             x.reset()
         x.cancel()
 
+    def test_slots(self):
+        x = self.ioloop.call_every(3, lambda: 0)
+        assert not hasattr(x, '__dict__')
+        x.cancel()
+
     def test_only_once(self):
         # make sure that callback is called only once per-loop
         def fun():
@@ -495,6 +554,205 @@ class TestCallEvery(PyftpdlibTestCase):
         assert ls
 
 
+class TestCallLaterTimerWheel(TestCallLater):
+    """Tests for CallLater class using a timer wheel scheduler."""
+
+    def setUp(self):
+        super().setUp()
+        self.ioloop.sched = TimerWheel(resolution=0.001)
+
+
+class TestCallEveryTimerWheel(TestCallEvery):
+    """Tests for CallEvery class using a timer wheel scheduler."""
+
+    def setUp(self):
+        super().setUp()
+        self.ioloop.sched = TimerWheel(resolution=0.001)
+
+
+class TestTimerWheel(PyftpdlibTestCase):
+    """Tests for TimerWheel class, with a fake clock."""
+
+    def setUp(self):
+        super().setUp()
+        self.now = 1000.0
+        patcher = patch("pyftpdlib.ioloop.timer", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 3 wheels of 4 slots of 1 sec, holding 64 secs
+        self.sched = TimerWheel(resolution=1, wheel_size=4, levels=3)
+        self.addCleanup(self.sched.close)
+        self.calls = []
+
+    def call_later(self, seconds, klass=_CallLater):
+        return klass(
+            seconds, self.calls.append, seconds, _scheduler=self.sched
+        )
+
+    def run_until(self, when):
+        while self.now < when:
+            self.now += 0.5
+            self.sched.poll()
+
+    def test_order(self):
+        delays = [50, 0, 3, 1, 17, 4, 2.5, 63]
+        for x in delays:
+            self.call_later(x)
+        assert len(self.sched._tasks) == len(delays)
+        self.sched.poll()
+        assert self.calls == [0]
+        self.run_until(self.now + 64)
+        assert self.calls == sorted(delays)
+        assert not self.sched._tasks
+
+    def test_never_early(self):
+        ls = []
+        for x in (0.2, 1.7, 5.3, 20.9):
+            _CallLater(
+                x,
+                lambda x=x, t=self.now: ls.append(self.now - t >= x),
+                _scheduler=self.sched,
+            )
+        self.run_until(self.now + 30)
+        assert ls == [True] * 4
+
+    def test_beyond_span(self):
+        self.call_later(100)
+        self.run_until(self.now + 99)
+        assert self.calls == []
+        self.run_until(self.now + 2)
+        assert self.calls == [100]
+
+    def test_cancel(self):
+        call = self.call_later(10)
+        self.call_later(20)
+        call.cancel()
+        assert len(self.sched._tasks) == 1
+        assert sum(len(x) for w in self.sched._wheels for x in w.values()) == 1
+        self.run_until(self.now + 30)
+        assert self.calls == [20]
+
+    def test_reset(self):
+        call = self.call_later(10)
+        self.run_until(self.now + 8)
+        call.reset()
+        self.run_until(self.now + 9)
+        assert self.calls == []
+        self.run_until(self.now + 2)
+        assert self.calls == [10]
+
+    def test_call_every(self):
+        self.call_later(3, klass=_CallEvery)
+        self.run_until(self.now + 10)
+        assert self.calls == [3, 3, 3]
+
+    def test_poll_timeout(self):
+        assert self.sched.poll() is None
+        self.call_later(2)
+        assert 1 <= self.sched.poll() <= 2
+        self.call_later(0, klass=_CallEvery)
+        assert self.sched.poll() == 0
+
+    def test_ioloop(self):
+        class IOLoopWithWheel(IOLoop):
+            scheduler_class = TimerWheel
+
+        with contextlib.closing(IOLoopWithWheel()) as ioloop:
+            assert isinstance(ioloop.sched, TimerWheel)
+            ioloop.call_later(0, self.calls.append, 1)
+            ioloop.loop(timeout=0.01, blocking=False)
+        assert self.calls == [1]
+
+
+class TestAddCallback(PyftpdlibTestCase):
+    """Tests for IOLoop.add_callback()."""
+
+    def setUp(self):
+        super().setUp()
+        self.ioloop = IOLoop.factory()
+        self.addCleanup(self.ioloop.close)
+
+    def poll(self, cond, count=100):
+        while not cond() and count > 0:
+            self.ioloop.loop(timeout=0.01, blocking=False)
+            count -= 1
+
+    def test_from_thread(self):
+        ls = []
+        self.ioloop._get_waker()
+        t = threading.Thread(
+            target=self.ioloop.add_callback,
+            args=(lambda: ls.append(threading.current_thread()),),
+        )
+        t.start()
+        t.join()
+        self.poll(lambda: ls)
+        assert ls == [threading.current_thread()]
+
+    def test_exception(self):
+        ls = []
+        self.ioloop._get_waker()
+        self.ioloop.add_callback(lambda: 1 / 0)
+        self.ioloop.add_callback(ls.append, 1)
+        with patch("pyftpdlib.ioloop.logger.error") as m:
+            self.poll(lambda: ls)
+        assert ls == [1]
+        assert m.called
+
+    def test_close(self):
+        waker = self.ioloop._get_waker()
+        self.ioloop.close()
+        assert waker._closed
+        assert self.ioloop._waker is None
+        # must not raise
+        waker.wake()
+
+
+class TestThreadPool(PyftpdlibTestCase):
+    """Tests for ThreadPool class."""
+
+    def setUp(self):
+        super().setUp()
+        self.ioloop = IOLoop.factory()
+        self.addCleanup(self.ioloop.close)
+        self.pool = ThreadPool(max_workers=2)
+        self.addCleanup(self.pool.shutdown)
+
+    def run_pool(self, function):
+        ls = []
+        self.pool.submit(
+            self.ioloop, "test", function, lambda *args: ls.append(args)
+        )
+        count = 100
+        while not ls and count > 0:
+            self.ioloop.loop(timeout=0.01, blocking=False)
+            count -= 1
+        assert len(ls) == 1
+        return ls[0]
+
+    def test_submit(self):
+        ret, err = self.run_pool(threading.current_thread)
+        assert ret is not threading.current_thread()
+        assert err is None
+
+    def test_submit_exc(self):
+        ret, err = self.run_pool(lambda: 1 / 0)
+        assert ret is None
+        assert isinstance(err, ZeroDivisionError)
+
+    def test_stats(self):
+        self.run_pool(lambda: time.sleep(0.01))
+        self.run_pool(lambda: 1 / 0)
+        stats = self.pool.stats()
+        assert stats['max_workers'] == 2
+        assert stats['queued'] == 0
+        assert stats['running'] == 0
+        assert stats['completed'] == 1
+        assert stats['failed'] == 1
+        assert stats['ops']['test']['calls'] == 2
+        assert stats['ops']['test']['max_time'] >= 0.01
+
+
 class TestAsyncChat(PyftpdlibTestCase):
 
     def get_connected_handler(self):
@@ -526,6 +784,78 @@ class TestAsyncChat(PyftpdlibTestCase):
                     assert send.called
                     assert handle_close.called
 
+    def test_sendmsg_retry(self):
+        ac = self.get_connected_handler()
+        for errnum in pyftpdlib.ioloop._ERRNOS_RETRY:
+            with patch(
+                "pyftpdlib.ioloop.socket.socket.sendmsg",
+                side_effect=OSError(errnum, ""),
+            ) as m:
+                assert ac.sendmsg([b"x", b"y"]) == 0
+                assert m.called
+
+    def test_sendmsg_disconnect(self):
+        ac = self.get_connected_handler()
+        for errnum in pyftpdlib.ioloop._ERRNOS_DISCONNECTED:
+            with patch(
+                "pyftpdlib.ioloop.socket.socket.sendmsg",
+                side_effect=OSError(errnum, ""),
+            ) as send:
+                with patch.object(ac, "handle_close") as handle_close:
+                    assert ac.sendmsg([b"x", b"y"]) == 0
+                    assert send.called
+                    assert handle_close.called
+
+    @pytest.mark.skipif(not POSIX, reason="UNIX only")
+    def test_send_queued(self):
+        rd, wr = socketpair()
+        self.addCleanup(rd.close)
+        ac = AsyncChat(sock=wr)
+        self.addCleanup(ac.close)
+        ac.producer_fifo.extend([b"foo", bytearray(b"bar"), memoryview(b"x")])
+        with patch.object(ac, "sendmsg", wraps=ac.sendmsg) as m:
+            ac.send_queued()
+        assert m.call_count == 1
+        assert rd.recv(1024) == b"foobarx"
+        assert not ac.producer_fifo
+
+    def test_send_queued_partial(self):
+        ac = self.get_connected_handler()
+        ac.connected = True
+        ac.producer_fifo.extend([b"foo", b"bar", None])
+        with patch.object(ac, "sendmsg", return_value=4) as m:
+            ac.send_queued()
+        assert m.call_args[0][0] == [b"foo", b"bar"]
+        assert len(ac.producer_fifo) == 2
+        first = ac.producer_fifo[0]
+        assert isinstance(first, memoryview)
+        assert first == b"ar"
+        assert ac.producer_fifo[1] is None
+
+    def test_send_queued_max_size(self):
+        ac = self.get_connected_handler()
+        ac.connected = True
+        ac.ac_out_buffer_size = 4
+        data = b"x" * 10
+        ac.producer_fifo.append(data)
+        with patch.object(ac, "send", return_value=4) as m:
+            ac.send_queued()
+        assert len(m.call_args[0][0]) == 4
+        assert ac.producer_fifo[0] == data[4:]
+
+    def test_send_queued_producer(self):
+        ac = self.get_connected_handler()
+        ac.connected = True
+        producer = Mock()
+        producer.more.side_effect = [b"foo", b""]
+        ac.producer_fifo.extend([producer, b"bar"])
+        with patch.object(ac, "send", return_value=3) as m:
+            ac.send_queued()
+            assert m.call_args[0][0] == b"foo"
+            ac.send_queued()
+            assert m.call_args[0][0] == b"bar"
+        assert not ac.producer_fifo
+
     def test_recv_retry(self):
         ac = self.get_connected_handler()
         for errnum in pyftpdlib.ioloop._ERRNOS_RETRY:
@@ -0,0 +1,210 @@
+# Copyright (C) 2007 Giampaolo Rodola' <g.rodola@gmail.com>.
+# Use of this source code is governed by MIT license that can be
+# found in the LICENSE file.
+
+import ftplib
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+from pyftpdlib.log import BackgroundHandler
+from pyftpdlib.log import JSONFormatter
+
+from . import GLOBAL_TIMEOUT
+from . import PASSWD
+from . import USER
+from . import FtpdThreadWrapper
+from . import PyftpdlibTestCase
+from . import close_client
+
+
+def make_record(msg, *args, **fields):
+    record = logging.LogRecord(
+        'pyftpdlib', logging.INFO, __file__, 1, msg, args, None
+    )
+    if fields:
+        record.fields = fields
+    return record
+
+
+class TestJSONFormatter(PyftpdlibTestCase):
+
+    def test_format(self):
+        line = JSONFormatter().format(
+            make_record('hello %s', 'world', cmd='RETR', bytes=10)
+        )
+        assert '\n' not in line
+        out = json.loads(line)
+        assert out['level'] == 'INFO'
+        assert out['msg'] == 'hello world'
+        assert out['cmd'] == 'RETR'
+        assert out['bytes'] == 10
+        assert len(out['time']) == len('2000-01-01 00:00:00.000')
+
+    def test_exception(self):
+        try:
+            1 / 0  # noqa: B018
+        except ZeroDivisionError:
+            record = logging.LogRecord(
+                'pyftpdlib', logging.ERROR, __file__, 1, 'err', None,
+                sys.exc_info(),
+            )  # fmt: skip
+        out = json.loads(JSONFormatter().format(record))
+        assert 'ZeroDivisionError' in out['exc']
+
+
+class TestBackgroundHandler(PyftpdlibTestCase):
+
+    def make_handler(self, **kwargs):
+        # by default the writer thread only wakes up on flush()
+        kwargs.setdefault('flush_interval', 3600)
+        kwargs.setdefault('batch_size', 1000)
+        handler = BackgroundHandler(**kwargs)
+        self.addCleanup(handler.close)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        return handler
+
+    def test_stream(self):
+        stream = io.StringIO()
+        handler = self.make_handler(stream=stream)
+        for i in range(3):
+            handler.handle(make_record('line %s', i))
+        assert stream.getvalue() == ''
+        handler.flush()
+        assert stream.getvalue() == 'line 0\nline 1\nline 2\n'
+        stats = handler.stats()
+        assert stats['written'] == 3
+        assert stats['batches'] == 1
+        assert stats['queued'] == 0
+
+    def test_batch_size(self):
+        stream = io.StringIO()
+        handler = self.make_handler(stream=stream, batch_size=2)
+        handler.handle(make_record('a'))
+        handler.handle(make_record('b'))
+        # the writer is woken up
+        for _ in range(100):
+            if stream.getvalue():
+                break
+            time.sleep(0.01)
+        assert stream.getvalue() == 'a\nb\n'
+
+    def test_max_queue(self):
+        stream = io.StringIO()
+        handler = self.make_handler(stream=stream, max_queue=2)
+        for x in 'abc':
+            handler.handle(make_record(x))
+        handler.flush()
+        assert stream.getvalue() == 'a\nb\n'
+        assert handler.stats()['dropped'] == 1
+
+    def test_file(self):
+        testfn = self.get_testfn()
+        handler = self.make_handler(filename=testfn)
+        handler.handle(make_record('hello'))
+        handler.close()
+        with open(testfn) as f:
+            assert f.read() == 'hello\n'
+        # records are appended
+        handler = self.make_handler(filename=testfn)
+        handler.handle(make_record('world'))
+        handler.close()
+        with open(testfn) as f:
+            assert f.read() == 'hello\nworld\n'
+
+    def test_rotation(self):
+        testfn = self.get_testfn()
+        self.addCleanup(
+            lambda: [
+                os.remove(f'{testfn}.{i}')
+                for i in (1, 2)
+                if os.path.exists(f'{testfn}.{i}')
+            ]
+        )
+        handler = self.make_handler(
+            filename=testfn, max_bytes=10, backup_count=2
+        )
+        for x in ('aaaaaaa', 'bbbbbbb', 'ccccccc', 'ddddddd'):
+            handler.handle(make_record(x))
+            handler.flush()
+        assert handler.stats()['rotations'] == 3
+        with open(testfn) as f:
+            assert f.read() == 'ddddddd\n'
+        with open(testfn + '.1') as f:
+            assert f.read() == 'ccccccc\n'
+        with open(testfn + '.2') as f:
+            assert f.read() == 'bbbbbbb\n'
+        assert not os.path.exists(testfn + '.3')
+
+    def test_close(self):
+        stream = io.StringIO()
+        handler = self.make_handler(stream=stream)
+        handler.handle(make_record('a'))
+        thread = handler._thread
+        handler.close()
+        assert not thread.is_alive()
+        assert stream.getvalue() == 'a\n'
+        # idempotent
+        handler.close()
+
+
+class TestFtpJSONLogging(PyftpdlibTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.stream = io.StringIO()
+        self.handler = BackgroundHandler(
+            stream=self.stream, flush_interval=3600
+        )
+        self.handler.setFormatter(JSONFormatter())
+        self.logger = logging.getLogger('pyftpdlib')
+        self.level = self.logger.level
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+        self.server = FtpdThreadWrapper()
+        self.server.start()
+        self.client = ftplib.FTP(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+        self.client.login(USER, PASSWD)
+
+    def tearDown(self):
+        close_client(self.client)
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+        # the writer thread must be gone before the server is stopped
+        self.handler.close()
+        self.server.stop()
+        super().tearDown()
+
+    def wait_record(self, cmd):
+        # the command is logged after the response is sent
+        for _ in range(100):
+            self.handler.flush()
+            for line in self.stream.getvalue().splitlines():
+                record = json.loads(line)
+                if record.get('cmd') == cmd:
+                    return record
+            time.sleep(0.01)
+        raise AssertionError(f"{cmd} was not logged")
+
+    def test_log_cmd(self):
+        testfn = self.get_testfn()
+        self.client.mkd(testfn)
+        rec = self.wait_record('MKD')
+        assert rec['code'] == 257
+        assert rec['arg'] == os.path.abspath(testfn)
+        assert rec['username'] == USER
+        assert rec['remote_ip'] == self.client.sock.getsockname()[0]
+        assert rec['remote_port'] == self.client.sock.getsockname()[1]
+
+    def test_log_transfer(self):
+        testfn = self.get_testfn()
+        self.client.storbinary(f'STOR {testfn}', io.BytesIO(b'x' * 10))
+        rec = self.wait_record('STOR')
+        assert rec['bytes'] == 10
+        assert rec['receive'] is True
+        assert rec['completed'] is True
+        assert rec['file'] == os.path.abspath(testfn)
@@ -0,0 +1,360 @@
+# Copyright (C) 2007 Giampaolo Rodola' <g.rodola@gmail.com>.
+# Use of this source code is governed by MIT license that can be
+# found in the LICENSE file.
+
+import ftplib
+import importlib.util
+import io
+import os
+import socket
+import warnings
+from unittest.mock import patch
+
+import pytest
+
+import pyftpdlib
+from pyftpdlib.handlers import PassivePortAllocator
+from pyftpdlib.metrics import Histogram
+from pyftpdlib.metrics import Metrics
+from pyftpdlib.metrics import MetricsServer
+
+from . import GLOBAL_TIMEOUT
+from . import HOME
+from . import HOST
+from . import PASSWD
+from . import POSIX
+from . import USER
+from . import FtpdThreadWrapper
+from . import PyftpdlibTestCase
+from . import call_until
+from . import close_client
+
+
+# the local-ftp command line, when pyftpdlib is the vendored copy
+CLI = os.path.join(os.path.dirname(pyftpdlib.__file__), '..', '__main__.py')
+
+
+class FakeDTP:
+    def __init__(self, receive=False):
+        self.receive = receive
+        self.tot_bytes_sent = 0
+        self.tot_bytes_received = 0
+
+
+def http_get(sock, path='/metrics'):
+    sock.settimeout(GLOBAL_TIMEOUT)
+    with sock:
+        sock.sendall(f'GET {path} HTTP/1.0\r\nHost: x\r\n\r\n'.encode())
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    head, _, body = b''.join(chunks).partition(b'\r\n\r\n')
+    return head.split(b'\r\n')[0].decode(), body.decode()
+
+
+class TestHistogram(PyftpdlibTestCase):
+
+    def test_observe(self):
+        h = Histogram((1, 10, 100))
+        for x in (0.5, 1, 5, 50, 500, 5000):
+            h.observe(x)
+        assert h.counts == [2, 1, 1, 2]
+        assert h.count == 6
+        assert h.sum == 5556.5
+        assert h.mean() == 5556.5 / 6
+
+    def test_quantile(self):
+        h = Histogram((1, 10, 100))
+        assert h.quantile(0.5) == 0
+        for _ in range(99):
+            h.observe(0.1)
+        h.observe(50)
+        assert h.quantile(0.5) == 1
+        assert h.quantile(0.99) == 1
+        assert h.quantile(1) == 100
+        h.observe(1000)
+        assert h.quantile(1) == 100
+
+    def test_prometheus(self):
+        h = Histogram((1, 10))
+        h.observe(0.5)
+        h.observe(5)
+        h.observe(50)
+        assert h.prometheus('x', 'cmd="A"') == [
+            'x_bucket{cmd="A",le="1"} 1',
+            'x_bucket{cmd="A",le="10"} 2',
+            'x_bucket{cmd="A",le="+Inf"} 3',
+            'x_sum{cmd="A"} 55.5',
+            'x_count{cmd="A"} 3',
+        ]
+        assert h.prometheus('x')[0] == 'x_bucket{le="1"} 1'
+        assert h.prometheus('x')[-1] == 'x_count 3'
+
+
+class TestMetrics(PyftpdlibTestCase):
+
+    def test_connections(self):
+        metrics = Metrics()
+        ctrl = object()
+        metrics.control_opened(ctrl)
+        assert metrics.snapshot()['control_connections'] == 1
+        metrics.control_closed(ctrl)
+        metrics.control_closed(ctrl)
+        snap = metrics.snapshot()
+        assert snap['control_connections'] == 0
+        assert snap['control_accepted'] == 1
+
+    def test_transfers(self):
+        metrics = Metrics()
+        down, up = FakeDTP(), FakeDTP(receive=True)
+        metrics.data_opened(down)
+        metrics.data_opened(up)
+        down.tot_bytes_sent = 100
+        up.tot_bytes_received = 10
+        # bytes of open data channels are counted
+        assert metrics.bytes_transferred() == (100, 10)
+        assert metrics.snapshot()['data_connections'] == 2
+        down.tot_bytes_sent = 200
+        metrics.data_closed(down, sendfile=True)
+        metrics.data_closed(down, sendfile=True)
+        metrics.data_closed(up, sendfile=False)
+        assert metrics.bytes_transferred() == (200, 10)
+        snap = metrics.snapshot()
+        assert snap['data_connections'] == 0
+        assert snap['data_accepted'] == 2
+        assert snap['transfers'] == {
+            ('download', 'sendfile'): 1,
+            ('upload', 'recv'): 1,
+        }
+
+    def test_rates(self):
+        now = [1000.0]
+        with patch('pyftpdlib.metrics.timer', lambda: now[0]):
+            metrics = Metrics(rate_window=2)
+            dtp = FakeDTP()
+            metrics.data_opened(dtp)
+            assert metrics.rates() == (0, 0)
+            for _ in range(5):
+                now[0] += 1
+                dtp.tot_bytes_sent += 1000
+                metrics.observe_iteration(0.001, now[0])
+            # averaged over the last 2 seconds only
+            assert len(metrics._samples) == 3
+            assert metrics.rates() == (1000, 0)
+            now[0] += 0.5
+            dtp.tot_bytes_sent += 1000
+            assert metrics.rates() == (3000 / 2.5, 0)
+
+    def test_observe(self):
+        metrics = Metrics()
+        metrics.observe_command('LIST', 0.002)
+        metrics.observe_command('LIST', 0.004)
+        metrics.observe_listing(150)
+        metrics.observe_iteration(0.0002, 0)
+        snap = metrics.snapshot()
+        assert snap['commands']['LIST'][0] == 2
+        assert snap['commands']['LIST'][1] == pytest.approx(0.003)
+        assert snap['listings'] == (1, 150)
+        assert snap['iterations'][0] == 1
+
+    def test_report(self):
+        metrics = Metrics()
+        metrics.observe_command('RETR', 0.002)
+        lines = metrics.report()
+        assert lines[0].startswith('uptime: ')
+        assert lines[-1].startswith('RETR: 1 (avg 2.000 ms')
+
+    def test_prometheus(self):
+        metrics = Metrics()
+        metrics.observe_command('RETR', 0.002)
+        metrics.data_opened(FakeDTP())
+        text = metrics.prometheus().decode()
+        assert text.endswith('\n')
+        lines = text.splitlines()
+        assert '# TYPE ftp_command_duration_seconds histogram' in lines
+        assert 'ftp_command_duration_seconds_count{command="RETR"} 1' in lines
+        assert 'ftp_data_connections 1' in lines
+        assert 'ftp_sent_bytes_total 0' in lines
+        for line in lines:
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                float(value)
+
+    def test_passive_ports(self):
+        metrics = Metrics()
+        assert metrics.snapshot()['passive_ports'] is None
+        metrics.passive_allocator = PassivePortAllocator([1, 2, 3])
+        metrics.passive_allocator.acquire()
+        assert metrics.snapshot()['passive_ports']['in_use'] == 1
+        assert any(
+            x.startswith('passive ports: 1 in use, 2 free')
+            for x in metrics.report()
+        )
+        lines = metrics.prometheus().decode().splitlines()
+        assert 'ftp_passive_ports{state="free"} 2' in lines
+        assert 'ftp_passive_ports_exhausted_total 0' in lines
+
+    def test_tls_handshakes(self):
+        metrics = Metrics()
+        assert not any(x.startswith('TLS') for x in metrics.report())
+        metrics.tls_handshake('control', False)
+        metrics.tls_handshake('data', True)
+        metrics.tls_handshake('data', True)
+        assert metrics.snapshot()['tls_handshakes'] == {
+            ('control', 'full'): 1,
+            ('data', 'resumed'): 2,
+        }
+        assert (
+            'TLS handshakes: control 1 full, 0 resumed; data 0 full, '
+            '2 resumed'
+        ) in metrics.report()
+        lines = metrics.prometheus().decode().splitlines()
+        assert (
+            'ftp_tls_handshakes_total{channel="data",type="resumed"} 2'
+        ) in lines
+
+
+class TestFtpMetrics(PyftpdlibTestCase):
+    """Test metrics collected by a running server, SITE STATS and
+    MetricsServer.
+    """
+
+    server_class = FtpdThreadWrapper
+    client_class = ftplib.FTP
+
+    def setUp(self):
+        super().setUp()
+        self.metrics = Metrics()
+        self.server = self.server_class()
+        self.server.handler.metrics = self.metrics
+        self.ioloop = self.server.server.ioloop
+        self.ioloop.metrics = self.metrics
+        self.server.start()
+        self.client = self.client_class(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+        self.client.login(USER, PASSWD)
+        self.testfn = self.get_testfn()
+        self.metrics_server = None
+
+    def tearDown(self):
+        close_client(self.client)
+        if self.metrics_server is not None:
+            with self.server.lock:
+                self.metrics_server.close()
+        self.ioloop.metrics = None
+        self.server.stop()
+        super().tearDown()
+
+    def test_collected(self):
+        data = b'abcde12345' * 10000
+        with open(self.testfn, 'wb') as file:
+            file.write(data)
+        self.client.retrbinary("retr " + self.testfn, lambda x: None)
+        self.client.storbinary("stor " + self.testfn, io.BytesIO(b'x' * 10))
+        self.client.nlst()
+        snap = self.metrics.snapshot()
+        assert snap['control_connections'] == 1
+        assert snap['data_connections'] == 0
+        assert snap['data_accepted'] == 3
+        assert snap['bytes_sent'] >= len(data)
+        assert snap['bytes_received'] == 10
+        assert snap['listings'][0] == 1
+        assert snap['iterations'][0] > 0
+        for cmd in ('USER', 'PASS', 'RETR', 'STOR', 'NLST'):
+            assert snap['commands'][cmd][0] == 1, cmd
+        transfers = snap['transfers']
+        assert transfers[('upload', 'recv')] == 1
+        if hasattr(os, 'sendfile'):
+            assert transfers[('download', 'sendfile')] == 1
+        assert sum(n for (d, _), n in transfers.items() if d == 'download') == 2
+        self.client.quit()
+        call_until(
+            lambda: self.metrics.snapshot()['control_connections'],
+            "ret == 0",
+        )
+
+    def test_site_stats(self):
+        resp = self.client.sendcmd('site stats')
+        lines = resp.splitlines()
+        assert lines[0] == '211-Server statistics:'
+        assert lines[-1] == '211 End of statistics.'
+        assert ' control connections: 1 (total 1)' in lines
+        assert any(x.startswith(' PASS: 1 ') for x in lines)
+
+    def test_site_stats_perm(self):
+        self.client.sendcmd('rein')
+        self.client.login('anonymous', '@nopasswd')
+        with pytest.raises(ftplib.error_perm, match="Not enough priv"):
+            self.client.sendcmd('site stats')
+
+    @pytest.mark.skipif(not os.path.isfile(CLI), reason="no local-ftp CLI")
+    def test_site_stats_cli(self):
+        # users set up by the local-ftp command line with --metrics
+        # can run SITE STATS
+        spec = importlib.util.spec_from_file_location('local_ftp', CLI)
+        cli = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(cli)
+        user = cli.make_authorizer(HOME, USER, PASSWD, metrics=True)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            anonymous = cli.make_authorizer(HOME, metrics=True)
+        for authorizer, username, password in (
+            (user, USER, PASSWD),
+            (anonymous, 'anonymous', '@nopasswd'),
+        ):
+            self.server.handler.authorizer = authorizer
+            self.client.sendcmd('rein')
+            self.client.login(username, password)
+            assert self.client.sendcmd('site stats').startswith('211')
+        assert not cli.make_authorizer(HOME, USER, PASSWD).has_perm(USER, 'M')
+
+    def test_site_stats_disabled(self):
+        self.server.handler.metrics = None
+        with pytest.raises(ftplib.error_perm, match='550'):
+            self.client.sendcmd('site stats')
+
+    def test_endpoint(self):
+        with self.server.lock:
+            self.metrics_server = MetricsServer(
+                (HOST, 0), self.metrics, self.ioloop
+            )
+        addr = self.metrics_server.address[:2]
+        status, body = http_get(socket.create_connection(addr))
+        assert status == 'HTTP/1.0 200 OK'
+        assert 'ftp_control_connections 1' in body.splitlines()
+        assert 'command="PASS"' in body
+        status, body = http_get(socket.create_connection(addr), '/foo')
+        assert status == 'HTTP/1.0 404 Not Found'
+        assert body == ''
+
+    def test_endpoint_timeout(self):
+        with self.server.lock:
+            self.metrics_server = MetricsServer(
+                (HOST, 0), self.metrics, self.ioloop
+            )
+        addr = self.metrics_server.address[:2]
+        with patch('pyftpdlib.metrics._MetricsHandler.timeout', 0.1):
+            sock = socket.create_connection(addr)
+            sock.settimeout(GLOBAL_TIMEOUT)
+            with sock:
+                sock.sendall(b'GET /metrics HTTP/1.0\r\n')
+                # the request is never completed
+                assert sock.recv(1024) == b''
+
+    @pytest.mark.skipif(not POSIX, reason="UNIX only")
+    def test_endpoint_unix(self):
+        path = self.get_testfn()
+        with self.server.lock:
+            self.metrics_server = MetricsServer(path, self.metrics, self.ioloop)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        status, body = http_get(sock)
+        assert status == 'HTTP/1.0 200 OK'
+        assert 'ftp_control_connections 1' in body.splitlines()
+        with self.server.lock:
+            self.metrics_server.close()
+            self.metrics_server = None
+        assert not os.path.exists(path)
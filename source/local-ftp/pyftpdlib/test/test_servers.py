@@ -4,21 +4,31 @@
 
 import contextlib
 import ftplib
+import os
 import socket
+import time
+from unittest.mock import patch
 
 import pytest
 
 from pyftpdlib import handlers
 from pyftpdlib import servers
+from pyftpdlib.ioloop import AsyncioLoop
+from pyftpdlib.metrics import Metrics
+from pyftpdlib.metrics import MetricsServer
+from pyftpdlib.prefork import WorkerStats
 
 from . import GLOBAL_TIMEOUT
 from . import HOST
 from . import PASSWD
+from . import POSIX
 from . import SUPPORTS_MULTIPROCESSING
 from . import USER
 from . import WINDOWS
+from . import FtpdMultiprocWrapper
 from . import FtpdThreadWrapper
 from . import PyftpdlibTestCase
+from . import call_until
 from . import close_client
 from .test_functional import TestCornerCases
 from .test_functional import TestFtpAbort
@@ -31,6 +41,7 @@ from .test_functional import TestFtpRetrieveData
 from .test_functional import TestFtpStoreData
 from .test_functional import TestIPv4Environment
 from .test_functional import TestIPv6Environment
+from .test_metrics import http_get
 
 
 class TestFTPServer(PyftpdlibTestCase):
@@ -70,6 +81,281 @@ class TestFTPServer(PyftpdlibTestCase):
         with servers.FTPServer((HOST, 0), handlers.FTPHandler) as server:
             assert server is not None
 
+    def test_rejected_without_handler(self):
+        # connections exceeding limits don't get a handler
+        inits = []
+
+        class Handler(handlers.FTPHandler):
+            def __init__(self, *args, **kwargs):
+                inits.append(None)
+                super().__init__(*args, **kwargs)
+
+        class FTPd(self.server_class):
+            handler = Handler
+
+        self.server = FTPd()
+        self.server.server.max_cons_per_ip = 1
+        self.server.start()
+        self.client = self.client_class(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+        client = self.client_class(timeout=GLOBAL_TIMEOUT)
+        with pytest.raises(ftplib.error_temp, match="421"):
+            client.connect(self.server.host, self.server.port)
+        client.close()
+        assert len(inits) == 1
+        assert self.server.server.registry.count_ip(HOST) == 1
+        self.client.quit()
+        self.client = None
+        call_until(lambda: len(self.server.server.registry), "ret == 0")
+
+    def test_rejected_by_handler(self):
+        # an overridden handle_max_cons_per_ip() gets called
+        class Handler(handlers.FTPHandler):
+            def handle_max_cons_per_ip(self):
+                self.respond("421 Go away.")
+                self.close_when_done()
+
+        class FTPd(self.server_class):
+            handler = Handler
+
+        self.server = FTPd()
+        self.server.server.max_cons_per_ip = 1
+        self.server.start()
+        self.client = self.client_class(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+        client = self.client_class(timeout=GLOBAL_TIMEOUT)
+        with pytest.raises(ftplib.error_temp, match="421 Go away"):
+            client.connect(self.server.host, self.server.port)
+        client.close()
+        self.client.quit()
+        self.client = None
+        call_until(lambda: len(self.server.server.registry), "ret == 0")
+
+    def test_ip_map(self):
+        self.server = self.server_class()
+        self.server.start()
+        self.client = self.client_class(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+        self.client.login(USER, PASSWD)
+        with pytest.warns(DeprecationWarning):
+            assert self.server.server.ip_map == [HOST]
+
+    def test_reject_log_rate_limited(self):
+        with servers.FTPServer((HOST, 0), handlers.FTPHandler) as server:
+            with patch.object(servers.logger, 'warning') as warning:
+                for _ in range(5):
+                    server._log_reject(('10.0.0.1', 1234), "Go away.")
+                assert warning.call_count == 1
+                # called by the IO loop once the interval expires
+                server._log_rejects_unlogged()
+                assert warning.call_count == 2
+                assert warning.call_args[0][1] == 4
+
+    @pytest.mark.skipif(not POSIX, reason="POSIX only")
+    @pytest.mark.skipif(not SUPPORTS_MULTIPROCESSING, reason="not supported")
+    def test_max_cons_per_ip_multiprocess(self):
+        # the connection handled by a child process stays accounted
+        # in the parent until the process exits
+        class FTPd(self.server_class):
+            server_class = servers.MultiprocessFTPServer
+
+        self.server = FTPd()
+        self.server.server.max_cons_per_ip = 1
+        self.server.start()
+        self.client = self.client_class(timeout=GLOBAL_TIMEOUT)
+        self.client.connect(self.server.host, self.server.port)
+        self.client.login(USER, PASSWD)
+        client = self.client_class(timeout=GLOBAL_TIMEOUT)
+        with pytest.raises(ftplib.error_temp, match="421"):
+            client.connect(self.server.host, self.server.port)
+        client.close()
+        self.client.quit()
+        self.client.close()
+        stop_at = time.monotonic() + GLOBAL_TIMEOUT
+        while True:
+            self.client = self.client_class(timeout=GLOBAL_TIMEOUT)
+            try:
+                self.client.connect(self.server.host, self.server.port)
+            except ftplib.error_temp:
+                self.client.close()
+                if time.monotonic() > stop_at:
+                    raise
+                time.sleep(0.1)
+            else:
+                break
+
+
+class TestConnectionRegistry(PyftpdlibTestCase):
+
+    def test_subnet(self):
+        prefixlen = (24, 64)
+        assert servers._subnet('10.0.0.1', prefixlen) == '10.0.0.0/24'
+        assert servers._subnet('::ffff:10.0.0.1', prefixlen) == '10.0.0.0/24'
+        assert servers._subnet('fe80::1:2', prefixlen) == 'fe80::/64'
+        assert servers._subnet('10.0.1.1', (16, 64)) == '10.0.0.0/16'
+        assert servers._subnet('foo', prefixlen) == 'foo'
+
+    def test_counters(self):
+        registry = servers.ConnectionRegistry()
+        registry.add('10.0.0.1', '10.0.0.0/24')
+        registry.add('10.0.0.1', '10.0.0.0/24')
+        registry.add('10.0.0.2', '10.0.0.0/24')
+        assert len(registry) == 3
+        assert registry.count_ip('10.0.0.1') == 2
+        assert registry.count_subnet('10.0.0.0/24') == 3
+        assert registry.remove('10.0.0.1') == '10.0.0.0/24'
+        assert registry.remove('10.0.0.2') == '10.0.0.0/24'
+        assert registry.remove('10.0.0.2') is None
+        assert registry.count_ip('10.0.0.2') == 0
+        assert registry.count_subnet('10.0.0.0/24') == 1
+        registry.remove('10.0.0.1')
+        assert len(registry) == 0
+        assert not registry._ips
+        assert not registry._subnets
+
+    def test_consume_token(self):
+        registry = servers.ConnectionRegistry()
+        now = 1000.0
+        for _ in range(3):
+            assert registry.consume_token('10.0.0.1', 2, 3, now)
+        assert not registry.consume_token('10.0.0.1', 2, 3, now)
+        # other addresses have their own bucket
+        assert registry.consume_token('10.0.0.2', 2, 3, now)
+        # refilled at 2 tokens per second
+        assert registry.consume_token('10.0.0.1', 2, 3, now + 0.5)
+        assert not registry.consume_token('10.0.0.1', 2, 3, now + 0.5)
+        # buckets got full again are discarded
+        registry.consume_token('10.0.0.3', 2, 3, now + 10)
+        assert list(registry._buckets) == ['10.0.0.3']
+
+
+# =====================================================================
+# --- pre-fork
+# =====================================================================
+
+
+class TestWorkerStats(PyftpdlibTestCase):
+
+    def test_counters(self):
+        stats = WorkerStats(2, ip_slots=16)
+        stats.attach(0)
+        stats.add('10.0.0.1')
+        stats.add('10.0.0.1')
+        stats.add('10.0.0.2')
+        assert stats.count() == 3
+        assert stats.count_ip('10.0.0.1') >= 2
+        stats.remove('10.0.0.1')
+        assert stats.count() == 2
+        stats.add('10.0.0.3', '10.0.0.0/24')
+        stats.add('10.0.0.4', '10.0.0.0/24')
+        assert stats.count_subnet('10.0.0.0/24') >= 2
+        stats.remove('10.0.0.4', '10.0.0.0/24')
+        assert stats.count_subnet('10.0.0.0/24') >= 1
+        stats.incr('bytes_sent', 100)
+        row = stats.snapshot()[0]
+        assert row['accepted'] == 5
+        assert row['closed'] == 2
+        assert row['peak'] == 4
+        assert row['bytes_sent'] == 100
+        assert stats.totals()['accepted'] == 5
+
+    def test_attach_resets_live_counters(self):
+        # a restarted worker must not inherit its predecessor's
+        # connections, but cumulative counters are preserved
+        stats = WorkerStats(1, ip_slots=16)
+        stats.attach(0)
+        stats.add('10.0.0.1')
+        stats.attach(0)
+        assert stats.count() == 0
+        assert stats.count_ip('10.0.0.1') == 0
+        row = stats.snapshot()[0]
+        assert row['accepted'] == 1
+        assert row['restarts'] == 1
+
+
+if POSIX:
+
+    class PreforkFTPd(FtpdMultiprocWrapper):
+        worker_processes = 2
+
+        def run(self):
+            self.server.serve_forever(worker_processes=self.worker_processes)
+
+
+@pytest.mark.skipif(not POSIX, reason="POSIX only")
+@pytest.mark.skipif(not SUPPORTS_MULTIPROCESSING, reason="not supported")
+class TestPrefork(PyftpdlibTestCase):
+    """Run the server in pre-fork mode."""
+
+    def setUp(self):
+        super().setUp()
+        self.server = None
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            close_client(client)
+        if self.server is not None:
+            self.server.stop()
+        super().tearDown()
+
+    def connect(self):
+        client = ftplib.FTP(timeout=GLOBAL_TIMEOUT)
+        self.clients.append(client)
+        client.connect(self.server.host, self.server.port)
+        return client
+
+    def test_login(self):
+        self.server = PreforkFTPd()
+        self.server.start()
+        for _ in range(4):
+            self.connect().login(USER, PASSWD)
+
+    def test_asyncio(self):
+        # each worker gets an asyncio loop of its own
+        class Ftpd(PreforkFTPd):
+            server_class = _AsyncioFTPServer
+
+        self.server = Ftpd()
+        self.server.start()
+        for _ in range(4):
+            client = self.connect()
+            client.login(USER, PASSWD)
+            client.sendcmd('NOOP')
+
+    def test_max_cons_per_ip_across_workers(self):
+        servers.FTPServer.max_cons_per_ip = 1
+        self.server = PreforkFTPd()
+        self.server.start()
+        self.connect().login(USER, PASSWD)
+        # whichever worker accepts it, the second connection must be
+        # rejected
+        with pytest.raises(ftplib.error_temp, match="421"):
+            self.connect()
+
+    def test_on_worker_start(self):
+        # one metrics endpoint per worker, each registered against the
+        # IO loop of its worker
+        sockdir = os.path.abspath(self.get_testfn())
+        os.mkdir(sockdir)
+        metrics = Metrics()
+
+        class Server(servers.FTPServer):
+            def on_worker_start(self, id):
+                path = os.path.join(sockdir, str(id))
+                MetricsServer(path, metrics, self.ioloop)
+
+        class Ftpd(PreforkFTPd):
+            server_class = Server
+
+        self.server = Ftpd()
+        self.server.start()
+        call_until(lambda: sorted(os.listdir(sockdir)), "ret == ['0', '1']")
+        for id in range(Ftpd.worker_processes):
+            sock = socket.socket(socket.AF_UNIX)
+            sock.connect(os.path.join(sockdir, str(id)))
+            assert http_get(sock)[0] == 'HTTP/1.0 200 OK'
+
 
 # =====================================================================
 # --- threaded FTP server mixin tests
@@ -150,6 +436,62 @@ class TestCornerCasesThreadMixin(ThreadFTPTestMixin, TestCornerCases):
 #     pass
 
 
+# =====================================================================
+# --- FTP server running on an asyncio loop mixin tests
+# =====================================================================
+
+
+class _AsyncioFTPServer(servers.FTPServer):
+    def __init__(self, address_or_socket, handler, ioloop=None, backlog=100):
+        super().__init__(
+            address_or_socket, handler, ioloop or AsyncioLoop(), backlog
+        )
+
+
+class _AsyncioFTPd(FtpdThreadWrapper):
+    server_class = _AsyncioFTPServer
+
+
+class AsyncioFTPTestMixin:
+    server_class = _AsyncioFTPd
+
+
+class TestFtpAuthenticationAsyncioMixin(
+    AsyncioFTPTestMixin, TestFtpAuthentication
+):
+    pass
+
+
+class TestFtpCmdsSemanticAsyncioMixin(
+    AsyncioFTPTestMixin, TestFtpCmdsSemantic
+):
+    pass
+
+
+class TestFtpStoreDataAsyncioMixin(AsyncioFTPTestMixin, TestFtpStoreData):
+    pass
+
+
+class TestFtpRetrieveDataAsyncioMixin(
+    AsyncioFTPTestMixin, TestFtpRetrieveData
+):
+    pass
+
+
+class TestFtpListingCmdsAsyncioMixin(AsyncioFTPTestMixin, TestFtpListingCmds):
+    pass
+
+
+class TestFtpAbortAsyncioMixin(AsyncioFTPTestMixin, TestFtpAbort):
+    pass
+
+
+class TestCornerCasesAsyncioMixin(AsyncioFTPTestMixin, TestCornerCases):
+    def test_ioloop_fileno(self):
+        # the asyncio loop doesn't expose its selector's fd
+        pass
+
+
 # =====================================================================
 # --- multiprocess FTP server mixin tests
 # =====================================================================